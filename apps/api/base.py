@@ -19,21 +19,25 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import hashlib
 import json
+import os
 import re
+import threading
 import time
 from copy import deepcopy
-from multiprocessing.pool import ThreadPool
+from http import client as http_client, cookiejar
 from urllib import parse
 from retrying import Retrying
 
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
-from django.core.cache import cache
 from django.utils import translation
 from django.utils.module_loading import import_string
 from django.utils.translation import ugettext as _
 from opentelemetry.context import attach, get_current
-from requests.exceptions import ReadTimeout
+from requests.exceptions import ConnectionError as RequestsConnectionError, ReadTimeout
+from urllib3.exceptions import MaxRetryError, ProtocolError
+from urllib3.util.retry import Retry
 
 from apps.utils.log import logger
 from apps.exceptions import ApiResultError, ApiRequestError, PermissionError
@@ -42,6 +46,8 @@ from apps.utils.time_handler import timestamp_to_datetime
 from apps.api.exception import DataAPIException
 from apps.api.modules.utils import add_esb_info_before_request
 from apps.utils.function import ignored
+from apps.utils.cache import layered_cache
+from apps.utils.thread import ExecutorPool, get_executor
 
 
 def add_common_info_before_request(params):
@@ -119,6 +125,103 @@ class DataApiRetryClass(object):
         return retry_obj
 
 
+class BlockAllCookiePolicy(cookiejar.DefaultCookiePolicy):
+    """
+    共享session不保存服务端返回的cookie，避免不同请求之间串用
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    复用长连接的同时服务端恰好关闭了该空闲连接时, 请求会以 RemoteDisconnected/BrokenPipe 失败,
+    urllib3 将其视为读异常, 非幂等方法不会重试; 此时服务端未返回任何数据, 请求未被处理, 换新连接重试一次
+    """
+
+    def send(self, request, **kwargs):
+        try:
+            return super(KeepAliveAdapter, self).send(request, **kwargs)
+        except RequestsConnectionError as e:
+            if not self.is_connection_dropped(e):
+                raise
+            logger.info(f"[SessionPool] {request.method} {request.url} connection dropped, retry: {e}")
+            return super(KeepAliveAdapter, self).send(request, **kwargs)
+
+    @staticmethod
+    def is_connection_dropped(e: RequestsConnectionError) -> bool:
+        reason = e.args[0] if e.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        if not isinstance(reason, ProtocolError) or len(reason.args) < 2:
+            return False
+        return isinstance(reason.args[1], (http_client.RemoteDisconnected, BrokenPipeError))
+
+
+class SessionPool(object):
+    """
+    按host复用的requests session，保持长连接
+    """
+
+    _sessions = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls, url, pool_maxsize=None):
+        pool_maxsize = pool_maxsize or settings.DATAAPI_SESSION_POOL_MAXSIZE
+        parsed_url = parse.urlparse(url)
+        # fork后的子进程不能复用父进程的连接
+        key = (os.getpid(), parsed_url.scheme, parsed_url.netloc, pool_maxsize)
+        session = cls._sessions.get(key)
+        if session is not None:
+            return session
+        with cls._lock:
+            session = cls._sessions.get(key)
+            if session is None:
+                session = cls._build_session(pool_maxsize)
+                cls._sessions[key] = session
+        return session
+
+    @staticmethod
+    def _build_session(pool_maxsize):
+        session = requests.session()
+        session.cookies.set_policy(BlockAllCookiePolicy())
+        # 建立连接失败时所有请求都重试; 读异常(如读超时)时请求可能已被处理, 仅重试幂等方法,
+        # 避免重复执行作业、创建订阅等非幂等操作; 不重试业务状态码; 服务端关闭空闲长连接由 KeepAliveAdapter 重试
+        retry = Retry(
+            total=settings.DATAAPI_SESSION_RETRY,
+            connect=settings.DATAAPI_SESSION_RETRY,
+            read=settings.DATAAPI_SESSION_RETRY,
+            status=0,
+            method_whitelist=Retry.DEFAULT_METHOD_WHITELIST,
+            raise_on_status=False,
+        )
+        adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+
+class LocalResponse(object):
+    """
+    进程内调用的返回, 与 requests.Response 保持一致的使用方式
+    """
+
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, result):
+        self.result = result
+
+    def json(self):
+        return self.result
+
+    @property
+    def text(self):
+        return json.dumps(self.result)
+
+
 class DataAPI(object):
     """Single API for DATA"""
 
@@ -141,6 +244,9 @@ class DataAPI(object):
         cache_time=0,
         default_timeout=60,
         data_api_retry_cls=None,
+        pool_maxsize=None,
+        local_handler=None,
+        executor_pool=None,
     ):
         """
         初始化一个请求句柄
@@ -159,9 +265,13 @@ class DataAPI(object):
         @param {int} cache_time 缓存时间
         @param {int} default_timeout 默认超时时间
         @param {DataApiRetryClass} data_api_retry_cls 超时配置
+        @param {int} pool_maxsize 长连接池大小，为空时使用 DATAAPI_SESSION_POOL_MAXSIZE
+        @param {string} local_handler 进程内调用的函数路径，不为空时不发送http请求，直接调用该函数
+        @param {string} executor_pool 并发请求所用的共享线程池，为空时使用默认线程池
         """
         self.url = url
         self.module = module
+        self.executor_pool = executor_pool or ExecutorPool.DEFAULT
         self.method = method
         self.default_return_value = default_return_value
 
@@ -180,6 +290,8 @@ class DataAPI(object):
         self.cache_time = cache_time
         self.default_timeout = default_timeout
         self.data_api_retry_cls = data_api_retry_cls
+        self.pool_maxsize = pool_maxsize
+        self.local_handler = local_handler
 
     def __call__(
         self,
@@ -372,6 +484,14 @@ class DataAPI(object):
             else:
                 logger.exception(_log)
 
+    @property
+    def cache_prefix(self):
+        """
+        缓存统计维度, 模块名可能是惰性翻译对象, 统一取未翻译的原文, 避免随请求语言变化
+        """
+        with translation.override(None):
+            return f"api_{self.module}"
+
     def _build_cache_key(self, params):
         """
         缓存key的组装方式，保证URL和参数相同的情况下返回是一致的
@@ -391,7 +511,7 @@ class DataAPI(object):
         :param cache_key:
         :return:
         """
-        cache.set(cache_key, data, self.cache_time)
+        layered_cache.set(cache_key, data, self.cache_time, prefix=self.cache_prefix)
 
     def _send(self, params, timeout, request_id, request_cookies):
         """
@@ -399,43 +519,52 @@ class DataAPI(object):
         @param params: 请求的参数,预期是一个字典
         @return: requests response
         """
+        if self.local_handler is not None:
+            return LocalResponse(import_string(self.local_handler)(params))
 
-        # 增加request id
-        session = requests.session()
-        session.headers.update({"X-DATA-REQUEST-ID": request_id})
+        url = self.build_actual_url(params)
+
+        # 增加request id, 请求头与cookie按请求传入, 不修改共享session
+        if settings.DATAAPI_SESSION_KEEP_ALIVE:
+            session = SessionPool.get_session(url, self.pool_maxsize)
+        else:
+            session = requests.session()
+        headers = {"X-DATA-REQUEST-ID": request_id}
 
         # headers 申明重载请求方法
         if self.method_override is not None:
-            session.headers.update({"X-METHOD-OVERRIDE": self.method_override})
+            headers["X-METHOD-OVERRIDE"] = self.method_override
             # params['X_HTTP_METHOD_OVERRIDE'] = self.method_override
 
-        session.headers.update({"blueking-language": translation.get_language(), "request-id": get_request_id()})
-
-        url = self.build_actual_url(params)
+        headers.update({"blueking-language": translation.get_language(), "request-id": get_request_id()})
 
         # 发出请求并返回结果
         query_params = {"bklog_request_id": request_id}
         non_file_data, file_data = self._split_file_data(params)
         if self.method.upper() == "GET":
             params.update(query_params)
-            return session.request(method=self.method, url=url, params=params, verify=False, timeout=timeout)
+            return session.request(
+                method=self.method, url=url, params=params, headers=headers, verify=False, timeout=timeout
+            )
         if self.method.upper() == "DELETE":
-            session.headers.update({"Content-Type": "application/json; charset=utf-8"})
+            headers["Content-Type"] = "application/json; charset=utf-8"
             return session.request(
                 method=self.method,
                 url=url,
                 data=json.dumps(non_file_data),
                 params=query_params,
+                headers=headers,
                 verify=False,
                 timeout=timeout,
             )
         if self.method.upper() in ["PUT", "PATCH", "POST"]:
             if not file_data:
-                session.headers.update({"Content-Type": "application/json; charset=utf-8"})
+                headers["Content-Type"] = "application/json; charset=utf-8"
                 params = json.dumps(non_file_data)
             else:
                 params = non_file_data
 
+            cookies = None
             if request_cookies:
                 local_request = None
                 try:
@@ -444,13 +573,15 @@ class DataAPI(object):
                     pass
 
                 if local_request and local_request.COOKIES:
-                    session.cookies.update(local_request.COOKIES)
+                    cookies = local_request.COOKIES
             return session.request(
                 method=self.method,
                 url=url,
                 data=params,
                 params=query_params,
                 files=file_data,
+                headers=headers,
+                cookies=cookies,
                 verify=False,
                 timeout=timeout,
             )
@@ -476,15 +607,13 @@ class DataAPI(object):
                 non_file_data[k] = v
         return non_file_data, file_data
 
-    @staticmethod
-    def _get_cache(cache_key):
+    def _get_cache(self, cache_key):
         """
         获取缓存
         :param cache_key:
         :return:
         """
-        if cache.get(cache_key):
-            return cache.get(cache_key)
+        return layered_cache.get(cache_key, prefix=self.cache_prefix) or None
 
     def bulk_request(
         self,
@@ -512,28 +641,22 @@ class DataAPI(object):
         start = limit
 
         # 如果第一次没拿完，根据请求总数并发请求
-        pool = ThreadPool()
+        executor = get_executor(self.executor_pool)
         futures = []
         while start < count:
             request_params = {"page": {"limit": limit, "start": start}, "no_request": True}
             request_params.update(params)
-            # request_params["requests"] = get_request()
             futures.append(
-                pool.apply_async(
-                    self.thread_activate_request,
-                    args=(request_params,),
-                    kwds={"request": get_request(), "context": get_current()},
+                executor.submit(
+                    self.thread_activate_request, request_params, request=get_request(), context=get_current()
                 )
             )
 
             start += limit
 
-        pool.close()
-        pool.join()
-
         # 取值
         for future in futures:
-            data.extend(get_data(future.get()))
+            data.extend(get_data(future.result()))
 
         return data
 
@@ -575,6 +698,8 @@ DRF_DATAAPI_CONFIG = [
     "output_standard",
     "request_auth",
     "cache_time",
+    "pool_maxsize",
+    "executor_pool",
 ]
 
 
@@ -25,6 +25,16 @@ from apps.api.modules.utils import add_esb_info_before_request
 from config.domains import LOG_SEARCH_APIGATEWAY_ROOT
 
 
+def get_esquery_local_handler(action):
+    """
+    开启进程内调用时返回esquery本地处理函数
+    非白名单应用需要走接口鉴权，不能在进程内直接执行
+    """
+    if settings.ESQUERY_LOCAL_DISPATCH and settings.APP_CODE in settings.ESQUERY_WHITE_LIST:
+        return f"apps.log_esquery.local_dispatch.{action}"
+    return None
+
+
 class _BkLogApi:
     MODULE = _("log_search元数据")
 
@@ -35,6 +45,17 @@ class _BkLogApi:
             module=self.MODULE,
             description=_("查询数据"),
             before_request=add_esb_info_before_request,
+            local_handler=get_esquery_local_handler("search"),
+            default_timeout=settings.ES_QUERY_TIMEOUT,
+        )
+
+        self.msearch = DataAPI(
+            method="POST",
+            url=LOG_SEARCH_APIGATEWAY_ROOT + "esquery_msearch/",
+            module=self.MODULE,
+            description=_("批量查询数据"),
+            before_request=add_esb_info_before_request,
+            local_handler=get_esquery_local_handler("msearch"),
             default_timeout=settings.ES_QUERY_TIMEOUT,
         )
 
@@ -44,6 +65,7 @@ class _BkLogApi:
             module=self.MODULE,
             description=_("拉取索引mapping"),
             before_request=add_esb_info_before_request,
+            local_handler=get_esquery_local_handler("mapping"),
         )
 
         self.dsl = DataAPI(
@@ -52,6 +74,7 @@ class _BkLogApi:
             module=self.MODULE,
             description=_("查询数据DSL模式"),
             before_request=add_esb_info_before_request,
+            local_handler=get_esquery_local_handler("dsl"),
         )
 
         self.scroll = DataAPI(
@@ -60,6 +83,16 @@ class _BkLogApi:
             module=self.MODULE,
             description=_("scroll滚动查询"),
             before_request=add_esb_info_before_request,
+            local_handler=get_esquery_local_handler("scroll"),
+        )
+
+        self.clear_scroll = DataAPI(
+            method="POST",
+            url=LOG_SEARCH_APIGATEWAY_ROOT + "esquery_clear_scroll/",
+            module=self.MODULE,
+            description=_("释放scroll滚动查询"),
+            before_request=add_esb_info_before_request,
+            local_handler=get_esquery_local_handler("clear_scroll"),
         )
 
         self.indices = DataAPI(
@@ -92,6 +125,7 @@ class _BkLogApi:
             module=self.MODULE,
             description=_("es请求转发"),
             before_request=add_esb_info_before_request,
+            local_handler=get_esquery_local_handler("es_route"),
         )
 
         self.connectivity_detect = DataAPI(
@@ -24,6 +24,7 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from apps.api.base import DataAPI  # noqa
 from config.domains import BK_NODE_APIGATEWAY_ROOT  # noqa
 from apps.api.modules.utils import add_esb_info_before_request  # noqa
+from apps.utils.thread import ExecutorPool  # noqa
 
 
 class _BKNodeApi:
@@ -34,6 +35,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/create/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"创建订阅配置",
             before_request=add_esb_info_before_request,
         )
@@ -41,6 +43,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/update/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"更新订阅配置",
             before_request=add_esb_info_before_request,
         )
@@ -48,6 +51,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/info/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"查询订阅配置信息",
             before_request=add_esb_info_before_request,
         )
@@ -55,6 +59,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/run/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"执行订阅下发任务",
             before_request=add_esb_info_before_request,
         )
@@ -62,6 +67,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/instance_status/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"查询订阅实例状态",
             before_request=add_esb_info_before_request,
         )
@@ -69,6 +75,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/task_result/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"查看订阅任务运行状态",
             before_request=add_esb_info_before_request,
         )
@@ -76,6 +83,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/check_task_ready/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"查看订阅任务是否发起",
             before_request=add_esb_info_before_request,
         )
@@ -83,6 +91,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/delete/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"删除订阅配置",
             before_request=add_esb_info_before_request,
         )
@@ -90,6 +99,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/task_result_detail/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"查询订阅任务中实例的详细状态",
             before_request=add_esb_info_before_request,
         )
@@ -97,6 +107,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/switch/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"节点管理订阅功能开关",
             before_request=add_esb_info_before_request,
         )
@@ -105,6 +116,7 @@ class _BKNodeApi:
             method="POST",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/statistic/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u"节点管理统计订阅任务数据",
             before_request=add_esb_info_before_request,
         )
@@ -112,6 +124,7 @@ class _BKNodeApi:
             method="GET",
             url=BK_NODE_APIGATEWAY_ROOT + "backend/api/subscription/query_host_subscriptions/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.NODEMAN,
             description=u" 获取主机订阅列表",
             before_request=add_esb_info_before_request,
         )
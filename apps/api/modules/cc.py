@@ -22,6 +22,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from apps.api.base import DataAPI
 from apps.api.modules.utils import add_esb_info_before_request, filter_abnormal_ip_hosts_topo, filter_abnormal_ip_hosts
+from apps.utils.thread import ExecutorPool
 from config.domains import CC_APIGATEWAY_ROOT_V2
 
 
@@ -53,6 +54,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "search_business/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description=u"查询业务列表",
             before_request=get_supplier_account_before,
             cache_time=60,
@@ -61,6 +63,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "search_inst_by_object/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description=u"查询CC对象列表",
             before_request=get_supplier_account_before,
         )
@@ -68,6 +71,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "search_biz_inst_topo/",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description=u"查询业务TOPO，显示各个层级",
             before_request=get_supplier_account_before,
         )
@@ -75,6 +79,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "search_module",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询模块",
             before_request=get_supplier_account_before,
         )
@@ -82,6 +87,7 @@ class _CCApi:
             method="GET",
             url=CC_APIGATEWAY_ROOT_V2 + "search_module",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询模块",
             before_request=get_supplier_account_before,
         )
@@ -89,6 +95,7 @@ class _CCApi:
             method="GET",
             url=CC_APIGATEWAY_ROOT_V2 + "get_biz_internal_module",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询内部业务模块",
             before_request=get_supplier_account_before,
         )
@@ -96,6 +103,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "search_object_attribute",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询对象属性",
             before_request=filter_bk_field_prefix_before,
         )
@@ -103,6 +111,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "list_biz_hosts",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询业务下的主机",
             before_request=get_supplier_account_before,
             after_request=filter_abnormal_ip_hosts,
@@ -111,6 +120,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "list_biz_hosts_topo",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询业务下的主机和拓扑信息",
             before_request=get_supplier_account_before,
             after_request=filter_abnormal_ip_hosts_topo,
@@ -119,6 +129,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "search_cloud_area",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询云区域",
             before_request=get_supplier_account_before,
         )
@@ -126,6 +137,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "find_host_topo_relation",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="获取主机与拓扑的关系",
             before_request=get_supplier_account_before,
         )
@@ -133,6 +145,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "search_set",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="查询集群",
             before_request=get_supplier_account_before,
         )
@@ -140,6 +153,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "list_service_template",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="获取服务模板列表",
             before_request=get_supplier_account_before,
         )
@@ -147,6 +161,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "list_set_template",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="获取集群模板列表",
             before_request=get_supplier_account_before,
         )
@@ -154,6 +169,7 @@ class _CCApi:
             method="POST",
             url=CC_APIGATEWAY_ROOT_V2 + "find_module_with_relation",
             module=self.MODULE,
+            executor_pool=ExecutorPool.CMDB,
             description="根据条件查询业务下的模块",
             before_request=add_esb_info_before_request,
         )
@@ -20,6 +20,7 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from django.utils.translation import ugettext_lazy as _
 
 from apps.api.base import DataAPI
+from apps.utils.thread import ExecutorPool
 from config.domains import JOB_APIGATEWAY_ROOT_V2
 
 
@@ -36,6 +37,7 @@ class _JobApi:
             url=JOB_APIGATEWAY_ROOT_V2 + "fast_execute_script",
             description=_("快速执行脚本"),
             module=self.MODULE,
+            executor_pool=ExecutorPool.JOB,
             before_request=get_job_request_before,
         )
         self.fast_push_file = DataAPI(
@@ -43,6 +45,7 @@ class _JobApi:
             url=JOB_APIGATEWAY_ROOT_V2 + "fast_push_file",
             description=_("快速分发文件"),
             module=self.MODULE,
+            executor_pool=ExecutorPool.JOB,
             before_request=get_job_request_before,
         )
         self.get_job_instance_log = DataAPI(
@@ -50,6 +53,7 @@ class _JobApi:
             url=JOB_APIGATEWAY_ROOT_V2 + "get_job_instance_log",
             description=_("根据作业id获取执行日志"),
             module=self.MODULE,
+            executor_pool=ExecutorPool.JOB,
             before_request=get_job_request_before,
         )
 
@@ -20,3 +20,8 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 FEATURE_TOGGLE_CACHE_EXPIRED = 180
 
 FEATURE_TOGGLE_LIST_CACHE = "feature_toggles"
+
+# 特性开关快照版本号缓存key，开关变更时更新，各进程据此刷新进程内快照
+FEATURE_TOGGLE_VERSION_KEY = "feature_toggle_version"
+# 进程内快照检查版本号的间隔(秒)
+FEATURE_TOGGLE_SNAPSHOT_CHECK_INTERVAL = 10
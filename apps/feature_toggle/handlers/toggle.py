@@ -17,9 +17,18 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
+import threading
+import time
+import uuid
 
 from django.conf import settings
+from django.core.cache import cache
 
+from apps.feature_toggle.constants import (
+    FEATURE_TOGGLE_CACHE_EXPIRED,
+    FEATURE_TOGGLE_SNAPSHOT_CHECK_INTERVAL,
+    FEATURE_TOGGLE_VERSION_KEY,
+)
 from apps.feature_toggle.plugins.base import FeatureToggleBase, get_feature_toggle
 from apps.utils.function import ignored
 from apps.utils.log import logger
@@ -54,12 +63,52 @@ class Toggle(object):
         self.biz_id_white_list = biz_id_white_list
 
 
+class ToggleSnapshot(object):
+    """
+    特性开关进程内快照
+    1. 构建时一次性读取 settings 与 db 中的全部开关，之后只读，变更时整体替换
+    2. plugins 按开关名称首次读取时执行并记录结果, plugin 执行异常或降级时不记录, 下次读取时重新执行
+    """
+
+    def __init__(self, version, params: dict):
+        self.version = version
+        self.params = params
+        self.build_time = time.time()
+        self.check_time = self.build_time
+        self._toggles = {}
+        # plugin 中可能再次读取其他开关，需要可重入
+        self._lock = threading.RLock()
+
+    def get(self, name):
+        if name in self._toggles:
+            return self._toggles[name]
+
+        with self._lock:
+            if name in self._toggles:
+                return self._toggles[name]
+            param = self.params.get(name)
+            if not param:
+                self._toggles[name] = None
+                return None
+            plugin = FeatureToggleObject._get_plugin(name)
+            toggle = FeatureToggleObject._format_result(plugin.set_status(param=dict(param)))
+            if plugin.fallback:
+                logger.warning(f"[feature toggle] plugin of [{name}] fallback, result not memoized")
+                return toggle
+            self._toggles[name] = toggle
+            return toggle
+
+
 class FeatureToggleObject(object):
     """
     特性开关表
     同一个变量读取顺序为: settings-->db-->plugins
+    读取的是进程内快照，开关保存后通过版本号通知各进程刷新
     """
 
+    _snapshot = None
+    _snapshot_lock = threading.Lock()
+
     @classmethod
     def switch(cls, name, biz_id=None):
         """
@@ -102,34 +151,7 @@ class FeatureToggleObject(object):
         Returns:
             None or Toggle object
         """
-        from apps.feature_toggle.models import FeatureToggle
-
-        param = {}
-        if settings.FEATURE_TOGGLE.get(name):
-            param["name"] = name
-            param["alias"] = ""
-            param["status"] = settings.FEATURE_TOGGLE.get(name)
-            param["description"] = ""
-            param["is_viewed"] = True
-            param["feature_config"] = None
-            param["biz_id_white_list"] = None
-
-        with ignored(Exception, log_exception=True):
-            feature_toggle = FeatureToggle.objects.filter(name=name).first()
-            if feature_toggle:
-                param["name"] = feature_toggle.name
-                param["alias"] = feature_toggle.alias
-                param["status"] = feature_toggle.status
-                param["description"] = feature_toggle.description
-                param["is_viewed"] = feature_toggle.is_viewed
-                param["feature_config"] = feature_toggle.feature_config
-                param["biz_id_white_list"] = feature_toggle.biz_id_white_list
-
-        if not param:
-            return None
-
-        param = cls._load_plugins(name=name, param=param)
-        return cls._format_result(param)
+        return cls.snapshot().get(name)
 
     @classmethod
     def toggle_list(cls, **kwargs):
@@ -145,26 +167,58 @@ class FeatureToggleObject(object):
         return [cls._format_result(param) for param in cls._filter_params(result, kwargs)]
 
     @classmethod
-    def _load_plugins(cls, name, param):
+    def snapshot(cls) -> ToggleSnapshot:
         """
-        执行对应plugin并将对应返回值赋值给param
-        Args:
-            name: [Str] toggle name
-            param: [Dict] 预存到cache toggle 参数
-        Returns:
-            param: [Dict] 返回处理后的param
-        Raises:
-            BaseException: 对应cls没有继承自FutureToggleBase
+        获取进程内快照，超过检查间隔后对比版本号，版本变化或超过最大存活时间时重建
         """
-        feature_toggle_cls = get_feature_toggle(name)
-        if not issubclass(feature_toggle_cls, FeatureToggleBase):
-            raise BaseException(f"{feature_toggle_cls} 没有继承自FutureToggleBase")
-        return feature_toggle_cls().set_status(param=param)
+        snapshot = cls._snapshot
+        if snapshot is not None and time.time() - snapshot.check_time < FEATURE_TOGGLE_SNAPSHOT_CHECK_INTERVAL:
+            return snapshot
+
+        with cls._snapshot_lock:
+            snapshot = cls._snapshot
+            now = time.time()
+            if snapshot is not None and now - snapshot.check_time < FEATURE_TOGGLE_SNAPSHOT_CHECK_INTERVAL:
+                return snapshot
+
+            version = cls._get_version()
+            if (
+                snapshot is not None
+                and version is not None
+                and version == snapshot.version
+                and now - snapshot.build_time < FEATURE_TOGGLE_CACHE_EXPIRED
+            ):
+                snapshot.check_time = now
+                return snapshot
+
+            cls._snapshot = ToggleSnapshot(version=version, params=cls._get_raw_params())
+            return cls._snapshot
 
     @classmethod
-    def _get_params(cls) -> dict:
+    def invalidate(cls, notify=True):
         """
-        获取全量params combine后的列表
+        丢弃进程内快照，notify为True时更新版本号通知其他进程刷新
+        """
+        cls._snapshot = None
+        if not notify:
+            return
+        with ignored(Exception, log_exception=True):
+            cache.set(FEATURE_TOGGLE_VERSION_KEY, uuid.uuid4().hex, None)
+
+    @classmethod
+    def _get_version(cls):
+        with ignored(Exception, log_exception=True):
+            version = cache.get(FEATURE_TOGGLE_VERSION_KEY)
+            if version is None:
+                cache.add(FEATURE_TOGGLE_VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(FEATURE_TOGGLE_VERSION_KEY)
+            return version
+        return None
+
+    @classmethod
+    def _get_raw_params(cls) -> dict:
+        """
+        获取settings与db合并后未经过plugins处理的全量params
         Returns:
             Dict
         """
@@ -172,6 +226,8 @@ class FeatureToggleObject(object):
 
         params = {}
         for name, status in settings.FEATURE_TOGGLE.items():
+            if not status:
+                continue
             params[name] = {
                 "name": name,
                 "alias": "",
@@ -182,24 +238,61 @@ class FeatureToggleObject(object):
                 "biz_id_white_list": None,
             }
 
-        for feature_toggle in FeatureToggle.objects.all():
-            params[feature_toggle.name] = {
-                "name": feature_toggle.name,
-                "alias": feature_toggle.alias,
-                "status": feature_toggle.status,
-                "description": feature_toggle.description,
-                "is_viewed": feature_toggle.is_viewed,
-                "feature_config": feature_toggle.feature_config,
-                "biz_id_white_list": feature_toggle.biz_id_white_list,
-            }
+        with ignored(Exception, log_exception=True):
+            for feature_toggle in FeatureToggle.objects.all():
+                params[feature_toggle.name] = {
+                    "name": feature_toggle.name,
+                    "alias": feature_toggle.alias,
+                    "status": feature_toggle.status,
+                    "description": feature_toggle.description,
+                    "is_viewed": feature_toggle.is_viewed,
+                    "feature_config": feature_toggle.feature_config,
+                    "biz_id_white_list": feature_toggle.biz_id_white_list,
+                }
+
+        return params
+
+    @classmethod
+    def _load_plugins(cls, name, param):
+        """
+        执行对应plugin并将对应返回值赋值给param
+        Args:
+            name: [Str] toggle name
+            param: [Dict] 预存到cache toggle 参数
+        Returns:
+            param: [Dict] 返回处理后的param
+        """
+        return cls._get_plugin(name).set_status(param=param)
 
-        for name, param in params.items():
+    @classmethod
+    def _get_plugin(cls, name) -> FeatureToggleBase:
+        """
+        获取开关对应的plugin实例
+        Raises:
+            BaseException: 对应cls没有继承自FutureToggleBase
+        """
+        feature_toggle_cls = get_feature_toggle(name)
+        if not issubclass(feature_toggle_cls, FeatureToggleBase):
+            raise BaseException(f"{feature_toggle_cls} 没有继承自FutureToggleBase")
+        return feature_toggle_cls()
+
+    @classmethod
+    def _get_params(cls) -> dict:
+        """
+        获取全量params combine后的列表
+        Returns:
+            Dict
+        """
+        snapshot = cls.snapshot()
+        params = {}
+        for name, param in snapshot.params.items():
             try:
-                param = cls._load_plugins(name, param)
+                toggle = snapshot.get(name)
             except Exception as e:  # pylint: disable=broad-except
                 logger.error(f"load plugin error: {e}")
+                params[name] = dict(param)
             else:
-                params[name] = param
+                params[name] = dict(vars(toggle))
 
         return params
 
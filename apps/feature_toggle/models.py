@@ -18,7 +18,10 @@ WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.test.signals import setting_changed
 
 from django.utils.translation import ugettext_lazy as _
 from django_jsonfield_backport.models import JSONField
@@ -42,3 +45,24 @@ class FeatureToggle(SoftDeleteModel):
     class Meta:
         verbose_name = _("日志平台特性开关")
         verbose_name_plural = _("41_日志平台特性开关")
+
+
+@receiver(post_save, sender=FeatureToggle)
+@receiver(post_delete, sender=FeatureToggle)
+def refresh_feature_toggle_snapshot(sender, **kwargs):
+    """
+    特性开关变更后刷新进程内快照
+    """
+    from apps.feature_toggle.handlers.toggle import FeatureToggleObject
+
+    # 当前进程立即刷新，事务提交后再通知其他进程，避免其他进程读到未提交前的数据
+    FeatureToggleObject.invalidate(notify=False)
+    transaction.on_commit(FeatureToggleObject.invalidate)
+
+
+@receiver(setting_changed)
+def refresh_feature_toggle_snapshot_by_setting(setting, **kwargs):
+    if setting == "FEATURE_TOGGLE":
+        from apps.feature_toggle.handlers.toggle import FeatureToggleObject
+
+        FeatureToggleObject.invalidate(notify=False)
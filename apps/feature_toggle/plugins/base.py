@@ -37,6 +37,8 @@ def register(target_class: "FeatureToggleBase"):
 
 class FeatureToggleBase(ABC):
     target = None
+    # set_status 因依赖的服务异常而使用了降级结果时置为True, 结果不会被快照记录
+    fallback = False
 
     @abstractmethod
     def set_status(self, param: dict) -> dict:
@@ -100,6 +102,7 @@ class FeatureCollectorITSM(FeatureToggleBase):
             except Exception as e:  # pylint: disable=broad-except
                 logger.exception("[BKLOG] get itsm service fail => %s", e)
                 param["status"] = "off"
+                self.fallback = True
 
         return param
 
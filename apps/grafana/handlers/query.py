@@ -17,7 +17,6 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-import copy
 import re
 import time
 from collections import defaultdict
@@ -29,11 +28,14 @@ from django.utils.translation import ugettext_lazy as _
 from apps.api import CCApi
 from apps.utils.log import logger
 from apps.grafana.constants import TIME_SERIES_FIELD_TYPE, LOG_SEARCH_DIMENSION_LIST, CMDB_EXTEND_FIELDS
+from apps.grafana.handlers.query_cache import TimeSeriesCache
 from apps.iam import Permission, ActionEnum, ResourceEnum
-from apps.log_search.constants import GlobalCategoriesEnum
+from apps.log_esquery.constants import QueryPriority
+from apps.log_search.constants import GlobalCategoriesEnum, TimeFieldTypeEnum
 from apps.log_search.exceptions import BaseSearchIndexSetDataDoseNotExists
 from apps.log_search.handlers.biz import BizHandler
 from apps.log_search.handlers.search.aggs_handlers import AggsViewAdapter
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
 from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler
 from apps.log_search.models import LogIndexSet, ProjectInfo, Scenario
 from bk_dataview.grafana import client
@@ -106,12 +108,12 @@ class GrafanaQueryHandler:
                 record[dimension] = bucket.get("key")
                 if depth + 1 == count:
                     record[metric_field] = bucket.get(metric_field).get("value")
-                    records.append(copy.deepcopy(record))
+                    records.append(dict(record))
                 else:
                     self._get_buckets(records, record, dimensions, bucket, metric_field, depth + 1)
         else:
             record[metric_field] = aggregations.get(metric_field).get("value")
-            records.append(copy.deepcopy(record))
+            records.append(dict(record))
 
     def _format_time_series(self, params, data, time_field):
         """
@@ -232,19 +234,10 @@ class GrafanaQueryHandler:
         """
         self.check_panel_permission(query_dict["dashboard_id"], query_dict["panel_id"], query_dict["result_table_id"])
 
-        time_field = SearchHandler(query_dict["result_table_id"], {}).time_field
-
         # 如果是统计数量，则无需提供指标字段，用 _id 字段统计即可
         if query_dict["method"] == "value_count":
             query_dict["metric_field"] = "_index"
 
-        aggs = self._get_aggregations(
-            metric_field=query_dict["metric_field"],
-            agg_method=query_dict["method"],
-            dimensions=query_dict.get("group_by", []),
-            interval=query_dict["interval"],
-            time_field=time_field,
-        )
         search_dict = {
             "start_time": query_dict["start_time"],
             "end_time": query_dict["end_time"],
@@ -266,22 +259,46 @@ class GrafanaQueryHandler:
             # "time_range": f"1m",
             "bk_biz_id": self.bk_biz_id,
             "keyword": query_dict.get("query_string", ""),
-            "aggs": aggs,
+            "query_priority": QueryPriority.BACKGROUND,
         }
         search_handler = SearchHandler(query_dict["result_table_id"], search_dict)
-        result = search_handler.search(search_type=None)
+        time_field = search_handler.time_field
+        # 聚合条件依赖时间字段，在初始化后设置，避免为获取时间字段重复初始化 SearchHandler
+        search_handler.aggs = self._get_aggregations(
+            metric_field=query_dict["metric_field"],
+            agg_method=query_dict["method"],
+            dimensions=query_dict.get("group_by", []),
+            interval=query_dict["interval"],
+            time_field=time_field,
+        )
 
         all_dimensions = query_dict["group_by"][::-1] + [time_field]
+        fetch = partial(self._query_records, search_handler, all_dimensions, query_dict["metric_field"])
 
-        if not result["aggregations"]:
+        # 只有 date 类型的时间字段桶的键为毫秒时间戳，才能按桶缓存
+        time_series_cache = TimeSeriesCache(
+            query_dict, time_field, enabled=search_handler.time_field_type == TimeFieldTypeEnum.DATE.value
+        )
+        records = time_series_cache.query(fetch)
+        if not records:
             # 无数据
             return []
 
-        records = []
-        self._get_buckets(records, {}, all_dimensions, result["aggregations"], query_dict["metric_field"])
+        return self._format_time_series(query_dict, records, time_field)
 
-        records = self._format_time_series(query_dict, records, search_handler.time_field)
+    def _query_records(self, search_handler, all_dimensions, metric_field, start_time, end_time):
+        """
+        查询指定时间范围内的聚合结果并解析为记录
+        """
+        search_handler.start_time = start_time
+        search_handler.end_time = end_time
+        result = search_handler.search(search_type=None, need_list=False, need_origin_log=False, need_fields=False)
 
+        if not result["aggregations"]:
+            return []
+
+        records = []
+        self._get_buckets(records, {}, all_dimensions, result["aggregations"], metric_field)
         return records
 
     def query_log(self, query_dict: dict):
@@ -290,7 +307,7 @@ class GrafanaQueryHandler:
         """
         self.check_panel_permission(query_dict["dashboard_id"], query_dict["panel_id"], query_dict["result_table_id"])
 
-        time_field = SearchHandler(query_dict["result_table_id"], {}).time_field
+        time_field = IndexSetSearchContext.get(query_dict["result_table_id"], with_mapping=False).time_field
 
         search_dict = {
             "start_time": query_dict["start_time"],
@@ -312,9 +329,10 @@ class GrafanaQueryHandler:
             "size": query_dict.get("size", 10),
             "bk_biz_id": self.bk_biz_id,
             "keyword": query_dict.get("query_string", ""),
+            "query_priority": QueryPriority.BACKGROUND,
         }
         search_handler = SearchHandler(query_dict["result_table_id"], search_dict)
-        result = search_handler.search(search_type=None)
+        result = search_handler.search(search_type=None, need_list=False)
 
         # 前面的字段固定
         fields = [time_field, "log"] if "log" in result["fields"] else [time_field]
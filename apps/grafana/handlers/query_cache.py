@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import json
+import time
+from collections import defaultdict
+from typing import Callable, List
+
+from django.conf import settings
+from django.core.cache import cache
+from prometheus_client import Counter
+
+from apps.utils import md5_sum
+from apps.utils.log import logger
+
+grafana_query_cache_buckets = Counter(
+    "bklog_grafana_query_cache_buckets", "grafana time series query cache buckets", ["result"]
+)
+grafana_query_cache_bytes_saved = Counter(
+    "bklog_grafana_query_cache_bytes_saved", "grafana time series query cache bytes saved"
+)
+
+
+class TimeSeriesCache(object):
+    """
+    Grafana 时序查询增量缓存
+    1. 按 (索引集, 指标, 聚合方法, 维度, 过滤条件, 汇聚周期) 缓存已封闭的时间桶
+    2. 只有完整落在查询时间范围内, 且早于封闭时间的桶才会被缓存
+    3. 缓存保存一段连续的桶区间, 查询时只补查区间之前的空缺与末尾未封闭的部分
+    4. 写入时仍处于入库延迟窗口内的桶只短时间有效, 过期后重新查询, 使延迟到达的日志能够被统计
+    """
+
+    CACHE_KEY_PREFIX = "grafana_time_series"
+
+    def __init__(self, query_dict: dict, time_field: str, enabled: bool = True, now: float = None):
+        self.time_field = time_field
+        self.start_time = query_dict.get("start_time")
+        self.end_time = query_dict.get("end_time")
+        self.interval = query_dict["interval"] * 1000
+        self.enabled = all([enabled, settings.GRAFANA_QUERY_CACHE_ENABLED, self.start_time, self.end_time])
+        if not self.enabled:
+            return
+
+        self.cache_key = self._build_cache_key(query_dict, time_field)
+        now = time.time() if now is None else now
+        self.now = now
+        # 可缓存的桶区间 [start, end), 单位毫秒, 与 date_histogram 的桶边界对齐
+        finalized_time = self._align((now - settings.GRAFANA_QUERY_CACHE_FINALIZE_DELAY) * 1000)
+        self.start = -self._align(-self.start_time * 1000)
+        self.end = min(self._align(self.end_time * 1000), finalized_time)
+
+    def _align(self, timestamp) -> int:
+        return int(timestamp // self.interval * self.interval)
+
+    def _build_cache_key(self, query_dict: dict, time_field: str) -> str:
+        params = {
+            "index_set_id": query_dict["result_table_id"],
+            "metric_field": query_dict["metric_field"],
+            "method": query_dict["method"],
+            "group_by": query_dict.get("group_by", []),
+            "where": query_dict.get("where", []),
+            "interval": query_dict["interval"],
+            "query_string": query_dict.get("query_string", ""),
+            "target": sorted(host["bk_target_ip"] for host in query_dict.get("target", [])),
+            "time_field": time_field,
+        }
+        return "{}_{}".format(self.CACHE_KEY_PREFIX, md5_sum(json.dumps(params, sort_keys=True)))
+
+    def query(self, fetch: Callable[[int, int], List[dict]]) -> List[dict]:
+        """
+        查询时序数据, 命中的桶直接取缓存
+        :param fetch: 按时间范围(秒)查询记录的函数, 记录中的 time_field 为桶的起始时间(毫秒)
+        """
+        if not self.enabled or self.start >= self.end:
+            return fetch(self.start_time, self.end_time)
+
+        entry, entry_size = self._get_entry()
+        if entry:
+            entry = self._expire_recent_buckets(entry)
+        hit_start = max(self.start, entry["start"]) if entry else self.start
+        hit_end = min(self.end, entry["end"]) if entry else self.start
+        if hit_start >= hit_end:
+            # 缓存与本次可缓存区间不相交, 全量查询后重建缓存
+            records = fetch(self.start_time, self.end_time)
+            self._record(hit_buckets=0, bytes_saved=0)
+            self._set_entry({"start": self.start, "end": self.end, "buckets": {}}, records)
+            return records
+
+        leading_records = []
+        if hit_start > self.start_time * 1000:
+            leading_records = [
+                record for record in fetch(self.start_time, hit_start // 1000) if record[self.time_field] < hit_start
+            ]
+        trailing_records = []
+        if hit_end <= self.end_time * 1000:
+            trailing_records = [
+                record for record in fetch(hit_end // 1000, self.end_time) if record[self.time_field] >= hit_end
+            ]
+
+        hit_records = []
+        for bucket_time in range(hit_start, hit_end, self.interval):
+            hit_records.extend(entry["buckets"].get(str(bucket_time), []))
+
+        hit_buckets = (hit_end - hit_start) // self.interval
+        entry_buckets = max((entry["end"] - entry["start"]) // self.interval, 1)
+        self._record(hit_buckets=hit_buckets, bytes_saved=entry_size * hit_buckets // entry_buckets)
+
+        if self.start < entry["start"] or self.end > entry["end"]:
+            entry["start"] = min(self.start, entry["start"])
+            entry["end"] = max(self.end, entry["end"])
+            self._set_entry(entry, leading_records + trailing_records)
+
+        return leading_records + hit_records + trailing_records
+
+    def _expire_recent_buckets(self, entry: dict) -> dict:
+        """
+        写入时晚于 refresh_from 的桶可能还有日志未入库, 超过 recent_expire 后丢弃, 重新查询
+        """
+        refresh_from = entry.get("refresh_from")
+        if refresh_from is None or self.now < entry["recent_expire"] or entry["end"] <= refresh_from:
+            return entry
+        entry["end"] = max(refresh_from, entry["start"])
+        entry["buckets"] = {
+            bucket_time: bucket_records
+            for bucket_time, bucket_records in entry["buckets"].items()
+            if int(bucket_time) < entry["end"]
+        }
+        entry.pop("refresh_from")
+        entry.pop("recent_expire")
+        return entry
+
+    def _record(self, hit_buckets: int, bytes_saved: int):
+        miss_buckets = (self.end - self.start) // self.interval - hit_buckets
+        grafana_query_cache_buckets.labels(result="hit").inc(hit_buckets)
+        grafana_query_cache_buckets.labels(result="miss").inc(miss_buckets)
+        grafana_query_cache_bytes_saved.inc(bytes_saved)
+
+    def _get_entry(self):
+        try:
+            cache_result = cache.get(self.cache_key)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[grafana query cache] get cache({self.cache_key}) failed: {e}")
+            return None, 0
+        if not cache_result:
+            return None, 0
+        return json.loads(cache_result), len(cache_result)
+
+    def _set_entry(self, entry: dict, records: List[dict]):
+        """
+        将查询结果中可缓存的桶合并到缓存中, 超出最大桶数时淘汰最早的桶
+        """
+        buckets = defaultdict(list)
+        for record in records:
+            bucket_time = record[self.time_field]
+            if self.start <= bucket_time < self.end:
+                buckets[str(bucket_time)].append(record)
+        entry["buckets"].update(buckets)
+
+        settled_time = self._align((self.now - settings.GRAFANA_QUERY_CACHE_SETTLE_DELAY) * 1000)
+        if entry.get("refresh_from") is None:
+            entry["refresh_from"] = settled_time
+            entry["recent_expire"] = self.now + settings.GRAFANA_QUERY_CACHE_RECENT_TTL
+        else:
+            # 之前写入的近期桶仍按原有的过期时间重新查询
+            entry["refresh_from"] = min(entry["refresh_from"], settled_time)
+
+        max_start = entry["end"] - settings.GRAFANA_QUERY_CACHE_MAX_BUCKETS * self.interval
+        if entry["start"] < max_start:
+            entry["start"] = max_start
+            entry["buckets"] = {
+                bucket_time: bucket_records
+                for bucket_time, bucket_records in entry["buckets"].items()
+                if int(bucket_time) >= max_start
+            }
+
+        try:
+            cache.set(self.cache_key, json.dumps(entry), settings.GRAFANA_QUERY_CACHE_TTL)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[grafana query cache] set cache({self.cache_key}) failed: {e}")
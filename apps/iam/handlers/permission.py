@@ -17,7 +17,7 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-
+import time
 from typing import Union, List, Dict
 from django.conf import settings
 from django.utils.translation import ugettext as _
@@ -26,6 +26,7 @@ from django.utils.translation import ugettext as _
 from apps.utils.log import logger
 from apps.iam.exceptions import ActionNotExistError, PermissionDeniedError, GetSystemInfoError
 from apps.iam.handlers.actions import ActionMeta, get_action_by_id, _all_actions
+from apps.iam.handlers.policy import CompiledPolicy, PolicyAttributeMissingError, policy_cache
 from apps.iam.handlers.resources import (
     get_resource_by_id,
     _all_resources,
@@ -33,7 +34,7 @@ from apps.iam.handlers.resources import (
     Business as BusinessResource,
 )
 from apps.utils.local import get_request, get_request_username
-from iam import IAM, Request, Subject, Resource, make_expression, ObjectSet, MultiActionRequest
+from iam import IAM, Request, Subject, Resource, MultiActionRequest
 from iam.apply.models import (
     ActionWithoutResources,
     Application,
@@ -242,10 +243,8 @@ class Permission(object):
                 return True
         # ===== 针对demo业务的权限豁免 结束 ===== #
 
-        request = self.make_request(action, resources)
-
         try:
-            result = self.iam_client.is_allowed(request)
+            result = self._eval_policy(action, resources)
         except AuthAPIError as e:
             logger.exception(f"[IAM AuthAPI Error]: {e}")
             result = False
@@ -260,6 +259,48 @@ class Permission(object):
 
         return result
 
+    def get_policy(self, action: Union[ActionMeta, str], refresh: bool = False) -> CompiledPolicy:
+        """
+        获取用户在动作下编译后的策略，按(用户, 动作)缓存
+        :param action: 动作
+        :param refresh: 是否忽略缓存重新拉取
+        """
+        action = get_action_by_id(action)
+        if not refresh:
+            policy = policy_cache.get(self.username, action.id)
+            if policy is not None:
+                return policy
+
+        # 不带资源拉取全量策略，在本地计算
+        policy = CompiledPolicy(self.iam_client._do_policy_query(self.make_request(action), with_resources=False))
+        policy_cache.set(self.username, action.id, policy)
+        return policy
+
+    def _eval_policy(self, action: ActionMeta, resources: List[Resource]) -> bool:
+        """
+        使用缓存的策略在本地计算权限
+        1. 缓存策略判定无权限时重新拉取一次，避免刚授权的用户被拒绝
+        2. 策略依赖本地资源缺失的属性时，交由权限中心计算
+        """
+        objects = {}
+        for resource in resources:
+            attribute = dict(resource.attribute or {})
+            attribute["id"] = resource.id
+            objects[resource.type] = attribute
+
+        begin_time = time.time()
+        try:
+            policy = self.get_policy(action)
+            if policy.eval(objects):
+                return True
+            if policy.create_time >= begin_time:
+                # 刚从权限中心拉取的策略，无需再次拉取
+                return False
+            return self.get_policy(action, refresh=True).eval(objects)
+        except PolicyAttributeMissingError as e:
+            logger.info(f"[IAM] policy attribute({e}) missing, eval by iam")
+            return self.iam_client.is_allowed(self.make_request(action, resources))
+
     def batch_is_allowed(self, actions: List[ActionMeta], resources: List[List[Resource]]):
         """
         查询某批资源某批操作是否有权限
@@ -317,32 +358,26 @@ class Permission(object):
             business_list = ProjectInfo.objects.all()
 
         # 拉取策略
-        request = self.make_request(action=action)
-
         try:
-            policies = self.iam_client._do_policy_query(request)
+            policy = self.get_policy(action)
         except AuthAPIError as e:
             logger.exception(f"[IAM AuthAPI Error]: {e}")
             return []
 
-        if not policies:
+        if policy.is_empty:
             # 如果策略是空，则说明没有任何权限，若存在Demo业务，返回Demo业务，否则返回空
             for business in business_list:
                 if settings.DEMO_BIZ_ID == business.bk_biz_id:
                     return [business]
             return []
 
-        # 生成表达式
-        expr = make_expression(policies)
+        # 一次遍历批量计算
+        allowed_list = policy.batch_eval(
+            ResourceEnum.BUSINESS.id, [{"id": str(business.bk_biz_id)} for business in business_list]
+        )
 
         results = []
-        for business in business_list:
-            obj_set = ObjectSet()
-            obj_set.add_object(ResourceEnum.BUSINESS.id, {"id": str(business.bk_biz_id)})
-
-            # 计算表达式
-            is_allowed = self.iam_client._eval_expr(expr, obj_set)
-
+        for business, is_allowed in zip(business_list, allowed_list):
             # 针对demo业务权限豁免
             if is_allowed or str(settings.DEMO_BIZ_ID) == str(business.bk_biz_id):
                 results.append(business)
@@ -397,6 +432,8 @@ class Permission(object):
         try:
             grant_result = self.iam_client.grant_resource_creator_actions(application, self.bk_token, self.username)
             logger.info(f"[grant_creator_action] Success! resource: {resource.to_dict()}, result: {grant_result}")
+            # 授权后丢弃缓存的策略
+            policy_cache.invalidate(application["creator"])
         except Exception as e:  # pylint: disable=broad-except
             logger.exception(f"[grant_creator_action] Failed! resource: {resource.to_dict()}, result: {e}")
 
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import threading
+import time
+from typing import Dict, List
+
+from cachetools import TTLCache
+from django.conf import settings
+
+from iam.eval.constants import OP
+from iam.eval.expression import field_value_convert
+from iam.eval.operators import BINARY_OPERATORS
+
+
+class PolicyAttributeMissingError(Exception):
+    """
+    策略依赖的资源属性在本地资源中不存在，需要交给权限中心计算
+    """
+
+
+def _get_attribute(objects: Dict[str, dict], resource_type: str, attribute: str):
+    """
+    获取资源属性，资源类型不存在时返回None(与SDK一致)，资源存在但属性缺失时抛出异常
+    """
+    obj = objects.get(resource_type)
+    if obj is None:
+        return None
+    if attribute not in obj:
+        raise PolicyAttributeMissingError(f"{resource_type}.{attribute}")
+    return obj[attribute]
+
+
+class Predicate(object):
+    def __call__(self, objects: Dict[str, dict]) -> bool:
+        raise NotImplementedError
+
+
+class AnyPredicate(Predicate):
+    def __call__(self, objects):
+        return True
+
+
+class NonePredicate(Predicate):
+    def __call__(self, objects):
+        return False
+
+
+class AndPredicate(Predicate):
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+
+    def __call__(self, objects):
+        for child in self.children:
+            if not child(objects):
+                return False
+        return True
+
+
+class OrPredicate(Predicate):
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+
+    def __call__(self, objects):
+        for child in self.children:
+            if child(objects):
+                return True
+        return False
+
+
+class SetPredicate(Predicate):
+    """
+    eq/in 预先计算为集合，按哈希查找
+    """
+
+    def __init__(self, resource_type: str, attribute: str, values):
+        self.resource_type = resource_type
+        self.attribute = attribute
+        self.values = frozenset(values)
+
+    def __call__(self, objects):
+        attr = _get_attribute(objects, self.resource_type, self.attribute)
+        if isinstance(attr, (list, tuple)):
+            return any(a in self.values for a in attr if _is_hashable(a))
+        return _is_hashable(attr) and attr in self.values
+
+
+class StartsWithPredicate(Predicate):
+    """
+    _bk_iam_path_ 等前缀匹配, 多个前缀合并为一次 str.startswith 调用
+    """
+
+    def __init__(self, resource_type: str, attribute: str, prefixes):
+        self.resource_type = resource_type
+        self.attribute = attribute
+        self.prefixes = tuple(prefixes)
+
+    def __call__(self, objects):
+        attr = _get_attribute(objects, self.resource_type, self.attribute)
+        attrs = attr if isinstance(attr, (list, tuple)) else [attr]
+        return any(isinstance(a, str) and a.startswith(self.prefixes) for a in attrs)
+
+
+class OperatorPredicate(Predicate):
+    """
+    其他操作符复用SDK的计算逻辑
+    """
+
+    def __init__(self, resource_type: str, attribute: str, operator):
+        self.resource_type = resource_type
+        self.attribute = attribute
+        self.operator = operator
+
+    def __call__(self, objects):
+        attr = _get_attribute(objects, self.resource_type, self.attribute)
+        value = self.operator.value
+        attr_is_array = isinstance(attr, (list, tuple))
+        value_is_array = isinstance(value, (list, tuple))
+        try:
+            if self.operator.op.startswith("not_"):
+                return self.operator._eval_negative(attr, attr_is_array, value, value_is_array)
+            return self.operator._eval_positive(attr, attr_is_array, value, value_is_array)
+        except (TypeError, AttributeError):
+            return False
+
+
+def _is_hashable(value) -> bool:
+    return isinstance(value, (str, int, float, bool)) or value is None
+
+
+def _merge_set_predicates(children: List[Predicate]) -> List[Predicate]:
+    """
+    OR 中同一字段的多个 eq/in 合并为一个集合
+    """
+    merged = {}
+    result = []
+    for child in children:
+        if isinstance(child, SetPredicate):
+            key = (child.resource_type, child.attribute)
+            if key in merged:
+                merged[key].values = merged[key].values | child.values
+                continue
+            child = SetPredicate(child.resource_type, child.attribute, child.values)
+            merged[key] = child
+        result.append(child)
+    return result
+
+
+def compile_policy(policy: dict) -> Predicate:
+    """
+    将权限中心返回的策略表达式编译为可直接调用的判断函数
+    :param policy: {"op": "OR", "content": [{"op": "in", "field": "biz.id", "value": ["1", "2"]}]}
+    """
+    if not policy:
+        return NonePredicate()
+
+    op = policy["op"]
+    if op in (OP.AND, OP.OR):
+        children = [compile_policy(c) for c in policy["content"]]
+        if op == OP.AND:
+            return AndPredicate(children)
+        if any(isinstance(child, AnyPredicate) for child in children):
+            return AnyPredicate()
+        children = _merge_set_predicates(children)
+        return children[0] if len(children) == 1 else OrPredicate(children)
+
+    if op not in BINARY_OPERATORS:
+        raise ValueError("operator %s not supported" % op)
+
+    if op == OP.ANY:
+        return AnyPredicate()
+
+    field, value = field_value_convert(op, policy["field"], policy["value"])
+    resource_type, __, attribute = field.partition(".")
+    values = value if isinstance(value, (list, tuple)) else [value]
+
+    if op == OP.IN and isinstance(value, (list, tuple)) and all(_is_hashable(v) for v in values):
+        return SetPredicate(resource_type, attribute, values)
+    if op == OP.EQ and all(_is_hashable(v) for v in values):
+        return SetPredicate(resource_type, attribute, values)
+    if op == OP.STARTS_WITH and all(isinstance(v, str) for v in values):
+        return StartsWithPredicate(resource_type, attribute, values)
+    return OperatorPredicate(resource_type, attribute, BINARY_OPERATORS[op](field, value))
+
+
+class CompiledPolicy(object):
+    def __init__(self, policy: dict):
+        self.predicate = compile_policy(policy)
+        self.is_empty = not policy
+        self.create_time = time.time()
+
+    def eval(self, objects: Dict[str, dict]) -> bool:
+        """
+        :param objects: 资源类型 -> 资源属性(需包含id)
+        """
+        return self.predicate(objects)
+
+    def batch_eval(self, resource_type: str, instances: List[dict]) -> List[bool]:
+        """
+        批量计算同一类型的资源实例，缺失属性的实例按无权限处理
+        """
+        results = []
+        for instance in instances:
+            try:
+                results.append(self.predicate({resource_type: instance}))
+            except PolicyAttributeMissingError:
+                results.append(False)
+        return results
+
+
+class PolicyCache(object):
+    """
+    进程内按 (用户, 动作) 缓存编译后的策略
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._lock = threading.Lock()
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, username: str, action_id: str):
+        with self._lock:
+            return self._cache.get((username, action_id))
+
+    def set(self, username: str, action_id: str, policy: CompiledPolicy):
+        with self._lock:
+            self._cache[(username, action_id)] = policy
+
+    def invalidate(self, username: str = None):
+        with self._lock:
+            if username is None:
+                self._cache.clear()
+                return
+            for key in [key for key in self._cache.keys() if key[0] == username]:
+                self._cache.pop(key, None)
+
+
+policy_cache = PolicyCache(maxsize=settings.IAM_POLICY_CACHE_MAXSIZE, ttl=settings.IAM_POLICY_CACHE_TTL)
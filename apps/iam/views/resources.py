@@ -24,11 +24,11 @@ from typing import Dict, List
 from django.db.models import Q
 
 from apps.api import TransferApi
-from apps.iam import Permission
+from apps.iam.handlers.policy import CompiledPolicy
 from apps.log_databus.constants import STORAGE_CLUSTER_TYPE, REGISTERED_SYSTEM_DEFAULT
 from apps.log_databus.models import CollectorConfig
 from apps.log_search.models import LogIndexSet, ProjectInfo
-from iam import PathEqDjangoQuerySetConverter, make_expression, ObjectSet, DjangoQuerySetConverter
+from iam import PathEqDjangoQuerySetConverter, DjangoQuerySetConverter
 from iam.eval.constants import KEYWORD_BK_IAM_PATH_FIELD_SUFFIX, OP
 from iam.resource.provider import ResourceProvider, ListResult
 
@@ -238,20 +238,13 @@ class EsSourceResourceProvider(BaseResourceProvider):
         if not expression:
             return ListResult(results=[], count=0)
 
-        expr = make_expression(expression)
+        policy = CompiledPolicy(expression)
 
         clusters = self.list_clusters()
-        iam_client = Permission.get_iam_client()
-
-        filtered_clusters = []
 
         # 这里需要手动匹配策略... Org
-        for cluster in clusters:
-            obj_set = ObjectSet()
-            obj_set.add_object("es_source", cluster)
-            is_allowed = iam_client._eval_expr(expr, obj_set)
-            if is_allowed:
-                filtered_clusters.append(cluster)
+        allowed_list = policy.batch_eval("es_source", clusters)
+        filtered_clusters = [cluster for cluster, is_allowed in zip(clusters, allowed_list) if is_allowed]
 
         results = [
             {"id": item["id"], "display_name": item["display_name"]}
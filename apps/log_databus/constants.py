@@ -34,6 +34,8 @@ CHECK_TASK_READY_NOTE_FOUND_EXCEPTION_CODE = "1306201"
 
 COLLECTOR_CONFIG_NAME_EN_REGEX = r"^[A-Za-z0-9_]+$"
 
+SUBSCRIPTION_STATUS_CACHE_KEY = "collector_subscription_status_{subscription_id}"
+
 
 class EsSourceType(ChoicesEnum):
     OTHER = "other"
@@ -78,6 +80,10 @@ STORAGE_CLUSTER_TYPE = "elasticsearch"
 KAFKA_CLUSTER_TYPE = "kafka"
 TRANSFER_CLUSTER_TYPE = "transfer"
 REGISTERED_SYSTEM_DEFAULT = "_default"
+# 日志平台索引名格式 {bk_biz_id}_bklog_*
+BKLOG_INDEX_PREFIX = "_bklog_"
+# 业务已用容量批量写入大小
+STORAGE_USED_BATCH_SIZE = 500
 ETL_DELIMITER_IGNORE = "i"
 ETL_DELIMITER_DELETE = "d"
 ETL_DELIMITER_END = "e"
@@ -25,6 +25,7 @@ import arrow
 from django.db import IntegrityError
 from django.db import transaction
 from django.conf import settings
+from django.core.cache import cache
 from django.utils.translation import ugettext_lazy as _
 
 from apps.api import CCApi
@@ -34,7 +35,7 @@ from apps.feature_toggle.handlers.toggle import FeatureToggleObject
 from apps.feature_toggle.plugins.constants import FEATURE_COLLECTOR_ITSM
 from apps.log_databus.handlers.collector_scenario.custom_define import get_custom
 from apps.utils.function import map_if
-from apps.utils.thread import MultiExecuteFunc
+from apps.utils.thread import ExecutorPool, MultiExecuteFunc
 from apps.constants import UserOperationTypeEnum, UserOperationActionEnum
 from apps.iam import ResourceEnum, Permission
 from apps.log_databus.handlers.storage import StorageHandler
@@ -54,6 +55,7 @@ from apps.log_databus.constants import (
     SEARCH_BIZ_INST_TOPO_LEVEL,
     INTERNAL_TOPO_INDEX,
     BIZ_TOPO_INDEX,
+    SUBSCRIPTION_STATUS_CACHE_KEY,
 )
 from apps.log_databus.exceptions import (
     CollectorConfigNotExistException,
@@ -562,7 +564,9 @@ class CollectorHandler(object):
         try:
             self.data.subscription_id = collector_scenario.update_or_create_subscription(self.data, params)
             self.data.save()
-            subscription_status = self.get_subscription_status_by_list([self.data.collector_config_id])
+            subscription_status = self.get_subscription_status_by_list(
+                [self.data.collector_config_id], use_cache=False
+            )
             if subscription_status[0]["status"] == CollectStatus.RUNNING:
                 logger.warning(
                     f"nodeman get status aleady is ready， collector_config_id -> {self.data.collector_config_id}, "
@@ -812,6 +816,7 @@ class CollectorHandler(object):
             params["scope"] = {"node_type": TargetNodeTypeEnum.INSTANCE.value, "nodes": nodes}
 
         task_id = str(NodeApi.run_subscription_task(params)["task_id"])
+        self.invalidate_subscription_status(self.data.subscription_id)
 
         # 对指定nodes进行重试，合并任务
         if nodes is not None:
@@ -1236,11 +1241,12 @@ class CollectorHandler(object):
                     return {"log_detail": "\n".join(log), "log_result": detail_result}
         return {"log_detail": "\n".join(log), "log_result": detail_result}
 
-    def get_subscription_status_by_list(self, collector_id_list: list, multi_flag=False) -> list:
+    def get_subscription_status_by_list(self, collector_id_list: list, multi_flag=False, use_cache=True) -> list:
         """
         批量获取采集项订阅状态
         :param  [list] collector_id_list: 采集项ID列表
         :param [Boolean] multi_flag:是否使用并发
+        :param [Boolean] use_cache: 是否使用订阅状态缓存, 需要准确判断是否部署中时不使用
         :return: [dict]
         """
         return_data = list()
@@ -1248,11 +1254,11 @@ class CollectorHandler(object):
         subscription_collector_map = dict()
 
         collector_list = CollectorConfig.objects.filter(collector_config_id__in=collector_id_list).values(
-            "collector_config_id", "subscription_id", "itsm_ticket_status"
+            "collector_config_id", "subscription_id", "itsm_ticket_status", "is_active"
         )
-        status_result = {}
-        if multi_flag:
-            multi_execute_func = MultiExecuteFunc()
+        active_map = {
+            collector_obj["collector_config_id"]: collector_obj["is_active"] for collector_obj in collector_list
+        }
         for collector_obj in collector_list:
 
             # 若订阅ID未写入
@@ -1274,30 +1280,20 @@ class CollectorHandler(object):
             # 订阅ID和采集配置ID的映射关系 & 需要查询订阅ID列表
             subscription_collector_map[collector_obj["subscription_id"]] = collector_obj["collector_config_id"]
             subscription_id_list.append(collector_obj["subscription_id"])
-            if multi_flag:
-                multi_execute_func.append(
-                    collector_obj["collector_config_id"],
-                    NodeApi.subscription_statistic,
-                    params={
-                        "subscription_id_list": [collector_obj["subscription_id"]],
-                        "plugin_name": LogPluginInfo.NAME,
-                    },
-                )
-            else:
-                status_result[collector_obj["collector_config_id"]] = NodeApi.subscription_statistic(
-                    params={
-                        "subscription_id_list": [collector_obj["subscription_id"]],
-                        "plugin_name": LogPluginInfo.NAME,
-                    }
-                )
 
         # 如果没有订阅ID，则直接返回
         if not subscription_id_list:
-            return self._clean_terminated(return_data)
+            return self._clean_terminated(return_data, active_map)
 
-        # 并发查询所需的配置
-        if multi_flag:
-            status_result = multi_execute_func.run()
+        # 所有订阅批量查询
+        statistic_map = self.get_subscription_statistic(
+            subscription_id_list, multi_flag=multi_flag, use_cache=use_cache
+        )
+        status_result = {
+            subscription_collector_map[subscription_id]: [statistic]
+            for subscription_id, statistic in statistic_map.items()
+            if subscription_id in subscription_collector_map
+        }
         # 接口查询到的数据进行处理
         subscription_status_data, subscription_id_list = self.format_subscription_status(
             status_result, subscription_id_list
@@ -1321,16 +1317,79 @@ class CollectorHandler(object):
             )
 
         # 若采集项已停用，则采集状态修改为“已停用”
-        return self._clean_terminated(return_data)
+        return self._clean_terminated(return_data, active_map)
+
+    @classmethod
+    def get_subscription_statistic(cls, subscription_id_list: list, multi_flag=False, use_cache=True) -> dict:
+        """
+        批量查询订阅状态统计, 每批订阅只请求一次节点管理
+        部署已结束的订阅状态短时间缓存, 仍在部署中的订阅每次重新查询
+        :param subscription_id_list: 订阅ID列表
+        :param multi_flag: 多个批次时是否并发查询
+        :param use_cache: 是否使用缓存
+        :return: {subscription_id: statistic}
+        """
+        statistic_map = dict()
+        if use_cache:
+            cached_statistics = cache.get_many(
+                [SUBSCRIPTION_STATUS_CACHE_KEY.format(subscription_id=_id) for _id in subscription_id_list]
+            )
+            for subscription_id in subscription_id_list:
+                cache_key = SUBSCRIPTION_STATUS_CACHE_KEY.format(subscription_id=subscription_id)
+                statistic = cached_statistics.get(cache_key)
+                if statistic and not cls._is_statistic_running(statistic):
+                    statistic_map[subscription_id] = statistic
+
+        refresh_id_list = [_id for _id in subscription_id_list if _id not in statistic_map]
+        if not refresh_id_list:
+            return statistic_map
+
+        batch_size = settings.COLLECTOR_SUBSCRIPTION_STATUS_BATCH_SIZE
+        params_list = [
+            {"subscription_id_list": refresh_id_list[index : index + batch_size], "plugin_name": LogPluginInfo.NAME}
+            for index in range(0, len(refresh_id_list), batch_size)
+        ]
+        if multi_flag and len(params_list) > 1:
+            multi_execute_func = MultiExecuteFunc(pool=ExecutorPool.NODEMAN)
+            for index, params in enumerate(params_list):
+                multi_execute_func.append(index, NodeApi.subscription_statistic, params=params)
+            result_list = list(multi_execute_func.run().values())
+        else:
+            result_list = [NodeApi.subscription_statistic(params=params) for params in params_list]
+
+        refreshed_cache = dict()
+        for result in result_list:
+            for statistic in result or []:
+                statistic_map[statistic["subscription_id"]] = statistic
+                if not cls._is_statistic_running(statistic):
+                    cache_key = SUBSCRIPTION_STATUS_CACHE_KEY.format(subscription_id=statistic["subscription_id"])
+                    refreshed_cache[cache_key] = statistic
+        if refreshed_cache:
+            cache.set_many(refreshed_cache, settings.COLLECTOR_SUBSCRIPTION_STATUS_CACHE_TTL)
+        return statistic_map
+
+    @staticmethod
+    def _is_statistic_running(statistic: dict) -> bool:
+        return any(
+            status["status"] in [CollectStatus.PENDING, CollectStatus.RUNNING] and status["count"]
+            for status in statistic.get("status", [])
+        )
+
+    @staticmethod
+    def invalidate_subscription_status(subscription_id):
+        """
+        触发订阅任务后清除状态缓存, 保证列表立即展示部署中
+        """
+        if subscription_id:
+            cache.delete(SUBSCRIPTION_STATUS_CACHE_KEY.format(subscription_id=subscription_id))
 
-    def _clean_terminated(self, data: list):
+    def _clean_terminated(self, data: list, active_map: dict):
         for _data in data:
             # RUNNING状态
             if _data["status"] == CollectStatus.RUNNING:
                 continue
 
-            _collector_config = CollectorConfig.objects.get(collector_config_id=_data["collector_id"])
-            if not _collector_config.is_active:
+            if not active_map.get(_data["collector_id"], True):
                 _data["status"] = CollectStatus.TERMINATED
                 _data["status_name"] = RunStatus.TERMINATED
         return data
@@ -31,7 +31,7 @@ from elasticsearch import Elasticsearch
 
 from apps.log_databus.utils.es_config import get_es_config
 from apps.utils.log import logger
-from apps.utils.thread import MultiExecuteFunc
+from apps.utils.thread import ExecutorPool, MultiExecuteFunc
 from apps.constants import UserOperationTypeEnum, UserOperationActionEnum
 from apps.iam import Permission, ResourceEnum
 from apps.log_esquery.utils.es_route import EsRoute
@@ -273,7 +273,7 @@ class StorageHandler(object):
         return cluster_info
 
     def _get_cluster_detail_info(self, cluster_info: List[dict]):
-        multi_execute_func = MultiExecuteFunc()
+        multi_execute_func = MultiExecuteFunc(pool=ExecutorPool.ES)
 
         def get_cluster_stats(cluster_id: int):
             return EsRoute(
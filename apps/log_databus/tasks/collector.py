@@ -22,6 +22,8 @@ import pytz
 
 from celery.task import periodic_task
 from celery.schedules import crontab
+from django.db import transaction
+from django.utils import timezone
 
 from apps.api.modules.bkdata_databus import BkDataDatabusApi
 from apps.log_databus.models import CollectorConfig
@@ -30,11 +32,14 @@ from apps.api import TransferApi
 from apps.log_databus.constants import (
     STORAGE_CLUSTER_TYPE,
     REGISTERED_SYSTEM_DEFAULT,
+    BKLOG_INDEX_PREFIX,
+    STORAGE_USED_BATCH_SIZE,
     CollectItsmStatus,
 )
 from apps.feature_toggle.plugins.constants import FEATURE_BKDATA_DATAID
 from apps.log_measure.handlers.elastic import ElasticHandle
 from apps.utils.log import logger
+from apps.utils.thread import ExecutorPool, MultiExecuteFunc
 from apps.log_databus.models import StorageUsed
 from apps.feature_toggle.handlers.toggle import FeatureToggleObject
 
@@ -66,40 +71,55 @@ def collector_status():
 def sync_storage_capacity():
     """
     每小时同步业务各集群已用容量
+    每个集群只查询一次索引信息, 在内存中按业务前缀汇总, 各集群并发查询
     :return:
     """
 
     # 1、获取已有采集项业务
-    business_list = CollectorConfig.objects.all().values("bk_biz_id").distinct()
+    biz_id_list = list(CollectorConfig.objects.all().values_list("bk_biz_id", flat=True).order_by().distinct())
 
     # 2、获取所有集群
     params = {"cluster_type": STORAGE_CLUSTER_TYPE}
     cluster_obj = TransferApi.get_cluster_info(params)
-    for _cluster in cluster_obj:
 
+    multi_execute_func = MultiExecuteFunc(pool=ExecutorPool.ES)
+    for _cluster in cluster_obj:
         # 2-1公共集群：所有业务都需要查询
         if _cluster["cluster_config"].get("registered_system") == REGISTERED_SYSTEM_DEFAULT:
-            for _business in business_list:
-                storage_used = get_biz_storage_capacity(_business["bk_biz_id"], _cluster)
-                StorageUsed.objects.update_or_create(
-                    bk_biz_id=_business["bk_biz_id"],
-                    storage_cluster_id=_cluster["cluster_config"]["cluster_id"],
-                    defaults={"storage_used": storage_used},
-                )
+            cluster_biz_id_list = biz_id_list
         # 2-2第三方集群：只需查询指定业务
         else:
             bk_biz_id = _cluster["cluster_config"].get("custom_option", {}).get("bk_biz_id")
             if not bk_biz_id:
                 continue
-            storage_used = get_biz_storage_capacity(bk_biz_id, _cluster)
-            StorageUsed.objects.update_or_create(
-                bk_biz_id=bk_biz_id,
-                storage_cluster_id=_cluster["cluster_config"]["cluster_id"],
-                defaults={"storage_used": storage_used},
-            )
+            cluster_biz_id_list = [bk_biz_id]
+        multi_execute_func.append(
+            result_key=_cluster["cluster_config"]["cluster_id"],
+            func=get_cluster_storage_capacity,
+            params={"cluster": _cluster, "biz_id_list": cluster_biz_id_list},
+            use_request=False,
+        )
+    results = multi_execute_func.run()
+
+    # 3、批量写入
+    storage_used_map = {
+        (int(bk_biz_id), cluster_id): storage_used
+        for cluster_id, biz_storage_used in results.items()
+        if biz_storage_used is not None
+        for bk_biz_id, storage_used in biz_storage_used.items()
+    }
+    bulk_upsert_storage_used(storage_used_map)
 
 
-def get_biz_storage_capacity(bk_biz_id, cluster):
+def get_cluster_storage_capacity(params):
+    """
+    获取集群内各业务已用容量 单位GB, 查询失败时返回None
+    """
+    cluster = params["cluster"]
+    biz_id_list = params["biz_id_list"]
+    if not biz_id_list:
+        return {}
+
     # 集群信息
     cluster_config = cluster["cluster_config"]
     domain_name = cluster_config["domain_name"]
@@ -107,7 +127,8 @@ def get_biz_storage_capacity(bk_biz_id, cluster):
     auth_info = cluster.get("auth_info", {})
     username = auth_info.get("username")
     password = auth_info.get("password")
-    index_format = f"{bk_biz_id}_bklog_*"
+    # 只有一个业务时直接按业务前缀查询, 避免拉取集群内所有业务的索引
+    index_format = f"{biz_id_list[0]}{BKLOG_INDEX_PREFIX}*" if len(biz_id_list) == 1 else f"*{BKLOG_INDEX_PREFIX}*"
 
     # 索引信息
     try:
@@ -116,13 +137,53 @@ def get_biz_storage_capacity(bk_biz_id, cluster):
         )
     except Exception as e:  # pylint: disable=broad-except
         logger.exception(f"集群[{domain_name}] 索引cat信息获取失败，错误信息：{e}")
-        return 0
+        return None
 
-    # 汇总容量
-    total_size = 0
+    # 按业务前缀汇总容量
+    total_size = {str(bk_biz_id): 0 for bk_biz_id in biz_id_list}
     for _info in indices_info:
         if _info["status"] == "close":
             continue
-        total_size += int(_info["store.size"])
+        bk_biz_id, separator, _ = _info["index"].partition(BKLOG_INDEX_PREFIX)
+        if not separator or bk_biz_id not in total_size:
+            continue
+        total_size[bk_biz_id] += int(_info["store.size"])
 
-    return round(total_size / 1024, 2)
+    return {bk_biz_id: round(size / 1024, 2) for bk_biz_id, size in total_size.items()}
+
+
+def bulk_upsert_storage_used(storage_used_map):
+    """
+    批量写入业务已用容量
+    :param storage_used_map: {(bk_biz_id, storage_cluster_id): storage_used}
+    """
+    if not storage_used_map:
+        return
+
+    now = timezone.now()
+    cluster_id_list = {cluster_id for _, cluster_id in storage_used_map}
+    update_objs = []
+    with transaction.atomic():
+        for storage_used_obj in StorageUsed.objects.filter(storage_cluster_id__in=cluster_id_list).select_for_update():
+            key = (storage_used_obj.bk_biz_id, storage_used_obj.storage_cluster_id)
+            if key not in storage_used_map:
+                continue
+            storage_used_obj.storage_used = storage_used_map.pop(key)
+            storage_used_obj.updated_at = now
+            update_objs.append(storage_used_obj)
+        StorageUsed.objects.bulk_update(
+            update_objs, fields=["storage_used", "updated_at"], batch_size=STORAGE_USED_BATCH_SIZE
+        )
+        StorageUsed.objects.bulk_create(
+            [
+                StorageUsed(
+                    bk_biz_id=bk_biz_id,
+                    storage_cluster_id=cluster_id,
+                    storage_used=storage_used,
+                    created_at=now,
+                    updated_at=now,
+                )
+                for (bk_biz_id, cluster_id), storage_used in storage_used_map.items()
+            ],
+            batch_size=STORAGE_USED_BATCH_SIZE,
+        )
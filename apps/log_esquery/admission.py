@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import hashlib
+import random
+import sys
+import time
+
+from blueapps.utils.unique import uniqid
+from django.conf import settings
+from prometheus_client import Counter, Histogram
+from redis.exceptions import RedisError
+
+from apps.log_esquery.constants import QueryPriority
+from apps.log_esquery.exceptions import EsQueryConcurrencyLimitedException, EsQueryRateLimitedException
+from apps.log_esquery.qos import redis_client
+from apps.log_search.models import Scenario
+from apps.utils.log import logger
+
+esquery_admission = Counter(
+    "bklog_esquery_admission", "Admission result of esquery requests", ["cluster", "priority", "result"]
+)
+esquery_admission_wait = Histogram(
+    "bklog_esquery_admission_wait_seconds",
+    "Queue wait time of admitted esquery requests",
+    ["priority"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+
+# 令牌桶: 按 (app_code, 索引集/索引) 限制查询速率, 交互检索再按用户区分
+# KEYS[1]: 令牌桶
+# ARGV[1]: 每秒生成令牌数 ARGV[2]: 桶容量 ARGV[3]: 当前时间(毫秒) ARGV[4]: 本次消耗令牌数
+# 返回: {是否放行, 需等待的毫秒数}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed = 0
+local retry_after = 0
+if tokens >= requested then
+    tokens = tokens - requested
+    allowed = 1
+else
+    retry_after = math.ceil((requested - tokens) * 1000 / rate)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return {allowed, retry_after}
+"""
+
+# 集群并发: 执行中的查询记录在 inflight 中(score为租约到期时间), 并发已满时进入 queue 排队
+# queue 的 score 为 优先级 * 1e13 + 入队时间, 同一优先级先到先得; 只有排在前 空闲数 位的等待者可以获得执行机会
+# KEYS[1]: inflight KEYS[2]: queue
+# ARGV[1]: 查询标识 ARGV[2]: 排队score ARGV[3]: 集群并发上限 ARGV[4]: 当前时间(毫秒)
+# ARGV[5]: 租约时长(毫秒) ARGV[6]: 排队过期时长(毫秒) ARGV[7]: 最大优先级
+# 返回: 1 获得执行机会 0 继续等待
+# 脚本只使用按score/排名的操作, 复杂度为 O(log N), 不随排队数增长遍历队列
+CONCURRENCY_ACQUIRE_SCRIPT = """
+local ticket = ARGV[1]
+local limit = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local lease = tonumber(ARGV[5])
+local queue_ttl = tonumber(ARGV[6])
+local max_priority = tonumber(ARGV[7])
+-- 清理租约已到期(进程异常退出未释放)的查询
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZSCORE', KEYS[2], ticket) == false then
+    redis.call('ZADD', KEYS[2], ARGV[2], ticket)
+end
+-- 按优先级区间清理异常退出未出队的等待者(入队时间早于 now - queue_ttl)
+for priority = 0, max_priority do
+    local band = priority * 1e13
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], band, band + now - queue_ttl - 1)
+end
+redis.call('PEXPIRE', KEYS[2], queue_ttl)
+local free = limit - redis.call('ZCARD', KEYS[1])
+if free <= 0 then
+    return 0
+end
+local rank = redis.call('ZRANK', KEYS[2], ticket)
+if rank == false or rank >= free then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ticket)
+redis.call('ZADD', KEYS[1], now + lease, ticket)
+redis.call('PEXPIRE', KEYS[1], lease)
+return 1
+"""
+
+# 排队score中优先级的权重, 需大于毫秒时间戳
+PRIORITY_SCORE_WEIGHT = 10 ** 13
+
+
+class EsQueryAdmission(object):
+    """
+    ES查询准入控制, 在查询超时前保护ES集群:
+    1. 令牌桶: 同一 (app_code, 索引集/索引) 的查询速率超过限制时直接拒绝, 交互检索按用户分别限速,
+       避免同一索引集的所有用户共享本应用的令牌桶
+    2. 集群并发: 同一集群执行中的查询数达到上限时排队, 交互检索优先于导出, 导出优先于后台查询(如Grafana)
+       web进程中排队会一直占用worker, 最长只等待 ESQUERY_ADMISSION_WEB_MAX_WAIT 秒
+    令牌扣减、入队与出队均在Lua脚本中原子执行, 多进程部署下共享同一限制
+    """
+
+    def __init__(self, search_dict: dict):
+        scenario_id = search_dict.get("scenario_id") or Scenario.LOG
+        self.bk_app_code = search_dict.get("bk_app_code") or settings.APP_CODE
+        self.bk_username = search_dict.get("bk_username") or ""
+        self.priority = search_dict.get("query_priority") or self.get_default_priority(self.bk_app_code)
+        if scenario_id == Scenario.BKDATA:
+            self.cluster = scenario_id
+        else:
+            self.cluster = f"{scenario_id}_{search_dict.get('storage_cluster_id')}"
+        target = search_dict.get("index_set_id") or search_dict.get("indices") or ""
+        self.target = hashlib.md5(str(target).encode()).hexdigest()
+        self.ticket = ""
+
+    @staticmethod
+    def get_default_priority(bk_app_code: str) -> str:
+        # 本应用发起的查询默认为交互检索, 其它应用通过接口发起的默认为后台查询
+        return QueryPriority.INTERACTIVE if bk_app_code == settings.APP_CODE else QueryPriority.BACKGROUND
+
+    @property
+    def enabled(self) -> bool:
+        return settings.USE_REDIS and settings.ESQUERY_ADMISSION_ENABLED
+
+    @property
+    def bucket_key(self) -> str:
+        if self.priority == QueryPriority.INTERACTIVE and self.bk_username:
+            return f"{settings.APP_CODE}_admission_bucket_{self.bk_app_code}_{self.bk_username}_{self.target}"
+        return f"{settings.APP_CODE}_admission_bucket_{self.bk_app_code}_{self.target}"
+
+    @property
+    def max_wait(self) -> float:
+        max_wait = settings.ESQUERY_ADMISSION_MAX_WAIT.get(self.priority, 0)
+        if "celery" not in sys.argv:
+            max_wait = min(max_wait, settings.ESQUERY_ADMISSION_WEB_MAX_WAIT)
+        return max_wait
+
+    @property
+    def inflight_key(self) -> str:
+        # 同一集群的key使用相同的hash tag, 保证脚本操作的key在同一slot
+        return f"{settings.APP_CODE}_admission_{{{self.cluster}}}_inflight"
+
+    @property
+    def queue_key(self) -> str:
+        return f"{settings.APP_CODE}_admission_{{{self.cluster}}}_queue"
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def acquire(self):
+        if not self.enabled:
+            return
+        try:
+            self._consume_token()
+            self._wait_for_slot()
+        except RedisError as e:
+            # redis异常时放行, 不影响查询
+            logger.exception(f"[Esquery Admission] cluster [{self.cluster}] admission error: {e}")
+            esquery_admission.labels(cluster=self.cluster, priority=self.priority, result="error").inc()
+            self.ticket = ""
+
+    def release(self):
+        if not self.ticket:
+            return
+        try:
+            redis_client.zrem(self.inflight_key, self.ticket)
+        except RedisError as e:
+            # 租约到期后会被自动清理
+            logger.exception(f"[Esquery Admission] cluster [{self.cluster}] release error: {e}")
+        self.ticket = ""
+
+    def _consume_token(self):
+        token_bucket = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        allowed, retry_after = token_bucket(
+            keys=[self.bucket_key],
+            args=[
+                settings.ESQUERY_ADMISSION_RATE,
+                settings.ESQUERY_ADMISSION_BURST,
+                self._now_ms(),
+                1,
+            ],
+        )
+        if allowed:
+            return
+        esquery_admission.labels(cluster=self.cluster, priority=self.priority, result="rate_limited").inc()
+        logger.warning(
+            f"[Esquery Admission] app [{self.bk_app_code}] user [{self.bk_username}] "
+            f"target [{self.target}] rate limited"
+        )
+        raise EsQueryRateLimitedException(
+            EsQueryRateLimitedException.MESSAGE.format(retry_after=round(int(retry_after) / 1000, 1))
+        )
+
+    def _wait_for_slot(self):
+        acquire = redis_client.register_script(CONCURRENCY_ACQUIRE_SCRIPT)
+        ticket = uniqid()
+        max_wait = self.max_wait
+        enqueue_at = time.time()
+        score = QueryPriority.ORDER.get(self.priority, 0) * PRIORITY_SCORE_WEIGHT + int(enqueue_at * 1000)
+        queue_ttl = (max(settings.ESQUERY_ADMISSION_MAX_WAIT.values()) + 60) * 1000
+        while True:
+            admitted = acquire(
+                keys=[self.inflight_key, self.queue_key],
+                args=[
+                    ticket,
+                    score,
+                    settings.ESQUERY_ADMISSION_CLUSTER_CONCURRENCY,
+                    self._now_ms(),
+                    settings.ESQUERY_ADMISSION_LEASE * 1000,
+                    queue_ttl,
+                    max(QueryPriority.ORDER.values()),
+                ],
+            )
+            waited = time.time() - enqueue_at
+            if admitted:
+                self.ticket = ticket
+                esquery_admission.labels(cluster=self.cluster, priority=self.priority, result="admitted").inc()
+                esquery_admission_wait.labels(priority=self.priority).observe(waited)
+                return
+            if waited >= max_wait:
+                redis_client.zrem(self.queue_key, ticket)
+                esquery_admission.labels(
+                    cluster=self.cluster, priority=self.priority, result="concurrency_limited"
+                ).inc()
+                logger.warning(f"[Esquery Admission] cluster [{self.cluster}] busy, {self.priority} query rejected")
+                raise EsQueryConcurrencyLimitedException(
+                    EsQueryConcurrencyLimitedException.MESSAGE.format(wait=max_wait)
+                )
+            # 加入随机抖动, 避免大量等待者同时轮询redis
+            step = settings.ESQUERY_ADMISSION_WAIT_STEP * random.uniform(0.5, 1.5)
+            time.sleep(max(min(step, max_wait - waited), 0))
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
@@ -24,3 +24,16 @@ ES_ROUTE_ALLOW_URL = ["_cat", "_cluster", "_nodes", "_stats"]
 WILDCARD_PATTERN = "*"
 
 BKDATA_NOT_HAVE_INDEX = "1532006"
+
+
+class QueryPriority(object):
+    """
+    查询优先级, 集群并发已满时按优先级排队, 数值越小越优先
+    """
+
+    INTERACTIVE = "interactive"
+    EXPORT = "export"
+    BACKGROUND = "background"
+
+    ORDER = {INTERACTIVE: 0, EXPORT: 1, BACKGROUND: 2}
+    CHOICES = ((INTERACTIVE, INTERACTIVE), (EXPORT, EXPORT), (BACKGROUND, BACKGROUND))
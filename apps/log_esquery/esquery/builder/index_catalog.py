@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import re
+import time
+from typing import Dict, Iterable, List, Optional
+
+import arrow
+from django.conf import settings
+from prometheus_client import Counter
+
+from apps.log_esquery.esquery.client.QueryClientEs import QueryClientEs
+from apps.log_search.constants import DEFAULT_TIME_FIELD
+from apps.utils.cache import JsonSerializer, layered_cache
+from apps.utils.log import logger
+
+index_catalog_resolve = Counter(
+    "bklog_index_catalog_resolve", "Index catalog resolve result of QueryIndexOptimizer", ["result"]
+)
+
+
+class IndexCatalog(object):
+    """
+    采集项(LOG场景)结果表的索引目录
+    记录每个物理索引的别名、创建时间、dtEventTimeStamp最小最大值、文档数及存储大小,
+    查询时按时间范围直接解析为具体索引, 避免 {rt}_{YYYYMMDD}* 通配展开到无关或空的索引
+    """
+
+    CACHE_PREFIX = "index_catalog"
+    # v2_{rt}_{YYYYMMDD}_{n} 或 {rt}_{YYYYMMDDHH}_{n}
+    INDEX_NAME_PATTERN = r"^(?:v2_)?{result_table_id}_(?P<date>\d{{8}})\d*_(?P<seq>\d+)$"
+    CAT_INDICES_COLUMNS = "index,creation.date,docs.count,store.size"
+
+    def __init__(self, result_table_id: str):
+        self.result_table_id = result_table_id.replace(".", "_")
+        self.index_name_regex = re.compile(
+            self.INDEX_NAME_PATTERN.format(result_table_id=re.escape(self.result_table_id))
+        )
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.CACHE_PREFIX}_{self.result_table_id}"
+
+    def get(self) -> Optional[Dict]:
+        return layered_cache.get(self.cache_key, prefix=self.CACHE_PREFIX, serializer=JsonSerializer)
+
+    def save(self, indices: List[Dict], refresh_time: int = None):
+        catalog = {
+            "refresh_time": int(time.time() * 1000) if refresh_time is None else refresh_time,
+            "indices": sorted(indices, key=lambda x: (x["date"], x["creation_date"], x["seq"])),
+        }
+        layered_cache.set(
+            self.cache_key, catalog, settings.INDEX_CATALOG_TTL, prefix=self.CACHE_PREFIX, serializer=JsonSerializer
+        )
+
+    def resolve(self, start_time: arrow.Arrow, end_time: arrow.Arrow) -> Optional[List[str]]:
+        """
+        将时间范围解析为具体索引列表, 目录不存在时返回None由调用方退回通配方式
+        1. 已停止写入的索引按 [min_time, max_time] 判断是否与查询范围相交, 空索引直接跳过
+        2. 最新索引仍在写入, 只判断 min_time
+        3. 目录刷新之后可能新建了索引, 对刷新时间之后的日期补充按天通配
+        """
+        catalog = self.get()
+        if not catalog:
+            index_catalog_resolve.labels(result="miss").inc()
+            return None
+
+        now = arrow.utcnow()
+        end_time = min(end_time, now)
+        start_ms, end_ms = start_time.float_timestamp * 1000, end_time.float_timestamp * 1000
+        entries: List[Dict] = catalog["indices"]
+
+        matched_entries: List[Dict] = []
+        for position, entry in enumerate(entries):
+            is_latest = position == len(entries) - 1
+            if not is_latest and (not entry["docs_count"] or entry["min_time"] is None):
+                continue
+            if not is_latest and entry["max_time"] < start_ms:
+                continue
+            if entry["min_time"] is not None and entry["min_time"] > end_ms:
+                continue
+            matched_entries.append(entry)
+
+        tail_patterns: List[str] = []
+        if end_ms >= catalog["refresh_time"]:
+            refresh_day = arrow.get(catalog["refresh_time"] / 1000).floor("day")
+            start_day = max(refresh_day, start_time.to("GMT").floor("day"))
+            tail_patterns = [
+                f"{self.result_table_id}_{day.format('YYYYMMDD')}*"
+                for day in arrow.Arrow.range("day", start_day, end_time.to("GMT"))
+            ]
+
+        if not matched_entries and not tail_patterns:
+            # 范围内没有数据, 仍然保证查询合法且只命中一天
+            tail_patterns = [f"{self.result_table_id}_{end_time.to('GMT').format('YYYYMMDD')}*"]
+
+        index_list = [entry["index"] for entry in matched_entries] + tail_patterns
+        if len(",".join(index_list)) > settings.INDEX_CATALOG_MAX_INDEX_LENGTH:
+            # 索引过多时按月折叠, 避免请求URL超长, 仍然跳过没有数据的月份
+            month_patterns = [f"{self.result_table_id}_{entry['date'][:6]}*" for entry in matched_entries]
+            index_list = list(dict.fromkeys(month_patterns + tail_patterns))
+
+        index_catalog_resolve.labels(result="hit").inc()
+        return index_list
+
+    def refresh(self, client: QueryClientEs) -> List[Dict]:
+        """
+        通过 _cat/indices、_cat/aliases 以及按 _index 分桶的最值聚合刷新目录
+        """
+        index_pattern = f"v2_{self.result_table_id}_*,{self.result_table_id}_*"
+        cat_result = client.cat_indices(
+            index=index_pattern,
+            bytes="b",
+            format="json",
+            params={"request_timeout": settings.ES_QUERY_TIMEOUT, "h": self.CAT_INDICES_COLUMNS},
+        )
+
+        indices: Dict[str, Dict] = {}
+        for item in cat_result:
+            match = self.index_name_regex.match(item["index"])
+            if not match:
+                continue
+            indices[item["index"]] = {
+                "index": item["index"],
+                "date": match.group("date"),
+                "seq": int(match.group("seq")),
+                "aliases": [],
+                "creation_date": int(item.get("creation.date") or 0),
+                "docs_count": int(item.get("docs.count") or 0),
+                "store_size": int(item.get("store.size") or 0),
+                "min_time": None,
+                "max_time": None,
+            }
+        if not indices:
+            self.save([])
+            return []
+
+        try:
+            for alias in client.es_route(f"/_cat/aliases/{self.result_table_id}_*?format=json"):
+                if alias["index"] in indices:
+                    indices[alias["index"]]["aliases"].append(alias["alias"])
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[index_catalog] get aliases of {self.result_table_id} failed: {e}")
+
+        # 已停止写入且文档数未变化的索引沿用上次的最值, 只聚合新建或仍在写入的索引
+        stored_entries = {entry["index"]: entry for entry in (self.get() or {}).get("indices", [])}
+        latest_index = max(indices.values(), key=lambda x: (x["date"], x["creation_date"], x["seq"]))["index"]
+        aggregate_indices: List[str] = []
+        for name, entry in indices.items():
+            stored = stored_entries.get(name)
+            if name != latest_index and stored and stored["docs_count"] == entry["docs_count"]:
+                entry["min_time"], entry["max_time"] = stored["min_time"], stored["max_time"]
+                continue
+            if entry["docs_count"]:
+                aggregate_indices.append(name)
+
+        if aggregate_indices:
+            # 首次构建时全部需要聚合, 直接使用通配避免请求URL过长
+            aggregate_index = ",".join(aggregate_indices) if stored_entries else index_pattern
+            self._aggregate_time_range(client, aggregate_index, indices)
+
+        index_list = list(indices.values())
+        self.save(index_list)
+        return index_list
+
+    @staticmethod
+    def _aggregate_time_range(client: QueryClientEs, aggregate_index: str, indices: Dict[str, Dict]):
+        """
+        按 _index 分桶聚合 dtEventTimeStamp 最值, 写入对应索引的目录项
+        """
+        body = {
+            "size": 0,
+            "aggs": {
+                "indices": {
+                    "terms": {"field": "_index", "size": len(indices)},
+                    "aggs": {
+                        "min_time": {"min": {"field": DEFAULT_TIME_FIELD}},
+                        "max_time": {"max": {"field": DEFAULT_TIME_FIELD}},
+                    },
+                }
+            },
+        }
+        result = client.query(aggregate_index, body)
+        for bucket in result.get("aggregations", {}).get("indices", {}).get("buckets", []):
+            entry = indices.get(bucket["key"])
+            if entry is None or bucket["min_time"]["value"] is None:
+                continue
+            entry["min_time"] = int(bucket["min_time"]["value"])
+            entry["max_time"] = int(bucket["max_time"]["value"])
+
+    @classmethod
+    def refresh_cluster(cls, storage_cluster_id: int, result_table_ids: Iterable[str]):
+        """
+        刷新同一存储集群下的所有结果表, 共用一个ES客户端
+        """
+        client = QueryClientEs(storage_cluster_id)
+        for result_table_id in result_table_ids:
+            try:
+                cls(result_table_id).refresh(client)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.exception(
+                    f"[index_catalog] refresh {result_table_id} of cluster({storage_cluster_id}) failed: {e}"
+                )
@@ -25,6 +25,8 @@ from dateutil.parser import parse
 from dateutil.rrule import rrule
 from dateutil.rrule import DAILY
 from dateutil import tz
+from django.conf import settings
+from apps.log_esquery.esquery.builder.index_catalog import IndexCatalog
 from apps.log_esquery.type_constants import type_index_set_string, type_index_set_list
 from apps.log_search.models import Scenario
 from apps.utils.function import map_if
@@ -50,7 +52,9 @@ class QueryIndexOptimizer(object):
         if scenario_id in [Scenario.BKDATA, Scenario.LOG]:
             # 日志采集使用0时区区分index入库,数据平台使用服务器所在时区
             time_zone = "GMT" if scenario_id == Scenario.LOG else tz.gettz()
-            result_table_id_list = self.index_filter(result_table_id_list, start_time, end_time, time_zone)
+            result_table_id_list = self.index_filter(
+                result_table_id_list, start_time, end_time, time_zone, use_catalog=scenario_id == Scenario.LOG
+            )
 
         if not use_time_range:
             result_table_id_list = []
@@ -75,12 +79,22 @@ class QueryIndexOptimizer(object):
         return self._index
 
     def index_filter(
-        self, result_table_id_list: type_index_set_list, start_time: datetime, end_time: datetime, time_zone: str
+        self,
+        result_table_id_list: type_index_set_list,
+        start_time: datetime,
+        end_time: datetime,
+        time_zone: str,
+        use_catalog: bool = False,
     ) -> List[str]:
         # BkData索引集优化
         final_index_list: list = []
         for x in result_table_id_list:
-            a_index_list: list = self.index_time_filter(x, start_time, end_time, time_zone)
+            a_index_list = None
+            if use_catalog and settings.INDEX_CATALOG_ENABLED:
+                # 优先使用索引目录解析为具体索引, 目录不存在时按日期通配
+                a_index_list = IndexCatalog(x).resolve(start_time, end_time)
+            if a_index_list is None:
+                a_index_list = self.index_time_filter(x, start_time, end_time, time_zone)
             final_index_list = final_index_list + a_index_list
         return final_index_list
 
@@ -0,0 +1,161 @@
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import re
+from typing import Any, Dict, List
+
+from django.conf import settings
+from prometheus_client import Counter
+
+from apps.log_esquery.constants import WILDCARD_PATTERN
+from apps.log_esquery.esquery.builder.query_string_builder import QueryStringBuilder
+
+query_string_plan = Counter("bklog_query_string_plan", "Query string plan strategy of esquery search", ["strategy"])
+
+
+class QueryPlanStrategy(object):
+    """
+    执行计划类型, 按代价从低到高
+    """
+
+    MATCH_ALL = "match_all"
+    NGRAM = "ngram"
+    MATCH_PHRASE = "match_phrase"
+    QUERY_STRING = "query_string"
+    LEADING_WILDCARD = "leading_wildcard"
+
+    COST = {MATCH_ALL: 0, NGRAM: 1, MATCH_PHRASE: 1, QUERY_STRING: 2, LEADING_WILDCARD: 5}
+
+
+class QueryStringPlanner(object):
+    """
+    查询语句执行计划
+    普通关键字原先被包装为 *keyword* 的query_string, 需要扫描所有分词字段的词典, 代价极高
+    在已知全文检索字段时改写为对应字段的 match_phrase, 字段存在ngram子字段时使用子字段保留子串匹配语义
+    用户显式使用查询语法(包括通配符)或要求通配匹配时保持query_string
+    """
+
+    # query_string 语法中以通配符开头的词项
+    LEADING_WILDCARD_PATTERN = re.compile(r"(^|[\s(:])[*?]\S")
+
+    def __init__(
+        self,
+        query_string: str,
+        fulltext_fields: List[str] = None,
+        ngram_fields: List[str] = None,
+        wildcard: bool = False,
+    ):
+        """
+        @param query_string: 用户输入的查询语句
+        @param fulltext_fields: 全文检索字段, 为空时无法改写, 保持原有通配查询
+        @param ngram_fields: 全文检索字段的ngram子字段, 如 log.ngram
+        @param wildcard: 用户要求通配匹配
+        """
+        self.builder = QueryStringBuilder(query_string)
+        self.raw_query_string: str = self.builder.html_unescape(query_string)
+        self.keyword: str = self.raw_query_string.strip()
+        self.fulltext_fields: List[str] = list(fulltext_fields or [])
+        self.ngram_fields: List[str] = list(ngram_fields or [])
+        self.wildcard = wildcard
+        self._plan: Dict[str, Any] = None
+
+    @property
+    def query_string(self) -> str:
+        """
+        兼容原有query_string, 用于高亮判断及未改写时的查询
+        """
+        return self.builder.query_string
+
+    @property
+    def plan(self) -> Dict[str, Any]:
+        if self._plan is None:
+            self._plan = self._make_plan()
+            query_string_plan.labels(strategy=self._plan["strategy"]).inc()
+        return self._plan
+
+    @property
+    def query(self) -> Dict[str, Any]:
+        return self.plan["query"]
+
+    @property
+    def explain(self) -> Dict[str, Any]:
+        """
+        EXPLAIN: 执行计划类型、查询字段、预估代价及原因
+        """
+        return {key: value for key, value in self.plan.items() if key != "query"}
+
+    def _make_plan(self) -> Dict[str, Any]:
+        query_string = self.query_string
+        if query_string == WILDCARD_PATTERN:
+            return self._build_plan(
+                QueryPlanStrategy.MATCH_ALL, self._build_query_string(query_string), [], "empty keyword"
+            )
+
+        if query_string == self.raw_query_string:
+            # 用户使用了查询语法, 原样执行
+            strategy = QueryPlanStrategy.QUERY_STRING
+            reason = "query syntax"
+            if self.LEADING_WILDCARD_PATTERN.search(query_string):
+                strategy = QueryPlanStrategy.LEADING_WILDCARD
+                reason = "leading wildcard in query syntax"
+            return self._build_plan(strategy, self._build_query_string(query_string), [], reason)
+
+        # 普通关键字
+        if self.wildcard or not self.fulltext_fields or not settings.ESQUERY_QUERY_PLANNER_ENABLED:
+            reason = "wildcard requested" if self.wildcard else "no fulltext field"
+            if not settings.ESQUERY_QUERY_PLANNER_ENABLED:
+                reason = "planner disabled"
+            return self._build_plan(
+                QueryPlanStrategy.LEADING_WILDCARD, self._build_query_string(query_string), [], reason
+            )
+
+        queries: List[Dict[str, Any]] = []
+        fields: List[str] = []
+        strategy = QueryPlanStrategy.NGRAM
+        for field in self.fulltext_fields:
+            ngram_field = self._get_ngram_field(field)
+            if ngram_field:
+                queries.append({"match": {ngram_field: {"query": self.keyword, "operator": "and"}}})
+                fields.append(ngram_field)
+                continue
+            strategy = QueryPlanStrategy.MATCH_PHRASE
+            queries.append({"match_phrase": {field: {"query": self.keyword}}})
+            fields.append(field)
+
+        query = queries[0] if len(queries) == 1 else {"bool": {"should": queries, "minimum_should_match": 1}}
+        return self._build_plan(strategy, query, fields, "plain keyword rewritten")
+
+    def _get_ngram_field(self, field: str) -> str:
+        for ngram_field in self.ngram_fields:
+            if ngram_field.startswith(f"{field}."):
+                return ngram_field
+        return ""
+
+    @staticmethod
+    def _build_query_string(query_string: str) -> Dict[str, Any]:
+        return {"query_string": {"query": query_string, "analyze_wildcard": True}}
+
+    @staticmethod
+    def _build_plan(strategy: str, query: Dict[str, Any], fields: List[str], reason: str) -> Dict[str, Any]:
+        return {
+            "strategy": strategy,
+            "fields": fields,
+            "cost": QueryPlanStrategy.COST[strategy],
+            "reason": reason,
+            "query": query,
+        }
@@ -26,7 +26,7 @@ from django.conf import settings
 from elasticsearch.client import _make_path
 from opentelemetry import trace
 from apps.log_esquery.constants import BKDATA_NOT_HAVE_INDEX
-from apps.utils.thread import MultiExecuteFunc
+from apps.utils.thread import ExecutorPool, MultiExecuteFunc
 from apps.log_esquery.esquery.client.QueryClientTemplate import QueryClientTemplate
 from apps.api import BkDataQueryApi, BkDataMetaApi, BkDataStorekitApi
 from apps.log_esquery.exceptions import EsClientSearchException
@@ -131,7 +131,7 @@ class QueryClientBkData(QueryClientTemplate):
         ]
 
         if with_storage and index_list:
-            multi_execute_func = MultiExecuteFunc()
+            multi_execute_func = MultiExecuteFunc(pool=ExecutorPool.BKDATA)
             for _index in index_list:
                 result_table_id = _index["result_table_id"]
                 multi_execute_func.append(result_table_id, QueryClientBkData.get_cluster_info, result_table_id)
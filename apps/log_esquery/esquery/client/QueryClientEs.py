@@ -17,22 +17,18 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-import socket
-
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 from elasticsearch import Elasticsearch as Elasticsearch
-from elasticsearch6 import Elasticsearch as Elasticsearch6
 from elasticsearch5 import Elasticsearch as Elasticsearch5
 
 from django.utils.translation import ugettext as _
 from django.conf import settings
 
 from apps.log_esquery.esquery.client.QueryClientTemplate import QueryClientTemplate
+from apps.log_esquery.esquery.client.client_pool import EsClientPool
 from apps.api import TransferApi
 from apps.log_esquery.exceptions import (
     EsClientMetaInfoException,
-    EsClientConnectInfoException,
-    EsClientSocketException,
     EsClientSearchException,
     BaseSearchFieldsException,
     EsClientScrollException,
@@ -65,6 +61,25 @@ class QueryClientEs(QueryClientTemplate):
             self.catch_timeout_raise(e)
             raise EsClientSearchException(EsClientSearchException.MESSAGE.format(error=e))
 
+    def msearch_key(self, index: str):
+        self._build_connection()
+        return id(self._client)
+
+    def msearch(self, search_list: List[Tuple[str, Dict[str, Any], bool]]) -> List[Dict]:
+        lines: List[Dict[str, Any]] = []
+        for index, body, track_total_hits in search_list:
+            # 如果版本不是5.0且track_total_hits为True时
+            if track_total_hits and not isinstance(self._client, Elasticsearch5):
+                body.update({"track_total_hits": True})
+            lines.extend([{"index": index}, body])
+
+        try:
+            params = {"request_timeout": settings.ES_QUERY_TIMEOUT}
+            return self._client.msearch(body=lines, params=params)["responses"]
+        except Exception as e:  # pylint: disable=broad-except
+            self.catch_timeout_raise(e)
+            raise EsClientSearchException(EsClientSearchException.MESSAGE.format(error=e))
+
     def mapping(self, index: str) -> Dict:
         self._build_connection()
         try:
@@ -82,6 +97,14 @@ class QueryClientEs(QueryClientTemplate):
             self.catch_timeout_raise(e)
             raise EsClientScrollException(EsClientScrollException.MESSAGE.format(error=e))
 
+    def clear_scroll(self, index: str, scroll_id: str) -> Dict:
+        self._build_connection()
+        try:
+            return self._client.clear_scroll(scroll_id=scroll_id)
+        except Exception as e:  # pylint: disable=broad-except
+            self.catch_timeout_raise(e)
+            raise EsClientScrollException(EsClientScrollException.MESSAGE.format(error=e))
+
     def cluster_stats(self, index=None):
         self._build_connection()
         try:
@@ -118,50 +141,20 @@ class QueryClientEs(QueryClientTemplate):
         if not self._active:
             self._get_connection()
             if not self._active:
-                raise EsClientSearchException(EsClientSearchException.MESSAGE.format(error=_(u"EsClient链接失败")))
+                raise EsClientSearchException(EsClientSearchException.MESSAGE.format(error=_("EsClient链接失败")))
             else:
                 pass
         else:
             pass
 
     def _get_connection(self):
-        self.host, self.port, self.username, self.password, self.version, self.schema = self._connect_info(
-            self.storage_cluster_id
-        )
         self._active: bool = False
-
-        if not self.host or not self.port:
-            raise EsClientConnectInfoException()
-
-        cs = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        es_address: tuple = (str(self.host), int(self.port))
-        cs.settimeout(2)
-        try:
-            status: int = cs.connect_ex(es_address)
-            # this status is returnback from tcpserver
-            if status != 0:
-                raise EsClientSocketException(EsClientSocketException.MESSAGE.format(error=""))
-        except Exception as e:  # pylint: disable=broad-except
-            raise EsClientSocketException(EsClientSocketException.MESSAGE.format(error=e))
-        cs.close()
-
-        # 根据版本加载客户端
-        if self.version.startswith("5."):
-            self.elastic_client = Elasticsearch5
-        elif self.version.startswith("6."):
-            self.elastic_client = Elasticsearch6
-        else:
-            self.elastic_client = Elasticsearch
-
-        http_auth = (self.username, self.password) if self.username and self.password else None
-        self._client: Elasticsearch = self.elastic_client(
-            [self.host], http_auth=http_auth, scheme=self.schema, port=self.port, sniffer_timeout=600, verify_certs=True
+        pooled_client = EsClientPool.instance().get_client(
+            f"es_{self.storage_cluster_id}", lambda: self._connect_info(self.storage_cluster_id)
         )
-        if not self._client.ping():
-            self._active = False
-
-        else:
-            self._active = True
+        self.host, self.port, self.username, self.password, self.version, self.schema = pooled_client.connect_info
+        self._client: Elasticsearch = pooled_client.client
+        self._active = True
 
     @staticmethod
     def _connect_info(storage_cluster_id: int) -> tuple:
@@ -17,21 +17,18 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-import socket
-
-from typing import Dict, Any
+import re
+from typing import Dict, Any, List, Tuple
 from elasticsearch import Elasticsearch as Elasticsearch
-from elasticsearch6 import Elasticsearch as Elasticsearch6
 from elasticsearch5 import Elasticsearch as Elasticsearch5
 from django.utils.translation import ugettext as _
 from django.conf import settings
 
 from apps.log_esquery.esquery.client.QueryClientTemplate import QueryClientTemplate
+from apps.log_esquery.esquery.client.client_pool import EsClientPool
 from apps.api import TransferApi
 from apps.log_esquery.exceptions import (
     EsClientMetaInfoException,
-    EsClientConnectInfoException,
-    EsClientSocketException,
     EsClientSearchException,
     BaseSearchFieldsException,
     EsClientScrollException,
@@ -44,6 +41,8 @@ from apps.utils.thread import MultiExecuteFunc
 from apps.log_search.exceptions import IndexResultTableApiException
 from apps.log_esquery.constants import DEFAULT_SCHEMA
 
+CONCRETE_INDEX_REGEX = re.compile(r"^(?:v2_)?(?P<rt>.+?)_\d{8,}_\d+$")
+
 
 class QueryClientLog(QueryClientTemplate):
     def __init__(self):
@@ -64,6 +63,25 @@ class QueryClientLog(QueryClientTemplate):
             self.catch_timeout_raise(e)
             raise EsClientSearchException(EsClientSearchException.MESSAGE.format(error=e))
 
+    def msearch_key(self, index: str):
+        self._build_connection(index)
+        return id(self._client)
+
+    def msearch(self, search_list: List[Tuple[str, Dict[str, Any], bool]]) -> List[Dict]:
+        lines: List[Dict[str, Any]] = []
+        for index, body, track_total_hits in search_list:
+            # 如果版本不是5.0且track_total_hits为True时
+            if track_total_hits and not isinstance(self._client, Elasticsearch5):
+                body.update({"track_total_hits": True})
+            lines.extend([{"index": index}, body])
+
+        try:
+            params = {"request_timeout": settings.ES_QUERY_TIMEOUT}
+            return self._client.msearch(body=lines, params=params)["responses"]
+        except Exception as e:  # pylint: disable=broad-except
+            self.catch_timeout_raise(e)
+            raise EsClientSearchException(EsClientSearchException.MESSAGE.format(error=e))
+
     def mapping(self, index: str) -> Dict:
         index_target = self._get_index_target(index)
         try:
@@ -94,6 +112,14 @@ class QueryClientLog(QueryClientTemplate):
             self.catch_timeout_raise(e)
             raise EsClientScrollException(EsClientScrollException.MESSAGE.format(error=e))
 
+    def clear_scroll(self, index, scroll_id: str) -> Dict:
+        self._build_connection(index)
+        try:
+            return self._client.clear_scroll(scroll_id=scroll_id)
+        except Exception as e:  # pylint: disable=broad-except
+            self.catch_timeout_raise(e)
+            raise EsClientScrollException(EsClientScrollException.MESSAGE.format(error=e))
+
     def cat_indices(self, index=None, bytes="mb", format="json", params=None):
         if params is None:
             params = {"request_timeout": 10}
@@ -134,6 +160,10 @@ class QueryClientLog(QueryClientTemplate):
         index_list: list = index.split(",")
         new_index_list = []
         for _index in index_list:
+            # 索引目录解析出的具体索引 v2_{rt}_{YYYYMMDD}_{n}, 需要去掉版本前缀和日期序号才是结果表
+            concrete_match = CONCRETE_INDEX_REGEX.match(_index)
+            if concrete_match:
+                _index = f"{concrete_match.group('rt')}_*"
             tmp_index: str = _index.replace("_%s_" % settings.TABLE_ID_PREFIX, "_%s." % settings.TABLE_ID_PREFIX)
             tmp_index_list = tmp_index.split("_")
             new_index: str = tmp_index.replace("_%s" % tmp_index_list[-1], "")
@@ -141,43 +171,11 @@ class QueryClientLog(QueryClientTemplate):
         return new_index_list[-1]
 
     def _get_connection(self, index: str):
-        self.host, self.port, self.username, self.password, self.version, self.schema = self._connect_info(index)
         self._active: bool = False
-
-        if not self.host or not self.port:
-            raise EsClientConnectInfoException()
-
-        cs = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        es_address: tuple = (str(self.host), int(self.port))
-        cs.settimeout(2)
-        try:
-            status: int = cs.connect_ex(es_address)
-            # this status is returnback from tcpserver
-            if status != 0:
-                raise EsClientSocketException(EsClientSocketException.MESSAGE.format(error=""))
-        except Exception as e:  # pylint: disable=broad-except
-            raise EsClientSocketException(EsClientSocketException.MESSAGE.format(error=e))
-        cs.close()
-
-        logger.info(f"[esquery]get connection with {self.host}:{self.port} by {self.username}")
-
-        # 根绝版本加载客户端
-        if self.version.startswith("5."):
-            self.elastic_client = Elasticsearch5
-        elif self.version.startswith("6."):
-            self.elastic_client = Elasticsearch6
-        else:
-            self.elastic_client = Elasticsearch
-
-        http_auth = (self.username, self.password) if self.username and self.password else None
-        self._client: Elasticsearch = self.elastic_client(
-            [self.host], http_auth=http_auth, scheme=self.schema, port=self.port, sniffer_timeout=600, verify_certs=True
-        )
-        if not self._client.ping():
-            self._active = False
-
-        else:
-            self._active = True
+        pooled_client = EsClientPool.instance().get_client(f"log_{index}", lambda: self._connect_info(index))
+        self.host, self.port, self.username, self.password, self.version, self.schema = pooled_client.connect_info
+        self._client: Elasticsearch = pooled_client.client
+        self._active = True
 
     @staticmethod
     def _connect_info(index: str) -> tuple:
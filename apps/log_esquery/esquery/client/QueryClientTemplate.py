@@ -17,7 +17,7 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
 import requests
 from elasticsearch import exceptions as EsExceptions
@@ -41,6 +41,24 @@ class QueryClientTemplate(object):
     def mapping(self, index: str) -> Dict:
         raise NotImplementedError()
 
+    def msearch_key(self, index: str):
+        """
+        msearch_key相同的查询可以合并为一次_msearch请求, 默认不合并
+        """
+        return id(self)
+
+    def msearch(self, search_list: List[Tuple[str, Dict[str, Any], bool]]) -> List[Dict]:
+        """
+        批量查询, 不支持_msearch的场景逐个查询
+        @param search_list: [(index, body, track_total_hits)]
+        """
+        return [
+            self.query(index, body, track_total_hits=track_total_hits) for index, body, track_total_hits in search_list
+        ]
+
+    def clear_scroll(self, index: str, scroll_id: str) -> Dict:
+        raise NotImplementedError()
+
     def es_route(self, url: str, index=None):
         raise NotImplementedError()
 
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import socket
+import threading
+import time
+from collections import defaultdict, namedtuple
+from typing import Callable, Dict, List
+
+from django.conf import settings
+from django.utils.translation import ugettext as _
+from elasticsearch import Elasticsearch as Elasticsearch
+from elasticsearch6 import Elasticsearch as Elasticsearch6
+from elasticsearch5 import Elasticsearch as Elasticsearch5
+from prometheus_client import Counter
+
+from apps.log_esquery.exceptions import (
+    EsClientConnectInfoException,
+    EsClientSocketException,
+    EsClientSearchException,
+)
+from apps.utils.log import logger
+
+ConnectInfo = namedtuple("ConnectInfo", ["host", "port", "username", "password", "version", "schema"])
+
+es_client_pool_events = Counter("bklog_es_client_pool_events", "es client pool events", ["event"])
+
+
+class PooledClient(object):
+    """
+    连接池中的ES客户端
+    """
+
+    def __init__(self, client: Elasticsearch, connect_info: ConnectInfo):
+        self.client = client
+        self.connect_info = connect_info
+        self.healthy = True
+        self.last_used_time = time.time()
+
+
+class EsClientPool(object):
+    """
+    进程级ES客户端注册表
+    1. 按存储集群缓存长连接客户端，避免每次查询都重新建立连接池并ping
+    2. 连接信息按TTL缓存，账号密码或版本变化时淘汰旧客户端
+    3. 后台线程定期探活，替代每次请求前的ping
+    4. 被淘汰的客户端可能仍有其他线程在查询, 超过 ES_CLIENT_CLOSE_DELAY 后再由探活线程关闭
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # key -> (过期时间, ConnectInfo)
+        self._connect_infos: Dict[str, tuple] = {}
+        # ConnectInfo -> PooledClient, 同一集群的不同结果表共享客户端
+        self._clients: Dict[ConnectInfo, PooledClient] = {}
+        # 等待关闭的客户端 [(关闭时间, PooledClient)]
+        self._retired_clients: List[tuple] = []
+        self._stats = defaultdict(int)
+        self._health_check_thread = None
+
+    @classmethod
+    def instance(cls) -> "EsClientPool":
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def get_client(self, key: str, get_connect_info: Callable[[], tuple]) -> PooledClient:
+        """
+        获取客户端
+        :param key: 连接信息缓存key, 如集群ID或结果表
+        :param get_connect_info: 获取连接信息的函数, 返回(host, port, username, password, version, schema)
+        """
+        connect_info = self._get_connect_info(key, get_connect_info)
+        with self._lock:
+            pooled_client = self._clients.get(connect_info)
+            if pooled_client and pooled_client.healthy:
+                pooled_client.last_used_time = time.time()
+                self._record("hit")
+                return pooled_client
+
+        pooled_client = PooledClient(self._build_client(connect_info), connect_info)
+        discarded_client = evicted_client = None
+        with self._lock:
+            existing_client = self._clients.get(connect_info)
+            if existing_client and existing_client.healthy:
+                # 其他线程已并发创建了可用客户端, 丢弃当前创建的
+                existing_client.last_used_time = time.time()
+                discarded_client, pooled_client = pooled_client, existing_client
+                self._record("hit")
+            else:
+                if existing_client:
+                    evicted_client = existing_client
+                    self._record("evict_unhealthy")
+                self._clients[connect_info] = pooled_client
+                self._record("miss")
+        # 当前创建的客户端未被其他线程使用, 可以直接关闭
+        self._close(discarded_client)
+        self._retire(evicted_client)
+        self._ensure_health_check()
+        return pooled_client
+
+    def invalidate(self, key: str):
+        """
+        使连接信息失效, 下次获取时重新拉取
+        """
+        with self._lock:
+            self._connect_infos.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["clients"] = len(self._clients)
+            stats["connect_infos"] = len(self._connect_infos)
+            stats["retired_clients"] = len(self._retired_clients)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            pooled_clients = list(self._clients.values()) + [client for _, client in self._retired_clients]
+            self._connect_infos.clear()
+            self._clients.clear()
+            self._retired_clients = []
+        for pooled_client in pooled_clients:
+            self._close(pooled_client)
+
+    def _get_connect_info(self, key: str, get_connect_info: Callable[[], tuple]) -> ConnectInfo:
+        now = time.time()
+        with self._lock:
+            cached = self._connect_infos.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        connect_info = ConnectInfo(*get_connect_info())
+        if not connect_info.host or not connect_info.port:
+            raise EsClientConnectInfoException()
+
+        evicted_client = None
+        with self._lock:
+            if cached and cached[1] != connect_info:
+                # 账号密码或版本发生变化, 淘汰旧客户端
+                evicted_client = self._clients.pop(cached[1], None)
+                if evicted_client:
+                    self._record("evict_changed")
+                logger.info(f"[EsClientPool] connect info of [{key}] changed, evict old client")
+            self._connect_infos[key] = (now + settings.ES_CLIENT_CONNECT_INFO_TTL, connect_info)
+        self._retire(evicted_client)
+        return connect_info
+
+    def _retire(self, pooled_client: PooledClient):
+        """
+        被淘汰的客户端可能仍有进行中的查询, 延迟关闭
+        """
+        if pooled_client is None:
+            return
+        with self._lock:
+            self._retired_clients.append((time.time() + settings.ES_CLIENT_CLOSE_DELAY, pooled_client))
+
+    def _close_retired(self):
+        now = time.time()
+        with self._lock:
+            expired_clients = [client for close_time, client in self._retired_clients if close_time <= now]
+            self._retired_clients = [item for item in self._retired_clients if item[0] > now]
+        for pooled_client in expired_clients:
+            self._close(pooled_client)
+
+    @staticmethod
+    def _close(pooled_client: PooledClient):
+        """
+        关闭被淘汰客户端的连接池
+        """
+        if pooled_client is None:
+            return
+        try:
+            pooled_client.client.transport.close()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(
+                f"[EsClientPool] close client {pooled_client.connect_info.host}:{pooled_client.connect_info.port} "
+                f"error: {e}"
+            )
+
+    @staticmethod
+    def _build_client(connect_info: ConnectInfo) -> Elasticsearch:
+        cs = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        es_address: tuple = (str(connect_info.host), int(connect_info.port))
+        cs.settimeout(2)
+        try:
+            status: int = cs.connect_ex(es_address)
+            # this status is returnback from tcpserver
+            if status != 0:
+                raise EsClientSocketException(EsClientSocketException.MESSAGE.format(error=""))
+        except Exception as e:  # pylint: disable=broad-except
+            raise EsClientSocketException(EsClientSocketException.MESSAGE.format(error=e))
+        finally:
+            cs.close()
+
+        logger.info(f"[EsClientPool] build connection with {connect_info.host}:{connect_info.port}")
+
+        # 根据版本加载客户端
+        if connect_info.version.startswith("5."):
+            elastic_client = Elasticsearch5
+        elif connect_info.version.startswith("6."):
+            elastic_client = Elasticsearch6
+        else:
+            elastic_client = Elasticsearch
+
+        http_auth = (
+            (connect_info.username, connect_info.password) if connect_info.username and connect_info.password else None
+        )
+        client: Elasticsearch = elastic_client(
+            [connect_info.host],
+            http_auth=http_auth,
+            scheme=connect_info.schema,
+            port=connect_info.port,
+            sniffer_timeout=600,
+            verify_certs=True,
+            maxsize=settings.ES_CLIENT_POOL_MAXSIZE,
+        )
+        if not client.ping():
+            raise EsClientSearchException(EsClientSearchException.MESSAGE.format(error=_("EsClient链接失败")))
+        return client
+
+    def _ensure_health_check(self):
+        if self._health_check_thread is not None and self._health_check_thread.is_alive():
+            return
+        with self._lock:
+            if self._health_check_thread is not None and self._health_check_thread.is_alive():
+                return
+            self._health_check_thread = threading.Thread(target=self._health_check_loop, daemon=True)
+            self._health_check_thread.start()
+
+    def _health_check_loop(self):
+        while True:
+            time.sleep(settings.ES_CLIENT_HEALTH_CHECK_INTERVAL)
+            try:
+                self.health_check()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.exception(f"[EsClientPool] health check error: {e}")
+
+    def health_check(self):
+        """
+        探活并淘汰空闲客户端, 关闭到期的已淘汰客户端
+        """
+        self._close_retired()
+        now = time.time()
+        with self._lock:
+            pooled_clients = list(self._clients.items())
+
+        for connect_info, pooled_client in pooled_clients:
+            if now - pooled_client.last_used_time > settings.ES_CLIENT_IDLE_TIMEOUT:
+                evicted = False
+                with self._lock:
+                    if self._clients.get(connect_info) is pooled_client:
+                        self._clients.pop(connect_info)
+                        self._record("evict_idle")
+                        evicted = True
+                if evicted:
+                    self._retire(pooled_client)
+                continue
+            try:
+                healthy = pooled_client.client.ping()
+            except Exception:  # pylint: disable=broad-except
+                healthy = False
+            if not healthy:
+                logger.warning(f"[EsClientPool] client {connect_info.host}:{connect_info.port} is unhealthy")
+                self._record("health_check_fail")
+            pooled_client.healthy = healthy
+
+    def _record(self, event: str):
+        with self._lock:
+            self._stats[event] += 1
+        es_client_pool_events.labels(event=event).inc()
@@ -42,6 +42,8 @@ class DslBuilder(object):
         collapse={},
         search_after=[],
         use_time_range=True,
+        slice_dict={},
+        query_clause=None,
     ):  # pylint: disable=dangerous-default-value
         """
 
@@ -60,6 +62,7 @@ class DslBuilder(object):
         :
         :param begin {int} 0:
         :param size: {int} 30
+        :param query_clause: {Dict} 查询语句执行计划生成的查询子句, 为空时使用search_string生成query_string
         """
 
         # init params
@@ -84,7 +87,10 @@ class DslBuilder(object):
         self.search = Search()
 
         query_bool_obj: type_query_bool_dict = Dsl(
-            query_string=search_string, filter_dict_list=self.filter_dict_list, range_field_dict=self.time_range_dict
+            query_string=search_string,
+            filter_dict_list=self.filter_dict_list,
+            range_field_dict=self.time_range_dict,
+            query_clause=query_clause,
         ).dsl_dict
         if not query_bool_obj:
             raise BaseSearchQueryBuilderException
@@ -121,6 +127,10 @@ class DslBuilder(object):
             self._body.update({"search_after": self.search_after})
             self._body.pop("from")
 
+        # sliced scroll, 将scroll拆分为多个可并发拉取的分片
+        if slice_dict:
+            self._body.update({"slice": slice_dict})
+
     @property
     def body(self):
         return self._body
@@ -244,7 +244,13 @@ class BoolShouldIns(object):
 
 
 class Dsl(object):
-    def __init__(self, query_string: str, filter_dict_list: List, range_field_dict: Dict[str, Dict[str, Any]]):
+    def __init__(
+        self,
+        query_string: str,
+        filter_dict_list: List,
+        range_field_dict: Dict[str, Dict[str, Any]],
+        query_clause: Dict[str, Any] = None,
+    ):
         # 处理filter list
         must_ins_list: List = []
         self.filters: List = self.divid_filter_list(filter_dict_list)
@@ -253,8 +259,8 @@ class Dsl(object):
             must_ins_list.append(must_ins)
         self.should_ins = BoolShouldIns(must_ins_list).should_ins
 
-        # 生成query string
-        self.query_string: type_query_string = EsQueryBuilder.build_query_string(query_string)
+        # 生成query string, 已有执行计划生成的查询子句时直接使用
+        self.query_string: type_query_string = query_clause or EsQueryBuilder.build_query_string(query_string)
         self.range_dict: type_range = None
         if range_field_dict:
             # 生成range dict
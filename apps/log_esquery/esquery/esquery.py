@@ -28,8 +28,9 @@ from apps.log_esquery.type_constants import (
     type_time_range_dict,
     type_addition,
 )
+from apps.log_esquery.admission import EsQueryAdmission
 from apps.log_esquery.esquery.builder.query_time_builder import QueryTimeBuilder
-from apps.log_esquery.esquery.builder.query_string_builder import QueryStringBuilder
+from apps.log_esquery.esquery.builder.query_string_planner import QueryStringPlanner
 from apps.log_esquery.esquery.builder.query_filter_builder import QueryFilterBuilder
 from apps.log_esquery.esquery.builder.query_index_optimizer import QueryIndexOptimizer
 from apps.log_esquery.esquery.builder.query_sort_builder import QuerySortBuilder
@@ -38,6 +39,7 @@ from apps.log_search.models import Scenario
 from apps.log_esquery.esquery.client.QueryClient import QueryClient
 from apps.utils.log import logger
 from apps.log_search.exceptions import ScenarioQueryIndexFailException, ScenarioNotSupportedException
+from apps.log_esquery.exceptions import EsClientSearchException
 from apps.utils.time_handler import generate_time_range
 
 
@@ -45,6 +47,8 @@ class EsQuery(object):
     def __init__(self, search_dict: type_search_dict):
 
         self.search_dict: Dict[str, Any] = search_dict
+        # 查询语句执行计划, 构建DSL后生成
+        self.query_plan: Dict[str, Any] = {}
 
     def _init_common_args(self):
         # 初始刷查询场景类型 bkdata log 或者 es, 以及连接信息ID
@@ -84,9 +88,13 @@ class EsQuery(object):
 
     def _optimizer(self, indices, scenario_id, start_time, end_time, time_zone, use_time_range):
 
-        # 优化query_string
-        query_string: str = self.search_dict.get("query_string")
-        query_string = QueryStringBuilder(query_string).query_string
+        # 优化query_string: 普通关键字按全文检索字段改写, 避免前导通配
+        query_string_planner = QueryStringPlanner(
+            self.search_dict.get("query_string"),
+            fulltext_fields=self.search_dict.get("fulltext_fields"),
+            ngram_fields=self.search_dict.get("ngram_fields"),
+            wildcard=self.search_dict.get("query_string_wildcard", False),
+        )
 
         # 优化filter
         addition: type_addition = self.search_dict.get("filter", [])
@@ -105,7 +113,7 @@ class EsQuery(object):
         # 优化排序,需要预查询介入，需要client
         sort_list: List[List[str, str]] = self.search_dict.get("sort_list", [])
         sort_tuple: Tuple = tuple(QuerySortBuilder(sort_list).sort_list)
-        return query_string, filter_dict_list, index, sort_tuple
+        return query_string_planner, filter_dict_list, index, sort_tuple
 
     def _init_other_args(self):
         # 查询条目
@@ -133,7 +141,10 @@ class EsQuery(object):
             result["hits"]["total"] = result["hits"]["total"]["value"]
         return result
 
-    def search(self):
+    def _build_search(self):
+        """
+        生成查询所需的场景、索引和DSL
+        """
         scenario_id, indices, storage_cluster_id = self._init_common_args()
         time_field, time_field_type, time_field_unit = self._init_time_field_args()
         include_start_time, include_end_time = self._init_include_time_args()
@@ -153,13 +164,15 @@ class EsQuery(object):
             include_end_time=include_end_time,
         ).time_range_dict
 
-        query_string, filter_dict_list, index, sort_tuple = self._optimizer(
+        query_string_planner, filter_dict_list, index, sort_tuple = self._optimizer(
             indices, scenario_id, start_time, end_time, time_zone, use_time_range
         )
+        self.query_plan = query_string_planner.explain
         size, start, aggs, highlight, scroll, collapse = self._init_other_args()
         # 调用DSL生成器
         body = DslBuilder(
-            search_string=query_string,
+            search_string=query_string_planner.query_string,
+            query_clause=query_string_planner.query,
             filter_dict_list=filter_dict_list,
             time_range_dict=time_range_dict,
             sort_tuple=sort_tuple,
@@ -170,26 +183,106 @@ class EsQuery(object):
             collapse=collapse,
             search_after=search_after,
             use_time_range=use_time_range,
+            slice_dict=self.search_dict.get("slice"),
         ).body
 
-        logger.info(f"scenario_id => [{scenario_id}], indices => [{index}], body => [{body}]")
-
-        if self.search_dict.get("debug"):
-            return {"scenario": scenario_id, "indices": index, "body": body}
+        logger.info(
+            f"scenario_id => [{scenario_id}], indices => [{index}], body => [{body}], query_plan => [{self.query_plan}]"
+        )
 
         client = QueryClient(
             scenario_id,
             storage_cluster_id=storage_cluster_id,
             bkdata_authentication_method=bkdata_authentication_method,
             bkdata_data_token=bkdata_data_token,
-        ).get_instance()
+        )
+        return client, index, body, scroll, track_total_hits
 
-        logger.info(f"[Esquery] scenario_id => [{scenario_id}], indices => [{index}], body => [{body}]")
+    def search(self):
+        client, index, body, scroll, track_total_hits = self._build_search()
+
+        if self.search_dict.get("debug"):
+            return {"scenario": client.scenario_id, "indices": index, "body": body, "query_plan": self.query_plan}
 
-        result: Dict[str:Any] = client.query(index, body, scroll=scroll, track_total_hits=track_total_hits)
+        logger.info(f"[Esquery] scenario_id => [{client.scenario_id}], indices => [{index}], body => [{body}]")
+
+        with EsQueryAdmission(self.search_dict):
+            result: Dict[str:Any] = client.get_instance().query(
+                index, body, scroll=scroll, track_total_hits=track_total_hits
+            )
 
         return self.compatibility_result(result)
 
+    def msearch(self):
+        """
+        批量查询: 同一集群的查询合并为一次 _msearch 请求, 结果按请求顺序返回, 单个查询失败不影响其他查询
+        带 body 的查询按DSL模式处理, 其余按普通查询生成DSL
+        """
+        searches: List[Dict[str, Any]] = self.search_dict.get("searches", [])
+        responses: List[Dict[str, Any]] = [{} for _ in searches]
+
+        # 按集群分组 {msearch_key: (client, admission, [(position, index, body, track_total_hits)])}
+        groups: Dict[Any, Tuple] = {}
+        for position, search_dict in enumerate(searches):
+            try:
+                if "body" in search_dict:
+                    # DSL模式的查询, 与dsl接口一致不统计精确总数
+                    query_client, index, body = EsQuery(search_dict)._build_dsl()
+                    track_total_hits = False
+                else:
+                    query_client, index, body, _, track_total_hits = EsQuery(search_dict)._build_search()
+                client = query_client.get_instance()
+                msearch_key = client.msearch_key(index)
+            except Exception as e:  # pylint: disable=broad-except
+                responses[position] = self._msearch_error(e)
+                continue
+            if msearch_key not in groups:
+                # 每组合并为一次ES请求, 按组进行准入控制
+                admission = EsQueryAdmission(
+                    dict(
+                        search_dict,
+                        bk_app_code=self.search_dict.get("bk_app_code"),
+                        bk_username=self.search_dict.get("bk_username"),
+                        query_priority=self.search_dict.get("query_priority"),
+                    )
+                )
+                groups[msearch_key] = (client, admission, [])
+            groups[msearch_key][2].append((position, index, body, track_total_hits))
+
+        for client, admission, items in groups.values():
+            logger.info(f"[Esquery] msearch => [{len(items)}] searches")
+            try:
+                with admission:
+                    results = client.msearch([(index, body, total_hits) for _, index, body, total_hits in items])
+            except Exception as e:  # pylint: disable=broad-except
+                for position, *_ in items:
+                    responses[position] = self._msearch_error(e)
+                continue
+
+            for (position, *_), result in zip(items, results):
+                if "error" in result:
+                    responses[position] = self._msearch_error(
+                        EsClientSearchException(EsClientSearchException.MESSAGE.format(error=result["error"]))
+                    )
+                    continue
+                responses[position] = {
+                    "result": True,
+                    "data": self.compatibility_result(result),
+                    "code": 0,
+                    "message": "",
+                }
+        return responses
+
+    @staticmethod
+    def _msearch_error(e: Exception) -> Dict[str, Any]:
+        logger.warning(f"[Esquery] msearch error: {e}")
+        return {
+            "result": False,
+            "data": None,
+            "code": getattr(e, "code", EsClientSearchException.ERROR_CODE),
+            "message": getattr(e, "message", str(e)),
+        }
+
     def scroll(self):
         # 调用客户端执行scroll
         scenario_id, indices, storage_cluster_id = self._init_common_args()
@@ -208,28 +301,47 @@ class EsQuery(object):
 
         client = QueryClient(scenario_id, storage_cluster_id=storage_cluster_id).get_instance()
 
-        result = client.scroll(indices, scroll_id, scroll)
+        with EsQueryAdmission(self.search_dict):
+            result = client.scroll(indices, scroll_id, scroll)
 
         return result
 
+    def clear_scroll(self):
+        # 释放scroll上下文, 开销很小不经过准入控制
+        scenario_id, indices, storage_cluster_id = self._init_common_args()
+
+        if scenario_id == Scenario.BKDATA:
+            raise ScenarioNotSupportedException(
+                ScenarioNotSupportedException.MESSAGE.format(scenario_id=Scenario.BKDATA)
+            )
+
+        client = QueryClient(scenario_id, storage_cluster_id=storage_cluster_id).get_instance()
+        return client.clear_scroll(indices, self.search_dict.get("scroll_id"))
+
     # 调用客户端执行dsl
-    def dsl(self):
+    def _build_dsl(self):
+        """
+        DSL模式直接使用请求中的DSL, 只生成查询所需的客户端和索引
+        """
         dsl: dict = self.search_dict.get("body", {})
         scenario_id, index_set_string, storage_cluster_id = self._init_common_args()
         bkdata_authentication_method, bkdata_data_token = self._init_bkdata_args()
-        # 获取client
         client = QueryClient(
             scenario_id,
             storage_cluster_id=storage_cluster_id,
             bkdata_authentication_method=bkdata_authentication_method,
             bkdata_data_token=bkdata_data_token,
-        ).get_instance()
+        )
+        return client, index_set_string, dsl
 
-        index = index_set_string
+    def dsl(self):
+        query_client, index, dsl = self._build_dsl()
+        client = query_client.get_instance()
 
         logger.info(f"[esquery_dsl] index => [{index}], dsl => [{dsl}]")
 
-        result: Dict = client.query(index, dsl)
+        with EsQueryAdmission(self.search_dict):
+            result: Dict = client.query(index, dsl)
         result = self.compatibility_result(result)
         result.update({"dsl": json.dumps(dsl)})
         return result
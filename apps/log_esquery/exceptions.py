@@ -186,6 +186,16 @@ class EsTimeoutException(EsClientBaseException):
     MESSAGE = _("Es 查询超时")
 
 
+class EsQueryRateLimitedException(EsClientBaseException):
+    ERROR_CODE = "967"
+    MESSAGE = _("查询过于频繁, 请{retry_after}秒后重试")
+
+
+class EsQueryConcurrencyLimitedException(EsClientBaseException):
+    ERROR_CODE = "968"
+    MESSAGE = _("集群查询繁忙, 排队等待{wait}秒后仍未获得执行机会, 请稍后重试")
+
+
 # =================================================
 # Search
 # =================================================
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import functools
+
+from rest_framework import exceptions
+
+from apps.exceptions import BaseException
+from apps.generic import _error
+from apps.log_esquery.esquery.esquery import EsQuery
+from apps.log_esquery.exceptions import EsTimeoutException
+from apps.log_esquery.qos import esquery_qos_by_params, qos_allow_by_params, qos_recover_by_params
+from apps.log_esquery.serializers import (
+    EsQuerySearchAttrSerializer,
+    EsQueryMSearchAttrSerializer,
+    EsQueryDslAttrSerializer,
+    EsQueryMappingAttrSerializer,
+    EsQueryScrollAttrSerializer,
+    EsQueryEsRouteSerializer,
+)
+from apps.utils.drf import custom_params_valid
+from apps.utils.log import logger
+
+ESQUERY_LOCAL_ACTIONS = {
+    "search": EsQuerySearchAttrSerializer,
+    "msearch": EsQueryMSearchAttrSerializer,
+    "dsl": EsQueryDslAttrSerializer,
+    "mapping": EsQueryMappingAttrSerializer,
+    "scroll": EsQueryScrollAttrSerializer,
+    "clear_scroll": EsQueryScrollAttrSerializer,
+    "es_route": EsQueryEsRouteSerializer,
+}
+
+
+def dispatch(action: str, params: dict) -> dict:
+    """
+    在进程内执行esquery
+    SaaS 与 API 模块同代码同配置部署时，BkLogApi 的查询类接口不经过网关直接在进程内执行，
+    鉴权、QOS、准入控制与返回结构与 esquery 接口保持一致
+    :param action: search, msearch, dsl, mapping, scroll, clear_scroll, es_route
+    :param params: 请求参数
+    :return: 与接口一致的返回 {"result": True, "data": {}, "code": 0, "message": ""}
+    """
+    path = f"/api/v1/esquery/{action}/"
+    if not qos_allow_by_params(path, params):
+        return _error("429", exceptions.Throttled.default_detail)
+
+    try:
+        data = custom_params_valid(serializer=ESQUERY_LOCAL_ACTIONS[action], params=params)
+        data["bk_app_code"] = params.get("bk_app_code")
+        data["bk_username"] = params.get("bk_username")
+        result = getattr(EsQuery(data), action)()
+    except exceptions.ValidationError as e:
+        return _error(f"{e.status_code}", str(e))
+    except BaseException as e:
+        # 处理EsQuery超时报错
+        if isinstance(e, EsTimeoutException):
+            esquery_qos_by_params(path, params, params.get("bk_app_code"))
+        logger.exception(f"[esquery local dispatch] {action} error: {e}")
+        return _error(e.code, e.message, e.data, e.errors)
+
+    qos_recover_by_params(path, params)
+    return {"result": True, "data": result, "code": 0, "message": ""}
+
+
+search = functools.partial(dispatch, "search")
+msearch = functools.partial(dispatch, "msearch")
+dsl = functools.partial(dispatch, "dsl")
+mapping = functools.partial(dispatch, "mapping")
+scroll = functools.partial(dispatch, "scroll")
+clear_scroll = functools.partial(dispatch, "clear_scroll")
+es_route = functools.partial(dispatch, "es_route")
@@ -19,7 +19,8 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 from django.conf import settings
 from django.core.management import BaseCommand
-from django.core.cache import cache
+
+from apps.log_esquery.qos import redis_client
 
 
 class Command(BaseCommand):
@@ -28,7 +29,11 @@ class Command(BaseCommand):
             self.stderr.write("you not setup redis config")
             return
 
-        limit_keys = cache.keys("*_limit")
+        # 限流key直接写入redis, 不带django cache的前缀和版本
+        limit_keys = [
+            limit_key.decode() if isinstance(limit_key, bytes) else limit_key
+            for limit_key in redis_client.scan_iter("*_limit")
+        ]
         if not limit_keys:
             self.stdout.write(self.style.SUCCESS("not have query limit"))
 
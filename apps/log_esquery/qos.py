@@ -21,7 +21,6 @@ import datetime
 
 from blueapps.utils.unique import uniqid
 from django.conf import settings
-from django.core.cache import cache
 from django_redis import get_redis_connection
 from rest_framework import throttling
 
@@ -34,11 +33,21 @@ redis_client = None
 if settings.USE_REDIS:
     redis_client = get_redis_connection("default")
 
-
-def get_current_window_range():
-    now = datetime.datetime.now()
-    next = now + datetime.timedelta(minutes=settings.BKLOG_QOS_LIMIT_WINDOW)
-    return now.timestamp(), next.timestamp()
+# 检查限制标记、统计窗口内超时次数、设置限制标记在一个脚本内原子执行, 避免并发请求同时越过检查
+# KEYS[1]: 超时计数 KEYS[2]: 限制标记
+# ARGV[1]: 当前时间 ARGV[2]: 窗口内超时次数上限 ARGV[3]: 限制时长(秒)
+QOS_THROTTLE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+return 1
+"""
 
 
 def get_window_time_point():
@@ -48,14 +57,12 @@ def get_window_time_point():
 
 
 def get_window_count(request):
-    count = 0
-    values = redis_client.zrange(build_qos_key(request), 0, settings.BKLOG_QOS_LIMIT, desc=True, withscores=True)
-    window_start, window_end = get_current_window_range()
-    for value in values:
-        _, score = value
-        if window_start <= score <= window_end:
-            count += 1
-    return count
+    return get_window_count_by_params(request.path, _get_request_data(request))
+
+
+def get_window_count_by_params(path, data):
+    # 计数的score为超时发生时间+窗口时长, 未过期的即为窗口内的超时次数, 直接由redis计数
+    return redis_client.zcount(build_qos_key_by_params(path, data), datetime.datetime.now().timestamp(), "+inf")
 
 
 def clear_redis_zset(request):
@@ -63,18 +70,25 @@ def clear_redis_zset(request):
 
 
 def esquery_qos(request):
+    if not settings.USE_REDIS or not settings.BKLOG_QOS_USE:
+        return
+    auth_info = Permission.get_auth_info(request)
+    esquery_qos_by_params(request.path, _get_request_data(request), auth_info["bk_app_code"])
+
+
+def esquery_qos_by_params(path, data, bk_app_code):
     if not settings.USE_REDIS:
         return
     if not settings.BKLOG_QOS_USE:
         return
-    auth_info = Permission.get_auth_info(request)
-    if auth_info["bk_app_code"] not in settings.BKLOG_QOS_LIMIT_APP:
+    if bk_app_code not in settings.BKLOG_QOS_LIMIT_APP:
         return
     token = uniqid()
-    key = build_qos_key(request)
+    key = build_qos_key_by_params(path, data)
     window_time_point = get_window_time_point()
     redis_client.zadd(f"{key}", {f"{token}_{window_time_point}": window_time_point})
-    logger.info(f"[Esquery Qos] qos count [{build_qos_key(request)}] increment")
+    redis_client.expire(key, settings.BKLOG_QOS_LIMIT_WINDOW * TimeEnum.ONE_MINUTE_SECOND.value)
+    logger.info(f"[Esquery Qos] qos count [{key}] increment")
 
 
 def _get_request_data(request):
@@ -84,8 +98,10 @@ def _get_request_data(request):
 
 
 def build_qos_key(request) -> str:
-    path = request.path
-    data = _get_request_data(request)
+    return build_qos_key_by_params(request.path, _get_request_data(request))
+
+
+def build_qos_key_by_params(path, data) -> str:
     index_set_id = data.get("index_set_id")
     if index_set_id is not None:
         return f"{settings.APP_CODE}_qos_{path}_{index_set_id}"
@@ -98,14 +114,49 @@ def build_qos_limit_key(request) -> str:
     return f"{build_qos_key(request)}_limit"
 
 
+def is_qos_limited(path, data) -> bool:
+    """
+    是否已被QOS限制
+    """
+    if not settings.USE_REDIS:
+        return False
+    return bool(redis_client.exists(f"{build_qos_key_by_params(path, data)}_limit"))
+
+
 def qos_recover(request, response):
+    if not response.exception:
+        qos_recover_by_params(request.path, _get_request_data(request))
+
+
+def qos_recover_by_params(path, data):
+    """
+    查询成功后清空超时计数
+    """
     if not settings.USE_REDIS:
         return
-    count = get_window_count(request)
-    if not response.exception:
-        if count != 0:
-            logger.info(f"[Esquery Qos] qos recover [{build_qos_key(request)}]")
-            clear_redis_zset(request)
+    if get_window_count_by_params(path, data) != 0:
+        key = build_qos_key_by_params(path, data)
+        logger.info(f"[Esquery Qos] qos recover [{key}]")
+        redis_client.delete(key)
+
+
+def qos_allow_by_params(path, data) -> bool:
+    """
+    检查限制标记、统计窗口内超时次数并在达到上限时设置限制标记
+    """
+    if not settings.USE_REDIS:
+        return True
+    key = build_qos_key_by_params(path, data)
+    limit_key = f"{key}_limit"
+    qos_limit_time = settings.BKLOG_QOS_LIMIT_TIME * TimeEnum.ONE_MINUTE_SECOND.value
+    throttle_script = redis_client.register_script(QOS_THROTTLE_SCRIPT)
+    allowed = throttle_script(
+        keys=[key, limit_key],
+        args=[datetime.datetime.now().timestamp(), settings.BKLOG_QOS_LIMIT, qos_limit_time],
+    )
+    if not allowed:
+        logger.warning(f"[Esquery Qos] query limited by key [{limit_key}]")
+    return bool(allowed)
 
 
 class QosThrottle(throttling.BaseThrottle):
@@ -117,21 +168,7 @@ class QosThrottle(throttling.BaseThrottle):
             return True
 
         self.limit_key = build_qos_limit_key(request)
-
-        # 如果已经被限制 直接禁止
-        if cache.has_key(self.limit_key):  # noqa
-            return False
-
-        # 检查超时次数
-        qos_limit_time = settings.BKLOG_QOS_LIMIT_TIME * TimeEnum.ONE_MINUTE_SECOND.value
-        count = get_window_count(request)
-        if count >= settings.BKLOG_QOS_LIMIT:
-            # 设置禁止标记 并删除计数
-            if cache.set(self.limit_key, "1", timeout=qos_limit_time, nx=True):
-                logger.warning(f"[Esquery Qos] query limit key [{self.limit_key}] set")
-                clear_redis_zset(request)
-            return False
-        return True
+        return qos_allow_by_params(request.path, _get_request_data(request))
 
     def wait(self):
-        return cache.ttl(self.limit_key)
+        return redis_client.ttl(self.limit_key)
@@ -21,7 +21,7 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
-from apps.log_esquery.constants import ES_ROUTE_ALLOW_URL
+from apps.log_esquery.constants import ES_ROUTE_ALLOW_URL, QueryPriority
 from apps.log_search.models import Scenario
 from apps.exceptions import ValidationError
 from apps.log_esquery.exceptions import (
@@ -62,6 +62,18 @@ class EsQuerySearchAttrSerializer(serializers.Serializer):
 
     # dsl校验
     query_string = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    # 查询语句执行计划: 全文检索字段及其ngram子字段, 是否要求通配匹配
+    fulltext_fields = serializers.ListField(
+        child=serializers.CharField(), required=False, default=[], allow_empty=True, allow_null=True
+    )
+    ngram_fields = serializers.ListField(
+        child=serializers.CharField(), required=False, default=[], allow_empty=True, allow_null=True
+    )
+    query_string_wildcard = serializers.BooleanField(required=False, default=False)
+    # 查询优先级, 集群繁忙时交互检索优先于导出和后台查询
+    query_priority = serializers.ChoiceField(
+        choices=QueryPriority.CHOICES, required=False, allow_null=True, allow_blank=True
+    )
 
     # ip过滤和filter条件
     filter = serializers.ListField(allow_empty=True, required=False, default=[], allow_null=True)
@@ -93,6 +105,8 @@ class EsQuerySearchAttrSerializer(serializers.Serializer):
 
     # 添加scroll参数
     scroll = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    # sliced scroll 分片参数, 如 {"id": 0, "max": 4}
+    slice = serializers.DictField(required=False, default={}, allow_null=True)
 
     def validate(self, attrs):
         super().validate(attrs)
@@ -173,12 +187,32 @@ class EsQuerySearchAttrSerializer(serializers.Serializer):
         return new_filter
 
 
+class EsQueryMSearchAttrSerializer(serializers.Serializer):
+    searches = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+    query_priority = serializers.ChoiceField(
+        choices=QueryPriority.CHOICES, required=False, allow_null=True, allow_blank=True
+    )
+
+    def validate_searches(self, searches):
+        # 带 body 的查询按DSL模式校验, 其余按普通查询校验
+        validated_searches = []
+        for search in searches:
+            serializer_class = EsQueryDslAttrSerializer if "body" in search else EsQuerySearchAttrSerializer
+            slz = serializer_class(data=search)
+            slz.is_valid(raise_exception=True)
+            validated_searches.append(slz.validated_data)
+        return validated_searches
+
+
 class EsQueryScrollAttrSerializer(serializers.Serializer):
     indices = serializers.CharField(required=False)
     scenario_id = serializers.ChoiceField(choices=Scenario.CHOICES)
     storage_cluster_id = serializers.IntegerField()
     scroll_id = serializers.CharField(required=True)
     scroll = serializers.CharField(required=False, default=SCROLL)
+    query_priority = serializers.ChoiceField(
+        choices=QueryPriority.CHOICES, required=False, allow_null=True, allow_blank=True
+    )
 
     def validata(self, attrs):
         super().validate(attrs)
@@ -311,6 +345,9 @@ class EsQueryDslAttrSerializer(serializers.Serializer):
 
     bkdata_authentication_method = serializers.CharField(required=False)
     bkdata_data_token = serializers.CharField(required=False)
+    query_priority = serializers.ChoiceField(
+        choices=QueryPriority.CHOICES, required=False, allow_null=True, allow_blank=True
+    )
 
     def validate(self, attrs):
         super().validate(attrs)
@@ -33,6 +33,7 @@ from apps.log_esquery.exceptions import (
 from apps.log_esquery.permission import Permission
 from apps.log_esquery.serializers import (
     EsQuerySearchAttrSerializer,
+    EsQueryMSearchAttrSerializer,
     EsQueryDslAttrSerializer,
     EsQueryMappingAttrSerializer,
     EsQueryScrollAttrSerializer,
@@ -55,6 +56,14 @@ class EsQueryViewSet(APIViewSet):
         qos_recover(request, response)
         return response
 
+    def params_valid(self, serializer, params=None):
+        data = super(EsQueryViewSet, self).params_valid(serializer, params)
+        # 准入控制按调用方应用及用户限速, 并确定默认优先级
+        auth_info = Permission.get_auth_info(self.request)
+        data["bk_app_code"] = auth_info["bk_app_code"]
+        data["bk_username"] = auth_info["bk_username"]
+        return data
+
     def get_permissions(self):
         auth_info = Permission.get_auth_info(self.request)
         # ESQUERY白名单不需要鉴权
@@ -222,6 +231,59 @@ class EsQueryViewSet(APIViewSet):
         esquery = EsQuery(data)
         return Response(esquery.search())
 
+    @list_route(methods=["POST"], url_path="msearch/")
+    def msearch(self, request):
+        """
+        @api {post} /esquery/msearch/ 01_搜索-批量搜索日志内容
+        @apiName msearch_log
+        @apiGroup 13_Esquery
+        @apiDescription 同一集群的查询合并为一次_msearch请求, 结果按请求顺序返回, 单个查询失败不影响其他查询
+        @apiParam {List} searches 查询列表, 每一项参数与 /esquery/search/ 一致, 带 body 的项参数与 /esquery/dsl/ 一致
+        @apiParamExample {Json} 请求参数
+        {
+            "searches": [
+                {
+                    "indices": "2_bklog.test",
+                    "scenario_id": "log",
+                    "query_string": "error",
+                    "start_time": "2019-06-11 00:00:00",
+                    "end_time": "2019-06-12 11:11:11",
+                    "size": 10
+                }
+            ]
+        }
+        @apiSuccessExample {json} 成功返回:
+        {
+            "result": true,
+            "data": [
+                {
+                    "result": true,
+                    "data": {
+                        "hits": {
+                            "hits": [],
+                            "total": 0,
+                            "max_score": null
+                        },
+                        "took": 1,
+                        "timed_out": false
+                    },
+                    "code": 0,
+                    "message": ""
+                },
+                {
+                    "result": false,
+                    "data": null,
+                    "code": "3632954",
+                    "message": "EsClient查询错误"
+                }
+            ],
+            "code": 0,
+            "message": ""
+        }
+        """
+        data = self.params_valid(EsQueryMSearchAttrSerializer)
+        return Response(EsQuery(data).msearch())
+
     @list_route(methods=["POST"], url_path="dsl/")
     def dsl(self, request):
         """
@@ -516,6 +578,39 @@ class EsQueryViewSet(APIViewSet):
         esquery = EsQuery(data)
         return Response(esquery.scroll())
 
+    @list_route(methods=["POST"], url_path="clear_scroll/")
+    def clear_scroll(self, request):
+        """
+        @api {post} /esquery/clear_scroll/ 04_搜索-释放滚动查询
+        @apiName search_clear_scroll
+        @apiGroup 13_Esquery
+        @apiParam {String} indices (非必填，scenario_id为log必填)索引
+        @apiParam {String} scenario_id (必填， 可选范围log、es)查询ES类型
+        @apiParam {int} storage_cluster_id (必填)集群ID
+        @apiParam {String} scroll_id (必填)scroll_id
+        @apiParamExample {Json} 请求参数
+        {
+            "indices": "2_bklog_yuanshi",
+            "scenario_id": "log"
+            "storage_cluster_id": 11,
+            "scroll_id": "DnF1ZXJ5VGhlbkZldGNoDQAAAAAABhgjFkc4eXdmRENnUmxPUXRsc"
+        }
+
+        @apiSuccessExample {json} 成功返回:
+        {
+            "result": true,
+            "data": {
+                "succeeded": true,
+                "num_freed": 13
+            },
+            "code": 0,
+            "message": ""
+        }
+        """
+        data = self.params_valid(EsQueryScrollAttrSerializer)
+        esquery = EsQuery(data)
+        return Response(esquery.clear_scroll())
+
     @list_route(methods=["GET"], url_path="indices/")
     def indices(self, request):
         """
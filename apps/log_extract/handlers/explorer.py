@@ -32,6 +32,7 @@ from apps.log_extract import exceptions
 from apps.log_extract import constants
 from apps.log_extract.fileserver import FileServer
 from apps.log_extract.handlers.thread import ThreadPool
+from apps.utils.thread import ExecutorPool, get_executor
 from apps.log_extract.models import Strategies
 from apps.utils.local import get_request_username
 from apps.exceptions import ApiResultError
@@ -700,23 +701,23 @@ def batch_request(func, params, get_data=lambda x: x["info"], get_count=lambda x
     start = 0
 
     # 根据请求总数并发请求
-    pool = ThreadPool()
+    executor = get_executor(getattr(func, "executor_pool", ExecutorPool.DEFAULT))
     params_and_future_list = []
     while start < count:
         request_params = {"page": {"limit": limit, "start": start}}
         request_params.update(params)
         params_and_future_list.append(
-            {"params": request_params, "future": pool.apply_async(func, kwds={"params": request_params})}
+            {
+                "params": request_params,
+                "future": executor.submit(ThreadPool.get_func_with_local(func), params=request_params),
+            }
         )
 
         start += limit
 
-    pool.close()
-    pool.join()
-
     # 取值
     for params_and_future in params_and_future_list:
-        result = params_and_future["future"].get()
+        result = params_and_future["future"].result()
 
         if not result:
             logger.error(
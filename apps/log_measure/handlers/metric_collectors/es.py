@@ -16,14 +16,20 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
+import time
 from collections import defaultdict
+from concurrent.futures import wait
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
 
 from six import iteritems, itervalues
 
+from django.conf import settings
 from django.utils.translation import ugettext as _
 from apps.api import BkLogApi
 from apps.log_measure.utils.metric import MetricUtils
 from apps.utils.log import logger
+from apps.utils.thread import ExecutorPool, get_executor
 from bk_monitor.constants import TimeFilterEnum
 from bk_monitor.utils.metric import Metric, register_metric
 
@@ -845,15 +851,23 @@ def get_url(version):
     return health_url, stats_url, pshard_stats_url, pending_tasks_url
 
 
-def query(cluster_id):
+def query(cluster_id, deadline=None):
     def get(url):
+        # 超出集群的采集时间预算后不再请求
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                logger.warning(f"[es monitor] cluster [{cluster_id}] out of time budget, skip [{url}]")
+                return None
         try:
             return BkLogApi.es_route(
                 {
                     "scenario_id": "es",
                     "storage_cluster_id": cluster_id,
                     "url": url,
-                }
+                },
+                timeout=timeout,
             )
         except Exception as e:
             logger.exception(f"request es info error {e}")
@@ -862,35 +876,71 @@ def query(cluster_id):
     return get
 
 
-def process_metric(data, metric, xtype, path, xform=None, dimensions=None):
+def compile_metrics(metrics: dict) -> List[Tuple[str, Tuple[str, ...], Optional[Callable]]]:
+    """
+    预先解析指标定义: (上报的指标名, 取值路径, 转换函数)
+    """
+    return [
+        (metric.replace(".", "_"), tuple(desc[1].split(".")), desc[2] if len(desc) > 2 else None)
+        for metric, desc in metrics.items()
+    ]
+
+
+@lru_cache(maxsize=32)
+def compiled_stats_metrics(version: tuple):
+    stats_metrics = stats_for_version(list(version), True)
+    stats_metrics.update(node_system_stats_for_version(list(version)))
+    return compile_metrics(stats_metrics)
+
+
+@lru_cache(maxsize=32)
+def compiled_pshard_metrics(version: tuple):
+    return compile_metrics(pshard_stats_for_version(list(version)))
+
+
+@lru_cache(maxsize=32)
+def compiled_health_metrics(version: tuple):
+    return compile_metrics(health_stats_for_version(list(version)))
+
+
+@lru_cache(maxsize=32)
+def compiled_index_metrics(version: tuple):
+    return compile_metrics(index_stats_for_version(list(version)))
+
+
+COMPILED_CLUSTER_PENDING_TASKS = compile_metrics(CLUSTER_PENDING_TASKS)
+COMPILED_CAT_ALLOCATION_METRICS = compile_metrics(CAT_ALLOCATION_METRICS)
+
+
+def process_metric(data, metric_name, path, xform=None, dimensions=None, timestamp=None):
     value = data
     # Traverse the nested dictionaries
-    for key in path.split("."):
-        if value is not None:
-            value = value.get(key)
-        else:
+    for key in path:
+        if value is None:
             break
+        value = value.get(key)
 
     if value is not None:
         if xform:
             value = xform(value)
         if not isinstance(value, (int, float)):
             value = int(value)
-        return Metric(
-            metric_name=metric.replace(".", "_"),
-            metric_value=value,
-            dimensions=dimensions,
-            timestamp=MetricUtils.get_instance().report_ts,
-        )
+        return Metric(metric_name=metric_name, metric_value=value, dimensions=dimensions, timestamp=timestamp)
 
 
-def process_stats_data(metrics, stats_url, get, version, base_dimensions):
+def process_metrics(metrics, data, compiled_metrics, dimensions, timestamp):
+    for metric_name, path, xform in compiled_metrics:
+        result_metric = process_metric(data, metric_name, path, xform, dimensions=dimensions, timestamp=timestamp)
+        if result_metric:
+            metrics.append(result_metric)
+
+
+def process_stats_data(metrics, stats_url, get, version, base_dimensions, timestamp=None):
     data = get(stats_url)
     if not data:
         return
     base_dimensions["elastic_name"] = data["cluster_name"]
-    stats_metrics = stats_for_version(version, True)
-    stats_metrics.update(node_system_stats_for_version(version))
+    stats_metrics = compiled_stats_metrics(tuple(version))
     for node_data in data.get("nodes", {}).values():
         dimensions = {**base_dimensions}
         node_name = node_data.get("name")
@@ -900,35 +950,24 @@ def process_stats_data(metrics, stats_url, get, version, base_dimensions):
         if ip:
             dimensions["ip_address"] = ip
 
-        for metric, value in stats_metrics.items():
-            result_metric = process_metric(node_data, metric, *value, dimensions=dimensions)
-            if result_metric:
-                metrics.append(result_metric)
+        process_metrics(metrics, node_data, stats_metrics, dimensions, timestamp)
 
 
-def process_pshard_stats_data(metrics, pshard_url, get, version, base_dimensions):
+def process_pshard_stats_data(metrics, pshard_url, get, version, base_dimensions, timestamp=None):
     data = get(pshard_url)
     if not data:
         return
-    pshard_stats_metrics = pshard_stats_for_version(version)
-    for metric, value in pshard_stats_metrics.items():
-        result_metric = process_metric(data, metric, *value, dimensions=base_dimensions)
-        if result_metric:
-            metrics.append(result_metric)
+    process_metrics(metrics, data, compiled_pshard_metrics(tuple(version)), base_dimensions, timestamp)
 
 
-def process_health_data(metrics, health_url, get, version, base_dimensions):
+def process_health_data(metrics, health_url, get, version, base_dimensions, timestamp=None):
     data = get(health_url)
     if not data:
         return
-    cluster_health_metrics = health_stats_for_version(version)
-    for metric, value in iteritems(cluster_health_metrics):
-        result_metric = process_metric(data, metric, *value, dimensions=base_dimensions)
-        if result_metric:
-            metrics.append(result_metric)
+    process_metrics(metrics, data, compiled_health_metrics(tuple(version)), base_dimensions, timestamp)
 
 
-def process_pending_tasks_data(metrics, pending_tasks_url, get, base_dimensions):
+def process_pending_tasks_data(metrics, pending_tasks_url, get, base_dimensions, timestamp=None):
     data = get(pending_tasks_url)
     if not data:
         return
@@ -947,17 +986,14 @@ def process_pending_tasks_data(metrics, pending_tasks_url, get, base_dimensions)
         "pending_tasks_time_in_queue": average_time_in_queue // (total or 1),
     }
 
-    for metric, value in iteritems(CLUSTER_PENDING_TASKS):
-        result_metric = process_metric(node_data, metric, *value, dimensions=base_dimensions)
-        if result_metric:
-            metrics.append(result_metric)
+    process_metrics(metrics, node_data, COMPILED_CLUSTER_PENDING_TASKS, base_dimensions, timestamp)
 
 
-def get_index_metrics(metrics, get, version, base_dimensions):
+def get_index_metrics(metrics, get, version, base_dimensions, timestamp=None):
     index_resp = get("_cat/indices?bytes=b")
     if not index_resp:
         return
-    index_stats_metrics = index_stats_for_version(version)
+    index_stats_metrics = compiled_index_metrics(tuple(version))
     health_stat = {"green": 0, "yellow": 1, "red": 2}
     reversed_health_stat = {"red": 0, "yellow": 1, "green": 2}
     for idx in index_resp:
@@ -987,15 +1023,10 @@ def get_index_metrics(metrics, get, version, base_dimensions):
                 del index_data[key]
                 # self.log.warning("The index %s has no metric data for %s", idx['index'], key)
 
-        for metric in index_stats_metrics:
-            # metric description
-            desc = index_stats_metrics[metric]
-            result_metric = process_metric(index_data, metric, *desc, dimensions=dimensions)
-            if result_metric:
-                metrics.append(result_metric)
+        process_metrics(metrics, index_data, index_stats_metrics, dimensions, timestamp)
 
 
-def process_cat_allocation_data(metrics, get, version, base_dimensions):
+def process_cat_allocation_data(metrics, get, version, base_dimensions, timestamp=None):
     if version < [5, 0, 0]:
         logger.debug(
             "Collecting cat allocation metrics is not supported in version %s. Skipping",
@@ -1010,37 +1041,58 @@ def process_cat_allocation_data(metrics, get, version, base_dimensions):
     for dic in data:
         cat_allocation_dic = {k.replace(".", "_"): v for k, v in dic.items() if k in data_to_collect and v is not None}
         dimensions = {**base_dimensions, "node_name": dic.get("node").lower()}
-        for metric in CAT_ALLOCATION_METRICS:
-            desc = CAT_ALLOCATION_METRICS[metric]
-            result_metric = process_metric(cat_allocation_dic, metric, *desc, dimensions=dimensions)
-            if result_metric:
-                metrics.append(result_metric)
+        process_metrics(metrics, cat_allocation_dic, COMPILED_CAT_ALLOCATION_METRICS, dimensions, timestamp)
+
+
+def collect_cluster_metrics(metrics, cluster_info, timestamp, deadline):
+    """
+    采集单个集群的指标, 结果逐项写入metrics, 超出时间预算时已采集的部分照常上报
+    """
+    version = get_version(cluster_info["cluster_config"]["version"])
+    cluster_id = cluster_info["cluster_config"]["cluster_id"]
+    get_func = query(cluster_id, deadline)
+    cluster_name = cluster_info["cluster_config"]["cluster_name"]
+    target_bk_biz_id = cluster_info["cluster_config"]["custom_option"]["bk_biz_id"]
+    health_url, stats_url, pshard_stats_url, pending_tasks_url = get_url(version)
+    base_dimensions = {
+        "cluster_id": cluster_id,
+        "cluster_name": cluster_name,
+        "target_bk_biz_id": target_bk_biz_id,
+    }
+    process_stats_data(metrics, stats_url, get_func, version, base_dimensions, timestamp)
+    process_pshard_stats_data(metrics, pshard_stats_url, get_func, version, base_dimensions, timestamp)
+    process_health_data(metrics, health_url, get_func, version, base_dimensions, timestamp)
+    process_pending_tasks_data(metrics, pending_tasks_url, get_func, base_dimensions, timestamp)
+    get_index_metrics(metrics, get_func, version, base_dimensions, timestamp)
+    process_cat_allocation_data(metrics, get_func, version, base_dimensions, timestamp)
 
 
 class EsMonitor:
     @staticmethod
     @register_metric("es_monitor", description=_("es 监控信息"), data_name="es_monitor", time_filter=TimeFilterEnum.MINUTE2)
     def elastic():
-        metrics = []
+        """
+        各集群并发采集, 每个集群有独立的时间预算, 总耗时取决于最慢集群的预算而不是所有集群耗时之和
+        """
+        timestamp = MetricUtils.get_instance().report_ts
+        budget = settings.ES_MONITOR_CLUSTER_TIMEOUT
+        deadline = time.time() + budget
+        executor = get_executor(ExecutorPool.ES)
+        cluster_metrics = []
+        futures = {}
         for cluster_info in MetricUtils.get_instance().cluster_infos.values():
-            try:
-                version = get_version(cluster_info["cluster_config"]["version"])
-                cluster_id = cluster_info["cluster_config"]["cluster_id"]
-                get_func = query(cluster_id)
-                cluster_name = cluster_info["cluster_config"]["cluster_name"]
-                target_bk_biz_id = cluster_info["cluster_config"]["custom_option"]["bk_biz_id"]
-                health_url, stats_url, pshard_stats_url, pending_tasks_url = get_url(version)
-                base_dimensions = {
-                    "cluster_id": cluster_id,
-                    "cluster_name": cluster_name,
-                    "target_bk_biz_id": target_bk_biz_id,
-                }
-                process_stats_data(metrics, stats_url, get_func, version, base_dimensions)
-                process_pshard_stats_data(metrics, pshard_stats_url, get_func, version, base_dimensions)
-                process_health_data(metrics, health_url, get_func, version, base_dimensions)
-                process_pending_tasks_data(metrics, pending_tasks_url, get_func, base_dimensions)
-                get_index_metrics(metrics, get_func, version, base_dimensions)
-                process_cat_allocation_data(metrics, get_func, version, base_dimensions)
-            except Exception as e:
-                logger.exception("failed get es info {}".format(e))
-        return metrics
+            metrics = []
+            cluster_metrics.append(metrics)
+            future = executor.submit(collect_cluster_metrics, metrics, cluster_info, timestamp, deadline)
+            futures[future] = cluster_info["cluster_config"]["cluster_id"]
+
+        _, not_done = wait(futures, timeout=max(deadline - time.time(), 0))
+        for future, cluster_id in futures.items():
+            if future in not_done:
+                logger.warning(f"[es monitor] cluster [{cluster_id}] collect not finished in {budget}s")
+                continue
+            if future.exception():
+                logger.error(f"[es monitor] cluster [{cluster_id}] failed get es info: {future.exception()}")
+
+        # 未完成的集群仍可能在追加指标, 只取当前已采集的部分
+        return [metric for metrics in cluster_metrics for metric in list(metrics)]
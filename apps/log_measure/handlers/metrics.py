@@ -26,13 +26,13 @@ from functools import wraps
 
 import arrow
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
 from django.db.models import Count
 from django.utils.translation import ugettext as _
 from elasticsearch import Elasticsearch
 
 from apps.api import TransferApi, NodeApi, CCApi
 from apps.utils.log import logger
+from apps.utils.cache import layered_cache
 from apps.log_databus.constants import STORAGE_CLUSTER_TYPE
 from apps.log_databus.models import CollectorConfig
 from apps.log_measure.exceptions import EsConnectFailException
@@ -74,18 +74,12 @@ class Metric(object):
 def register_metric(namespace, description="", cache_time=0):
     def wrapped_view(func):
         def _wrapped_view(*args, **kwargs):
-            cache_key = f"statistics_{namespace}"
+            if not cache_time:
+                return func(*args, **kwargs)
 
-            if cache_time:
-                result = cache.get(cache_key)
-                if result:
-                    return result
-
-            result = func(*args, **kwargs)
-
-            if cache_time:
-                cache.set(cache_key, result, cache_time)
-            return result
+            return layered_cache.get_or_set(
+                f"statistics_{namespace}", lambda: func(*args, **kwargs), cache_time, prefix="statistics"
+            )
 
         _wrapped_view.namespace = namespace
         _wrapped_view.description = description
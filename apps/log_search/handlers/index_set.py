@@ -53,9 +53,10 @@ from apps.log_databus.handlers.storage import StorageHandler
 from apps.log_databus.constants import STORAGE_CLUSTER_TYPE
 from apps.api import BkLogApi
 from apps.log_search.handlers.search.mapping_handlers import MappingHandlers
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
 from apps.log_search.constants import TimeFieldTypeEnum, TimeFieldUnitEnum, DEFAULT_TIME_FIELD
 from apps.decorators import user_operation_record
-from apps.utils.thread import MultiExecuteFunc
+from apps.utils.thread import ExecutorPool, MultiExecuteFunc
 
 
 class IndexSetHandler(APIModel):
@@ -440,7 +441,7 @@ class IndexSetHandler(APIModel):
         storage_cluster_id = index_set_obj.storage_cluster_id
         index_list: list = [x.get("result_table_id") for x in index_set_data]
         if scenario_id == Scenario.ES:
-            multi_execute_func = MultiExecuteFunc()
+            multi_execute_func = MultiExecuteFunc(pool=ExecutorPool.ES)
             for index in index_list:
 
                 def get_indices(i):
@@ -1034,6 +1035,9 @@ class BkDataIndexSetHandler(BaseIndexSetHandler):
                 result_table_id__in=unauthorized_result_tables,
             ).update(apply_status=LogIndexSetData.Status.PENDING)
 
+        # update 不触发 post_save 信号, 需要手动使检索上下文失效
+        IndexSetSearchContext.invalidate(index_set.index_set_id)
+
     def post_create(self, index_set):
         super(BkDataIndexSetHandler, self).post_create(index_set)
         self.check_rt_authorization_for_token(index_set)
@@ -28,6 +28,7 @@ from elasticsearch_dsl import Search, A
 
 from apps.utils.log import logger
 from apps.log_search.exceptions import DateHistogramException
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
 from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler as SearchHandlerEsquery
 from apps.utils.local import get_local_param
 from apps.utils.time_handler import timestamp_to_timeformat, DTEVENTTIMESTAMP_MULTIPLICATOR, generate_time_range
@@ -154,7 +155,7 @@ class AggsHandlers(AggsBase):
         if not interval or interval == "auto":
             interval, time_format = cls._init_default_interval(start_time, end_time)
 
-        time_field = SearchHandlerEsquery(index_set_id, copy.deepcopy(query_data)).time_field
+        time_field = IndexSetSearchContext.get(index_set_id, with_mapping=False).time_field
         min = start_time.timestamp * 1000
         max = end_time.timestamp * 1000
         date_histogram = A(
@@ -68,6 +68,7 @@ class AsyncExportHandlers(object):
             url_path=url,
             search_url_path=search_url,
             language=get_request_language_code(),
+            total=result["hits"]["total"],
         )
         return async_task.id
 
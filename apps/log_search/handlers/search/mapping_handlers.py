@@ -18,10 +18,11 @@ WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import functools
+import json
 import re
 from collections import defaultdict
 
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
 
 from django.conf import settings
 from django.utils.functional import cached_property
@@ -35,7 +36,8 @@ from apps.log_search.constants import (
     FEATURE_ASYNC_EXPORT_COMMON,
     FieldDataTypeEnum,
 )
-from apps.utils.cache import cache_ten_minute
+from apps.utils import md5_sum
+from apps.utils.cache import cache_ten_minute, layered_cache, JsonSerializer
 from apps.feature_toggle.handlers.toggle import FeatureToggleObject
 from apps.utils.local import get_request_username
 from apps.api import TransferApi, BkDataStorekitApi
@@ -68,6 +70,9 @@ TIME_TYPE = ["date"]
 TRACE_SCOPE = ["trace", "trace_detail", "trace_detail_log"]
 CONTEXT_SCOPE = ["search_context"]
 
+MAPPING_PROPERTY_CACHE_KEY = "mapping_property_{scenario_id}_{storage_cluster_id}_{result_table_id}"
+MAPPING_FIELDS_CACHE_KEY = "mapping_fields_{fingerprint}"
+
 
 class MappingHandlers(object):
     def __init__(
@@ -110,14 +115,34 @@ class MappingHandlers(object):
 
     @cached_property
     def nested_fields(self):
-        mapping_list: list = self._get_mapping()
-        property_dict: dict = self.find_merged_property(mapping_list)
+        property_dict: dict = self.get_merged_property()
         nested_fields = set()
         for key, value in property_dict.items():
             if FieldDataTypeEnum.NESTED.value == value.get("type", ""):
                 nested_fields.add(key)
         return nested_fields
 
+    def get_fulltext_fields(self) -> Tuple[List[str], List[str]]:
+        """
+        全文检索字段及其ngram子字段, 用于将普通关键字改写为字段查询
+        存在log字段时只检索log, 否则检索所有分词字段
+        :return: ([log], [log.ngram])
+        """
+        analyzed_fields: List[str] = [field["field_name"] for field in self.get_index_fields() if field["is_analyzed"]]
+        fulltext_fields: List[str] = ["log"] if "log" in analyzed_fields else analyzed_fields
+        property_dict: dict = self.get_merged_property()
+        ngram_fields: List[str] = []
+        for field in fulltext_fields:
+            field_property: dict = {"properties": property_dict}
+            for path in field.split("."):
+                field_property = field_property.get("properties", {}).get(path, {})
+            for sub_field, sub_property in field_property.get("fields", {}).items():
+                analyzer = f"{sub_property.get('analyzer', '')}{sub_property.get('type', '')}"
+                if "ngram" in sub_field.lower() or "ngram" in analyzer.lower():
+                    ngram_fields.append(f"{field}.{sub_field}")
+                    break
+        return fulltext_fields, ngram_fields
+
     def _get_sub_fields(self, conflict_result, properties, last_key):
         for property_key, property_define in properties.items():
             if "properties" in property_define:
@@ -127,25 +152,7 @@ class MappingHandlers(object):
             conflict_result[key].add(property_define["type"])
 
     def get_all_fields_by_index_id(self, scope="default"):
-        mapping_list: list = self._get_mapping()
-        property_dict: dict = self.find_merged_property(mapping_list)
-        fields_result: list = MappingHandlers.get_all_index_fields_by_mapping(property_dict)
-        fields_list: list = [
-            {
-                "field_type": field["field_type"],
-                "field_name": field["field_name"],
-                "field_alias": field.get("field_alias"),
-                "is_display": False,
-                "is_editable": True,
-                "tag": field.get("tag", "metric"),
-                "es_doc_values": field.get("es_doc_values", False),
-                "is_analyzed": field.get("is_analyzed", False),
-            }
-            for field in fields_result
-        ]
-        fields_list = self._combine_description_field(fields_list)
-        # 处理editable关系
-        final_fields_list: list = self._combine_fields(fields_list)
+        final_fields_list: list = self._combine_description_field(self.get_index_fields())
 
         user_name = get_request_username()
         user_index_set_config_obj = UserIndexSetConfig.objects.filter(
@@ -188,15 +195,134 @@ class MappingHandlers(object):
         display_fields_list = self._sort_display_fields(display_fields_list)
         return final_fields_list, display_fields_list
 
-    def _get_mapping(self):
-        return self._get_latest_mapping(index_set_id=self.index_set_id)
+    def get_index_fields(self) -> List[Dict[str, Any]]:
+        """
+        根据mapping生成字段列表(不含字段描述)
+        字段列表按各结果表mapping指纹缓存, mapping未变化时不重新计算
+        """
+        property_group: Dict[str, Dict] = self.get_property_group()
+        fingerprint = self.get_mapping_fingerprint(property_group)
+        cache_key = MAPPING_FIELDS_CACHE_KEY.format(fingerprint=fingerprint)
+        cached_fields = layered_cache.get(cache_key, prefix="mapping_fields", serializer=JsonSerializer)
+        if cached_fields is not None:
+            return cached_fields
+
+        property_dict: dict = self._merge_property([property_group[key]["property"] for key in self.mapping_keys()])
+        fields_result: list = MappingHandlers.get_all_index_fields_by_mapping(property_dict)
+        fields_list: list = [
+            {
+                "field_type": field["field_type"],
+                "field_name": field["field_name"],
+                "field_alias": field.get("field_alias"),
+                "is_display": False,
+                "is_editable": True,
+                "tag": field.get("tag", "metric"),
+                "es_doc_values": field.get("es_doc_values", False),
+                "is_analyzed": field.get("is_analyzed", False),
+            }
+            for field in fields_result
+        ]
+        # 处理editable关系
+        fields_list = self._combine_fields(fields_list)
+        layered_cache.set(
+            cache_key, fields_list, settings.MAPPING_FIELDS_TTL, prefix="mapping_fields", serializer=JsonSerializer
+        )
+        return fields_list
+
+    def get_mapping_fingerprint(self, property_group: Dict[str, Dict] = None) -> str:
+        """
+        索引集mapping指纹, 由场景、时间字段及各结果表mapping指纹组成, 任一结果表mapping变化时随之变化
+        """
+        property_group = property_group or self.get_property_group()
+        return self.mapping_fingerprint(
+            {
+                "scenario_id": self.scenario_id,
+                "time_field": self.time_field,
+                "tables": [[key, property_group[key]["fingerprint"]] for key in self.mapping_keys()],
+            }
+        )
+
+    def get_merged_property(self) -> dict:
+        property_group: Dict[str, Dict] = self.get_property_group()
+        return self._merge_property([property_group[key]["property"] for key in self.mapping_keys()])
+
+    def get_property_group(self) -> Dict[str, Dict]:
+        """
+        获取各结果表最新的mapping及其指纹
+        mapping按结果表缓存, 不同索引集共用同一个结果表时只需拉取一次
+        :return: {result_table_id: {"fingerprint": fingerprint, "property": property_dict}}
+        """
+        property_group: Dict[str, Dict] = {}
+        missing_keys: List[str] = []
+        for key in self.mapping_keys():
+            cache_key = self._property_cache_key(key)
+            stored = layered_cache.get(cache_key, prefix="mapping_property", serializer=JsonSerializer)
+            if stored is None:
+                missing_keys.append(key)
+                continue
+            property_group[key] = stored
+        if missing_keys:
+            property_group.update(self.refresh_property_group(missing_keys)[0])
+        return property_group
 
-    @cache_ten_minute("latest_mapping_key_{index_set_id}")
-    def _get_latest_mapping(self, *, index_set_id):  # noqa
+    def refresh_property_group(self, keys: List[str] = None) -> Tuple[Dict[str, Dict], List[str]]:
+        """
+        拉取mapping并按结果表保存, 返回保存的内容以及指纹发生变化的结果表
+        """
+        keys = keys or self.mapping_keys()
+        mapping_list: list = self._get_latest_mapping(",".join(keys))
+        if self.scenario_id in [Scenario.ES]:
+            # 第三方ES不按结果表拆分mapping
+            property_dict_group = {key: self.find_property_dict_first(mapping_list) for key in keys}
+        else:
+            mapping_group = self._mapping_group([self._normalize_result_table(key) for key in keys], mapping_list)
+            property_dict_group = {
+                key: self.find_property_dict_first(mapping_group.get(self._normalize_result_table(key), []))
+                for key in keys
+            }
+
+        property_group: Dict[str, Dict] = {}
+        changed_keys: List[str] = []
+        for key, property_dict in property_dict_group.items():
+            cache_key = self._property_cache_key(key)
+            stored = layered_cache.get(cache_key, prefix="mapping_property", serializer=JsonSerializer)
+            property_group[key] = {"fingerprint": self.mapping_fingerprint(property_dict), "property": property_dict}
+            if stored is None or stored["fingerprint"] != property_group[key]["fingerprint"]:
+                changed_keys.append(key)
+            # 没有拉取到mapping时缩短缓存时间, 尽快重试
+            timeout = settings.MAPPING_PROPERTY_TTL if property_dict else settings.CACHE_NEGATIVE_TTL
+            layered_cache.set(
+                cache_key, property_group[key], timeout, prefix="mapping_property", serializer=JsonSerializer
+            )
+        return property_group, changed_keys
+
+    @staticmethod
+    def mapping_fingerprint(content) -> str:
+        return md5_sum(json.dumps(content, sort_keys=True))
+
+    def mapping_keys(self) -> List[str]:
+        # 第三方ES整体取最新索引的mapping
+        if self.scenario_id in [Scenario.ES]:
+            return [self.indices]
+        return self.indices.split(",")
+
+    def _normalize_result_table(self, result_table_id: str) -> str:
+        # 与 _mapping_group 保持一致: 数平rt和索引对应不区分大小写
+        result_table_id = result_table_id.replace(".", "_")
+        if self.scenario_id in [Scenario.BKDATA]:
+            return result_table_id.lower()
+        return result_table_id
+
+    def _property_cache_key(self, key: str) -> str:
+        return MAPPING_PROPERTY_CACHE_KEY.format(
+            scenario_id=self.scenario_id, storage_cluster_id=self.storage_cluster_id, result_table_id=key
+        )
+
+    def _get_latest_mapping(self, indices: str) -> list:
         start_time, end_time = generate_time_range("1d", "", "", self.time_zone)
         latest_mapping = BkLogApi.mapping(
             {
-                "indices": self.indices,
+                "indices": indices,
                 "scenario_id": self.scenario_id,
                 "storage_cluster_id": self.storage_cluster_id,
                 "time_zone": self.time_zone,
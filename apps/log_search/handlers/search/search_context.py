@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, replace
+from typing import Optional, Tuple
+
+from cachetools import LRUCache
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.log_search.constants import TimeFieldTypeEnum, TimeFieldUnitEnum
+from apps.log_search.exceptions import BaseSearchIndexSetDataDoseNotExists, BaseSearchIndexSetException
+from apps.log_search.handlers.search.mapping_handlers import MappingHandlers
+from apps.log_search.handlers.search.pre_search_handlers import PreSearchHandlers
+from apps.log_search.models import LogIndexSet, LogIndexSetData, Scenario
+from apps.utils.log import logger
+
+SEARCH_CONTEXT_VERSION_KEY = "index_set_search_context_version_{index_set_id}"
+# 上下文字段变化时升级key, 避免滚动发布期间新旧进程读取对方的数据
+SEARCH_CONTEXT_CACHE_KEY = "index_set_search_context_v2_{index_set_id}_{version}"
+
+
+@dataclass(frozen=True)
+class IndexSetSearchContext(object):
+    """
+    索引集检索上下文: 构建SearchHandler所需的索引集固定信息
+    进程内及Redis两级缓存, 索引集变更时更新版本号使所有进程的缓存失效
+    """
+
+    index_set_id: int
+    indices: str
+    scenario_id: str
+    storage_cluster_id: Optional[int]
+    time_field: str
+    time_field_type: str
+    time_field_unit: str
+    # 以下为mapping相关信息, 仅在 has_mapping 为True时有效, mapping指纹变化后重新加载
+    has_mapping: bool = False
+    mapping_fingerprint: Optional[str] = None
+    default_sort_tag: bool = False
+    trace_type: Optional[str] = None
+    has_es_fields: bool = False
+    es_time_field_type: Optional[str] = None
+    nested_fields: Tuple[str, ...] = ()
+    trace_proto: Optional[str] = None
+    fulltext_fields: Tuple[str, ...] = ()
+    ngram_fields: Tuple[str, ...] = ()
+
+    _local = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, index_set_id: int, with_mapping: bool = True) -> "IndexSetSearchContext":
+        now = time.time()
+        local = cls._get_local()
+        with cls._lock:
+            item = local.get(index_set_id)
+        if item is not None:
+            version, checked_at, context = item
+            if now - checked_at < settings.INDEX_SET_SEARCH_CONTEXT_CHECK_INTERVAL and (
+                context.has_mapping or not with_mapping
+            ):
+                return context
+
+        version = cls._get_version(index_set_id)
+        context = None
+        if item is not None and item[0] == version:
+            context = item[2]
+        if context is None:
+            payload = cache.get(SEARCH_CONTEXT_CACHE_KEY.format(index_set_id=index_set_id, version=version))
+            if payload:
+                context = cls(**payload)
+
+        if context is None or (with_mapping and (not context.has_mapping or context.is_mapping_changed())):
+            context = context or cls.build(index_set_id)
+            if with_mapping:
+                context = context.load_mapping()
+            cache.set(
+                SEARCH_CONTEXT_CACHE_KEY.format(index_set_id=index_set_id, version=version),
+                asdict(context),
+                settings.INDEX_SET_SEARCH_CONTEXT_TTL,
+            )
+
+        with cls._lock:
+            local[index_set_id] = (version, now, context)
+        return context
+
+    @classmethod
+    def invalidate(cls, index_set_id: int, notify: bool = True):
+        local = cls._get_local()
+        with cls._lock:
+            local.pop(index_set_id, None)
+        if not notify:
+            return
+        try:
+            cache.set(
+                SEARCH_CONTEXT_VERSION_KEY.format(index_set_id=index_set_id),
+                uuid.uuid4().hex,
+                settings.INDEX_SET_SEARCH_CONTEXT_TTL * 2,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[search context] invalidate index_set({index_set_id}) failed: {e}")
+
+    @classmethod
+    def build(cls, index_set_id: int) -> "IndexSetSearchContext":
+        index_set: LogIndexSet = LogIndexSet.objects.filter(index_set_id=index_set_id).first()
+        if not index_set:
+            raise BaseSearchIndexSetException(BaseSearchIndexSetException.MESSAGE.format(index_set_id=index_set_id))
+        index_list = [x.get("result_table_id", None) for x in index_set.get_indexes(has_applied=True)]
+        if not index_list:
+            raise BaseSearchIndexSetDataDoseNotExists(
+                BaseSearchIndexSetDataDoseNotExists.MESSAGE.format(
+                    index_set_id=str(index_set_id) + "_" + index_set.index_set_name
+                )
+            )
+
+        time_field, time_field_type, time_field_unit = cls._get_time_field(index_set)
+        return cls(
+            index_set_id=index_set_id,
+            indices=",".join(index_list),
+            scenario_id=index_set.scenario_id,
+            storage_cluster_id=index_set.storage_cluster_id,
+            time_field=time_field,
+            time_field_type=time_field_type,
+            time_field_unit=time_field_unit,
+        )
+
+    def load_mapping(self) -> "IndexSetSearchContext":
+        """
+        补充预检查、nested字段及trace协议等需要读取mapping的信息
+        """
+        from apps.log_trace.handlers.proto.proto import Proto
+
+        pre_check_result = PreSearchHandlers.pre_check_fields(self.indices, self.scenario_id, self.storage_cluster_id)
+        fields_from_es = pre_check_result.get("fields_from_es", [])
+        es_time_field_type = None
+        for item in fields_from_es:
+            if item["field_name"] == self.time_field:
+                es_time_field_type = item["field_type"]
+                break
+        mapping_handlers = MappingHandlers(
+            self.indices, self.index_set_id, self.scenario_id, self.storage_cluster_id, self.time_field
+        )
+        fulltext_fields, ngram_fields = mapping_handlers.get_fulltext_fields()
+        return replace(
+            self,
+            has_mapping=True,
+            mapping_fingerprint=mapping_handlers.get_mapping_fingerprint(),
+            default_sort_tag=pre_check_result["default_sort_tag"],
+            trace_type=pre_check_result["trace_type"],
+            has_es_fields=bool(fields_from_es),
+            es_time_field_type=es_time_field_type,
+            nested_fields=tuple(sorted(mapping_handlers.nested_fields)),
+            trace_proto=Proto.judge_trace_type(mapping_handlers.get_index_fields()),
+            fulltext_fields=tuple(fulltext_fields),
+            ngram_fields=tuple(ngram_fields),
+        )
+
+    def is_mapping_changed(self) -> bool:
+        """
+        mapping指纹与加载时不一致, 说明nested字段、时间字段类型及全文检索字段等可能已变化
+        """
+        try:
+            fingerprint = MappingHandlers(
+                self.indices, self.index_set_id, self.scenario_id, self.storage_cluster_id, self.time_field
+            ).get_mapping_fingerprint()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[search context] get mapping fingerprint of index_set({self.index_set_id}) failed: {e}")
+            return False
+        return fingerprint != self.mapping_fingerprint
+
+    def is_nested_field(self, field: str) -> bool:
+        parent_path, *_ = field.split(".")
+        return parent_path in self.nested_fields
+
+    @staticmethod
+    def _get_time_field(index_set: LogIndexSet) -> tuple:
+        if index_set.scenario_id in [Scenario.BKDATA, Scenario.LOG]:
+            return "dtEventTimeStamp", TimeFieldTypeEnum.DATE.value, TimeFieldUnitEnum.SECOND.value
+        if index_set.time_field:
+            return index_set.time_field, index_set.time_field_type, index_set.time_field_unit
+        index_set_data: LogIndexSetData = LogIndexSetData.objects.filter(index_set_id=index_set.index_set_id).first()
+        if not index_set_data:
+            raise BaseSearchIndexSetException(
+                BaseSearchIndexSetException.MESSAGE.format(index_set_id=index_set.index_set_id)
+            )
+        return index_set_data.time_field, TimeFieldTypeEnum.DATE.value, TimeFieldUnitEnum.SECOND.value
+
+    @classmethod
+    def _get_local(cls) -> LRUCache:
+        if cls._local is None:
+            with cls._lock:
+                if cls._local is None:
+                    cls._local = LRUCache(maxsize=settings.INDEX_SET_SEARCH_CONTEXT_LOCAL_MAXSIZE)
+        return cls._local
+
+    @staticmethod
+    def _get_version(index_set_id: int) -> str:
+        version_key = SEARCH_CONTEXT_VERSION_KEY.format(index_set_id=index_set_id)
+        try:
+            version = cache.get(version_key)
+            if version is None:
+                cache.add(version_key, uuid.uuid4().hex, settings.INDEX_SET_SEARCH_CONTEXT_TTL * 2)
+                version = cache.get(version_key)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[search context] get version of index_set({index_set_id}) failed: {e}")
+            version = None
+        return version or "default"
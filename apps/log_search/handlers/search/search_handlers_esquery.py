@@ -20,6 +20,9 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import json
 import copy
 import hashlib
+import itertools
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 from typing import List, Dict, Any, Union
 from django.core.cache import cache
@@ -27,16 +30,17 @@ from django.conf import settings
 from requests.exceptions import ReadTimeout
 
 from apps.api.base import DataApiRetryClass
+from apps.exceptions import ApiResultError
 from apps.log_clustering.models import ClusteringConfig
 from apps.log_databus.constants import EtlConfig, TargetNodeTypeEnum
 from apps.log_databus.models import CollectorConfig
 from apps.log_search.models import (
     LogIndexSet,
-    LogIndexSetData,
     Scenario,
     UserIndexSetConfig,
     UserIndexSetSearchHistory,
 )
+from apps.log_esquery.constants import QueryPriority
 from apps.log_search.constants import (
     TimeEnum,
     SCROLL,
@@ -49,9 +53,6 @@ from apps.log_search.constants import (
     DEFAULT_BK_CLOUD_ID,
 )
 from apps.log_search.exceptions import (
-    BaseSearchIndexSetException,
-    BaseSearchIndexSetDataDoseNotExists,
-    BaseSearchResultAnalyzeException,
     BaseSearchGseIndexNoneException,
     BaseSearchSortListException,
     SearchExceedMaxSizeException,
@@ -65,6 +66,8 @@ from apps.api import BkLogApi, PaasCcApi
 from apps.utils.cache import cache_five_minute
 from apps.utils.db import array_group
 from apps.utils.local import get_request_username
+from apps.utils.log import logger
+from apps.utils.thread import FuncThread, executor_wrap, run_in_task_context
 from apps.log_search.handlers.es.dsl_bkdata_builder import (
     DslBkDataCreateSearchContextBody,
     DslBkDataCreateSearchContextBodyScenarioLog,
@@ -76,11 +79,13 @@ from apps.utils.local import get_local_param
 from apps.log_search.handlers.biz import BizHandler
 from apps.log_search.handlers.search.mapping_handlers import MappingHandlers
 from apps.log_search.handlers.search.search_sort_builder import SearchSortBuilder
-from apps.log_search.handlers.search.pre_search_handlers import PreSearchHandlers
-from apps.log_search.constants import TimeFieldTypeEnum, TimeFieldUnitEnum
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
 
 max_len_dict = Dict[str, int]
 
+# 上下文预取线程池, 进程内共享并限制并发数
+context_prefetch_executor = ThreadPoolExecutor(max_workers=settings.SEARCH_CONTEXT_PREFETCH_WORKERS)
+
 
 def fields_config(name: str, is_active: bool = False):
     def decorator(func):
@@ -108,11 +113,11 @@ class SearchHandler(object):
         self.index_set_id = index_set_id
         self.search_dict.update({"index_set_id": index_set_id})
 
-        self.scenario_id: str = ""
-        self.storage_cluster_id: int = -1
-
-        # 构建索引集字符串, 并初始化scenario_id、storage_cluster_id
-        self.indices: str = self._init_indices_str(index_set_id)
+        # 索引集检索上下文: 索引、场景、集群及时间字段等按索引集缓存, 预检查时同时加载mapping相关信息
+        self.context: IndexSetSearchContext = IndexSetSearchContext.get(index_set_id, with_mapping=pre_check_enable)
+        self.scenario_id: str = self.context.scenario_id
+        self.storage_cluster_id: int = self.context.storage_cluster_id
+        self.indices: str = self.context.indices
         self.search_dict.update(
             {"indices": self.indices, "scenario_id": self.scenario_id, "storage_cluster_id": self.storage_cluster_id}
         )
@@ -121,7 +126,7 @@ class SearchHandler(object):
         # 添加是否强校验的开关来控制是否强校验
         if pre_check_enable:
             self.search_dict.update(
-                PreSearchHandlers.pre_check_fields(self.indices, self.scenario_id, self.storage_cluster_id)
+                {"default_sort_tag": self.context.default_sort_tag, "trace_type": self.context.trace_type}
             )
 
         # 检索历史记录
@@ -130,9 +135,9 @@ class SearchHandler(object):
 
         self.use_time_range = search_dict.get("use_time_range", True)
         # 构建时间字段
-        self.time_field, self.time_field_type, self.time_field_unit = self._init_time_field(
-            index_set_id, self.scenario_id
-        )
+        self.time_field = self.context.time_field
+        self.time_field_type = self.context.time_field_type
+        self.time_field_unit = self.context.time_field_unit
         if not self.time_field:
             raise SearchIndexNoTimeFieldException()
         self.search_dict.update(
@@ -145,9 +150,7 @@ class SearchHandler(object):
         # 根据时间字段确定时间字段类型，根据预查询强校验es拉取到的时间类型
         # 添加是否强校验的开关来控制是否强校验
         if pre_check_enable:
-            self.time_field_type = self._set_time_filed_type(
-                self.time_field, self.search_dict.get("fields_from_es", [])
-            )
+            self.time_field_type = self._set_time_filed_type()
         self.search_dict.update({"time_field_type": self.time_field_type})
 
         # 设置IP字段对应的field ip serverIp
@@ -164,6 +167,12 @@ class SearchHandler(object):
 
         # 透传query string
         self.query_string: str = search_dict.get("keyword")
+        # 查询语句执行计划: 普通关键字按全文检索字段改写, 用户要求通配匹配时保持 *keyword*
+        self.fulltext_fields: list = list(self.context.fulltext_fields)
+        self.ngram_fields: list = list(self.context.ngram_fields)
+        self.keyword_wildcard: bool = search_dict.get("keyword_wildcard", False)
+        # 查询优先级: 集群繁忙时交互检索优先于导出和后台查询
+        self.query_priority: str = search_dict.get("query_priority", QueryPriority.INTERACTIVE)
 
         # 透传start
         self.start: int = search_dict.get("begin", 0)
@@ -351,7 +360,14 @@ class SearchHandler(object):
             target_config, *_ = target_config
             return True, {**config.get("trace_config"), "field": target_config["field"]}
 
-    def search(self, search_type="default"):
+    def search(self, search_type="default", need_list=True, need_origin_log=True, need_fields=True):
+        """
+        检索
+        @param search_type: 检索历史类型, 为空时不保存检索历史
+        @param need_list: 是否返回展示用的日志列表(list)
+        @param need_origin_log: 是否返回原始日志列表(origin_log_list)
+        @param need_fields: 是否统计字段最大长度(fields)
+        """
 
         # 校验是否超出最大查询数量
         if not self.is_scroll and self.size > MAX_RESULT_WINDOW:
@@ -368,11 +384,15 @@ class SearchHandler(object):
         result: dict = BkLogApi.search(
             {
                 "indices": self.indices,
+                "query_priority": self.query_priority,
                 "scenario_id": self.scenario_id,
                 "storage_cluster_id": self.storage_cluster_id,
                 "start_time": self.start_time,
                 "end_time": self.end_time,
                 "query_string": self.query_string,
+                "fulltext_fields": self.fulltext_fields,
+                "ngram_fields": self.ngram_fields,
+                "query_string_wildcard": self.keyword_wildcard,
                 "filter": self.filter,
                 "sort_list": self.sort_list,
                 "start": self.start,
@@ -395,9 +415,10 @@ class SearchHandler(object):
         if self._can_scroll(result):
             result = self._scroll(result)
 
-        result = self._deal_query_result(result)
-        field_dict = self._analyze_field_length(result.get("list"))
-        result.update({"fields": field_dict})
+        result = self._deal_query_result(
+            result, need_list=need_list, need_origin_log=need_origin_log, need_fields=need_fields
+        )
+        result.update({"fields": self.field})
 
         # 保存检索历史，按用户、索引集、检索条件缓存5分钟
         # 保存首页检索和trace通用查询检索历史
@@ -453,6 +474,7 @@ class SearchHandler(object):
             scroll_result = BkLogApi.scroll(
                 {
                     "indices": self.indices,
+                    "query_priority": self.query_priority,
                     "scenario_id": self.scenario_id,
                     "storage_cluster_id": self.storage_cluster_id,
                     "scroll": self.scroll,
@@ -476,11 +498,15 @@ class SearchHandler(object):
             result = BkLogApi.search(
                 {
                     "indices": self.indices,
+                    "query_priority": QueryPriority.EXPORT,
                     "scenario_id": self.scenario_id,
                     "storage_cluster_id": self.storage_cluster_id,
                     "start_time": self.start_time,
                     "end_time": self.end_time,
                     "query_string": self.query_string,
+                    "fulltext_fields": self.fulltext_fields,
+                    "ngram_fields": self.ngram_fields,
+                    "query_string_wildcard": self.keyword_wildcard,
                     "filter": self.filter,
                     "sort_list": self.sort_list,
                     "start": self.start,
@@ -508,11 +534,15 @@ class SearchHandler(object):
         result = BkLogApi.search(
             {
                 "indices": self.indices,
+                "query_priority": QueryPriority.EXPORT,
                 "scenario_id": self.scenario_id,
                 "storage_cluster_id": self.storage_cluster_id,
                 "start_time": self.start_time,
                 "end_time": self.end_time,
                 "query_string": self.query_string,
+                "fulltext_fields": self.fulltext_fields,
+                "ngram_fields": self.ngram_fields,
+                "query_string_wildcard": self.keyword_wildcard,
                 "filter": self.filter,
                 "sort_list": sorted_list,
                 "start": self.start,
@@ -545,11 +575,15 @@ class SearchHandler(object):
             search_result = BkLogApi.search(
                 {
                     "indices": self.indices,
+                    "query_priority": QueryPriority.EXPORT,
                     "scenario_id": self.scenario_id,
                     "storage_cluster_id": self.storage_cluster_id,
                     "start_time": self.start_time,
                     "end_time": self.end_time,
                     "query_string": self.query_string,
+                    "fulltext_fields": self.fulltext_fields,
+                    "ngram_fields": self.ngram_fields,
+                    "query_string_wildcard": self.keyword_wildcard,
                     "filter": self.filter,
                     "sort_list": sorted_list,
                     "start": self.start,
@@ -578,23 +612,205 @@ class SearchHandler(object):
     def scroll_result(self, scroll_result):
         scroll_size = len(scroll_result["hits"]["hits"])
         result_size = scroll_size
-        while scroll_size == MAX_RESULT_WINDOW and result_size < self.size:
-            _scroll_id = scroll_result["_scroll_id"]
-            scroll_result = BkLogApi.scroll(
+        _scroll_id = scroll_result.get("_scroll_id")
+        try:
+            while scroll_size == MAX_RESULT_WINDOW and result_size < self.size:
+                scroll_result = BkLogApi.scroll(
+                    {
+                        "indices": self.indices,
+                        "query_priority": QueryPriority.EXPORT,
+                        "scenario_id": self.scenario_id,
+                        "storage_cluster_id": self.storage_cluster_id,
+                        "scroll": SCROLL,
+                        "scroll_id": _scroll_id,
+                    },
+                    data_api_retry_cls=DataApiRetryClass.create_retry_obj(
+                        ReadTimeout, stop_max_attempt_number=MAX_EXPORT_REQUEST_RETRY
+                    ),
+                )
+                _scroll_id = scroll_result.get("_scroll_id") or _scroll_id
+                scroll_size = len(scroll_result["hits"]["hits"])
+                result_size += scroll_size
+                yield self._deal_query_result(scroll_result)
+        finally:
+            self.clear_scroll(_scroll_id)
+
+    def sliced_scroll_result(self, slice_id: int, slice_max: int):
+        """
+        sliced scroll: 拉取指定分片的全部数据, 分片内按sort_list排序, 逐页返回带排序值的原始hits, 多个分片可并发拉取
+        """
+        result = BkLogApi.search(
+            {
+                "indices": self.indices,
+                "query_priority": QueryPriority.EXPORT,
+                "scenario_id": self.scenario_id,
+                "storage_cluster_id": self.storage_cluster_id,
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+                "query_string": self.query_string,
+                "fulltext_fields": self.fulltext_fields,
+                "ngram_fields": self.ngram_fields,
+                "query_string_wildcard": self.keyword_wildcard,
+                "filter": self.filter,
+                "sort_list": self.sort_list,
+                "start": self.start,
+                "size": MAX_RESULT_WINDOW,
+                "aggs": {},
+                "highlight": {},
+                "time_zone": self.time_zone,
+                "time_range": self.time_range,
+                "use_time_range": self.use_time_range,
+                "time_field": self.time_field,
+                "time_field_type": self.time_field_type,
+                "time_field_unit": self.time_field_unit,
+                "scroll": SCROLL,
+                "collapse": self.collapse,
+                "slice": {"id": slice_id, "max": slice_max},
+            },
+            data_api_retry_cls=DataApiRetryClass.create_retry_obj(
+                ReadTimeout, stop_max_attempt_number=MAX_EXPORT_REQUEST_RETRY
+            ),
+        )
+        scroll_id = result.get("_scroll_id")
+        try:
+            while True:
+                hits = result.get("hits", {}).get("hits", [])
+                if hits:
+                    yield hits
+                if len(hits) < MAX_RESULT_WINDOW:
+                    return
+                result = BkLogApi.scroll(
+                    {
+                        "indices": self.indices,
+                        "query_priority": QueryPriority.EXPORT,
+                        "scenario_id": self.scenario_id,
+                        "storage_cluster_id": self.storage_cluster_id,
+                        "scroll": SCROLL,
+                        "scroll_id": scroll_id,
+                    },
+                    data_api_retry_cls=DataApiRetryClass.create_retry_obj(
+                        ReadTimeout, stop_max_attempt_number=MAX_EXPORT_REQUEST_RETRY
+                    ),
+                )
+                scroll_id = result.get("_scroll_id") or scroll_id
+        finally:
+            self.clear_scroll(scroll_id)
+
+    def clear_scroll(self, scroll_id: str):
+        """
+        释放scroll上下文, 失败时等待其超时后由ES自动释放
+        """
+        if not scroll_id:
+            return
+        try:
+            BkLogApi.clear_scroll(
                 {
                     "indices": self.indices,
                     "scenario_id": self.scenario_id,
                     "storage_cluster_id": self.storage_cluster_id,
-                    "scroll": SCROLL,
-                    "scroll_id": _scroll_id,
-                },
-                data_api_retry_cls=DataApiRetryClass.create_retry_obj(
-                    ReadTimeout, stop_max_attempt_number=MAX_EXPORT_REQUEST_RETRY
-                ),
+                    "scroll_id": scroll_id,
+                }
             )
-            scroll_size = len(scroll_result["hits"]["hits"])
-            result_size += scroll_size
-            yield self._deal_query_result(scroll_result)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[clear scroll] index_set({self.index_set_id}) clear scroll failed: {e}")
+
+    def export_stream(self, is_gzip: bool = False):
+        """
+        流式导出: 按页拉取并逐页序列化, 内存中最多只保留一页数据
+        """
+        pages = self._iter_export_pages()
+        # 预取第一页, 保证查询异常能在响应返回前抛出
+        first_page = next(pages, [])
+        return self._encode_export_pages(pages, is_gzip, first_page=first_page)
+
+    def _iter_export_pages(self):
+        if not self.is_scroll and self.size > MAX_RESULT_WINDOW:
+            self.size = MAX_RESULT_WINDOW
+
+        if self.is_scroll and self.size > MAX_SEARCH_SIZE:
+            raise SearchExceedMaxSizeException(SearchExceedMaxSizeException.MESSAGE.format(size=MAX_SEARCH_SIZE))
+
+        # 导出只需要原始日志, 不需要聚合与高亮
+        result: dict = BkLogApi.search(
+            {
+                "indices": self.indices,
+                "query_priority": QueryPriority.EXPORT,
+                "scenario_id": self.scenario_id,
+                "storage_cluster_id": self.storage_cluster_id,
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+                "query_string": self.query_string,
+                "fulltext_fields": self.fulltext_fields,
+                "ngram_fields": self.ngram_fields,
+                "query_string_wildcard": self.keyword_wildcard,
+                "filter": self.filter,
+                "sort_list": self.sort_list,
+                "start": self.start,
+                "size": min(self.size, MAX_RESULT_WINDOW),
+                "aggs": {},
+                "highlight": {},
+                "use_time_range": self.use_time_range,
+                "time_zone": self.time_zone,
+                "time_range": self.time_range,
+                "time_field": self.time_field,
+                "time_field_type": self.time_field_type,
+                "time_field_unit": self.time_field_unit,
+                "scroll": self.scroll,
+                "collapse": self.collapse,
+            },
+            data_api_retry_cls=DataApiRetryClass.create_retry_obj(
+                ReadTimeout, stop_max_attempt_number=MAX_EXPORT_REQUEST_RETRY
+            ),
+        )
+        can_scroll = self._can_scroll(result)
+        scroll_id = result.get("_scroll_id")
+
+        result_size = 0
+        try:
+            while True:
+                hits = result.get("hits", {}).get("hits", [])
+                page_size = len(hits)
+                hits = hits[: self.size - result_size]
+                result_size += len(hits)
+                yield [hit["_source"] for hit in hits]
+
+                # 需要继续滚动：上一页为满页且导出数量不足size
+                if not can_scroll or page_size < MAX_RESULT_WINDOW or result_size >= self.size:
+                    return
+
+                result = BkLogApi.scroll(
+                    {
+                        "indices": self.indices,
+                        "query_priority": QueryPriority.EXPORT,
+                        "scenario_id": self.scenario_id,
+                        "storage_cluster_id": self.storage_cluster_id,
+                        "scroll": self.scroll,
+                        "scroll_id": scroll_id,
+                    },
+                    data_api_retry_cls=DataApiRetryClass.create_retry_obj(
+                        ReadTimeout, stop_max_attempt_number=MAX_EXPORT_REQUEST_RETRY
+                    ),
+                )
+                scroll_id = result.get("_scroll_id") or scroll_id
+        finally:
+            # 导出完成、达到size或客户端断开时均释放scroll上下文
+            self.clear_scroll(scroll_id)
+
+    @staticmethod
+    def _encode_export_pages(pages, is_gzip: bool = False, first_page: list = None):
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if is_gzip else None
+        try:
+            for page in itertools.chain([first_page or []], pages):
+                chunk = "".join(f"{json.dumps(log)}\n" for log in page).encode("utf-8")
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+            if compressor:
+                yield compressor.flush()
+        finally:
+            # 响应被提前关闭时同步关闭分页生成器, 及时释放scroll
+            pages.close()
 
     def _get_sort_list_by_index_id(self, scope="default"):
         username = get_request_username()
@@ -780,9 +996,10 @@ class SearchHandler(object):
         ).index
 
         if self.zero:
+            # 上下两个方向合并为一次msearch查询
+            result_up, result_down = self._search_context_pages(context_indice, ["-", "+"])
+
             # up
-            body: dict = self._get_context_body("-")
-            result_up: dict = BkLogApi.dsl({"indices": context_indice, "scenario_id": self.scenario_id, "body": body})
             result_up: dict = self._deal_query_result(result_up)
             result_up.update(
                 {
@@ -793,9 +1010,6 @@ class SearchHandler(object):
 
             # down
             body: dict = self._get_context_body("+")
-
-            result_down: Dict = BkLogApi.dsl({"indices": context_indice, "scenario_id": self.scenario_id, "body": body})
-
             result_down: dict = self._deal_query_result(result_down)
             result_down.update(
                 # self.analyze_context_result(result_down.get("list"))
@@ -823,8 +1037,7 @@ class SearchHandler(object):
                 "dsl": json.dumps(body),
             }
         if self.start < 0:
-            body: Dict = self._get_context_body("-")
-            result_up = BkLogApi.dsl({"indices": context_indice, "scenario_id": self.scenario_id, "body": body})
+            result_up = self._search_context_page({"indices": context_indice, "order": "-"})
 
             result_up: dict = self._deal_query_result(result_up)
             result_up.update(
@@ -842,8 +1055,7 @@ class SearchHandler(object):
             )
             return result_up
         if self.start > 0:
-            body: Dict = self._get_context_body("+")
-            result_down = BkLogApi.dsl({"indices": context_indice, "scenario_id": self.scenario_id, "body": body})
+            result_down = self._search_context_page({"indices": context_indice, "order": "+"})
 
             result_down = self._deal_query_result(result_down)
             result_down.update(
@@ -860,11 +1072,94 @@ class SearchHandler(object):
 
         return {"list": []}
 
-    def _get_context_body(self, order):
+    def _search_context_page(self, params: dict) -> dict:
+        """
+        查询上下文的一页
+        @param params: indices 索引, order 方向 "-" 向上 "+" 向下, start 偏移量 默认为当前请求的偏移量
+        """
+        return self._search_context_pages(
+            params["indices"], [params["order"]], params.get("start"), params.get("prefetch", True)
+        )[0]
+
+    def _search_context_pages(self, indices: str, orders: List[str], start: int = None, prefetch: bool = True):
+        """
+        查询各方向的上下文, 优先从上下文窗口缓存读取, 未命中的方向合并为一次msearch请求, 并在后台预取同方向的下一页
+        @param indices: 索引
+        @param orders: 方向列表 "-" 向上 "+" 向下
+        @param start: 偏移量 默认为当前请求的偏移量, 向上为负数
+        @param prefetch: 是否预取下一页
+        """
+        start = self.start if start is None else start
+        results = {order: cache.get(self._get_context_window_cache_key(indices, order, start)) for order in orders}
+        missing_orders = [order for order in orders if results[order] is None]
+        if missing_orders:
+            responses = BkLogApi.msearch(
+                {
+                    "searches": [
+                        {
+                            "indices": indices,
+                            "scenario_id": self.scenario_id,
+                            "body": self._get_context_body(order, start),
+                        }
+                        for order in missing_orders
+                    ]
+                }
+            )
+            for order, response in zip(missing_orders, responses):
+                if not response["result"]:
+                    raise ApiResultError(response["message"], code=response["code"])
+                results[order] = response["data"]
+                cache.set(
+                    self._get_context_window_cache_key(indices, order, start),
+                    response["data"],
+                    settings.SEARCH_CONTEXT_WINDOW_TTL,
+                )
+
+        for order in orders:
+            # 当前页取满说明同方向还有日志, 预取下一页供"加载更多"使用
+            if not prefetch or len(results[order].get("hits", {}).get("hits", [])) < self.size:
+                continue
+            next_start = abs(start) + self.size
+            next_start = -next_start if order == "-" else next_start
+            if cache.get(self._get_context_window_cache_key(indices, order, next_start)) is None:
+                self._prefetch_context_page({"indices": indices, "order": order, "start": next_start})
+        return [results[order] for order in orders]
+
+    def _prefetch_context_page(self, params: dict):
+        def prefetch(_params):
+            try:
+                self._search_context_page(dict(_params, prefetch=False))
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"[search context] prefetch index_set({self.index_set_id}) {_params} failed: {e}")
+
+        # 预取线程常驻进程, 任务结束后需清理线程变量
+        context_prefetch_executor.submit(
+            run_in_task_context, executor_wrap, FuncThread(prefetch, params, "prefetch", {})
+        )
+
+    def _get_context_window_cache_key(self, indices: str, order: str, start: int) -> str:
+        anchor = [
+            self.index_set_id,
+            indices,
+            self.gseindex,
+            self.gseIndex,
+            self.ip,
+            self.serverIp,
+            self.path,
+            self.container_id,
+            self.logfile,
+            order,
+            abs(start),
+            self.size,
+        ]
+        return "search_context_window_" + hashlib.md5(json.dumps(anchor).encode()).hexdigest()
+
+    def _get_context_body(self, order, start=None):
+        start = self.start if start is None else start
         if self.scenario_id == Scenario.BKDATA:
             return DslBkDataCreateSearchContextBody(
                 size=self.size,
-                start=self.start,
+                start=start,
                 gseindex=self.gseindex,
                 path=self.path,
                 ip=self.ip,
@@ -877,7 +1172,7 @@ class SearchHandler(object):
         if self.scenario_id == Scenario.LOG:
             return DslBkDataCreateSearchContextBodyScenarioLog(
                 size=self.size,
-                start=self.start,
+                start=start,
                 gseIndex=self.gseIndex,
                 path=self.path,
                 serverIp=self.serverIp,
@@ -938,39 +1233,6 @@ class SearchHandler(object):
             )
             return result
 
-    def _init_indices_str(self, index_set_id: int) -> str:
-        tmp_index_obj: LogIndexSet = LogIndexSet.objects.filter(index_set_id=index_set_id).first()
-        if tmp_index_obj:
-            self.scenario_id = tmp_index_obj.scenario_id
-            self.storage_cluster_id = tmp_index_obj.storage_cluster_id
-            index_set_data_obj_list: list = tmp_index_obj.get_indexes(has_applied=True)
-            if len(index_set_data_obj_list) > 0:
-                index_list: list = [x.get("result_table_id", None) for x in index_set_data_obj_list]
-                return ",".join(index_list)
-            raise BaseSearchIndexSetDataDoseNotExists(
-                BaseSearchIndexSetDataDoseNotExists.MESSAGE.format(
-                    index_set_id=str(index_set_id) + "_" + tmp_index_obj.index_set_name
-                )
-            )
-        raise BaseSearchIndexSetException(BaseSearchIndexSetException.MESSAGE.format(index_set_id=index_set_id))
-
-    def _init_time_field(self, index_set_id: int, scenario_id: str) -> tuple:
-        # get timestamp field
-        if scenario_id in [Scenario.BKDATA, Scenario.LOG]:
-            return "dtEventTimeStamp", TimeFieldTypeEnum.DATE.value, TimeFieldUnitEnum.SECOND.value
-        else:
-            log_index_set_obj = LogIndexSet.objects.filter(index_set_id=index_set_id).first()
-            time_field = log_index_set_obj.time_field
-            time_field_type = log_index_set_obj.time_field_type
-            time_field_unit = log_index_set_obj.time_field_unit
-            if time_field:
-                return time_field, time_field_type, time_field_unit
-            index_set_obj: LogIndexSetData = LogIndexSetData.objects.filter(index_set_id=index_set_id).first()
-            if not index_set_obj:
-                raise BaseSearchIndexSetException(BaseSearchIndexSetException.MESSAGE.format(index_set_id=index_set_id))
-            time_field = index_set_obj.time_field
-            return time_field, TimeFieldTypeEnum.DATE.value, TimeFieldUnitEnum.SECOND.value
-
     def _init_sort(self) -> list:
         sort_list = SearchSortBuilder.sort_list(**self.search_dict)
         return sort_list
@@ -979,18 +1241,23 @@ class SearchHandler(object):
     def _init_filter(self):
 
         new_attrs: dict = self._combine_addition_host_scope(self.search_dict)
-        mapping_handlers = MappingHandlers(
-            index_set_id=self.index_set_id,
-            indices=self.indices,
-            scenario_id=self.scenario_id,
-            storage_cluster_id=self.storage_cluster_id,
+        # 上下文已加载mapping时直接使用其中的nested字段
+        nested_checker = (
+            self.context
+            if self.context.has_mapping
+            else MappingHandlers(
+                index_set_id=self.index_set_id,
+                indices=self.indices,
+                scenario_id=self.scenario_id,
+                storage_cluster_id=self.storage_cluster_id,
+            )
         )
         filter_list: list = new_attrs.get("addition", [])
         new_filter_list: list = []
         for item in filter_list:
             field: str = item.get("key") if item.get("key") else item.get("field")
             _type = "field"
-            if mapping_handlers.is_nested_field(field):
+            if nested_checker.is_nested_field(field):
                 _type = FieldDataTypeEnum.NESTED.value
             value = item.get("value")
             operator: str = item.get("method") if item.get("method") else item.get("operator")
@@ -1108,7 +1375,16 @@ class SearchHandler(object):
         }
         return highlight
 
-    def _deal_query_result(self, result_dict: dict) -> dict:
+    def _deal_query_result(
+        self, result_dict: dict, need_list: bool = True, need_origin_log: bool = True, need_fields: bool = False
+    ) -> dict:
+        """
+        单次遍历处理检索结果
+        origin_log_list 直接引用原始 _source, list 为在其上浅拷贝并补充 index、高亮的展示视图
+        @param need_list: 是否生成展示用的日志列表
+        @param need_origin_log: 是否生成原始日志列表
+        @param need_fields: 是否在遍历时同步统计字段最大长度, 结果保存在self.field
+        """
         result: dict = {
             "aggregations": result_dict.get("aggregations", {}),
         }
@@ -1125,17 +1401,19 @@ class SearchHandler(object):
             return result
         # hit data
         for hit in result_dict["hits"]["hits"]:
-            log = hit["_source"]
-            origin_log = copy.deepcopy(log)
-            origin_log_list.append(origin_log)
-            _index = hit["_index"]
-            log.update({"index": _index})
-            if "highlight" not in hit:
-                log_list.append(log)
+            origin_log = hit["_source"]
+            if need_origin_log:
+                origin_log_list.append(origin_log)
+            if not need_list and not need_fields:
                 continue
-            for key in hit["highlight"]:
-                log[key] = "".join(hit["highlight"][key])
-            log_list.append(log)
+            log = dict(origin_log)
+            log["index"] = hit["_index"]
+            for key, value in hit.get("highlight", {}).items():
+                log[key] = "".join(value)
+            if need_list:
+                log_list.append(log)
+            if need_fields:
+                self._update_fields_length(log)
 
         result.update(
             {
@@ -1152,48 +1430,23 @@ class SearchHandler(object):
 
     def _analyze_field_length(self, log_list: List[Dict[str, Any]]):
         for item in log_list:
-
-            def get_filed_and_get_length(_item: dict, father: str = ""):
-                for key in _item:
-                    _key: str = ""
-                    if isinstance(_item[key], dict):
-                        get_filed_and_get_length(_item[key], key)
-                    else:
-                        if father:
-                            _key = "{}.{}".format(father, key)
-                        else:
-                            _key = "%s" % key
-                    if _key:
-                        self._update_result_fields(_key, _item[key])
-
-            get_filed_and_get_length(item)
+            self._update_fields_length(item)
         return self.field
 
-    def _update_result_fields(self, _key: str, _item: Any):
-        max_len_dict_obj: max_len_dict = self.field.get(_key)
-        if max_len_dict_obj:
-            # modify
-            _len: int = max_len_dict_obj.get("max_length")
-            try:
-                new_len: int = len(str(_item))
-            except BaseSearchResultAnalyzeException:
-                new_len: int = 16
-            if new_len >= _len:
-                if new_len > len(_key):
-                    max_len_dict_obj.update({"max_length": new_len})
-                else:
-                    max_len_dict_obj.update({"max_length": len(_key)})
-            return
-        # insert
-        try:
-            new_len: int = len(str(_item))
-        except BaseSearchResultAnalyzeException:
-            new_len: int = 16
-
-        if new_len > len(_key):
-            self.field.update({_key: {"max_length": new_len}})
-        else:
-            self.field.update({_key: {"max_length": len(_key)}})
+    def _update_fields_length(self, log: Dict[str, Any], father: str = ""):
+        # 嵌套字段仅拼接上一级字段名, 与前端展示保持一致
+        for key, value in log.items():
+            if isinstance(value, dict):
+                self._update_fields_length(value, key)
+                continue
+            _key = f"{father}.{key}" if father else key
+            value_len = len(value) if isinstance(value, str) else len(str(value))
+            max_length = max(value_len, len(_key))
+            max_len_dict_obj: max_len_dict = self.field.get(_key)
+            if max_len_dict_obj is None:
+                self.field[_key] = {"max_length": max_length}
+            elif max_length > max_len_dict_obj["max_length"]:
+                max_len_dict_obj["max_length"] = max_length
 
     def _analyze_context_result(
         self, log_list: List[Dict[str, Any]], mark_gseindex: int = None, mark_gseIndex: int = None
@@ -1254,35 +1507,20 @@ class SearchHandler(object):
         return {"list": log_list_reversed, "zero_index": _index, "count_start": _count_start}
 
     def _analyze_empty_log(self, log_list: List[Dict[str, Any]]):
-        log_not_empty_list: List[Dict[str, Any]] = []
         for item in log_list:
-            a_item_dict: Dict[str:Any] = item
-
-            # 只要存在log字段则直接显示
-            if "log" in a_item_dict:
-                log_not_empty_list.append(a_item_dict)
+            # 只要存在log字段则直接显示, 否则打平每条记录作为log
+            if "log" not in item:
+                item["log"] = " ".join(self._flatten_log_context(item))
+        return log_list
+
+    @classmethod
+    def _flatten_log_context(cls, log: Dict[str, Any], father: str = ""):
+        for key, value in log.items():
+            if isinstance(value, dict):
+                yield from cls._flatten_log_context(value, key)
                 continue
-            # 递归打平每条记录
-            new_log_context_list: List[str] = []
-
-            def get_field_and_get_context(_item: dict, fater: str = ""):
-                for key in _item:
-                    _key: str = ""
-                    if isinstance(_item[key], dict):
-                        get_field_and_get_context(_item[key], key)
-                    else:
-                        if fater:
-                            _key = "{}.{}".format(fater, key)
-                        else:
-                            _key = "%s" % key
-                    if _key:
-                        a_context: str = "{}: {}".format(_key, _item[key])
-                        new_log_context_list.append(a_context)
-
-            get_field_and_get_context(a_item_dict)
-            a_item_dict.update({"log": " ".join(new_log_context_list)})
-            log_not_empty_list.append(a_item_dict)
-        return log_not_empty_list
+            _key = f"{father}.{key}" if father else key
+            yield f"{_key}: {value}"
 
     def _get_addition_host(self, bk_biz_id, target_node_type: str, target_nodes: list) -> list:
         if target_node_type == TargetNodeTypeEnum.INSTANCE.value:
@@ -1385,15 +1623,12 @@ class SearchHandler(object):
         }
         return addition_return_value.get(operator, lambda: value)()
 
-    def _set_time_filed_type(self, time_field: str, fields_from_es: list):
-        if not fields_from_es:
+    def _set_time_filed_type(self):
+        if not self.context.has_es_fields:
             raise SearchNotTimeFieldType()
-
-        for item in fields_from_es:
-            field_name = item["field_name"]
-            if field_name == time_field:
-                return item["field_type"]
-        raise SearchUnKnowTimeFieldType()
+        if self.context.es_time_field_type is None:
+            raise SearchUnKnowTimeFieldType()
+        return self.context.es_time_field_type
 
     def _enable_bcs_manage(self):
         return settings.PAASCC_APIGATEWAY if settings.PAASCC_APIGATEWAY != "" else None
@@ -0,0 +1,334 @@
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from blueapps.utils.unique import uniqid
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler
+from apps.log_search.models import Scenario
+from apps.utils.log import logger
+
+TAIL_STREAM_STATE_KEY = "tail_stream_{stream_key}"
+TAIL_STREAM_LOCK_KEY = "tail_stream_lock_{stream_key}"
+# 上游查询ES的锁超时时间, 防止持锁进程异常退出后日志流无法继续更新
+TAIL_STREAM_LOCK_TIMEOUT = 30
+# 只释放自己持有的锁: 查询超过锁超时时间后锁可能已被其他进程获取, 不能直接删除
+# KEYS[1]: 锁 ARGV[1]: 加锁时写入的token
+TAIL_STREAM_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+# 与 DslBkDataCreateSearchTailBody 保持一致: 首次查询最近5分钟的500条, 之后每次30条
+TAIL_ZERO_SIZE = 500
+TAIL_ZERO_RANGE = 5 * 60 * 1000
+TAIL_PAGE_SIZE = 30
+
+# 各场景游标字段: (时间, gse序号, 行序号)
+CURSOR_FIELDS = {
+    Scenario.BKDATA: ("dtEventTimeStamp", "gseindex", "_iteration_idx"),
+    Scenario.LOG: ("dtEventTimeStamp", "gseIndex", "iterationIndex"),
+}
+
+
+class TailStreamHandler(object):
+    """
+    实时日志推送
+    同一日志流(ip + path 或 container_id + logfile)的所有订阅者共享一个上游轮询:
+    每个轮询间隔内只有抢到锁的请求查询ES, 结果追加到Redis中的共享缓冲区, 其余请求按各自游标从缓冲区读取
+    轮询间隔根据是否有新日志在最小、最大间隔之间自适应调整
+    """
+
+    # 当前进程内正在推送的SSE连接数
+    _stream_connections = 0
+    _stream_lock = threading.Lock()
+
+    def __init__(self, index_set_id: int, search_dict: dict):
+        self.index_set_id = index_set_id
+        self.search_dict = search_dict
+        self.search_dict.update({"search_type_tag": "tail"})
+        self._search_handler: Optional[SearchHandler] = None
+        self.stream_key = self._get_stream_key()
+
+    def poll(self, cursor: str = None, wait: int = None) -> Dict[str, Any]:
+        """
+        长轮询: 返回游标之后的日志, 没有新日志时最多等待wait秒
+        sync worker下等待期间整个进程无法处理其他请求, 最长只等待 TAIL_STREAM_SYNC_LONG_POLL_TIMEOUT 秒
+        @param cursor: 上次返回的游标, 为空时返回最近的日志
+        @param wait: 最长等待时间 单位秒
+        """
+        max_wait = (
+            settings.TAIL_STREAM_LONG_POLL_TIMEOUT
+            if self.is_async_worker()
+            else settings.TAIL_STREAM_SYNC_LONG_POLL_TIMEOUT
+        )
+        wait = max_wait if wait is None else min(wait, max_wait)
+        after = self.parse_cursor(cursor)
+        deadline = time.time() + wait
+        while True:
+            state = cache.get(self.state_key)
+            if state and after is not None and not self._is_covered(state, after):
+                # 游标早于共享缓冲区, 单独补查缺失部分, 查不到时说明中间没有日志, 直接从缓冲区起点继续
+                entries = self._fetch(after)
+                if not entries:
+                    after = state["floor"]
+                    continue
+            else:
+                entries = self._read(state, after)
+                if not entries and self._is_due(state):
+                    state = self._refresh()
+                    entries = self._read(state, after)
+            if entries or time.time() >= deadline:
+                return self._to_result(entries, after, state)
+            time.sleep(max(min(settings.TAIL_STREAM_WAIT_STEP, deadline - time.time()), 0))
+
+    def stream(self, cursor: str = None) -> Iterator[str]:
+        """
+        SSE: 持续推送游标之后的日志, 事件id为游标, 客户端重连时通过Last-Event-ID断点续传
+        每个连接会一直占用处理请求的worker, 单次连接时长需小于gunicorn的worker超时时间,
+        只在异步worker下开启, sync worker或进程内连接数达到上限时推送busy事件后断开, 客户端应改用长轮询
+        """
+        if not self.is_async_worker() or not self._acquire_stream():
+            yield f"retry: {settings.TAIL_STREAM_SSE_RETRY}\nevent: busy\ndata: {{}}\n\n"
+            return
+        try:
+            deadline = time.time() + settings.TAIL_STREAM_SSE_MAX_DURATION
+            while time.time() < deadline:
+                wait = min(settings.TAIL_STREAM_LONG_POLL_TIMEOUT, max(deadline - time.time(), 0))
+                result = self.poll(cursor, wait=wait)
+                if not result["list"]:
+                    # 保持连接
+                    yield ": keepalive\n\n"
+                    continue
+                cursor = result["cursor"]
+                yield f"id: {cursor}\nevent: log\ndata: {json.dumps(result)}\n\n"
+        finally:
+            self._release_stream()
+
+    @staticmethod
+    def is_async_worker() -> bool:
+        return settings.GUNICORN_WORKER_CLASS in settings.ASYNC_WORKER_CLASSES
+
+    @classmethod
+    def _acquire_stream(cls) -> bool:
+        with cls._stream_lock:
+            if cls._stream_connections >= settings.TAIL_STREAM_SSE_MAX_CONNECTIONS:
+                return False
+            cls._stream_connections += 1
+            return True
+
+    @classmethod
+    def _release_stream(cls):
+        with cls._stream_lock:
+            cls._stream_connections -= 1
+
+    @property
+    def state_key(self) -> str:
+        return TAIL_STREAM_STATE_KEY.format(stream_key=self.stream_key)
+
+    @property
+    def lock_key(self) -> str:
+        return TAIL_STREAM_LOCK_KEY.format(stream_key=self.stream_key)
+
+    @property
+    def redis_lock_key(self) -> str:
+        # 直接操作redis时需自行加上应用前缀
+        return f"{settings.APP_CODE}_{self.lock_key}"
+
+    @property
+    def search_handler(self) -> SearchHandler:
+        # 只有作为上游轮询时才需要构建检索
+        if self._search_handler is None:
+            self._search_handler = SearchHandler(self.index_set_id, self.search_dict)
+        return self._search_handler
+
+    @staticmethod
+    def parse_cursor(cursor: Optional[str]) -> Optional[List[int]]:
+        if not cursor:
+            return None
+        try:
+            return [int(item) for item in cursor.split("_")]
+        except ValueError:
+            return None
+
+    @staticmethod
+    def format_cursor(cursor: Optional[List[int]]) -> str:
+        if not cursor:
+            return ""
+        return "_".join(str(item) for item in cursor)
+
+    def _get_stream_key(self) -> str:
+        if self.search_dict.get("container_id") and self.search_dict.get("logfile"):
+            source = ["container", self.search_dict["container_id"], self.search_dict["logfile"]]
+        else:
+            ip = self.search_dict.get("serverIp") or self.search_dict.get("ip", "")
+            source = ["host", ip, self.search_dict.get("path", "")]
+        return hashlib.md5(json.dumps([self.index_set_id] + source).encode()).hexdigest()
+
+    def _refresh(self) -> Optional[Dict[str, Any]]:
+        """
+        作为上游轮询查询ES并更新共享缓冲区, 未抢到锁时直接返回当前缓冲区
+        """
+        token = self._acquire_lock()
+        if not token:
+            return cache.get(self.state_key)
+        try:
+            state = cache.get(self.state_key) or {"entries": [], "cursor": None, "floor": None, "interval": 0}
+            now = time.time()
+            if state["cursor"] is None:
+                entries = self._fetch(None)
+                # 最近5分钟未被截断时, 缓冲区覆盖该时间段之后的全部日志
+                if len(entries) < TAIL_ZERO_SIZE:
+                    state["floor"] = [int(now * 1000) - TAIL_ZERO_RANGE, 0, 0]
+                else:
+                    state["floor"] = entries[0]["cursor"]
+                full_page = False
+            else:
+                entries = self._fetch(state["cursor"])
+                full_page = len(entries) >= TAIL_PAGE_SIZE
+
+            if entries:
+                state["entries"].extend(entries)
+                state["cursor"] = entries[-1]["cursor"]
+                overflow = len(state["entries"]) - settings.TAIL_STREAM_BUFFER_SIZE
+                if overflow > 0:
+                    state["floor"] = state["entries"][overflow - 1]["cursor"]
+                    state["entries"] = state["entries"][overflow:]
+                # 一页取满说明还有积压, 立即继续拉取
+                state["interval"] = 0 if full_page else settings.TAIL_STREAM_MIN_INTERVAL
+            else:
+                state["interval"] = min(
+                    max(state["interval"] * 2, settings.TAIL_STREAM_MIN_INTERVAL), settings.TAIL_STREAM_MAX_INTERVAL
+                )
+            state["polled_at"] = now
+            cache.set(self.state_key, state, settings.TAIL_STREAM_TTL)
+            return state
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception(f"[tail stream] refresh index_set({self.index_set_id}) stream failed: {e}")
+            raise
+        finally:
+            self._release_lock(token)
+
+    def _acquire_lock(self) -> Optional[str]:
+        """
+        获取上游轮询锁, 成功时返回锁的token
+        """
+        token = uniqid()
+        if settings.USE_REDIS:
+            locked = get_redis_connection("default").set(
+                self.redis_lock_key, token, nx=True, ex=TAIL_STREAM_LOCK_TIMEOUT
+            )
+        else:
+            locked = cache.add(self.lock_key, token, TAIL_STREAM_LOCK_TIMEOUT)
+        return token if locked else None
+
+    def _release_lock(self, token: str):
+        if settings.USE_REDIS:
+            try:
+                unlock = get_redis_connection("default").register_script(TAIL_STREAM_UNLOCK_SCRIPT)
+                unlock(keys=[self.redis_lock_key], args=[token])
+            except RedisError as e:
+                # 释放失败时等待锁超时
+                logger.warning(f"[tail stream] release lock({self.redis_lock_key}) failed: {e}")
+            return
+        # 非redis缓存仅用于单机部署, 先比较再删除
+        if cache.get(self.lock_key) == token:
+            cache.delete(self.lock_key)
+
+    def _fetch(self, after: Optional[List[int]]) -> List[Dict[str, Any]]:
+        """
+        查询ES中游标之后的日志, 游标为空时查询最近的日志
+        """
+        handler = self.search_handler
+        fields = CURSOR_FIELDS.get(handler.scenario_id)
+        if not fields:
+            return []
+        handler.start = 0
+        handler.zero = after is None
+        if after is not None:
+            # 同一gse序号下可能存在多行, 从上一个序号开始查询后再按游标过滤
+            gse_index = after[1] - 1
+            if handler.scenario_id == Scenario.BKDATA:
+                handler.gseindex = gse_index
+            else:
+                handler.gseIndex = gse_index
+
+        result = handler.search_tail_f()
+        entries = []
+        for log, origin_log in zip(result["list"], result["origin_log_list"]):
+            cursor = self._get_cursor(origin_log, fields)
+            if after is not None and cursor <= after:
+                continue
+            entries.append({"cursor": cursor, "log": log, "origin_log": origin_log})
+        return entries
+
+    @staticmethod
+    def _get_cursor(log: Dict[str, Any], fields: tuple) -> List[int]:
+        cursor = []
+        for field in fields:
+            try:
+                cursor.append(int(log.get(field) or 0))
+            except (TypeError, ValueError):
+                cursor.append(0)
+        return cursor
+
+    @staticmethod
+    def _read(state: Optional[Dict[str, Any]], after: Optional[List[int]]) -> List[Dict[str, Any]]:
+        if not state:
+            return []
+        if after is None:
+            return state["entries"]
+        return [entry for entry in state["entries"] if entry["cursor"] > after]
+
+    @staticmethod
+    def _is_covered(state: Dict[str, Any], after: List[int]) -> bool:
+        return state["floor"] is not None and after >= state["floor"]
+
+    @staticmethod
+    def _is_due(state: Optional[Dict[str, Any]]) -> bool:
+        if not state:
+            return True
+        return time.time() - state["polled_at"] >= state["interval"]
+
+    def _to_result(
+        self, entries: List[Dict[str, Any]], after: Optional[List[int]], state: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        if entries:
+            cursor = entries[-1]["cursor"]
+        elif after is not None:
+            cursor = after
+        else:
+            # 首次订阅暂无日志时从缓冲区当前位置开始
+            cursor = (state or {}).get("cursor") or (state or {}).get("floor")
+        return {
+            "total": len(entries),
+            "list": [entry["log"] for entry in entries],
+            "origin_log_list": [entry["origin_log"] for entry in entries],
+            "cursor": self.format_cursor(cursor),
+            "interval": (state or {}).get("interval", settings.TAIL_STREAM_MIN_INTERVAL),
+        }
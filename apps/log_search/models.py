@@ -20,8 +20,10 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import os
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.db.transaction import atomic
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django.utils.html import format_html
 from django_jsonfield_backport.models import JSONField
@@ -827,3 +829,22 @@ class UserMetaConf(models.Model):
         verbose_name = _("用户元配置")
         verbose_name_plural = _("44_用户元配置")
         unique_together = (("username", "type"),)
+
+
+@receiver(post_save, sender=LogIndexSet)
+@receiver(post_delete, sender=LogIndexSet)
+@receiver(post_save, sender=LogIndexSetData)
+@receiver(post_delete, sender=LogIndexSetData)
+def refresh_index_set_search_context(sender, instance, update_fields=None, **kwargs):
+    """
+    索引集或索引变更后使检索上下文缓存失效
+    """
+    from apps.log_search.handlers.search.search_context import IndexSetSearchContext
+
+    # 字段快照不影响检索上下文
+    if update_fields and set(update_fields) <= {"fields_snapshot"}:
+        return
+    index_set_id = instance.index_set_id
+    # 当前进程立即失效，事务提交后再通知其他进程，避免其他进程读到未提交前的数据
+    IndexSetSearchContext.invalidate(index_set_id, notify=False)
+    transaction.on_commit(lambda: IndexSetSearchContext.invalidate(index_set_id))
@@ -25,6 +25,7 @@ import datetime
 import arrow
 
 from dateutil.parser import parse
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
@@ -152,6 +153,8 @@ class SearchAttrSerializer(serializers.Serializer):
     time_range = serializers.CharField(required=False, default=None)
 
     keyword = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    # 普通关键字默认按全文检索字段匹配, 为True时按 *keyword* 通配匹配
+    keyword_wildcard = serializers.BooleanField(required=False, default=False)
     begin = serializers.IntegerField(required=False, default=0)
     size = serializers.IntegerField(required=False, default=10)
 
@@ -226,6 +229,8 @@ class SearchUserIndexSetConfigSerializer(serializers.Serializer):
 
 class SearchExportSerializer(serializers.Serializer):
     export_dict = serializers.CharField(required=False, allow_blank=False, allow_null=False)
+    is_stream = serializers.BooleanField(label=_("是否流式导出"), required=False, default=False)
+    is_gzip = serializers.BooleanField(label=_("是否gzip压缩"), required=False, default=False)
 
     def validate(self, attrs):
         super().validate(attrs)
@@ -245,9 +250,26 @@ class SearchExportSerializer(serializers.Serializer):
         return attrs
 
 
+class TailStreamSerializer(serializers.Serializer):
+    ip = serializers.CharField(label=_("IP"), required=False, allow_blank=True)
+    serverIp = serializers.CharField(label=_("IP"), required=False, allow_blank=True)
+    path = serializers.CharField(label=_("日志路径"), required=False, allow_blank=True)
+    container_id = serializers.CharField(label=_("容器ID"), required=False, allow_blank=True)
+    logfile = serializers.CharField(label=_("容器日志文件"), required=False, allow_blank=True)
+    cursor = serializers.CharField(label=_("游标"), required=False, allow_blank=True, default="")
+    wait = serializers.IntegerField(label=_("最长等待时间"), required=False, min_value=0, default=None)
+
+    def validate(self, attrs):
+        super().validate(attrs)
+        if attrs["wait"] is not None:
+            attrs["wait"] = min(attrs["wait"], settings.TAIL_STREAM_LONG_POLL_TIMEOUT)
+        return attrs
+
+
 class SearchAsyncExportSerializer(serializers.Serializer):
     bk_biz_id = serializers.IntegerField(label=_("业务id"), required=True)
     keyword = serializers.CharField(label=_("搜索关键字"), required=True)
+    keyword_wildcard = serializers.BooleanField(label=_("关键字通配匹配"), required=False, default=False)
     time_range = serializers.CharField(label=_("时间范围"), required=False)
     start_time = serializers.CharField(label=_("起始时间"), required=True)
     end_time = serializers.CharField(label=_("结束时间"), required=True)
@@ -18,9 +18,14 @@ WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import os
-import tarfile
+import gzip
+import heapq
 import json
+import inspect
+import queue
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import pytz
 import arrow
@@ -33,7 +38,6 @@ from celery.task import task, periodic_task
 
 from apps.constants import RemoteStorageType
 from apps.log_search.constants import (
-    ASYNC_DIR,
     FEATURE_ASYNC_EXPORT_COMMON,
     ASYNC_EXPORT_EMAIL_TEMPLATE,
     ASYNC_EXPORT_FILE_EXPIRED_DAYS,
@@ -61,6 +65,7 @@ def async_export(
     url_path: str,
     search_url_path: str,
     language: str,
+    total: int = None,
 ):
     """
     异步导出任务
@@ -70,14 +75,19 @@ def async_export(
     @param url_path {Str}
     @param search_url_path {Str}
     @param language {Str}
+    @param total {Int} 检索命中总数
     """
     random_hash = get_random_string(length=10)
     time_now = arrow.now().format("YYYYMMDDHHmmss")
     file_name = f"{ASYNC_APP_CODE}_{search_handler.index_set_id}_{time_now}_{random_hash}"
-    tar_file_name = f"{file_name}.tar.gz"
+    package_name = f"{file_name}.gz"
     async_task = AsyncTask.objects.filter(id=async_task_id).first()
     async_export_util = AsyncExportUtils(
-        search_handler=search_handler, sorted_fields=sorted_fields, file_name=file_name, tar_file_name=tar_file_name
+        search_handler=search_handler,
+        sorted_fields=sorted_fields,
+        file_name=file_name,
+        package_name=package_name,
+        total=total,
     )
     try:
         if not async_task:
@@ -92,17 +102,9 @@ def async_export(
             async_task.save()
             raise
 
-        async_task.file_name = tar_file_name
+        async_task.file_name = package_name
         async_task.file_size = async_export_util.get_file_size()
 
-        try:
-            async_export_util.export_upload()
-        except Exception as e:  # pylint: disable=broad-except
-            async_task.failed_reason = f"export upload error: {e}"
-            logger.error(async_task.failed_reason)
-            async_task.save()
-            raise
-
         try:
             url = async_export_util.generate_download_url(url_path=url_path)
         except Exception as e:  # pylint: disable=broad-except
@@ -140,7 +142,6 @@ def async_export(
 
     async_task.result = True
     async_task.save()
-    async_export_util.clean_package()
 
 
 @periodic_task(run_every=crontab(minute="0", hour="3"))
@@ -168,59 +169,193 @@ def clean_expired_task():
             expired_task.save()
 
 
+class SortValues(object):
+    """
+    按排序方向比较ES返回的sort值, 与ES默认行为一致, 缺失值总是排在最后
+    """
+
+    def __init__(self, values: list, orders: list):
+        self.values = values
+        self.orders = orders
+
+    def __lt__(self, other):
+        for value, other_value, order in zip(self.values, other.values, self.orders):
+            if value == other_value:
+                continue
+            if value is None:
+                return False
+            if other_value is None:
+                return True
+            return value < other_value if order == "asc" else value > other_value
+        return False
+
+
 class AsyncExportUtils(object):
     """
-    async export utils(export_package, export_upload, generate_download_url, send_msg, clean_package)
+    async export utils(export_package, generate_download_url, send_msg)
     """
 
-    def __init__(self, search_handler: SearchHandler, sorted_fields: list, file_name: str, tar_file_name: str):
+    def __init__(
+        self,
+        search_handler: SearchHandler,
+        sorted_fields: list,
+        file_name: str,
+        package_name: str,
+        total: int = None,
+    ):
         """
         @param search_handler: the handler cls to search
         @param sorted_fields: the fields to sort search result
         @param file_name: the export file name
-        @param tar_file_name: the file name which will be tar
+        @param package_name: the gzip package name which will be uploaded
+        @param total: the total hits of search, None if unknown
         """
         self.search_handler = search_handler
+        self.total = total
         self.sorted_fields = sorted_fields
         self.file_name = file_name
-        self.tar_file_name = tar_file_name
-        self.file_path = f"{ASYNC_DIR}/{self.file_name}"
-        self.tar_file_path = f"{ASYNC_DIR}/{self.tar_file_name}"
+        self.package_name = package_name
+        self.package_size = 0
         self.storage = self.init_remote_storage()
         self.notify = self.init_notify_type()
 
     def export_package(self):
         """
-        检索结果文件打包
+        检索结果边拉取边压缩边上传, 不在本地落盘
+        """
+        writer = self.storage.open_writer(file_name=self.package_name)
+        try:
+            with gzip.GzipFile(
+                filename=self.file_name,
+                mode="wb",
+                compresslevel=settings.ASYNC_EXPORT_COMPRESS_LEVEL,
+                fileobj=writer,
+            ) as f:
+                for page in self.iter_result_pages():
+                    # 按页批量写入, 减少压缩流的写入次数
+                    f.write("".join(f"{json.dumps(item)}\n" for item in page).encode("utf-8"))
+        except Exception:  # pylint: disable=broad-except
+            writer.abort()
+            raise
+        writer.close()
+        self.package_size = writer.size
+
+    def iter_result_pages(self):
+        """
+        按页返回原始日志, 总数不超过search_handler.size
         """
-        if not (os.path.exists(ASYNC_DIR) and os.path.isdir(ASYNC_DIR)):
-            os.makedirs(ASYNC_DIR)
+        if self.can_slice():
+            pages = self.sliced_scroll_pages(settings.ASYNC_EXPORT_SCROLL_SLICES)
+        else:
+            pages = self.sequential_pages()
 
+        result_size = 0
+        try:
+            for page in pages:
+                page = page[: self.search_handler.size - result_size]
+                result_size += len(page)
+                yield page
+                if result_size >= self.search_handler.size:
+                    return
+        finally:
+            pages.close()
+
+    def can_slice(self) -> bool:
+        """
+        sliced scroll 需要扫描全部命中结果, 只用于导出全部命中结果的第三方ES场景
+        """
+        return (
+            self.search_handler.scenario_id == Scenario.ES
+            and settings.ASYNC_EXPORT_SCROLL_SLICES > 1
+            and self.total is not None
+            and self.total <= self.search_handler.size
+        )
+
+    def sequential_pages(self):
+        """
+        按排序顺序拉取: 第三方ES使用scroll, 其余场景按排序字段search_after
+        """
         result = self.search_handler.pre_get_result(sorted_fields=self.sorted_fields, size=MAX_RESULT_WINDOW)
-        with open(self.file_path, "a+", encoding="utf-8") as f:
-            result_list = self.search_handler._deal_query_result(result_dict=result).get("origin_log_list")
-            for item in result_list:
-                f.write("%s\n" % json.dumps(item))
-            if self.search_handler.scenario_id == Scenario.ES:
-                generate_result = self.search_handler.scroll_result(result)
-            else:
-                generate_result = self.search_handler.search_after_result(result, self.sorted_fields)
-            self.write_file(f, generate_result)
-
-        with tarfile.open(self.tar_file_path, "w:gz") as tar:
-            tar.add(self.file_path, arcname=self.file_name)
-
-    def export_upload(self):
+        if self.search_handler.scenario_id == Scenario.ES:
+            generate_result = self.search_handler.scroll_result(result)
+        else:
+            generate_result = self.search_handler.search_after_result(result, self.sorted_fields)
+        try:
+            yield [hit["_source"] for hit in result.get("hits", {}).get("hits", [])]
+            for res in generate_result:
+                yield res.get("origin_log_list")
+        finally:
+            if inspect.getgeneratorstate(generate_result) == inspect.GEN_CREATED:
+                # 第一页即导出完成时后续生成器未启动, 需要单独释放scroll上下文
+                self.search_handler.clear_scroll(result.get("_scroll_id"))
+            generate_result.close()
+
+    def sliced_scroll_pages(self, slice_max: int):
         """
-        文件上传
+        并发拉取各个scroll分片, 分片内已按sort_list排序, 再按排序值多路归并, 导出顺序与顺序scroll一致
+        每个分片最多缓冲2页, 内存中最多保留 3 * slice_max 页数据
         """
-        self.storage.export_upload(file_path=self.tar_file_path, file_name=self.tar_file_name)
+        orders = [order for _, order in self.search_handler.sort_list]
+        page_queues = [queue.Queue(maxsize=2) for _ in range(slice_max)]
+        stop_event = threading.Event()
+        slice_done = object()
+
+        def put(page_queue, item):
+            while not stop_event.is_set():
+                try:
+                    page_queue.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        def fetch_slice(slice_id):
+            page_queue = page_queues[slice_id]
+            pages = self.search_handler.sliced_scroll_result(slice_id=slice_id, slice_max=slice_max)
+            try:
+                for page in pages:
+                    if stop_event.is_set():
+                        return
+                    put(page_queue, page)
+            except Exception as e:  # pylint: disable=broad-except
+                put(page_queue, e)
+            finally:
+                pages.close()
+                put(page_queue, slice_done)
+
+        def iter_slice_hits(page_queue):
+            while True:
+                item = page_queue.get()
+                if item is slice_done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+
+        executor = ThreadPoolExecutor(max_workers=slice_max)
+        for slice_id in range(slice_max):
+            executor.submit(fetch_slice, slice_id)
+
+        try:
+            page = []
+            for hit in heapq.merge(
+                *[iter_slice_hits(page_queue) for page_queue in page_queues],
+                key=lambda _hit: SortValues(_hit.get("sort", []), orders),
+            ):
+                page.append(hit["_source"])
+                if len(page) >= MAX_RESULT_WINDOW:
+                    yield page
+                    page = []
+            if page:
+                yield page
+        finally:
+            stop_event.set()
+            executor.shutdown(wait=True)
 
     def generate_download_url(self, url_path: str):
         """
         生成url
         """
-        return self.storage.generate_download_url(url_path=url_path, file_name=self.tar_file_name)
+        return self.storage.generate_download_url(url_path=url_path, file_name=self.package_name)
 
     def send_msg(
         self,
@@ -269,13 +404,6 @@ class AsyncExportUtils(object):
         }
         return title_template_map.get(title_model, title_template_map.get(MsgModel.NORMAL))
 
-    def clean_package(self):
-        """
-        清空产生的临时文件
-        """
-        os.remove(self.file_path)
-        os.remove(self.tar_file_path)
-
     @classmethod
     def init_remote_storage(cls):
         toggle = FeatureToggleObject.toggle(FEATURE_ASYNC_EXPORT_COMMON).feature_config
@@ -295,7 +423,7 @@ class AsyncExportUtils(object):
         """
         获取文件大小 单位：m，保留小数2位
         """
-        return round(os.path.getsize(self.tar_file_path) / float(1024 * 1024), 2)
+        return round(self.package_size / float(1024 * 1024), 2)
 
     @classmethod
     def init_notify_type(cls):
@@ -304,13 +432,3 @@ class AsyncExportUtils(object):
         )
 
         return NotifyType.get_instance(notify_type=notify_type)()
-
-    @classmethod
-    def write_file(cls, f, result):
-        """
-        将对应数据写到文件中
-        """
-        for res in result:
-            origin_result_list = res.get("origin_log_list")
-            for item in origin_result_list:
-                f.write("%s\n" % json.dumps(item))
@@ -25,6 +25,7 @@ from celery.task import periodic_task
 from apps.utils.log import logger
 from apps.utils.bk_data_auth import BkDataAuthHandler
 from apps.log_search.models import LogIndexSetData, LogIndexSet, Scenario
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
 from apps.log_databus.models import BKDataClean
 
 
@@ -44,14 +45,20 @@ def sync_auth_status():
     )
 
     # 获取状态为"审批中"的的索引集，并将token有权限的RT的状态置为NORMAL
-    updated_count = LogIndexSetData.objects.filter(
+    pending_index_set_data = LogIndexSetData.objects.filter(
         index_set_id__in=bkdata_index_set_ids,
         apply_status=LogIndexSetData.Status.PENDING,
         result_table_id__in=authorized_rt_list,
-    ).update(
+    )
+    changed_index_set_ids = set(pending_index_set_data.values_list("index_set_id", flat=True))
+    updated_count = pending_index_set_data.update(
         apply_status=LogIndexSetData.Status.NORMAL,
     )
 
+    # update 不触发 post_save 信号, 需要手动使检索上下文失效
+    for index_set_id in changed_index_set_ids:
+        IndexSetSearchContext.invalidate(index_set_id)
+
     logger.info(f"[sync_auth_status] {updated_count} rows of apply_status changed to NORMAL")
 
     update_bkdata_clean_count = BKDataClean.objects.filter(result_table_id__in=authorized_rt_list).update(
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from celery.schedules import crontab
+from celery.task import periodic_task
+from django.conf import settings
+
+from apps.log_esquery.esquery.builder.index_catalog import IndexCatalog
+from apps.log_search.models import LogIndexSet, LogIndexSetData, Scenario
+from apps.utils.lock import share_lock
+from apps.utils.log import logger
+
+
+@periodic_task(run_every=crontab(minute="*/10"))
+@share_lock()
+def sync_index_catalog():
+    """
+    按存储集群刷新采集项索引目录
+    """
+    if not settings.INDEX_CATALOG_ENABLED:
+        return
+    logger.info("[sync_index_catalog] start")
+    index_set_cluster = dict(
+        LogIndexSet.objects.filter(scenario_id=Scenario.LOG, is_active=True)
+        .exclude(storage_cluster_id=None)
+        .values_list("index_set_id", "storage_cluster_id")
+    )
+    cluster_result_tables = defaultdict(set)
+    for index_set_id, result_table_id in LogIndexSetData.objects.filter(
+        index_set_id__in=list(index_set_cluster.keys())
+    ).values_list("index_set_id", "result_table_id"):
+        cluster_result_tables[index_set_cluster[index_set_id]].add(result_table_id)
+
+    def refresh_cluster(item):
+        storage_cluster_id, result_table_ids = item
+        IndexCatalog.refresh_cluster(storage_cluster_id, sorted(result_table_ids))
+        logger.info(f"[sync_index_catalog] cluster({storage_cluster_id}) refreshed {len(result_table_ids)} tables")
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(refresh_cluster, cluster_result_tables.items()))
+    logger.info("[sync_index_catalog] end")
@@ -17,36 +17,92 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from celery.schedules import crontab
 from celery.task import periodic_task, task
+from django.conf import settings
 
+from apps.log_search.handlers.search.mapping_handlers import MappingHandlers
 from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler
 from apps.utils.lock import share_lock
 from apps.utils.log import logger
 from apps.exceptions import ApiResultError
 from apps.log_search.constants import BkDataErrorCode
-from apps.log_search.models import LogIndexSet
+from apps.log_search.models import LogIndexSet, Scenario
 
 
 @periodic_task(run_every=crontab(minute="*/10"))
 @share_lock()
 def sync_index_set_mapping_cache():
+    """
+    刷新索引集字段缓存
+    1. 按(场景, 集群)对结果表去重后分批拉取mapping, 多个索引集共用的结果表只拉取一次
+    2. mapping按内容计算指纹, 指纹未变化的索引集不重新生成字段列表
+    """
     logger.info("[sync_index_set_mapping_cache] start")
     index_set_id_list = LogIndexSet.objects.filter(is_active=True).values_list("index_set_id", flat=True)
 
-    def sync_mapping_cache(index_set_id):
-        logger.info("[sync_index_set_mapping_cache] index_set({}) start".format(index_set_id))
+    def build_mapping_handlers(index_set_id):
         try:
-            SearchHandler(index_set_id=index_set_id, search_dict={}).fields()
+            search_handler = SearchHandler(index_set_id=index_set_id, search_dict={}, pre_check_enable=False)
         except Exception as e:  # pylint: disable=broad-except
-            logger.exception("[sync_index_set_mapping_cache] index_set({}) sync failed: {}".format(index_set_id, e))
-            return
-        logger.info("[sync_index_set_mapping_cache] index_set({}) sync success".format(index_set_id))
+            logger.exception("[sync_index_set_mapping_cache] index_set({}) init failed: {}".format(index_set_id, e))
+            return None
+        return MappingHandlers(
+            search_handler.indices,
+            index_set_id,
+            search_handler.scenario_id,
+            search_handler.storage_cluster_id,
+            search_handler.time_field,
+        )
 
     with ThreadPoolExecutor() as executor:
-        executor.map(sync_mapping_cache, index_set_id_list)
-    logger.info("[sync_index_set_mapping_cache] end")
+        mapping_handlers_list = [
+            handlers for handlers in executor.map(build_mapping_handlers, index_set_id_list) if handlers
+        ]
+
+    # 相同场景及集群下的结果表合并拉取, 第三方ES按索引集整体拉取
+    batches = []
+    grouped_keys = defaultdict(dict)
+    for handlers in mapping_handlers_list:
+        for key in handlers.mapping_keys():
+            grouped_keys[(handlers.scenario_id, handlers.storage_cluster_id)].setdefault(key, handlers)
+    for (scenario_id, __), key_handlers in grouped_keys.items():
+        keys = list(key_handlers.keys())
+        batch_size = 1 if scenario_id == Scenario.ES else settings.MAPPING_SYNC_BATCH_SIZE
+        for start in range(0, len(keys), batch_size):
+            batch_keys = keys[start : start + batch_size]
+            batches.append((key_handlers[batch_keys[0]], batch_keys))
+
+    def refresh_mapping(batch):
+        handlers, keys = batch
+        try:
+            return len(handlers.refresh_property_group(keys)[1])
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("[sync_index_set_mapping_cache] refresh mapping({}) failed: {}".format(keys, e))
+            return 0
+
+    def sync_fields_cache(handlers):
+        try:
+            handlers.get_index_fields()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception(
+                "[sync_index_set_mapping_cache] index_set({}) sync failed: {}".format(handlers.index_set_id, e)
+            )
+
+    with ThreadPoolExecutor() as executor:
+        changed_count = sum(executor.map(refresh_mapping, batches))
+        # 字段列表按mapping指纹缓存, 指纹未变化时直接命中
+        list(executor.map(sync_fields_cache, mapping_handlers_list))
+
+    total_count = sum(len(keys) for __, keys in batches)
+    logger.info(
+        "[sync_index_set_mapping_cache] end, index_set: {}, mapping: {}, changed: {}".format(
+            len(mapping_handlers_list), total_count, changed_count
+        )
+    )
+    return {"index_set": len(mapping_handlers_list), "mapping": total_count, "changed": changed_count}
 
 
 @periodic_task(run_every=crontab(minute="0", hour="2"))
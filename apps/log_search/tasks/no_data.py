@@ -22,7 +22,9 @@ def no_data_check():
 
 
 def index_set_no_data_check(index_set_id):
-    result = SearchHandler(index_set_id=index_set_id, search_dict={"time_range": "1d"}).search(search_type=None)
+    result = SearchHandler(index_set_id=index_set_id, search_dict={"time_range": "1d"}).search(
+        search_type=None, need_list=False, need_origin_log=False, need_fields=False
+    )
     if result["total"] == 0:
         LogIndexSet.set_tag(index_set_id, InnerTag.NO_DATA.value)
         logger.warning(f"[no data check] index_set_id => [{index_set_id}] no have data")
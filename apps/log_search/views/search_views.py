@@ -23,7 +23,7 @@ from urllib import parse
 
 from six import StringIO
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 from rest_framework.response import Response
@@ -38,6 +38,7 @@ from apps.iam.handlers.drf import (
 from apps.log_search.exceptions import BaseSearchIndexSetException
 from apps.log_search.handlers.search.async_export_handlers import AsyncExportHandlers
 from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler as SearchHandlerEsquery
+from apps.log_search.handlers.search.tail_stream import TailStreamHandler
 from apps.log_search.handlers.index_set import IndexSetHandler
 from apps.log_search.models import LogIndexSet
 from apps.log_search.permission import Permission
@@ -49,6 +50,7 @@ from apps.log_search.serializers import (
     SearchIndexSetScopeSerializer,
     BcsWebConsoleSerializer,
     SearchAsyncExportSerializer,
+    TailStreamSerializer,
 )
 from apps.decorators import user_operation_record
 from apps.log_search.constants import (
@@ -82,7 +84,18 @@ class SearchViewSet(APIViewSet):
 
         if self.action in ["operators", "user_search_history"]:
             return []
-        if self.action in ["bizs", "search", "context", "tailf", "export", "fields", "config", "history"]:
+        if self.action in [
+            "bizs",
+            "search",
+            "context",
+            "tailf",
+            "tailf_poll",
+            "tailf_stream",
+            "export",
+            "fields",
+            "config",
+            "history",
+        ]:
             return [InstanceActionPermission([ActionEnum.SEARCH_LOG], ResourceEnum.INDICES)]
         return [ViewBusinessPermission()]
 
@@ -165,6 +178,7 @@ class SearchViewSet(APIViewSet):
         @apiParam {String} end_time 结束时间
         @apiParam {String} time_range 时间标识符符["15m", "30m", "1h", "4h", "12h", "1d", "customized"]
         @apiParam {String} keyword 搜索关键字
+        @apiParam {Boolean} [keyword_wildcard] 普通关键字按 *keyword* 通配匹配, 默认按全文检索字段匹配
         @apiParam {Json} ip IP列表
         @apiParam {Json} addition 搜索条件
         @apiParam {Int} begin 起始位置
@@ -361,6 +375,89 @@ class SearchViewSet(APIViewSet):
         search_handler = SearchHandlerEsquery(index_set_id, data)
         return Response(search_handler.search_tail_f())
 
+    @detail_route(methods=["POST"], url_path="tail_f/poll")
+    def tailf_poll(self, request, index_set_id=None):
+        """
+        @api {post} /search/index_set/$index_set_id/tail_f/poll/ 12_搜索-实时日志长轮询
+        @apiName search_log_tailf_poll
+        @apiGroup 11_Search
+        @apiDescription 同一日志流的订阅者共享上游轮询, 没有新日志时最多等待wait秒后返回;
+        sync worker下最长只等待 TAIL_STREAM_SYNC_LONG_POLL_TIMEOUT 秒
+        @apiParam {String} ip IP
+        @apiParam {String} serverIp IP(LOG场景)
+        @apiParam {String} path 日志路径
+        @apiParam {String} container_id 容器ID
+        @apiParam {String} logfile 容器日志文件
+        @apiParam {String} cursor 上次返回的游标, 为空时返回最近的日志
+        @apiParam {Int} wait 最长等待时间 单位秒
+        @apiParamExample {Json} 请求参数
+        {
+            "ip": "127.0.0.1",
+            "path": "/data/home/user00/log/accountsvrd/accountsvrd_127.0.0.1.error",
+            "cursor": "1534825132000_152358_0"
+        }
+        @apiSuccessExample {json} 成功返回:
+        {
+            "message": "",
+            "code": 0,
+            "data": {
+                "total": 1,
+                "list": [
+                    {
+                        "dtEventTimeStamp": 1534825133000,
+                        "log": "is_cluster</em>-COMMON: ok",
+                        "serverIp": "127.0.0.1",
+                        "gseIndex": 152359,
+                        "iterationIndex": 0,
+                        "path": "/tmp/health_check.log"
+                    }
+                ],
+                "origin_log_list": [],
+                "cursor": "1534825133000_152359_0",
+                "interval": 1
+            },
+            "result": true
+        }
+        """
+        params = self.params_valid(TailStreamSerializer)
+        cursor = params.pop("cursor")
+        wait = params.pop("wait")
+        return Response(TailStreamHandler(int(index_set_id), params).poll(cursor, wait=wait))
+
+    @detail_route(methods=["GET"], url_path="tail_f/stream")
+    def tailf_stream(self, request, index_set_id=None):
+        """
+        @api {get} /search/index_set/$index_set_id/tail_f/stream/ 12_搜索-实时日志推送
+        @apiName search_log_tailf_stream
+        @apiGroup 11_Search
+        @apiDescription Server-Sent Events, 事件id为游标, 断线重连时通过Last-Event-ID续传;
+        单次连接最长 TAIL_STREAM_SSE_MAX_DURATION 秒, 到期断开后客户端自动重连;
+        sync worker下不开启推送, 与进程内连接数达到上限时一样返回busy事件后断开, 客户端应改用 tail_f/poll 长轮询
+        @apiParam {String} ip IP
+        @apiParam {String} serverIp IP(LOG场景)
+        @apiParam {String} path 日志路径
+        @apiParam {String} container_id 容器ID
+        @apiParam {String} logfile 容器日志文件
+        @apiParam {String} cursor 起始游标
+        @apiSuccessExample text/event-stream 成功返回:
+        id: 1534825133000_152359_0
+        event: log
+        data: {"total": 1, "list": [...], "origin_log_list": [...], "cursor": "1534825133000_152359_0"}
+        @apiErrorExample text/event-stream 连接数超过上限:
+        retry: 30000
+        event: busy
+        data: {}
+        """
+        params = self.params_valid(TailStreamSerializer)
+        cursor = params.pop("cursor") or request.META.get("HTTP_LAST_EVENT_ID", "")
+        params.pop("wait")
+        response = StreamingHttpResponse(
+            TailStreamHandler(int(index_set_id), params).stream(cursor), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
     @detail_route(methods=["GET"], url_path="export")
     def export(self, request, index_set_id=None):
         """
@@ -375,6 +472,8 @@ class SearchViewSet(APIViewSet):
         @apiParam {Json} ip IP列表
         @apiParam {Json} addition 搜索条件
         @apiParam {Int} start 起始位置
+        @apiParam {Boolean} [is_stream] 是否流式导出, 按页拉取并边查边写入响应
+        @apiParam {Boolean} [is_gzip] 流式导出时是否gzip压缩
         @apiDescription 直接下载结果
         @apiParamExample {Json} 请求参数
         /api/v1/search/index_set/3/export/
@@ -390,8 +489,8 @@ class SearchViewSet(APIViewSet):
         {"a": "good", "b": {"c": ["d", "e"]}}
         """
 
-        params = self.params_valid(SearchExportSerializer).get("export_dict")
-        data = json.loads(params)
+        params = self.params_valid(SearchExportSerializer)
+        data = json.loads(params["export_dict"])
         index_set_id = int(index_set_id)
 
         tmp_index_obj = LogIndexSet.objects.filter(index_set_id=index_set_id).first()
@@ -405,15 +504,20 @@ class SearchViewSet(APIViewSet):
         else:
             raise BaseSearchIndexSetException(BaseSearchIndexSetException.MESSAGE.format(index_set_id=index_set_id))
 
-        output = StringIO()
         search_handler = SearchHandlerEsquery(index_set_id, data)
-        result = search_handler.search()
-        result_list = result.get("origin_log_list")
-        for item in result_list:
-            output.write(f"{json.dumps(item)}\n")
-        response = HttpResponse(output.getvalue())
-        response["Content-Type"] = "application/x-msdownload"
         file_name = f"bk_log_search_{index}.txt"
+        if params["is_stream"]:
+            response = StreamingHttpResponse(search_handler.export_stream(is_gzip=params["is_gzip"]))
+            if params["is_gzip"]:
+                file_name = f"{file_name}.gz"
+        else:
+            output = StringIO()
+            result = search_handler.search(need_list=False, need_fields=False)
+            result_list = result.get("origin_log_list")
+            for item in result_list:
+                output.write(f"{json.dumps(item)}\n")
+            response = HttpResponse(output.getvalue())
+        response["Content-Type"] = "application/x-msdownload"
         file_name = parse.quote(file_name, encoding="utf8")
         file_name = parse.unquote(file_name, encoding="ISO8859_1")
         response["Content-Disposition"] = 'attachment;filename="{}"'.format(file_name)
@@ -18,7 +18,6 @@ WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 from collections import defaultdict
-from typing import List
 
 import arrow
 
@@ -40,6 +39,8 @@ class LogTrace(Proto):
     SERVICE_NAME_FIELD = "tags.local_service"
     OPERATION_NAME_FIELD = "operationName"
     TRACE_ID_FIELD = "traceID"
+    SPAN_ID_FIELD = "spanID"
+    PARENT_SPAN_ID_FIELD = "parentSpanID"
     TRACES_ADDITIONS = {
         "operation": {"field": "operationName", "method": "is"},
         "service": {"field": "tags.local_service", "method": "is"},
@@ -165,55 +166,6 @@ class LogTrace(Proto):
         result["tree"] = self.result_to_tree(result)
         return result
 
-    @classmethod
-    def result_to_tree(cls, result) -> dict:
-        result_list: list = result.get("list", [])
-        return cls.build_tree(result_list)
-
-    @classmethod
-    def build_tree(cls, nodes):
-        if not nodes:
-            return nodes
-        first_root, *_ = nodes
-        cls.update_node(first_root)
-        nodes.remove(first_root)
-        return cls._build_tree(nodes, first_root)
-
-    @classmethod
-    def _insert_children(cls, childrens: List[dict], nodes):
-        for children in childrens:
-            if "children" not in children:
-                cls.update_node(children)
-
-            child_nodes = [
-                node for node in nodes if node.get("parentSpanID", "parentSpanID") == children.get("spanID", "spanID")
-            ]
-            for c_node in child_nodes:
-                cls.update_node(c_node)
-                children["children"].append(c_node)
-                nodes.remove(c_node)
-            cls._insert_children(children["children"], nodes)
-
-    @classmethod
-    def _build_tree(cls, nodes: List[dict], cur_node: dict):
-        """
-        从当前节点cur_node开始，找出父子关系，然后返回整颗树的根节点
-        """
-        # 找到子节点
-        cls._insert_children([cur_node], nodes)
-
-        # 找到父节点
-        parent_nodes = [
-            node for node in nodes if cur_node.get("parentSpanID", "parentSpanID") == node.get("spanID", "spanID")
-        ]
-        for p_node in parent_nodes:
-            cls.update_node(p_node)
-            p_node["children"].append(cur_node)
-            nodes.remove(p_node)
-
-        # 父节点继续往上查找父父节点，直到root根节点 (这里父节点只会有一个，所以递归遍历第0个即可)
-        return cls._build_tree(nodes, parent_nodes[0]) if parent_nodes else cur_node
-
     @classmethod
     def update_node(cls, child: dict) -> dict:
         child.update(
@@ -236,7 +188,7 @@ class LogTrace(Proto):
     def scatter(self, index_set_id: int, data: dict):
         data.update({"search_type": "trace_scatter"})
         search_handler = SearchHandlerEsquery(index_set_id, data)
-        result: dict = search_handler.search(search_type=None)
+        result: dict = search_handler.search(search_type=None, need_origin_log=False, need_fields=False)
         scatter_list: list = self.result_to_scatter(result)
         return {"scatter": scatter_list}
 
@@ -297,7 +249,7 @@ class LogTrace(Proto):
             "keyword": "*",
             "time_range": "customized",
         }
-        result = SearchHandlerEsquery(index_set_id, search_dict).search()
+        result = SearchHandlerEsquery(index_set_id, search_dict).search(need_origin_log=False, need_fields=False)
         return self._transform_to_jaeger(result.get("list", []))
 
     def trace_detail(self, index_set_id, trace_id):
@@ -310,7 +262,7 @@ class LogTrace(Proto):
             "time_range": "customized",
         }
 
-        result = SearchHandlerEsquery(index_set_id, search_dict).search()
+        result = SearchHandlerEsquery(index_set_id, search_dict).search(need_origin_log=False, need_fields=False)
         return self._transform_to_jaeger(result.get("list", []))
 
     def _transform_to_jaeger(self, spans):
@@ -18,19 +18,24 @@ WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 from collections import defaultdict
+from functools import lru_cache
 from typing import List
 
 import sys
+import json
 import arrow
 import humanize
 import datetime as dt
+from dateutil import tz
 from django.utils.translation import ugettext_lazy as _
 from apps.log_trace.constants import TraceProto
 from apps.log_trace.exceptions import TraceIDNotExistsException
 from apps.log_trace.handlers.proto.proto import Proto
 
+from apps.log_search.constants import MAX_RESULT_WINDOW
 from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler as SearchHandlerEsquery
 from apps.utils.local import get_local_param
+from apps.utils.log import logger
 from apps.utils.thread import MultiExecuteFunc
 
 OTLP_JAEGER_SPAN_KIND = {2: "server", 3: "client", 4: "producer", 5: "consumer", 1: "internal", 0: "unset"}
@@ -43,6 +48,8 @@ class OtlpTrace(Proto):
     SERVICE_NAME_FIELD = "resource.service.name"
     OPERATION_NAME_FIELD = "span_name"
     TRACE_ID_FIELD = "trace_id"
+    SPAN_ID_FIELD = "span_id"
+    PARENT_SPAN_ID_FIELD = "parent_span_id"
     TAGS_FIELD = "attributes"
     TRACES_ADDITIONS = {"operation": "span_name", "service": "resource.service.name"}
     TRACES_ADDITIONS = {
@@ -99,6 +106,9 @@ class OtlpTrace(Proto):
 
     DISPLAY_FIELDS = ["traceID", "operationName", "start_time", "duration"]
 
+    # 批量拉取trace时, 在首次查询span时间范围的基础上前后扩展的秒数
+    BATCH_TRACE_TIME_PADDING = 60 * 60
+
     FIELD_LOG_MAP = {
         "trace_id": "traceID",
         "span_id": "spanID",
@@ -136,56 +146,6 @@ class OtlpTrace(Proto):
         result["tree"] = self.result_to_tree(result)
         return result
 
-    @classmethod
-    def result_to_tree(cls, result) -> dict:
-        result_list: list = result.get("list", [])
-        return cls.build_tree(result_list)
-
-    @classmethod
-    def build_tree(cls, nodes):
-        if not nodes:
-            return nodes
-        first_root, *_ = nodes
-        cls.update_node(first_root)
-        nodes.remove(first_root)
-        return cls._build_tree(nodes, first_root)
-
-    @classmethod
-    def _insert_children(cls, childrens: List[dict], nodes):
-        for children in childrens:
-            if "children" not in children:
-                cls.update_node(children)
-            child_nodes = [
-                node
-                for node in nodes
-                if node.get("parent_span_id", "parent_span_id") == children.get("span_id", "span_id")
-            ]
-            for c_node in child_nodes:
-                cls.update_node(c_node)
-                children["children"].append(c_node)
-                nodes.remove(c_node)
-            cls._insert_children(children["children"], nodes)
-
-    @classmethod
-    def _build_tree(cls, nodes: List[dict], cur_node: dict):
-        """
-        从当前节点cur_node开始，找出父子关系，然后返回整颗树的根节点
-        """
-        # 找到子节点
-        cls._insert_children([cur_node], nodes)
-
-        # 找到父节点
-        parent_nodes = [
-            node for node in nodes if cur_node.get("parent_span_id", "parent_span_id") == node.get("span_id", "span_id")
-        ]
-        for p_node in parent_nodes:
-            cls.update_node(p_node)
-            p_node["children"].append(cur_node)
-            nodes.remove(p_node)
-
-        # 父节点继续往上查找父父节点，直到root根节点 (这里父节点只会有一个，所以递归遍历第0个即可)
-        return cls._build_tree(nodes, parent_nodes[0]) if parent_nodes else cur_node
-
     @classmethod
     def update_node(cls, child: dict) -> dict:
         child.update(
@@ -210,41 +170,103 @@ class OtlpTrace(Proto):
         if not trace_ids:
             return result
 
-        result = self.multi_search_trace(trace_ids, index_set_id)
-        trace_result = {"list": []}
+        spans = self.batch_search_trace(trace_ids, index_set_id, result.get("list", []))
+        trace_data = self._transform_to_jaeger(spans)
+        return {"list": self.map_fields_to_log(trace_data)}
 
-        for search_result in result.values():
-            trace_result["list"].extend(search_result.get("origin_log_list", []))
+    def batch_search_trace(self, trace_ids: List[str], index_set_id: int, first_spans: List[dict]) -> List[dict]:
+        """
+        一次查询拉取本页所有trace的span, 由_transform_to_jaeger在内存中按trace_id分组
+        时间范围取首次查询返回span的最小/最大开始时间, 避免无时间范围时查询全部索引
+        @param trace_ids: 本页的trace_id列表
+        @param index_set_id: 索引集ID
+        @param first_spans: 首次(collapse)查询返回的span
+        """
+        search_dict = {
+            "addition": [
+                {
+                    "key": self.TRACE_ID_FIELD,
+                    "method": "is one of",
+                    "value": ",".join(trace_ids),
+                    "condition": "and",
+                    "type": "field",
+                }
+            ],
+            "begin": 0,
+            "size": MAX_RESULT_WINDOW,
+            "keyword": "*",
+            "time_range": "customized",
+        }
+        start_times = [int(str(span["start_time"])[0:10]) for span in first_spans if span.get("start_time")]
+        if start_times:
+            search_dict.update(
+                {
+                    "start_time": min(start_times) - self.BATCH_TRACE_TIME_PADDING,
+                    "end_time": max(start_times) + self.BATCH_TRACE_TIME_PADDING,
+                }
+            )
+        else:
+            search_dict.update({"use_time_range": False})
 
-        trace_data = self._transform_to_jaeger(trace_result.get("list", []))
-        trace_result["list"] = self.map_fields_to_log(trace_data)
-        return trace_result
+        result = SearchHandlerEsquery(index_set_id, search_dict).search(
+            search_type=None, need_list=False, need_fields=False
+        )
+        spans = result.get("origin_log_list", [])
+        # ES7及以上未开启track_total_hits时总数最多统计到 MAX_RESULT_WINDOW, 取满一页同样视为被截断
+        if result.get("total", 0) > len(spans) or len(spans) >= MAX_RESULT_WINDOW:
+            # span总数超过单次查询上限, 合并查询的结果会截断部分trace, 改为按trace逐个查询
+            logger.info(
+                f"[otlp] index_set({index_set_id}) {result['total']} spans of {len(trace_ids)} traces "
+                f"exceed {len(spans)}, search trace one by one"
+            )
+            spans = self._search_trace_one_by_one(trace_ids, index_set_id, search_dict)
+        if start_times:
+            self._check_time_padding(index_set_id, spans)
+        return spans
 
-    def multi_search_trace(self, trace_ids: List[str], index_set_id):
-        multi_execute = MultiExecuteFunc()
+    def _search_trace_one_by_one(self, trace_ids: List[str], index_set_id: int, search_dict: dict) -> List[dict]:
+        multi_execute_func = MultiExecuteFunc()
         for trace_id in trace_ids:
-
-            def get_trace_search(param):
-                return SearchHandlerEsquery(param["index_set_id"], param["search_body"]).search()
-
-            search_dict = {
-                "use_time_range": False,
-                "addition": [
-                    {
-                        "key": "trace_id",
-                        "method": "is",
-                        "value": trace_id,
-                        "condition": "and",
-                        "type": "field",
-                    }
+            trace_search_dict = dict(
+                search_dict,
+                addition=[
+                    {"key": self.TRACE_ID_FIELD, "method": "is", "value": trace_id, "condition": "and", "type": "field"}
                 ],
-                "begin": 0,
-                "size": 10000,
-                "keyword": "*",
-                "time_range": "customized",
-            }
-            multi_execute.append(trace_id, get_trace_search, {"index_set_id": index_set_id, "search_body": search_dict})
-        return multi_execute.run()
+                size=self.TRACE_SIZE,
+            )
+            multi_execute_func.append(
+                trace_id, self._search_spans, {"index_set_id": index_set_id, "search_dict": trace_search_dict}
+            )
+        results = multi_execute_func.run()
+        spans = []
+        for trace_id in trace_ids:
+            spans.extend(results.get(trace_id, {}).get("origin_log_list", []))
+        return spans
+
+    @staticmethod
+    def _search_spans(params: dict) -> dict:
+        return SearchHandlerEsquery(params["index_set_id"], params["search_dict"]).search(
+            search_type=None, need_list=False, need_fields=False
+        )
+
+    def _check_time_padding(self, index_set_id: int, spans: List[dict]):
+        """
+        时间范围按首次查询的span前后扩展 BATCH_TRACE_TIME_PADDING, 持续时间接近该值的trace可能有span落在范围外
+        """
+        trace_times = defaultdict(list)
+        for span in spans:
+            if span.get("start_time"):
+                trace_times[span["trace_id"]].append(int(str(span["start_time"])[0:10]))
+        long_trace_ids = [
+            trace_id
+            for trace_id, times in trace_times.items()
+            if max(times) - min(times) >= self.BATCH_TRACE_TIME_PADDING
+        ]
+        if long_trace_ids:
+            logger.warning(
+                f"[otlp] index_set({index_set_id}) traces {long_trace_ids} last longer than "
+                f"{self.BATCH_TRACE_TIME_PADDING}s, spans out of the search time range may be missing"
+            )
 
     def map_fields_to_log(self, field_list, is_detail=False):
         return [self.transfer_trace_data(item) for item in field_list]
@@ -290,9 +312,16 @@ class OtlpTrace(Proto):
             return f"{service_name} {candidate_span['operationName']}"
         return ""
 
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _get_tz(time_zone):
+        return tz.gettz(time_zone)
+
     @classmethod
     def format_time(cls, timestamp):
-        return arrow.get(str(timestamp)[0:10]).to(get_local_param("time_zone")).strftime("%Y-%m-%d %H:%M:%S")
+        # 时区对象按名称缓存，避免每个 span 都经 arrow 解析字符串与时区
+        time_zone = cls._get_tz(get_local_param("time_zone"))
+        return dt.datetime.fromtimestamp(int(str(timestamp)[0:10]), time_zone).strftime("%Y-%m-%d %H:%M:%S")
 
     def to_microseconds(self, timestamp):
         return int(str(timestamp)[0:13])
@@ -305,32 +334,25 @@ class OtlpTrace(Proto):
         trace_ids = [trace["trace_id"] for trace in result.get("list", [])]
         if not trace_ids:
             return []
-        result = self.multi_search_trace(trace_ids, index_set_id)
-        trace_result = {"list": []}
-
-        for search_result in result.values():
-            trace_result["list"].extend(search_result.get("origin_log_list", []))
-        return self._transform_to_jaeger(trace_result.get("list", []))
+        spans = self.batch_search_trace(trace_ids, index_set_id, result.get("list", []))
+        return self._transform_to_jaeger(spans)
 
     def _transform_to_jaeger(self, spans):
         jaeger_traces = defaultdict(lambda: {"spans": [], "traceID": ""})
-        resources = defaultdict(list)
+        # 按resource内容索引process, 避免每个span都线性比较已有resource
+        process_ids = defaultdict(dict)
         processes = defaultdict(dict)
         for span in spans:
             trace_id = span["trace_id"]
-            process_id = ""
-            for index, resource in enumerate(resources[trace_id], 1):
-                if span["resource"] == resource:
-                    process_id = f"p{index}"
-                    break
-            if process_id == "":
-                resources[trace_id].append(span["resource"])
-                index = len(resources[trace_id])
-                processes[trace_id][f"p{index}"] = {
+            resource_key = json.dumps(span["resource"], sort_keys=True)
+            process_id = process_ids[trace_id].get(resource_key)
+            if process_id is None:
+                process_id = f"p{len(process_ids[trace_id]) + 1}"
+                process_ids[trace_id][resource_key] = process_id
+                processes[trace_id][process_id] = {
                     "serviceName": span["resource"].get("service.name", "unknown service"),
                     "tags": self._transform_to_tags(span["resource"]),
                 }
-                process_id = f"p{index}"
 
             jaeger_traces[span["trace_id"]]["traceID"] = span["trace_id"]
             jaeger_traces[span["trace_id"]]["spans"].append(
@@ -388,5 +410,5 @@ class OtlpTrace(Proto):
             "keyword": "*",
             "time_range": "customized",
         }
-        result = SearchHandlerEsquery(index_set_id, search_dict).search()
+        result = SearchHandlerEsquery(index_set_id, search_dict).search(need_origin_log=False, need_fields=False)
         return self._transform_to_jaeger(result.get("list", []))
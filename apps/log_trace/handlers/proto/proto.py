@@ -19,6 +19,7 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import copy
 from abc import ABC
+from collections import defaultdict
 from typing import List
 import json
 
@@ -39,6 +40,8 @@ class Proto(ABC):
     SERVICE_NAME_FIELD = None
     OPERATION_NAME_FIELD = None
     TRACE_ID_FIELD = None
+    SPAN_ID_FIELD = None
+    PARENT_SPAN_ID_FIELD = None
     TAGS_FIELD = None
     TRACES_ADDITIONS = {
         "operation": {"method": "is", "field": ""},
@@ -234,3 +237,65 @@ class Proto(ABC):
 
     def trace_detail(self, index_set_id, trace_id):
         pass
+
+    @classmethod
+    def result_to_tree(cls, result) -> dict:
+        result_list: list = result.get("list", [])
+        return cls.build_tree(result_list)
+
+    @classmethod
+    def build_tree(cls, nodes: List[dict]):
+        """
+        构建span调用树, 返回第一个节点所在树的根节点
+        一次遍历建立 span -> children 索引, 不使用递归:
+        1. 父节点不存在的孤儿节点以及其他根节点挂到根节点下
+        2. 存在环时, 环上最先出现的节点挂到根节点下, 断开环
+        """
+        if not nodes:
+            return nodes
+
+        span_map = {}
+        for node in nodes:
+            cls.update_node(node)
+            span_map.setdefault(node.get(cls.SPAN_ID_FIELD), node)
+
+        children_map = defaultdict(list)
+        for node in nodes:
+            parent_node = span_map.get(node.get(cls.PARENT_SPAN_ID_FIELD))
+            if parent_node is not None and parent_node is not node:
+                children_map[id(parent_node)].append(node)
+
+        # 从第一个节点往上查找根节点
+        root = nodes[0]
+        path = {id(root)}
+        parent_node = span_map.get(root.get(cls.PARENT_SPAN_ID_FIELD))
+        while parent_node is not None and id(parent_node) not in path:
+            root = parent_node
+            path.add(id(root))
+            parent_node = span_map.get(root.get(cls.PARENT_SPAN_ID_FIELD))
+
+        visited = {id(root)}
+
+        def attach_children(start: dict):
+            stack = [start]
+            while stack:
+                cur_node = stack.pop()
+                for child in children_map.get(id(cur_node), []):
+                    if id(child) in visited:
+                        continue
+                    visited.add(id(child))
+                    cur_node["children"].append(child)
+                    stack.append(child)
+
+        attach_children(root)
+        for node in nodes:
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+            root["children"].append(node)
+            attach_children(node)
+        return root
+
+    @classmethod
+    def update_node(cls, child: dict) -> dict:
+        raise NotImplementedError()
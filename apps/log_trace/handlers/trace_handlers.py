@@ -19,15 +19,13 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 from apps.log_trace.handlers.proto.proto import Proto
-from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler as SearchHandlerEsquery
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
 
 
 class TraceHandler(object):
     def __init__(self, index_set_id):
-        data = {"search_type": "trace"}
-        search_handler_esquery = SearchHandlerEsquery(index_set_id, data)
         self._index_set_id = index_set_id
-        self._proto_type = Proto.judge_trace_type(search_handler_esquery.fields().get("fields", []))
+        self._proto_type = IndexSetSearchContext.get(index_set_id).trace_proto
 
     def trace_detail(self, trace_id):
         return Proto.get_proto(self._proto_type).trace_detail(self._index_set_id, trace_id)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.log_trace.handlers.proto.log import LogTrace
+from apps.log_trace.handlers.proto.otlp import OtlpTrace
+from apps.utils.local import set_local_param
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+START_TIME = 1634000000000000
+
+
+def generate_spans(proto, size: int, shape: str) -> list:
+    """
+    生成测试span
+    random: 父节点从已生成的span中随机选择
+    chain: 单链, 树深度等于span数量
+    """
+    spans = []
+    for index in range(size):
+        if index == 0:
+            parent_index = None
+        elif shape == "chain":
+            parent_index = index - 1
+        else:
+            parent_index = random.randrange(index)
+        parent_span_id = f"span_{parent_index}" if parent_index is not None else ""
+        span = {proto.SPAN_ID_FIELD: f"span_{index}", proto.PARENT_SPAN_ID_FIELD: parent_span_id}
+        if proto is OtlpTrace:
+            span.update({"start_time": START_TIME + index, "end_time": START_TIME + index + 10})
+        else:
+            span.update({"startTime": START_TIME + index, "duration": 10})
+        spans.append(span)
+    # 打乱顺序, 模拟ES返回的无序span
+    root, *others = spans
+    random.shuffle(others)
+    return [root] + others
+
+
+class Command(BaseCommand):
+    help = "benchmark span tree building for LogTrace and OtlpTrace"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES, help="span counts of a trace")
+        parser.add_argument("--shape", type=str, default="random", choices=["random", "chain"], help="tree shape")
+
+    def handle(self, **options):
+        set_local_param("time_zone", settings.TIME_ZONE)
+        for size in options["sizes"]:
+            for proto in [LogTrace, OtlpTrace]:
+                spans = generate_spans(proto, size, options["shape"])
+                start = time.perf_counter()
+                proto.build_tree(spans)
+                cost = time.perf_counter() - start
+                self.stdout.write(
+                    f"[span tree benchmark] proto => [{proto.TYPE}], shape => [{options['shape']}], "
+                    f"spans => [{size}], cost => [{cost:.3f}s]"
+                )
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import socket
+import threading
+
+from django.test import TestCase
+from django.utils import translation
+from django.utils.translation import ugettext_lazy as _lazy
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from urllib3.exceptions import NewConnectionError, ReadTimeoutError
+
+from apps.api.base import DataAPI, KeepAliveAdapter, SessionPool
+
+
+class DroppingServer(object):
+    """
+    前 drop_count 个连接读取请求后不返回直接关闭, 模拟服务端关闭空闲长连接, 之后的连接正常返回
+    """
+
+    RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}"
+
+    def __init__(self, drop_count):
+        self.drop_count = drop_count
+        self.connections = 0
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}/api/"
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            conn.recv(65536)
+            if self.connections <= self.drop_count:
+                conn.close()
+                continue
+            conn.sendall(self.RESPONSE)
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class TestSessionPool(TestCase):
+    def setUp(self):
+        session = SessionPool._build_session(pool_maxsize=1)
+        self.retry = session.get_adapter("http://127.0.0.1").max_retries
+
+    def test_post_not_retried_after_read_timeout(self):
+        error = ReadTimeoutError(None, "/api/", "Read timed out.")
+        with self.assertRaises(ReadTimeoutError):
+            self.retry.increment(method="POST", url="/api/", error=error)
+
+    def test_get_retried_after_read_timeout(self):
+        error = ReadTimeoutError(None, "/api/", "Read timed out.")
+        self.assertEqual(self.retry.increment(method="GET", url="/api/", error=error).read, self.retry.read - 1)
+
+    def test_post_retried_after_connect_error(self):
+        error = NewConnectionError(None, "Connection refused")
+        self.assertEqual(self.retry.increment(method="POST", url="/api/", error=error).connect, self.retry.connect - 1)
+
+    def test_post_retried_after_connection_dropped(self):
+        server = DroppingServer(drop_count=1)
+        self.addCleanup(server.close)
+        session = SessionPool._build_session(pool_maxsize=1)
+        # 服务端关闭连接时请求未被处理, 非幂等方法也换新连接重试一次
+        response = session.post(server.url, data="{}", timeout=5)
+        self.assertEqual(response.json(), {})
+        self.assertEqual(server.connections, 2)
+
+    def test_connection_dropped_retried_once(self):
+        server = DroppingServer(drop_count=3)
+        self.addCleanup(server.close)
+        session = SessionPool._build_session(pool_maxsize=1)
+        with self.assertRaises(RequestsConnectionError):
+            session.post(server.url, data="{}", timeout=5)
+        self.assertEqual(server.connections, 2)
+
+    def test_read_timeout_not_connection_dropped(self):
+        error = RequestsConnectionError(ReadTimeoutError(None, "/api/", "Read timed out."))
+        self.assertFalse(KeepAliveAdapter.is_connection_dropped(error))
+
+
+class TestDataAPI(TestCase):
+    def test_cache_prefix_not_translated(self):
+        api = DataAPI(method="GET", url="http://127.0.0.1/api/", module=_lazy("数据平台"), description="")
+        with translation.override("en"):
+            self.assertEqual(api.cache_prefix, "api_数据平台")
+        self.assertIsInstance(api.cache_prefix, str)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from apps.feature_toggle.constants import FEATURE_TOGGLE_VERSION_KEY
+from apps.feature_toggle.handlers.toggle import FeatureToggleObject
+from apps.feature_toggle.models import FeatureToggle
+
+TOGGLE_NAME = "test_toggle"
+
+
+@patch("apps.feature_toggle.handlers.toggle.cache", caches["locmem"])
+class TestFeatureToggleObject(TestCase):
+    def setUp(self):
+        caches["locmem"].clear()
+        FeatureToggleObject.invalidate(notify=False)
+
+    def test_toggle_snapshot(self):
+        FeatureToggle.objects.create(name=TOGGLE_NAME, status="on", feature_config={"key": "value"})
+        self.assertTrue(FeatureToggleObject.switch(TOGGLE_NAME))
+
+        # 快照建立后读取开关不再查询db
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                self.assertTrue(FeatureToggleObject.switch(TOGGLE_NAME))
+                self.assertEqual(FeatureToggleObject.toggle(TOGGLE_NAME).feature_config, {"key": "value"})
+                self.assertIsNone(FeatureToggleObject.toggle("not_exists"))
+
+    def test_toggle_changed(self):
+        feature_toggle = FeatureToggle.objects.create(name=TOGGLE_NAME, status="on")
+        self.assertTrue(FeatureToggleObject.switch(TOGGLE_NAME))
+
+        feature_toggle.status = "off"
+        feature_toggle.save()
+        self.assertFalse(FeatureToggleObject.switch(TOGGLE_NAME))
+
+        with self.settings(FEATURE_TOGGLE={"test_setting_toggle": "on"}):
+            self.assertTrue(FeatureToggleObject.switch("test_setting_toggle"))
+        self.assertFalse(FeatureToggleObject.switch("test_setting_toggle"))
+
+    def test_version_changed(self):
+        self.assertFalse(FeatureToggleObject.switch(TOGGLE_NAME))
+        snapshot = FeatureToggleObject.snapshot()
+
+        # 模拟其他进程修改了开关
+        FeatureToggle.objects.filter(name=TOGGLE_NAME).delete()
+        FeatureToggle.objects.bulk_create([FeatureToggle(name=TOGGLE_NAME, status="on")])
+        self.assertFalse(FeatureToggleObject.switch(TOGGLE_NAME))
+
+        caches["locmem"].set(FEATURE_TOGGLE_VERSION_KEY, "new_version", None)
+        snapshot.check_time = 0
+        self.assertTrue(FeatureToggleObject.switch(TOGGLE_NAME))
+        self.assertEqual(FeatureToggleObject.snapshot().version, "new_version")
+
+    @patch("apps.log_databus.handlers.itsm.ItsmHandler.get_log_itsm_service_id", side_effect=[Exception("timeout"), 1])
+    def test_plugin_fallback_not_memoized(self, *args):
+        FeatureToggle.objects.create(name="collect_itsm", status="on")
+        # itsm 异常时降级关闭, 不记录到快照
+        self.assertFalse(FeatureToggleObject.switch("collect_itsm"))
+        self.assertTrue(FeatureToggleObject.switch("collect_itsm"))
+        self.assertEqual(FeatureToggleObject.toggle("collect_itsm").feature_config, {"itsm_service_id": 1})
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from apps.grafana.handlers.query_cache import TimeSeriesCache, grafana_query_cache_buckets
+
+TIME_FIELD = "dtEventTimeStamp"
+INTERVAL = 60
+START_TIME = 1634000010
+END_TIME = 1634003610
+QUERY_DICT = {
+    "result_table_id": 1,
+    "metric_field": "_index",
+    "method": "value_count",
+    "group_by": [],
+    "where": [],
+    "interval": INTERVAL,
+    "start_time": START_TIME,
+    "end_time": END_TIME,
+}
+
+
+class FakeFetch(object):
+    def __init__(self, late=0):
+        self.calls = []
+        # 模拟延迟到达的日志
+        self.late = late
+
+    def __call__(self, start_time, end_time):
+        self.calls.append((start_time, end_time))
+        interval = INTERVAL * 1000
+        first_bucket = start_time * 1000 // interval * interval
+        buckets = range(first_bucket, end_time * 1000, interval)
+        return [{TIME_FIELD: bucket, "_index": bucket // interval + self.late} for bucket in buckets]
+
+
+@override_settings(
+    GRAFANA_QUERY_CACHE_FINALIZE_DELAY=120, GRAFANA_QUERY_CACHE_SETTLE_DELAY=1200, GRAFANA_QUERY_CACHE_RECENT_TTL=3600
+)
+@patch("apps.grafana.handlers.query_cache.cache", caches["locmem"])
+class TestTimeSeriesCache(TestCase):
+    def setUp(self):
+        caches["locmem"].clear()
+
+    def query(self, query_dict, fetch, now, enabled=True):
+        return TimeSeriesCache(query_dict, TIME_FIELD, enabled=enabled, now=now).query(fetch)
+
+    def test_query(self):
+        now = END_TIME + 600
+        fetch = FakeFetch()
+        expected = FakeFetch()(START_TIME, END_TIME)
+
+        self.assertEqual(self.query(QUERY_DICT, fetch, now), expected)
+        self.assertEqual(fetch.calls, [(START_TIME, END_TIME)])
+
+        # 再次查询只补查首个不完整的桶与末尾的桶
+        fetch.calls = []
+        hit_before = grafana_query_cache_buckets.labels(result="hit")._value.get()
+        self.assertEqual(self.query(QUERY_DICT, fetch, now), expected)
+        self.assertEqual(fetch.calls, [(START_TIME, 1634000040), (1634003580, END_TIME)])
+        self.assertEqual(grafana_query_cache_buckets.labels(result="hit")._value.get() - hit_before, 59)
+
+        # 时间范围后移, 只查询新增的时间段
+        query_dict = dict(QUERY_DICT, start_time=START_TIME + 600, end_time=END_TIME + 600)
+        fetch.calls = []
+        self.assertEqual(self.query(query_dict, fetch, now + 600), FakeFetch()(START_TIME + 600, END_TIME + 600))
+        self.assertEqual(fetch.calls, [(START_TIME + 600, 1634000640), (1634003580, END_TIME + 600)])
+
+    def test_query_unfinalized(self):
+        # 未封闭的桶不缓存
+        fetch = FakeFetch()
+        self.query(QUERY_DICT, fetch, now=END_TIME)
+        self.query(QUERY_DICT, fetch, now=END_TIME)
+        self.assertEqual(fetch.calls[-1], (1634003460, END_TIME))
+
+    def test_query_disabled(self):
+        fetch = FakeFetch()
+        self.query(QUERY_DICT, fetch, END_TIME + 600, enabled=False)
+        self.query(QUERY_DICT, fetch, END_TIME + 600, enabled=False)
+        self.assertEqual(fetch.calls, [(START_TIME, END_TIME), (START_TIME, END_TIME)])
+
+    @override_settings(GRAFANA_QUERY_CACHE_RECENT_TTL=300)
+    def test_query_late_logs(self):
+        now = END_TIME + 600
+        fetch = FakeFetch()
+        self.query(QUERY_DICT, fetch, now)
+
+        # 近期的桶在短时间内仍命中缓存
+        fetch.late = 1
+        self.query(QUERY_DICT, fetch, now + 100)
+        self.assertEqual(fetch.calls[-1], (1634003580, END_TIME))
+
+        # 过期后重新查询封闭不足 SETTLE_DELAY 的桶, 延迟到达的日志能够被统计
+        records = self.query(QUERY_DICT, fetch, now + 400)
+        self.assertEqual(fetch.calls[-1], (1634002980, END_TIME))
+        records = {record[TIME_FIELD]: record["_index"] for record in records}
+        self.assertEqual(records[1634003520000], 1634003520000 // (INTERVAL * 1000) + 1)
+        self.assertEqual(records[1634002920000], 1634002920000 // (INTERVAL * 1000))
+
+        # 重新查询后的结果再次被缓存
+        self.query(QUERY_DICT, fetch, now + 500)
+        self.assertEqual(fetch.calls[-1], (1634003580, END_TIME))
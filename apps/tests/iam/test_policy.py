@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from collections import namedtuple
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from iam import ObjectSet, Resource, make_expression
+
+from apps.iam import ActionEnum, Permission
+from apps.iam.handlers.policy import CompiledPolicy, compile_policy, policy_cache
+
+BIZ_POLICY = {
+    "op": "OR",
+    "content": [
+        {"op": "in", "field": "biz.id", "value": ["1", "2"]},
+        {"op": "eq", "field": "biz.id", "value": "3"},
+    ],
+}
+INDICES_POLICY = {
+    "op": "OR",
+    "content": [
+        {"op": "in", "field": "indices.id", "value": ["10"]},
+        {"op": "starts_with", "field": "indices._bk_iam_path_", "value": "/biz,2/"},
+        {
+            "op": "AND",
+            "content": [
+                {"op": "not_eq", "field": "indices.id", "value": "13"},
+                {"op": "starts_with", "field": "indices._bk_iam_path_", "value": "/biz,3/indices,*/"},
+            ],
+        },
+    ],
+}
+
+Business = namedtuple("Business", ["bk_biz_id"])
+
+
+class FakeIAM(object):
+    def __init__(self, policies):
+        self.policies = policies
+        self.query_count = 0
+        self.remote_count = 0
+
+    def _do_policy_query(self, request, with_resources=True):
+        self.query_count += 1
+        return self.policies.get(request.action.id)
+
+    def is_allowed(self, request):
+        self.remote_count += 1
+        return True
+
+
+def indices_resource(index_set_id, bk_biz_id=None):
+    attribute = {"_bk_iam_path_": f"/biz,{bk_biz_id}/"} if bk_biz_id else {}
+    return Resource(settings.BK_IAM_SYSTEM_ID, "indices", str(index_set_id), attribute)
+
+
+@override_settings(DEMO_BIZ_ID=-1)
+class TestPolicy(TestCase):
+    def setUp(self):
+        policy_cache.invalidate()
+
+    def test_compile_policy(self):
+        # 与SDK的表达式计算结果保持一致
+        instances = [("10", "/biz,1/"), ("11", "/biz,2/"), ("12", "/biz,3/"), ("13", "/biz,3/"), ("14", "")]
+        for index_set_id, path in instances:
+            obj_set = ObjectSet()
+            obj_set.add_object("indices", {"id": index_set_id, "_bk_iam_path_": path})
+            self.assertEqual(
+                compile_policy(INDICES_POLICY)({"indices": {"id": index_set_id, "_bk_iam_path_": path}}),
+                make_expression(INDICES_POLICY).eval(obj_set),
+            )
+        self.assertTrue(compile_policy({"op": "any", "field": "biz.id", "value": []})({}))
+        self.assertFalse(compile_policy(None)({}))
+
+    def test_batch_eval(self):
+        policy = CompiledPolicy(BIZ_POLICY)
+        instances = [{"id": str(bk_biz_id)} for bk_biz_id in range(5)] + [{"name": "no id"}]
+        self.assertEqual(policy.batch_eval("biz", instances), [False, True, True, True, False, False])
+
+    def test_is_allowed(self):
+        fake_iam = FakeIAM({"search_log": INDICES_POLICY})
+        with patch.object(Permission, "get_iam_client", lambda _: fake_iam):
+            permission = Permission(username="admin")
+            self.assertTrue(permission.is_allowed(ActionEnum.SEARCH_LOG, [indices_resource(11, 2)]))
+            self.assertTrue(permission.is_allowed(ActionEnum.SEARCH_LOG, [indices_resource(10, 9)]))
+            self.assertEqual(fake_iam.query_count, 1)
+
+            # 缓存的策略判定无权限时重新拉取
+            self.assertFalse(permission.is_allowed(ActionEnum.SEARCH_LOG, [indices_resource(14, 4)]))
+            self.assertEqual(fake_iam.query_count, 2)
+
+            # 资源缺少策略依赖的属性时由权限中心计算
+            self.assertTrue(permission.is_allowed(ActionEnum.SEARCH_LOG, [indices_resource(15)]))
+            self.assertEqual(fake_iam.remote_count, 1)
+
+            # 授权后丢弃缓存
+            policy_cache.invalidate("admin")
+            permission.is_allowed(ActionEnum.SEARCH_LOG, [indices_resource(11, 2)])
+            self.assertEqual(fake_iam.query_count, 3)
+
+    def test_filter_business_list_by_action(self):
+        fake_iam = FakeIAM({"view_business": BIZ_POLICY})
+        business_list = [Business(bk_biz_id) for bk_biz_id in range(1000)]
+        with patch.object(Permission, "get_iam_client", lambda _: fake_iam):
+            result = Permission(username="admin").filter_business_list_by_action(
+                ActionEnum.VIEW_BUSINESS, business_list
+            )
+        self.assertEqual([business.bk_biz_id for business in result], [1, 2, 3])
+        self.assertEqual(fake_iam.query_count, 1)
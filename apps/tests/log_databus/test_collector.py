@@ -20,6 +20,7 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import copy
 from unittest.mock import patch
+from django.core.cache import caches
 from django.test import TestCase, override_settings
 
 from apps.log_databus.exceptions import CollectorConfigNotExistException
@@ -1156,3 +1157,65 @@ class TestCollector(TestCase):
 
         with self.assertRaises(BaseException):
             CollectorHandler._check_task_ready_exception(BaseException())
+
+
+def build_statistic(subscription_id, running=0, success=1):
+    return {
+        "subscription_id": subscription_id,
+        "status": [
+            {"status": "SUCCESS", "count": success},
+            {"status": "PENDING", "count": 0},
+            {"status": "FAILED", "count": 0},
+            {"status": "RUNNING", "count": running},
+        ],
+        "versions": [],
+        "instances": running + success,
+    }
+
+
+@override_settings(COLLECTOR_SUBSCRIPTION_STATUS_BATCH_SIZE=2)
+class TestSubscriptionStatistic(TestCase):
+    def setUp(self):
+        self.cache = caches["locmem"]
+        self.cache.clear()
+        patcher = patch("apps.log_databus.handlers.collector.cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requests = []
+        # 订阅3部署中
+        self.running = {3}
+
+    def subscription_statistic(self, params):
+        self.requests.append(params["subscription_id_list"])
+        return [
+            build_statistic(_id, running=int(_id in self.running), success=int(_id not in self.running))
+            for _id in params["subscription_id_list"]
+        ]
+
+    def test_batch_request(self):
+        with patch("apps.api.NodeApi.subscription_statistic", self.subscription_statistic):
+            result = CollectorHandler.get_subscription_statistic([1, 2, 3])
+        # 每批一次请求
+        self.assertEqual(self.requests, [[1, 2], [3]])
+        self.assertEqual(set(result.keys()), {1, 2, 3})
+
+    def test_cache_finished_only(self):
+        with patch("apps.api.NodeApi.subscription_statistic", self.subscription_statistic):
+            CollectorHandler.get_subscription_statistic([1, 2, 3])
+            self.requests = []
+            result = CollectorHandler.get_subscription_statistic([1, 2, 3])
+            # 部署已结束的订阅使用缓存, 部署中的重新查询
+            self.assertEqual(self.requests, [[3]])
+            self.assertEqual(set(result.keys()), {1, 2, 3})
+
+            self.requests = []
+            CollectorHandler.get_subscription_statistic([1, 2, 3], use_cache=False)
+            self.assertEqual(self.requests, [[1, 2], [3]])
+
+    def test_invalidate(self):
+        with patch("apps.api.NodeApi.subscription_statistic", self.subscription_statistic):
+            CollectorHandler.get_subscription_statistic([1, 2])
+            CollectorHandler.invalidate_subscription_status(1)
+            self.requests = []
+            CollectorHandler.get_subscription_statistic([1, 2])
+            self.assertEqual(self.requests, [[1]])
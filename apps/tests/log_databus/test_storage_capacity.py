@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from apps.log_databus.models import CollectorConfig, StorageUsed
+from apps.log_databus.tasks.collector import sync_storage_capacity
+
+TASK_MODULE = "apps.log_databus.tasks.collector"
+
+PUBLIC_CLUSTER = {
+    "cluster_config": {
+        "cluster_id": 1,
+        "domain_name": "es.public",
+        "port": 9200,
+        "registered_system": "_default",
+        "custom_option": {},
+    },
+    "auth_info": {"username": "", "password": ""},
+}
+THIRD_PARTY_CLUSTER = {
+    "cluster_config": {
+        "cluster_id": 2,
+        "domain_name": "es.third",
+        "port": 9200,
+        "registered_system": "bk_log",
+        "custom_option": {"bk_biz_id": 3},
+    },
+    "auth_info": {"username": "", "password": ""},
+}
+FAILED_CLUSTER = {
+    "cluster_config": {
+        "cluster_id": 3,
+        "domain_name": "es.failed",
+        "port": 9200,
+        "registered_system": "bk_log",
+        "custom_option": {"bk_biz_id": 3},
+    },
+    "auth_info": {"username": "", "password": ""},
+}
+
+INDICES = {
+    "es.public": [
+        {"index": "2_bklog_a_20220101", "store.size": "1024", "status": "open"},
+        {"index": "2_bklog_b_20220101", "store.size": "512", "status": "open"},
+        {"index": "3_bklog_a_20220101", "store.size": "2048", "status": "open"},
+        {"index": "3_bklog_b_20220101", "store.size": "2048", "status": "close"},
+        {"index": "4_bklog_a_20220101", "store.size": "2048", "status": "open"},
+        {"index": "v2_2_bklog_a_20220101", "store.size": "2048", "status": "open"},
+    ],
+    "es.third": [{"index": "3_bklog_a_20220101", "store.size": "512", "status": "open"}],
+}
+
+
+class FakeElasticHandle(object):
+    calls = []
+
+    def __init__(self, domain_name, port, username, password):
+        self.domain_name = domain_name
+
+    def get_indices_cat(self, index=None, bytes="b", column=None):
+        self.calls.append((self.domain_name, index))
+        if self.domain_name not in INDICES:
+            raise Exception("connection refused")
+        return INDICES[self.domain_name]
+
+
+class TestSyncStorageCapacity(TestCase):
+    def setUp(self):
+        FakeElasticHandle.calls = []
+        for index, bk_biz_id in enumerate([2, 3, 2]):
+            CollectorConfig.objects.create(
+                collector_config_name=f"test_{index}",
+                bk_biz_id=bk_biz_id,
+                collector_scenario_id="row",
+                category_id="os",
+            )
+        StorageUsed.objects.create(bk_biz_id=2, storage_cluster_id=1, storage_used=100)
+        StorageUsed.objects.create(bk_biz_id=3, storage_cluster_id=3, storage_used=100)
+
+    @patch(f"{TASK_MODULE}.ElasticHandle", FakeElasticHandle)
+    @patch(
+        f"{TASK_MODULE}.TransferApi.get_cluster_info",
+        return_value=[PUBLIC_CLUSTER, THIRD_PARTY_CLUSTER, FAILED_CLUSTER],
+    )
+    def test_sync_storage_capacity(self, mock_get_cluster_info):
+        sync_storage_capacity()
+
+        # 每个集群只查询一次
+        self.assertCountEqual(
+            FakeElasticHandle.calls, [("es.public", "*_bklog_*"), ("es.third", "3_bklog_*"), ("es.failed", "3_bklog_*")]
+        )
+        storage_used = {
+            (obj.bk_biz_id, obj.storage_cluster_id): obj.storage_used for obj in StorageUsed.objects.all()
+        }
+        self.assertEqual(
+            storage_used,
+            {
+                (2, 1): 1.5,
+                (3, 1): 2,
+                (3, 2): 0.5,
+                # 查询失败的集群保留原有容量
+                (3, 3): 100,
+            },
+        )
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import math
+import os
+from collections import defaultdict
+from unittest import skipUnless
+from unittest.mock import patch
+
+import redis
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from apps.log_esquery.admission import (
+    CONCURRENCY_ACQUIRE_SCRIPT,
+    EsQueryAdmission,
+    PRIORITY_SCORE_WEIGHT,
+    TOKEN_BUCKET_SCRIPT,
+)
+from apps.log_esquery.constants import QueryPriority
+from apps.log_esquery.exceptions import EsQueryConcurrencyLimitedException, EsQueryRateLimitedException
+
+
+class FakeRedis:
+    """
+    以python模拟准入控制的Lua脚本
+    """
+
+    def __init__(self):
+        self.hash = {}
+        self.zset = defaultdict(dict)
+
+    def zrem(self, key, member):
+        return int(self.zset[key].pop(member, None) is not None)
+
+    def register_script(self, script):
+        return {TOKEN_BUCKET_SCRIPT: self._token_bucket, CONCURRENCY_ACQUIRE_SCRIPT: self._acquire}[script]
+
+    def _token_bucket(self, keys, args):
+        rate, capacity, now, requested = args
+        tokens, ts = self.hash.get(keys[0], (capacity, now))
+        tokens = min(capacity, tokens + max(0, now - ts) * rate / 1000)
+        if tokens >= requested:
+            self.hash[keys[0]] = (tokens - requested, now)
+            return [1, 0]
+        self.hash[keys[0]] = (tokens, now)
+        return [0, math.ceil((requested - tokens) * 1000 / rate)]
+
+    def _acquire(self, keys, args):
+        inflight, queue = self.zset[keys[0]], self.zset[keys[1]]
+        ticket, score, limit, now, lease, queue_ttl, max_priority = args
+        for member, expire_at in list(inflight.items()):
+            if expire_at <= now:
+                inflight.pop(member)
+        queue.setdefault(ticket, score)
+        for priority in range(max_priority + 1):
+            band = priority * PRIORITY_SCORE_WEIGHT
+            for member, member_score in list(queue.items()):
+                if band <= member_score <= band + now - queue_ttl - 1:
+                    queue.pop(member)
+        free = limit - len(inflight)
+        ranking = sorted(queue, key=lambda member: queue[member])
+        if free <= 0 or ticket not in ranking or ranking.index(ticket) >= free:
+            return 0
+        queue.pop(ticket)
+        inflight[ticket] = now + lease
+        return 1
+
+
+SEARCH_DICT = {"bk_app_code": "bk_monitorv3", "scenario_id": "es", "storage_cluster_id": 1, "index_set_id": 1}
+# 配置后使用真实的redis执行Lua脚本, 例如 redis://127.0.0.1:6379/15
+TEST_REDIS_URL = os.environ.get("BKAPP_TEST_REDIS_URL")
+
+
+@override_settings(
+    USE_REDIS=True,
+    ESQUERY_ADMISSION_ENABLED=True,
+    ESQUERY_ADMISSION_RATE=1,
+    ESQUERY_ADMISSION_BURST=2,
+    ESQUERY_ADMISSION_CLUSTER_CONCURRENCY=1,
+    ESQUERY_ADMISSION_MAX_WAIT={"interactive": 0, "export": 0, "background": 0},
+)
+class TestEsQueryAdmission(TestCase):
+    def setUp(self):
+        self.fake_redis = FakeRedis()
+        patcher = patch("apps.log_esquery.admission.redis_client", self.fake_redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_default_priority(self):
+        self.assertEqual(EsQueryAdmission(SEARCH_DICT).priority, QueryPriority.BACKGROUND)
+        self.assertEqual(
+            EsQueryAdmission(dict(SEARCH_DICT, bk_app_code=settings.APP_CODE)).priority, QueryPriority.INTERACTIVE
+        )
+        self.assertEqual(
+            EsQueryAdmission(dict(SEARCH_DICT, query_priority=QueryPriority.EXPORT)).priority, QueryPriority.EXPORT
+        )
+
+    def test_cluster_key(self):
+        self.assertEqual(EsQueryAdmission(SEARCH_DICT).cluster, "es_1")
+        self.assertEqual(EsQueryAdmission({"scenario_id": "bkdata", "indices": "591_test"}).cluster, "bkdata")
+
+    def test_token_bucket(self):
+        with EsQueryAdmission(SEARCH_DICT):
+            pass
+        with EsQueryAdmission(SEARCH_DICT):
+            pass
+        with self.assertRaises(EsQueryRateLimitedException):
+            EsQueryAdmission(SEARCH_DICT).acquire()
+        # 令牌桶按 (app_code, 索引集) 区分
+        with EsQueryAdmission(dict(SEARCH_DICT, index_set_id=2)):
+            pass
+
+    def test_user_token_bucket(self):
+        search_dict = dict(SEARCH_DICT, bk_app_code=settings.APP_CODE, bk_username="alice")
+        for _ in range(2):
+            with EsQueryAdmission(search_dict):
+                pass
+        with self.assertRaises(EsQueryRateLimitedException):
+            EsQueryAdmission(search_dict).acquire()
+        # 交互检索按用户区分令牌桶, 其他用户检索同一索引集不受影响
+        with EsQueryAdmission(dict(search_dict, bk_username="bob")):
+            pass
+        # 后台查询仍按应用共享令牌桶
+        self.assertEqual(
+            EsQueryAdmission(dict(SEARCH_DICT, bk_username="alice")).bucket_key,
+            EsQueryAdmission(dict(SEARCH_DICT, bk_username="bob")).bucket_key,
+        )
+
+    @override_settings(
+        ESQUERY_ADMISSION_MAX_WAIT={"interactive": 10, "export": 60, "background": 30},
+        ESQUERY_ADMISSION_WEB_MAX_WAIT=3,
+    )
+    def test_web_max_wait(self):
+        admission = EsQueryAdmission(dict(SEARCH_DICT, query_priority=QueryPriority.EXPORT))
+        # web进程中排队时间受限, celery任务中按优先级配置
+        self.assertEqual(admission.max_wait, 3)
+        with patch("apps.log_esquery.admission.sys.argv", ["celery", "worker"]):
+            self.assertEqual(admission.max_wait, 60)
+
+    def test_cluster_concurrency(self):
+        admission = EsQueryAdmission(dict(SEARCH_DICT, bk_app_code=settings.APP_CODE))
+        admission.acquire()
+        with self.assertRaises(EsQueryConcurrencyLimitedException):
+            EsQueryAdmission(dict(SEARCH_DICT, index_set_id=2)).acquire()
+        # 超时放弃排队后不再占用队列
+        self.assertEqual(self.fake_redis.zset[admission.queue_key], {})
+        admission.release()
+        self.assertEqual(self.fake_redis.zset[admission.inflight_key], {})
+        with EsQueryAdmission(dict(SEARCH_DICT, index_set_id=2)):
+            pass
+
+    def test_priority_queue(self):
+        running = EsQueryAdmission(dict(SEARCH_DICT, index_set_id=3))
+        running.acquire()
+        # 后台查询先入队, 交互检索后入队
+        background = EsQueryAdmission(dict(SEARCH_DICT, query_priority=QueryPriority.BACKGROUND))
+        interactive = EsQueryAdmission(dict(SEARCH_DICT, index_set_id=2, query_priority=QueryPriority.INTERACTIVE))
+        acquire = self.fake_redis.register_script(CONCURRENCY_ACQUIRE_SCRIPT)
+        for ticket, admission in (("background", background), ("interactive", interactive)):
+            score = QueryPriority.ORDER[admission.priority] * PRIORITY_SCORE_WEIGHT + EsQueryAdmission._now_ms()
+            acquire(
+                keys=[admission.inflight_key, admission.queue_key],
+                args=[ticket, score, 1, EsQueryAdmission._now_ms(), 60000, 60000, 2],
+            )
+        running.release()
+        # 空出执行机会后交互检索优先
+        args = [1, EsQueryAdmission._now_ms(), 60000, 60000, 2]
+        self.assertEqual(acquire(keys=[running.inflight_key, running.queue_key], args=["background", 0] + args), 0)
+        self.assertEqual(acquire(keys=[running.inflight_key, running.queue_key], args=["interactive", 0] + args), 1)
+
+    def test_stale_waiter(self):
+        admission = EsQueryAdmission(SEARCH_DICT)
+        acquire = self.fake_redis.register_script(CONCURRENCY_ACQUIRE_SCRIPT)
+        now = EsQueryAdmission._now_ms()
+        # 异常退出未出队的后台查询排在队首
+        stale_score = QueryPriority.ORDER[QueryPriority.BACKGROUND] * PRIORITY_SCORE_WEIGHT + now - 120000
+        self.fake_redis.zset[admission.queue_key]["stale"] = stale_score
+        score = QueryPriority.ORDER[QueryPriority.BACKGROUND] * PRIORITY_SCORE_WEIGHT + now
+        self.assertEqual(
+            acquire(keys=[admission.inflight_key, admission.queue_key], args=["new", score, 1, now, 60000, 60000, 2]),
+            1,
+        )
+        self.assertNotIn("stale", self.fake_redis.zset[admission.queue_key])
+
+    @override_settings(ESQUERY_ADMISSION_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(5):
+            with EsQueryAdmission(SEARCH_DICT) as admission:
+                self.assertEqual(admission.ticket, "")
+
+
+@skipUnless(TEST_REDIS_URL, "BKAPP_TEST_REDIS_URL is not set")
+@override_settings(
+    USE_REDIS=True,
+    ESQUERY_ADMISSION_ENABLED=True,
+    ESQUERY_ADMISSION_RATE=1,
+    ESQUERY_ADMISSION_BURST=2,
+    ESQUERY_ADMISSION_CLUSTER_CONCURRENCY=1,
+    ESQUERY_ADMISSION_MAX_WAIT={"interactive": 0, "export": 0, "background": 0},
+)
+class TestEsQueryAdmissionRedis(TestCase):
+    """
+    使用真实的redis执行准入控制的Lua脚本
+    """
+
+    def setUp(self):
+        self.redis_client = redis.Redis.from_url(TEST_REDIS_URL)
+        patcher = patch("apps.log_esquery.admission.redis_client", self.redis_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clean_keys()
+        self.addCleanup(self.clean_keys)
+
+    def clean_keys(self):
+        keys = self.redis_client.keys(f"{settings.APP_CODE}_admission_*")
+        if keys:
+            self.redis_client.delete(*keys)
+
+    def test_token_bucket(self):
+        for _ in range(2):
+            with EsQueryAdmission(SEARCH_DICT):
+                pass
+        with self.assertRaises(EsQueryRateLimitedException):
+            EsQueryAdmission(SEARCH_DICT).acquire()
+        with EsQueryAdmission(dict(SEARCH_DICT, index_set_id=2)):
+            pass
+
+    def test_cluster_concurrency(self):
+        admission = EsQueryAdmission(dict(SEARCH_DICT, bk_app_code=settings.APP_CODE))
+        admission.acquire()
+        self.assertEqual(self.redis_client.zcard(admission.inflight_key), 1)
+        with self.assertRaises(EsQueryConcurrencyLimitedException):
+            EsQueryAdmission(dict(SEARCH_DICT, index_set_id=2)).acquire()
+        self.assertEqual(self.redis_client.zcard(admission.queue_key), 0)
+        admission.release()
+        self.assertEqual(self.redis_client.zcard(admission.inflight_key), 0)
+        with EsQueryAdmission(dict(SEARCH_DICT, index_set_id=2)):
+            pass
+
+    def test_priority_queue(self):
+        running = EsQueryAdmission(dict(SEARCH_DICT, index_set_id=3))
+        running.acquire()
+        acquire = self.redis_client.register_script(CONCURRENCY_ACQUIRE_SCRIPT)
+        now = EsQueryAdmission._now_ms()
+        keys = [running.inflight_key, running.queue_key]
+        for ticket, priority in (("background", QueryPriority.BACKGROUND), ("interactive", QueryPriority.INTERACTIVE)):
+            score = QueryPriority.ORDER[priority] * PRIORITY_SCORE_WEIGHT + now
+            self.assertEqual(acquire(keys=keys, args=[ticket, score, 1, now, 60000, 60000, 2]), 0)
+        running.release()
+        # 空出执行机会后交互检索优先
+        args = [1, EsQueryAdmission._now_ms(), 60000, 60000, 2]
+        self.assertEqual(acquire(keys=keys, args=["background", 0] + args), 0)
+        self.assertEqual(acquire(keys=keys, args=["interactive", 0] + args), 1)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import time
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from django.conf import settings
+from django.test import override_settings
+
+from apps.log_esquery.esquery.client.client_pool import EsClientPool
+
+CONNECT_INFO = ("127.0.0.1", 9200, "admin", "password", "7.10.0", "http")
+CHANGED_CONNECT_INFO = ("127.0.0.1", 9200, "admin", "new_password", "7.10.0", "http")
+
+
+@patch("apps.log_esquery.esquery.client.client_pool.EsClientPool._ensure_health_check", lambda _: None)
+@patch("apps.log_esquery.esquery.client.client_pool.EsClientPool._build_client", side_effect=lambda _: MagicMock())
+class TestEsClientPool(TestCase):
+    def setUp(self):
+        self.pool = EsClientPool()
+
+    def close_retired(self):
+        # 超过延迟关闭时间后由探活关闭
+        now = time.time() + settings.ES_CLIENT_CLOSE_DELAY + 1
+        with patch("apps.log_esquery.esquery.client.client_pool.time.time", return_value=now):
+            self.pool.health_check()
+
+    def test_reuse(self, *args):
+        get_connect_info = MagicMock(return_value=CONNECT_INFO)
+        client = self.pool.get_client("es_1", get_connect_info)
+        self.assertIs(self.pool.get_client("es_1", get_connect_info), client)
+        self.assertEqual(get_connect_info.call_count, 1)
+        self.assertEqual(self.pool.stats()["hit"], 1)
+        self.assertEqual(self.pool.stats()["miss"], 1)
+
+    def test_share_between_keys(self, *args):
+        client = self.pool.get_client("log_2_bklog.a", lambda: CONNECT_INFO)
+        self.assertIs(self.pool.get_client("log_2_bklog.b", lambda: CONNECT_INFO), client)
+        self.assertEqual(self.pool.stats()["clients"], 1)
+
+    @override_settings(ES_CLIENT_CONNECT_INFO_TTL=-1)
+    def test_evict_on_change(self, *args):
+        client = self.pool.get_client("es_1", lambda: CONNECT_INFO)
+        new_client = self.pool.get_client("es_1", lambda: CHANGED_CONNECT_INFO)
+        self.assertIsNot(new_client, client)
+        self.assertEqual(new_client.connect_info.password, "new_password")
+        self.assertEqual(self.pool.stats()["evict_changed"], 1)
+        self.assertEqual(self.pool.stats()["clients"], 1)
+        # 旧客户端可能仍有进行中的查询, 不立即关闭
+        client.client.transport.close.assert_not_called()
+        self.assertEqual(self.pool.stats()["retired_clients"], 1)
+        self.pool.health_check()
+        client.client.transport.close.assert_not_called()
+
+        self.close_retired()
+        client.client.transport.close.assert_called_once()
+        new_client.client.transport.close.assert_not_called()
+        self.assertEqual(self.pool.stats()["retired_clients"], 0)
+
+    def test_rebuild_unhealthy(self, *args):
+        client = self.pool.get_client("es_1", lambda: CONNECT_INFO)
+        client.client.ping.return_value = False
+        self.pool.health_check()
+        self.assertFalse(client.healthy)
+        self.assertIsNot(self.pool.get_client("es_1", lambda: CONNECT_INFO), client)
+        self.assertEqual(self.pool.stats()["evict_unhealthy"], 1)
+        client.client.transport.close.assert_not_called()
+        self.close_retired()
+        client.client.transport.close.assert_called_once()
+
+    @override_settings(ES_CLIENT_IDLE_TIMEOUT=-1)
+    def test_evict_idle(self, *args):
+        client = self.pool.get_client("es_1", lambda: CONNECT_INFO)
+        self.pool.health_check()
+        self.assertEqual(self.pool.stats()["clients"], 0)
+        self.assertEqual(self.pool.stats()["evict_idle"], 1)
+        client.client.transport.close.assert_not_called()
+        self.close_retired()
+        client.client.transport.close.assert_called_once()
+
+    def test_clear(self, *args):
+        client = self.pool.get_client("es_1", lambda: CONNECT_INFO)
+        self.pool.clear()
+        self.assertEqual(self.pool.stats()["clients"], 0)
+        client.client.transport.close.assert_called_once()
+
+    @override_settings(ES_CLIENT_CONNECT_INFO_TTL=-1)
+    def test_clear_retired(self, *args):
+        client = self.pool.get_client("es_1", lambda: CONNECT_INFO)
+        self.pool.get_client("es_1", lambda: CHANGED_CONNECT_INFO)
+        self.pool.clear()
+        client.client.transport.close.assert_called_once()
+        self.assertEqual(self.pool.stats()["retired_clients"], 0)
@@ -129,6 +129,7 @@ SEARCH_RESULT = {
             }
         },
     },
+    "query_plan": {"strategy": "match_all", "fields": [], "cost": 0, "reason": "empty keyword"},
 }
 
 
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from unittest.mock import patch
+
+import arrow
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from apps.log_esquery.esquery.builder.index_catalog import IndexCatalog
+from apps.log_esquery.esquery.builder.query_index_optimizer import QueryIndexOptimizer
+from apps.log_esquery.esquery.client.QueryClientLog import QueryClientLog
+from apps.log_search.models import Scenario
+from apps.utils.cache import LayeredCache
+
+RESULT_TABLE_ID = "2_bklog.search"
+START_TIME = arrow.get("2020-03-20T23:00:00+00:00")
+END_TIME = arrow.get("2020-03-22T15:59:59+00:00")
+
+
+def ms(value: str) -> int:
+    return arrow.get(value).timestamp * 1000
+
+
+def entry(date, min_time=None, max_time=None, docs_count=0):
+    return {
+        "index": f"v2_2_bklog_search_{date}_0",
+        "date": date,
+        "seq": 0,
+        "aliases": [f"2_bklog_search_{date}_read"],
+        "creation_date": arrow.get(date, "YYYYMMDD").timestamp * 1000,
+        "docs_count": docs_count,
+        "store_size": docs_count * 100,
+        "min_time": min_time,
+        "max_time": max_time,
+    }
+
+
+CATALOG_INDICES = [
+    entry("20200319", ms("2020-03-19T00:00:00+00:00"), ms("2020-03-19T23:59:59+00:00"), 10),
+    entry("20200320"),
+    entry("20200321", ms("2020-03-21T00:00:00+00:00"), ms("2020-03-21T23:59:59+00:00"), 5),
+    entry("20200322", ms("2020-03-22T00:00:00+00:00"), ms("2020-03-22T12:00:00+00:00"), 8),
+]
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.query_index = None
+
+    def cat_indices(self, index=None, bytes="mb", format="json", params=None):
+        return [
+            {"index": "v2_2_bklog_search_20200321_0", "creation.date": "1584748800000", "docs.count": "5"},
+            {"index": "v2_2_bklog_search_20200320_0", "creation.date": "1584662400000", "docs.count": "0"},
+            {"index": "v2_2_bklog_search_x_20200321_0", "creation.date": "1584748800000", "docs.count": "3"},
+        ]
+
+    def es_route(self, url, index=None):
+        return [{"alias": "2_bklog_search_20200321_read", "index": "v2_2_bklog_search_20200321_0"}]
+
+    def query(self, index, body, scroll=None, track_total_hits=False):
+        self.query_index = index
+        return {
+            "aggregations": {
+                "indices": {
+                    "buckets": [
+                        {
+                            "key": "v2_2_bklog_search_20200321_0",
+                            "doc_count": 5,
+                            "min_time": {"value": 1584748800000.0},
+                            "max_time": {"value": 1584835199000.0},
+                        }
+                    ]
+                }
+            }
+        }
+
+
+class IncrementalClient(FakeClient):
+    def cat_indices(self, index=None, bytes="mb", format="json", params=None):
+        return [
+            {"index": "v2_2_bklog_search_20200321_0", "creation.date": "1584748800000", "docs.count": "5"},
+            {"index": "v2_2_bklog_search_20200322_0", "creation.date": "1584835200000", "docs.count": "12"},
+        ]
+
+    def query(self, index, body, scroll=None, track_total_hits=False):
+        self.query_index = index
+        bucket = {
+            "key": "v2_2_bklog_search_20200322_0",
+            "doc_count": 12,
+            "min_time": {"value": 1584835200000.0},
+            "max_time": {"value": 1584878400000.0},
+        }
+        return {"aggregations": {"indices": {"buckets": [bucket]}}}
+
+
+class TestIndexCatalog(TestCase):
+    def setUp(self):
+        backend = caches["locmem"]
+        backend.clear()
+        self.cache_patcher = patch(
+            "apps.log_esquery.esquery.builder.index_catalog.layered_cache", LayeredCache(backend=backend)
+        )
+        self.cache_patcher.start()
+        self.catalog = IndexCatalog(RESULT_TABLE_ID)
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+
+    def test_fallback_without_catalog(self):
+        self.assertIsNone(self.catalog.resolve(START_TIME, END_TIME))
+        index = QueryIndexOptimizer(RESULT_TABLE_ID, Scenario.LOG, START_TIME, END_TIME, "Asia/Shanghai").index
+        self.assertIn("2_bklog_search_20200321*", index.split(","))
+
+    def test_resolve_concrete_indices(self):
+        self.catalog.save(CATALOG_INDICES, refresh_time=ms("2020-03-23T00:00:00+00:00"))
+        # 不相交及空的索引被跳过, 最新索引仍在写入
+        self.assertEqual(
+            self.catalog.resolve(START_TIME, END_TIME),
+            ["v2_2_bklog_search_20200321_0", "v2_2_bklog_search_20200322_0"],
+        )
+        index = QueryIndexOptimizer(RESULT_TABLE_ID, Scenario.LOG, START_TIME, END_TIME, "Asia/Shanghai").index
+        self.assertEqual(index, "v2_2_bklog_search_20200321_0,v2_2_bklog_search_20200322_0")
+
+        # 范围内没有任何数据时只查询结束时间当天
+        self.assertEqual(
+            self.catalog.resolve(arrow.get("2020-03-10T00:00:00+00:00"), arrow.get("2020-03-11T00:00:00+00:00")),
+            ["2_bklog_search_20200311*"],
+        )
+
+    def test_build_connection_with_concrete_indices(self):
+        self.catalog.save(CATALOG_INDICES, refresh_time=ms("2020-03-23T00:00:00+00:00"))
+        start_time, end_time = arrow.get("2020-03-19T00:00:00+00:00"), arrow.get("2020-03-19T12:00:00+00:00")
+        index = QueryIndexOptimizer(RESULT_TABLE_ID, Scenario.LOG, start_time, end_time, "Asia/Shanghai").index
+        self.assertEqual(index, "v2_2_bklog_search_20200319_0")
+
+        # 具体索引需要解析回所属的结果表获取集群连接
+        client = QueryClientLog()
+        with patch.object(QueryClientLog, "_get_connection", autospec=True) as get_connection:
+            get_connection.side_effect = lambda instance, rt: setattr(instance, "_active", True)
+            client._build_connection(index)
+        get_connection.assert_called_once_with(client, RESULT_TABLE_ID)
+        self.assertEqual(QueryClientLog._get_meta_index("2_bklog_search_20200321*"), RESULT_TABLE_ID)
+
+    def test_resolve_after_refresh(self):
+        self.catalog.save(CATALOG_INDICES, refresh_time=ms("2020-03-22T12:00:00+00:00"))
+        self.assertEqual(
+            self.catalog.resolve(START_TIME, END_TIME),
+            ["v2_2_bklog_search_20200321_0", "v2_2_bklog_search_20200322_0", "2_bklog_search_20200322*"],
+        )
+
+    @override_settings(INDEX_CATALOG_MAX_INDEX_LENGTH=50)
+    def test_resolve_fold_by_month(self):
+        self.catalog.save(CATALOG_INDICES, refresh_time=ms("2020-03-23T00:00:00+00:00"))
+        self.assertEqual(self.catalog.resolve(START_TIME, END_TIME), ["2_bklog_search_202003*"])
+
+    def test_refresh(self):
+        client = FakeClient()
+        indices = self.catalog.refresh(client)
+        self.assertEqual(client.query_index, "v2_2_bklog_search_*,2_bklog_search_*")
+        self.assertEqual(
+            [x["index"] for x in indices], ["v2_2_bklog_search_20200321_0", "v2_2_bklog_search_20200320_0"]
+        )
+
+        catalog = self.catalog.get()
+        self.assertEqual(
+            [x["index"] for x in catalog["indices"]], ["v2_2_bklog_search_20200320_0", "v2_2_bklog_search_20200321_0"]
+        )
+        empty, filled = catalog["indices"]
+        self.assertIsNone(empty["min_time"])
+        self.assertEqual(filled["aliases"], ["2_bklog_search_20200321_read"])
+        self.assertEqual((filled["min_time"], filled["max_time"]), (1584748800000, 1584835199000))
+
+    def test_refresh_incremental(self):
+        self.catalog.save(CATALOG_INDICES, refresh_time=ms("2020-03-22T12:00:00+00:00"))
+        client = IncrementalClient()
+        self.catalog.refresh(client)
+
+        # 已停止写入的索引沿用目录中的最值, 只聚合仍在写入的最新索引
+        self.assertEqual(client.query_index, "v2_2_bklog_search_20200322_0")
+        sealed, latest = self.catalog.get()["indices"]
+        stored = CATALOG_INDICES[2]
+        self.assertEqual((sealed["min_time"], sealed["max_time"]), (stored["min_time"], stored["max_time"]))
+        self.assertEqual((latest["min_time"], latest["max_time"]), (1584835200000, 1584878400000))
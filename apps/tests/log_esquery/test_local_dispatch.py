@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from apps.log_esquery import local_dispatch
+from apps.log_esquery.exceptions import EsClientSearchException, EsTimeoutException
+from apps.log_search.models import Scenario
+from apps.tests.log_esquery.test_qos import FakeRedis
+
+SEARCH_PARAMS = {
+    "scenario_id": Scenario.LOG,
+    "indices": "2_bklog.search",
+    "start_time": "2020-03-21 07:00:00",
+    "end_time": "2020-03-22 23:59:59",
+    "query_string": "*",
+    "size": 1,
+    "bk_app_code": "bk_log_search",
+}
+
+SEARCH_RESULT = {"hits": {"total": 0, "hits": []}}
+
+
+class TestLocalDispatch(TestCase):
+    @patch("apps.log_esquery.esquery.esquery.EsQuery.search", return_value=SEARCH_RESULT)
+    def test_search(self, *args):
+        result = local_dispatch.search(dict(SEARCH_PARAMS))
+        self.assertEqual(result, {"result": True, "data": SEARCH_RESULT, "code": 0, "message": ""})
+
+    @patch("apps.log_esquery.esquery.esquery.EsQuery.search", side_effect=EsClientSearchException())
+    def test_search_error(self, *args):
+        result = local_dispatch.search(dict(SEARCH_PARAMS))
+        self.assertFalse(result["result"])
+        self.assertEqual(result["code"], EsClientSearchException().code)
+
+    def test_params_invalid(self, *args):
+        result = local_dispatch.scroll({"scenario_id": Scenario.LOG})
+        self.assertFalse(result["result"])
+
+    @patch("apps.log_esquery.local_dispatch.qos_allow_by_params", return_value=False)
+    def test_qos_limited(self, *args):
+        result = local_dispatch.search(dict(SEARCH_PARAMS))
+        self.assertFalse(result["result"])
+
+    @override_settings(USE_REDIS=True, BKLOG_QOS_USE=True, BKLOG_QOS_LIMIT=3, BKLOG_QOS_LIMIT_APP=["bk_log_search"])
+    def test_qos_timeout_limit(self, *args):
+        fake_redis = FakeRedis()
+        with patch("apps.log_esquery.qos.redis_client", fake_redis):
+            with patch("apps.log_esquery.esquery.esquery.EsQuery.search", side_effect=EsTimeoutException()):
+                for _ in range(3):
+                    self.assertEqual(local_dispatch.search(dict(SEARCH_PARAMS))["code"], EsTimeoutException().code)
+            # 窗口内超时次数达到上限后限制查询
+            with patch("apps.log_esquery.esquery.esquery.EsQuery.search", return_value=SEARCH_RESULT) as search:
+                self.assertTrue(local_dispatch.search(dict(SEARCH_PARAMS))["code"].endswith("429"))
+                search.assert_not_called()
+
+    @override_settings(USE_REDIS=True, BKLOG_QOS_USE=True, BKLOG_QOS_LIMIT=3, BKLOG_QOS_LIMIT_APP=["bk_log_search"])
+    def test_qos_recover(self, *args):
+        fake_redis = FakeRedis()
+        with patch("apps.log_esquery.qos.redis_client", fake_redis):
+            with patch("apps.log_esquery.esquery.esquery.EsQuery.search", side_effect=EsTimeoutException()):
+                for _ in range(2):
+                    local_dispatch.search(dict(SEARCH_PARAMS))
+            # 查询成功后清空超时计数
+            with patch("apps.log_esquery.esquery.esquery.EsQuery.search", return_value=SEARCH_RESULT):
+                self.assertTrue(local_dispatch.search(dict(SEARCH_PARAMS))["result"])
+            with patch("apps.log_esquery.esquery.esquery.EsQuery.search", side_effect=EsTimeoutException()):
+                local_dispatch.search(dict(SEARCH_PARAMS))
+            with patch("apps.log_esquery.esquery.esquery.EsQuery.search", return_value=SEARCH_RESULT):
+                self.assertTrue(local_dispatch.search(dict(SEARCH_PARAMS))["result"])
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from apps.log_esquery.esquery.esquery import EsQuery
+from apps.log_esquery.exceptions import EsClientSearchException, EsTimeoutException
+
+SEARCH_RESULT = {"hits": {"total": {"value": 1, "relation": "eq"}, "hits": [{"_source": {"log": "test"}}]}}
+ERROR_RESULT = {"error": {"type": "index_not_found_exception"}, "status": 404}
+
+
+class FakeClient(object):
+    msearch_calls = []
+    search_lists = []
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def get_instance(self):
+        return self
+
+    def msearch_key(self, index):
+        return self.cluster
+
+    def msearch(self, search_list):
+        self.msearch_calls.append([index for index, _, _ in search_list])
+        self.search_lists.append(search_list)
+        if self.cluster == "timeout":
+            raise EsTimeoutException()
+        return [ERROR_RESULT if index == "not_exists" else SEARCH_RESULT for index, _, _ in search_list]
+
+
+def fake_build_search(esquery):
+    if esquery.search_dict["indices"] == "invalid":
+        raise EsClientSearchException()
+    return FakeClient(esquery.search_dict["cluster"]), esquery.search_dict["indices"], {}, None, True
+
+
+def fake_build_dsl(esquery):
+    return FakeClient(esquery.search_dict["cluster"]), esquery.search_dict["indices"], esquery.search_dict["body"]
+
+
+class TestMSearch(TestCase):
+    @patch("apps.log_esquery.esquery.esquery.EsQuery._build_search", fake_build_search)
+    def test_msearch(self):
+        FakeClient.msearch_calls = []
+        searches = [
+            {"cluster": "cluster_a", "indices": "index_1"},
+            {"cluster": "cluster_b", "indices": "index_2"},
+            {"cluster": "cluster_a", "indices": "not_exists"},
+            {"cluster": "cluster_a", "indices": "invalid"},
+            {"cluster": "timeout", "indices": "index_3"},
+            {"cluster": "cluster_a", "indices": "index_4"},
+        ]
+        result = EsQuery({"searches": searches}).msearch()
+
+        # 同一集群只发起一次请求
+        self.assertEqual(FakeClient.msearch_calls, [["index_1", "not_exists", "index_4"], ["index_2"], ["index_3"]])
+        self.assertEqual([r["result"] for r in result], [True, True, False, False, False, True])
+        self.assertEqual(result[0]["data"]["hits"]["total"], 1)
+        self.assertEqual(result[2]["code"], EsClientSearchException().code)
+        self.assertEqual(result[4]["code"], EsTimeoutException().code)
+
+    @patch("apps.log_esquery.esquery.esquery.EsQuery._build_search", fake_build_search)
+    @patch("apps.log_esquery.esquery.esquery.EsQuery._build_dsl", fake_build_dsl)
+    def test_msearch_dsl(self):
+        FakeClient.msearch_calls = []
+        FakeClient.search_lists = []
+        searches = [
+            {"cluster": "cluster_a", "indices": "index_1", "body": {"size": 2}},
+            {"cluster": "cluster_a", "indices": "index_2"},
+        ]
+        result = EsQuery({"searches": searches}).msearch()
+
+        # DSL模式的查询直接使用请求中的DSL, 与普通查询合并为一次请求
+        self.assertEqual(FakeClient.search_lists, [[("index_1", {"size": 2}, False), ("index_2", {}, True)]])
+        self.assertEqual([r["result"] for r in result], [True, True])
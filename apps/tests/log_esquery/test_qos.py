@@ -17,22 +17,32 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
+import fnmatch
 from collections import defaultdict
-from unittest import TestCase
+from io import StringIO
 from unittest.mock import patch
 
 from django.conf import settings
-from django.test import override_settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.request import Request
 from rest_framework.test import APIRequestFactory
 
-from apps.log_esquery.qos import build_qos_key, build_qos_limit_key, esquery_qos, qos_recover, QosThrottle
+from apps.log_esquery.qos import (
+    build_qos_key,
+    build_qos_limit_key,
+    esquery_qos,
+    is_qos_limited,
+    qos_recover,
+    QosThrottle,
+)
 
 
 class FakeRedis:
     def __init__(self):
         self._zset = defaultdict(list)
+        self._string = {}
 
     def get_value(self):
         return self._zset
@@ -45,8 +55,41 @@ class FakeRedis:
         self._zset[key].sort(key=lambda x: x[1], reverse=True)
         return self._zset[key][start:end]
 
+    def zcount(self, key, min_score, max_score):
+        max_score = float(max_score)
+        return len([value for value in self._zset[key] if min_score <= value[1] <= max_score])
+
     def delete(self, key):
-        self._zset.pop(key)
+        self._zset.pop(key, None)
+        self._string.pop(key, None)
+
+    def expire(self, key, timeout):
+        return True
+
+    def exists(self, key):
+        return int(key in self._string)
+
+    def ttl(self, key):
+        return 60 if key in self._string else -2
+
+    def scan_iter(self, match):
+        return [key.encode() for key in self._string if fnmatch.fnmatch(key, match)]
+
+    def register_script(self, script):
+        # 模拟 QOS_THROTTLE_SCRIPT
+        def throttle(keys, args):
+            count_key, limit_key = keys
+            now, limit, _ = args
+            if self.exists(limit_key):
+                return 0
+            self._zset[count_key] = [value for value in self._zset[count_key] if value[1] >= now]
+            if len(self._zset[count_key]) >= limit:
+                self._string[limit_key] = "1"
+                self.delete(count_key)
+                return 0
+            return 1
+
+        return throttle
 
 
 class FakeCache:
@@ -70,11 +113,10 @@ class FakeCache:
 fake_redis = FakeRedis()
 
 
-@patch("django.core.cache.cache", FakeCache())
+@override_settings(USE_REDIS=True)
 @patch("apps.log_esquery.qos.redis_client", fake_redis)
 @patch("apps.log_search.permission.Permission.get_auth_info", return_value={"bk_app_code": "bk_monitorv3"})
 class TestQos(TestCase):
-    @override_settings(CACHES={"default": {"BACKEND": "apps.tests.log_esquery.test_qos.FakeCache"}})
     def test_throttle(self, *args, **kwargs):
         throttle = QosThrottle()
         index_set_request_1 = self._build_request(1)
@@ -86,6 +128,9 @@ class TestQos(TestCase):
         esquery_qos(index_set_request_1)
         self.assertFalse(throttle.allow_request(index_set_request_1, None))
         self.assertEqual(len(fake_redis.get_value()[key]), 0)
+        self.assertTrue(is_qos_limited(index_set_request_1.path, {"index_set_id": 1}))
+        # 已被限制时直接禁止
+        self.assertFalse(throttle.allow_request(index_set_request_1, None))
 
     def test_recover(self, *args, **kwargs):
         index_set_request_1 = self._build_request(1)
@@ -116,6 +161,18 @@ class TestQos(TestCase):
             f"{settings.APP_CODE}_qos_/test_log_index_limit", build_qos_limit_key(index_set_request_indices)
         )
 
+    def test_command_list_limit(self, *args, **kwargs):
+        index_set_request_2 = self._build_request(2)
+        limit_key = build_qos_limit_key(index_set_request_2)
+        fake_redis._string[limit_key] = "1"
+        out = StringIO()
+        try:
+            with patch("apps.log_esquery.management.commands.qos.redis_client", fake_redis):
+                call_command("qos", stdout=out)
+        finally:
+            fake_redis.delete(limit_key)
+        self.assertIn(limit_key, out.getvalue())
+
     def _build_request(self, index_set_id=None, scenario_id="", indices=""):
         factory = APIRequestFactory()
         if index_set_id:
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.test import TestCase, override_settings
+
+from apps.log_esquery.esquery.builder.query_string_planner import QueryPlanStrategy, QueryStringPlanner
+from apps.log_esquery.esquery.dsl_builder.dsl_builder import DslBuilder
+
+
+class TestQueryStringPlanner(TestCase):
+    def test_match_all(self):
+        planner = QueryStringPlanner("", fulltext_fields=["log"])
+        self.assertEqual(planner.explain["strategy"], QueryPlanStrategy.MATCH_ALL)
+        self.assertEqual(planner.query, {"query_string": {"query": "*", "analyze_wildcard": True}})
+
+    def test_rewrite_plain_keyword(self):
+        planner = QueryStringPlanner(" connection timeout ", fulltext_fields=["log"])
+        self.assertEqual(planner.query, {"match_phrase": {"log": {"query": "connection timeout"}}})
+        self.assertEqual(
+            planner.explain,
+            {
+                "strategy": QueryPlanStrategy.MATCH_PHRASE,
+                "fields": ["log"],
+                "cost": 1,
+                "reason": "plain keyword rewritten",
+            },
+        )
+        # 高亮判断仍使用原有query_string
+        self.assertEqual(planner.query_string, "* connection timeout *")
+
+    def test_ngram_field(self):
+        planner = QueryStringPlanner("timeout", fulltext_fields=["log", "message"], ngram_fields=["log.ngram"])
+        self.assertEqual(
+            planner.query,
+            {
+                "bool": {
+                    "should": [
+                        {"match": {"log.ngram": {"query": "timeout", "operator": "and"}}},
+                        {"match_phrase": {"message": {"query": "timeout"}}},
+                    ],
+                    "minimum_should_match": 1,
+                }
+            },
+        )
+        self.assertEqual(planner.explain["fields"], ["log.ngram", "message"])
+
+    def test_keep_wildcard(self):
+        wildcard_query = {"query_string": {"query": "*timeout*", "analyze_wildcard": True}}
+        # 用户要求通配匹配
+        planner = QueryStringPlanner("timeout", fulltext_fields=["log"], wildcard=True)
+        self.assertEqual(planner.query, wildcard_query)
+        self.assertEqual(planner.explain["reason"], "wildcard requested")
+        # 未知全文检索字段
+        planner = QueryStringPlanner("timeout")
+        self.assertEqual(planner.query, wildcard_query)
+        self.assertEqual(planner.explain["strategy"], QueryPlanStrategy.LEADING_WILDCARD)
+        with override_settings(ESQUERY_QUERY_PLANNER_ENABLED=False):
+            planner = QueryStringPlanner("timeout", fulltext_fields=["log"])
+            self.assertEqual(planner.query, wildcard_query)
+
+    def test_query_syntax(self):
+        planner = QueryStringPlanner("log: error AND level: 1", fulltext_fields=["log"])
+        self.assertEqual(planner.explain["strategy"], QueryPlanStrategy.QUERY_STRING)
+        self.assertEqual(
+            planner.query, {"query_string": {"query": "log: error AND level: 1", "analyze_wildcard": True}}
+        )
+
+        planner = QueryStringPlanner("log: *timeout", fulltext_fields=["log"])
+        self.assertEqual(planner.explain["strategy"], QueryPlanStrategy.LEADING_WILDCARD)
+
+    def test_dsl_builder(self):
+        planner = QueryStringPlanner("timeout", fulltext_fields=["log"])
+        body = DslBuilder(search_string=planner.query_string, query_clause=planner.query).body
+        self.assertEqual(body["query"]["bool"]["filter"][0], {"match_phrase": {"log": {"query": "timeout"}}})
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import json
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from bk_monitor.exceptions import MonitorReportRequestException
+from bk_monitor.handler.monitor import CustomReporter
+from bk_monitor.models import MonitorReportConfig
+from bk_monitor.utils.report_config import ReportConfigSnapshot
+
+DATA_NAME = "test_report"
+METRIC_COUNT = 1000
+
+
+class FakeClient(object):
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.bodies = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def custom_report(self, data, timeout=None):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise MonitorReportRequestException("002", "timeout")
+            self.bodies.append(json.loads(data))
+
+
+class TestCustomReporter(TestCase):
+    def setUp(self):
+        ReportConfigSnapshot.invalidate(notify=False)
+        MonitorReportConfig.objects.create(data_name=DATA_NAME, bk_biz_id=2, data_id=1, access_token="token")
+        self.metrics = {DATA_NAME: [{"metrics": {"m": i}} for i in range(METRIC_COUNT)]}
+
+    def report(self, client):
+        with patch("bk_monitor.handler.monitor.MetricCollector.collect", return_value=self.metrics), patch(
+            "bk_monitor.handler.monitor.REPORT_RETRY_INTERVAL", 0
+        ):
+            CustomReporter(client=client, bk_biz_id=2, app_id="bk_log").report()
+
+    def test_concurrent_report(self):
+        client = FakeClient()
+        self.report(client)
+        self.assertEqual(len(client.bodies), 10)
+        self.assertGreater(client.max_running, 1)
+        self.assertEqual(sum(len(body["data"]) for body in client.bodies), METRIC_COUNT)
+        self.assertTrue(all(body["access_token"] == "token" for body in client.bodies))
+
+    def test_retry(self):
+        client = FakeClient(fail_times=2)
+        self.report(client)
+        self.assertEqual(sum(len(body["data"]) for body in client.bodies), METRIC_COUNT)
+
+    def test_snapshot_invalidate(self):
+        self.assertEqual(ReportConfigSnapshot.get(DATA_NAME).access_token, "token")
+        with self.assertNumQueries(0):
+            ReportConfigSnapshot.get(DATA_NAME)
+
+        config = MonitorReportConfig.objects.get(data_name=DATA_NAME)
+        config.is_enable = False
+        config.save()
+        self.assertIsNone(ReportConfigSnapshot.get(DATA_NAME))
+
+        client = FakeClient()
+        self.report(client)
+        self.assertEqual(client.bodies, [])
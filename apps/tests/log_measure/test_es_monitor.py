@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import time
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase, override_settings
+
+from apps.log_measure.handlers.metric_collectors.es import (
+    EsMonitor,
+    compile_metrics,
+    compiled_health_metrics,
+    process_metric,
+)
+
+ES_MODULE = "apps.log_measure.handlers.metric_collectors.es"
+
+
+def build_cluster_info(cluster_id):
+    return {
+        "cluster_config": {
+            "cluster_id": cluster_id,
+            "cluster_name": f"cluster_{cluster_id}",
+            "version": "7.10.2",
+            "custom_option": {"bk_biz_id": 2},
+        }
+    }
+
+
+def fake_es_route(params, timeout=None):
+    if params["storage_cluster_id"] == 2:
+        # 慢集群
+        time.sleep(0.5)
+    if params["url"] == "_cluster/health":
+        return {"status": "green", "number_of_nodes": 3}
+    return None
+
+
+class TestEsMetricCompile(TestCase):
+    def test_compile_metrics(self):
+        compiled = compile_metrics(
+            {
+                "elasticsearch.docs.count": ("gauge", "primaries.docs.count"),
+                "elasticsearch.search.query.time": ("gauge", "query.time", lambda ms: ms / 1000),
+            }
+        )
+        self.assertIn(("elasticsearch_docs_count", ("primaries", "docs", "count"), None), compiled)
+        self.assertEqual(compiled[1][1], ("query", "time"))
+        self.assertEqual(compiled[1][2](2000), 2)
+
+    def test_compiled_cache(self):
+        self.assertIs(compiled_health_metrics((7, 10, 2)), compiled_health_metrics((7, 10, 2)))
+
+    def test_process_metric(self):
+        data = {"primaries": {"docs": {"count": "10"}}}
+        metric = process_metric(data, "docs_count", ("primaries", "docs", "count"), dimensions={"a": 1}, timestamp=1)
+        self.assertEqual(metric.metric_value, 10)
+        self.assertEqual(metric.timestamp, 1)
+        self.assertIsNone(process_metric(data, "docs_deleted", ("primaries", "docs", "deleted")))
+        self.assertIsNone(process_metric(data, "missing", ("total", "docs", "count")))
+
+
+class TestEsMonitor(TestCase):
+    @override_settings(ES_MONITOR_CLUSTER_TIMEOUT=0.2)
+    def test_partial_result(self):
+        metric_utils = MagicMock(report_ts=1000, cluster_infos={1: build_cluster_info(1), 2: build_cluster_info(2)})
+        with patch(f"{ES_MODULE}.MetricUtils.get_instance", return_value=metric_utils), patch(
+            f"{ES_MODULE}.BkLogApi.es_route", side_effect=fake_es_route
+        ):
+            start = time.time()
+            metrics = EsMonitor.elastic()
+            self.assertLess(time.time() - start, 0.5)
+
+        cluster_ids = {metric.dimensions["cluster_id"] for metric in metrics}
+        self.assertEqual(cluster_ids, {1})
+        self.assertTrue(all(metric.timestamp == 1000 for metric in metrics))
+        self.assertIn("elasticsearch_cluster_status", {metric.metric_name for metric in metrics})
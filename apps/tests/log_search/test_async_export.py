@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import gzip
+import json
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
+from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler
+from apps.log_search.models import Scenario
+from apps.log_search.tasks.async_export import AsyncExportUtils, SortValues
+from apps.utils.remote_storage import NfsStorage
+
+SLICE_MAX = 4
+PAGE_COUNT = 2
+PAGE_SIZE = 3
+FILE_NAME = "bk_log_search_test"
+PACKAGE_NAME = f"{FILE_NAME}.gz"
+SCROLL_ID = "scroll_id"
+TOTAL = SLICE_MAX * PAGE_COUNT * PAGE_SIZE
+SORTED_FIELDS = ["dtEventTimeStamp", "gseIndex", "iterationIndex"]
+INDEX_SET_ID = 0
+ES_SEARCH_CONTEXT = IndexSetSearchContext(
+    index_set_id=INDEX_SET_ID,
+    indices="test_index",
+    scenario_id=Scenario.ES,
+    storage_cluster_id=1,
+    time_field="dtEventTimeStamp",
+    time_field_type="date",
+    time_field_unit="millisecond",
+)
+
+
+class FakeSearchHandler(object):
+    def __init__(self, size, error_slice=None, scenario_id=Scenario.ES):
+        self.size = size
+        self.error_slice = error_slice
+        self.scenario_id = scenario_id
+        self.sort_list = [["dtEventTimeStamp", "desc"]]
+        self.cleared_scroll_ids = []
+        self.search_after_fields = None
+
+    def sliced_scroll_result(self, slice_id, slice_max):
+        # 分片内按时间倒序返回, 各分片的时间交错
+        timestamps = sorted(range(slice_id, TOTAL, slice_max), reverse=True)
+        for page_index in range(PAGE_COUNT):
+            if slice_id == self.error_slice:
+                raise Exception("scroll error")
+            page = timestamps[page_index * PAGE_SIZE : (page_index + 1) * PAGE_SIZE]
+            yield [{"_source": {"slice": slice_id, "dtEventTimeStamp": ts}, "sort": [ts]} for ts in page]
+
+    @staticmethod
+    def _page(page_index):
+        return [{"page": page_index, "line": line} for line in range(PAGE_SIZE)]
+
+    def pre_get_result(self, sorted_fields, size):
+        scroll_id = SCROLL_ID if self.scenario_id == Scenario.ES else None
+        return {"_scroll_id": scroll_id, "hits": {"hits": [{"_source": log} for log in self._page(0)]}}
+
+    def scroll_result(self, result):
+        try:
+            for page_index in range(1, PAGE_COUNT * SLICE_MAX):
+                yield {"origin_log_list": self._page(page_index)}
+        finally:
+            self.clear_scroll(result["_scroll_id"])
+
+    def search_after_result(self, result, sorted_fields):
+        self.search_after_fields = sorted_fields
+        for page_index in range(1, PAGE_COUNT * SLICE_MAX):
+            yield {"origin_log_list": self._page(page_index)}
+
+    def clear_scroll(self, scroll_id):
+        if scroll_id:
+            self.cleared_scroll_ids.append(scroll_id)
+
+
+class FakeSlicedScrollApi(object):
+    """
+    按slice参数返回FakeSearchHandler中对应分片的数据, 模拟ES的sliced scroll
+    """
+
+    def __init__(self):
+        self.slice_pages = {}
+        self.search_params = []
+
+    def search(self, params, data_api_retry_cls=None):
+        self.search_params.append(params)
+        slice_id = params["slice"]["id"]
+        scroll_id = f"{SCROLL_ID}_{slice_id}"
+        self.slice_pages[scroll_id] = FakeSearchHandler(size=TOTAL).sliced_scroll_result(slice_id, SLICE_MAX)
+        return self.scroll({"scroll_id": scroll_id})
+
+    def scroll(self, params, data_api_retry_cls=None):
+        return {"_scroll_id": params["scroll_id"], "hits": {"hits": next(self.slice_pages[params["scroll_id"]], [])}}
+
+
+@override_settings(ASYNC_EXPORT_SCROLL_SLICES=SLICE_MAX)
+@patch("apps.log_search.tasks.async_export.AsyncExportUtils.init_notify_type", lambda _: None)
+class TestAsyncExport(TestCase):
+    def setUp(self) -> None:
+        self.nfs_path = tempfile.mkdtemp()
+
+    def _export_util(self, search_handler, total=TOTAL):
+        with patch(
+            "apps.log_search.tasks.async_export.AsyncExportUtils.init_remote_storage",
+            lambda _: NfsStorage(self.nfs_path),
+        ):
+            return AsyncExportUtils(
+                search_handler=search_handler,
+                sorted_fields=SORTED_FIELDS,
+                file_name=FILE_NAME,
+                package_name=PACKAGE_NAME,
+                total=total,
+            )
+
+    def _read_lines(self):
+        with gzip.open(os.path.join(self.nfs_path, PACKAGE_NAME), "rt") as f:
+            return [json.loads(line) for line in f.read().splitlines()]
+
+    def test_export_package(self):
+        export_util = self._export_util(FakeSearchHandler(size=100))
+        self.assertTrue(export_util.can_slice())
+        export_util.export_package()
+
+        package_path = os.path.join(self.nfs_path, PACKAGE_NAME)
+        self.assertEqual(export_util.package_size, os.path.getsize(package_path))
+        with gzip.open(package_path, "rt") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), SLICE_MAX * PAGE_COUNT * PAGE_SIZE)
+
+    def test_export_package_size_limit(self):
+        search_handler = FakeSearchHandler(size=10)
+        export_util = self._export_util(search_handler)
+        self.assertFalse(export_util.can_slice())
+        export_util.export_package()
+
+        # 限制条数时按顺序导出前N条, 并释放scroll
+        lines = self._read_lines()
+        self.assertEqual(len(lines), 10)
+        self.assertEqual([(line["page"], line["line"]) for line in lines[:4]], [(0, 0), (0, 1), (0, 2), (1, 0)])
+        self.assertEqual(search_handler.cleared_scroll_ids, [SCROLL_ID])
+
+    def test_export_package_merge(self):
+        export_util = self._export_util(FakeSearchHandler(size=100))
+        self.assertTrue(export_util.can_slice())
+        export_util.export_package()
+        # 各分片按排序值归并, 整体保持时间倒序
+        timestamps = [line["dtEventTimeStamp"] for line in self._read_lines()]
+        self.assertEqual(timestamps, list(range(TOTAL - 1, -1, -1)))
+
+    def test_export_package_first_page(self):
+        search_handler = FakeSearchHandler(size=PAGE_SIZE)
+        self._export_util(search_handler).export_package()
+        # 只导出第一页时也需要释放scroll
+        self.assertEqual(len(self._read_lines()), PAGE_SIZE)
+        self.assertEqual(search_handler.cleared_scroll_ids, [SCROLL_ID])
+
+    def test_export_package_search_after(self):
+        search_handler = FakeSearchHandler(size=100, scenario_id=Scenario.LOG)
+        export_util = self._export_util(search_handler)
+        self.assertFalse(export_util.can_slice())
+        export_util.export_package()
+        self.assertEqual(search_handler.search_after_fields, SORTED_FIELDS)
+        self.assertEqual(len(self._read_lines()), TOTAL)
+
+    def test_export_package_error(self):
+        export_util = self._export_util(FakeSearchHandler(size=100, error_slice=1))
+        with self.assertRaises(Exception):
+            export_util.export_package()
+        self.assertEqual(os.listdir(self.nfs_path), [])
+
+    @patch(
+        "apps.log_search.handlers.search.mapping_handlers.MappingHandlers.is_nested_field",
+        lambda _, __: False,
+    )
+    @patch(
+        "apps.log_search.handlers.search.search_context.IndexSetSearchContext.get",
+        lambda index_set_id, with_mapping: ES_SEARCH_CONTEXT,
+    )
+    @patch("apps.log_search.handlers.search.search_handlers_esquery.MAX_RESULT_WINDOW", PAGE_SIZE)
+    @patch("apps.log_search.tasks.async_export.MAX_RESULT_WINDOW", PAGE_SIZE)
+    def test_export_package_search_handler(self):
+        search_handler = SearchHandler(INDEX_SET_ID, {"size": 100}, pre_check_enable=False)
+        # 未指定排序时默认按时间倒序, 同样可以分片导出
+        self.assertEqual(search_handler.sort_list, [["dtEventTimeStamp", "desc"]])
+        export_util = self._export_util(search_handler)
+        self.assertTrue(export_util.can_slice())
+
+        api = FakeSlicedScrollApi()
+        with patch("apps.api.BkLogApi.search", api.search), patch("apps.api.BkLogApi.scroll", api.scroll), patch(
+            "apps.api.BkLogApi.clear_scroll"
+        ) as clear_scroll:
+            export_util.export_package()
+
+        self.assertEqual(sorted(params["slice"]["id"] for params in api.search_params), list(range(SLICE_MAX)))
+        self.assertTrue(all(params["sort_list"] == search_handler.sort_list for params in api.search_params))
+        timestamps = [line["dtEventTimeStamp"] for line in self._read_lines()]
+        self.assertEqual(timestamps, list(range(TOTAL - 1, -1, -1)))
+        self.assertEqual(clear_scroll.call_count, SLICE_MAX)
+
+    def test_sort_values(self):
+        orders = ["desc", "asc"]
+        values = [[2, "b"], [None, "a"], [2, "a"], [3, None], [3, "a"]]
+        self.assertEqual(
+            sorted(values, key=lambda value: SortValues(value, orders)),
+            [[3, "a"], [3, None], [2, "a"], [2, "b"], [None, "a"]],
+        )
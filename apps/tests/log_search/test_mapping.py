@@ -18,11 +18,13 @@ WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+from django.core.cache import caches
 from django.test import TestCase
 from unittest.mock import patch
 
 from apps.log_search.handlers.search.mapping_handlers import MappingHandlers
 from apps.log_search.models import Scenario
+from apps.utils.cache import LayeredCache
 
 INDICES = ""
 INDEX_SET_ID = 0
@@ -99,3 +101,108 @@ class TestMappingHandler(TestCase):
         self.assertFalse(
             MappingHandlers.async_export_fields(FAILED_LOG_ASYNC_FIELDS, Scenario.LOG)["async_export_usable"]
         )
+
+
+FINGERPRINT_INDICES = "2_bklog.fingerprint_a,2_bklog.fingerprint_b"
+
+
+def build_mapping(result_table_id, date, properties):
+    index = "v2_{}_{}_0".format(result_table_id.replace(".", "_"), date)
+    return {index: {"mappings": {"log": {"properties": properties}}}}
+
+
+MAPPING_RESULT = [
+    build_mapping("2_bklog.fingerprint_a", "20200320", {"log": {"type": "text"}}),
+    build_mapping("2_bklog.fingerprint_a", "20200321", {"log": {"type": "text"}, "serverIp": {"type": "keyword"}}),
+    build_mapping("2_bklog.fingerprint_b", "20200321", {"dtEventTimeStamp": {"type": "date"}}),
+]
+
+
+class MappingApi(object):
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def __call__(self, params):
+        self.calls.append(params["indices"])
+        return self.result
+
+
+class TestMappingFingerprint(TestCase):
+    def setUp(self) -> None:
+        backend = caches["locmem"]
+        backend.clear()
+        self.cache_patcher = patch(
+            "apps.log_search.handlers.search.mapping_handlers.layered_cache", LayeredCache(backend=backend)
+        )
+        self.cache_patcher.start()
+
+    def tearDown(self) -> None:
+        self.cache_patcher.stop()
+
+    @staticmethod
+    def build_handlers(index_set_id, indices=FINGERPRINT_INDICES):
+        return MappingHandlers(indices, index_set_id, Scenario.LOG, STORAGE_CLUSTER_ID, "dtEventTimeStamp")
+
+    def test_get_index_fields(self):
+        mapping_api = MappingApi(MAPPING_RESULT)
+        with patch("apps.api.BkLogApi.mapping", mapping_api):
+            fields = self.build_handlers(1).get_index_fields()
+            # 共用结果表的索引集不重新拉取mapping
+            self.assertEqual(self.build_handlers(2, "2_bklog.fingerprint_a").get_index_fields()[0]["field_name"], "log")
+            self.assertEqual(self.build_handlers(3).get_index_fields(), fields)
+        self.assertEqual(mapping_api.calls, [FINGERPRINT_INDICES])
+        self.assertEqual([field["field_name"] for field in fields], ["log", "serverIp", "dtEventTimeStamp"])
+
+    def test_refresh_property_group(self):
+        handlers = self.build_handlers(1)
+        with patch("apps.api.BkLogApi.mapping", MappingApi(MAPPING_RESULT)):
+            property_group, changed_keys = handlers.refresh_property_group()
+            self.assertEqual(changed_keys, ["2_bklog.fingerprint_a", "2_bklog.fingerprint_b"])
+            self.assertEqual(set(property_group["2_bklog.fingerprint_a"]["property"]), {"log", "serverIp"})
+            fields = handlers.get_index_fields()
+            self.assertEqual(handlers.refresh_property_group()[1], [])
+
+        changed_result = MAPPING_RESULT + [
+            build_mapping(
+                "2_bklog.fingerprint_b", "20200322", {"dtEventTimeStamp": {"type": "date"}, "path": {"type": "keyword"}}
+            )
+        ]
+        with patch("apps.api.BkLogApi.mapping", MappingApi(changed_result)):
+            self.assertEqual(handlers.refresh_property_group()[1], ["2_bklog.fingerprint_b"])
+            new_fields = handlers.get_index_fields()
+        self.assertEqual(len(new_fields), len(fields) + 1)
+        self.assertIn("path", [field["field_name"] for field in new_fields])
+
+    def test_get_fulltext_fields(self):
+        with patch("apps.api.BkLogApi.mapping", MappingApi(MAPPING_RESULT)):
+            self.assertEqual(self.build_handlers(1).get_fulltext_fields(), (["log"], []))
+
+        ngram_result = [
+            build_mapping(
+                "2_bklog.fingerprint_a",
+                "20200322",
+                {
+                    "log": {"type": "text", "fields": {"ngram": {"type": "text", "analyzer": "log_ngram_analyzer"}}},
+                    "message": {"type": "text"},
+                },
+            ),
+        ]
+        with patch("apps.api.BkLogApi.mapping", MappingApi(ngram_result)):
+            handlers = self.build_handlers(1)
+            handlers.refresh_property_group()
+            self.assertEqual(handlers.get_fulltext_fields(), (["log"], ["log.ngram"]))
+
+        no_log_result = [
+            build_mapping(
+                "2_bklog.fingerprint_a",
+                "20200322",
+                {"message": {"type": "text"}, "ext": {"properties": {"detail": {"type": "text"}}}},
+            ),
+        ]
+        with patch("apps.api.BkLogApi.mapping", MappingApi(no_log_result)):
+            handlers = self.build_handlers(1, "2_bklog.fingerprint_a")
+            handlers.refresh_property_group()
+            fulltext_fields, ngram_fields = handlers.get_fulltext_fields()
+        self.assertEqual(sorted(fulltext_fields), ["ext.detail", "message"])
+        self.assertEqual(ngram_fields, [])
@@ -17,16 +17,42 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
+import gzip
+import json
+
 import arrow
 
+from django.core.cache import caches
 from django.test import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+from apps.exceptions import ApiResultError
 from apps.log_search.constants import LOG_ASYNC_FIELDS
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
 from apps.log_search.handlers.search.search_handlers_esquery import SearchHandler
+from apps.log_search.models import Scenario
 
 INDEX_SET_ID = 0
+SEARCH_CONTEXT = IndexSetSearchContext(
+    index_set_id=INDEX_SET_ID,
+    indices="",
+    scenario_id="",
+    storage_cluster_id=-1,
+    time_field="dtEventTimeStamp",
+    time_field_type="time",
+    time_field_unit="s",
+)
 SEARCH_DICT = {"size": 100000}
+LOG_SEARCH_CONTEXT = IndexSetSearchContext(
+    index_set_id=INDEX_SET_ID,
+    indices="2_bklog_test",
+    scenario_id=Scenario.LOG,
+    storage_cluster_id=-1,
+    time_field="dtEventTimeStamp",
+    time_field_type="date",
+    time_field_unit="second",
+)
+CONTEXT_SEARCH_DICT = {"gseIndex": 100, "serverIp": "127.0.0.1", "path": "/tmp/out.txt", "size": 2}
 
 HITS = [
     {
@@ -70,12 +96,8 @@ class TestSearchHandler(TestCase):
         lambda _, __: False,
     )
     @patch(
-        "apps.log_search.handlers.search.search_handlers_esquery.SearchHandler._init_indices_str",
-        lambda _, index_set_id: "",
-    )
-    @patch(
-        "apps.log_search.handlers.search.search_handlers_esquery.SearchHandler._init_time_field",
-        lambda _, index_set_id, scenario_id: ("dtEventTimeStamp", "time", "s"),
+        "apps.log_search.handlers.search.search_context.IndexSetSearchContext.get",
+        lambda index_set_id, with_mapping: SEARCH_CONTEXT,
     )
     def setUp(self) -> None:
         self.search_handler = SearchHandler(index_set_id=INDEX_SET_ID, search_dict=SEARCH_DICT, pre_check_enable=False)
@@ -108,3 +130,147 @@ class TestSearchHandler(TestCase):
             logs_result.extend(result["list"])
 
         self.assertEqual(len(logs_result), 90000)
+
+    @patch("apps.api.BkLogApi.search", lambda _, data_api_retry_cls: SEARCH_RESULT)
+    @patch("apps.api.BkLogApi.scroll", lambda _, data_api_retry_cls: SEARCH_RESULT)
+    def test_export_stream(self):
+        self.search_handler.is_scroll = True
+        self.search_handler.scroll = "1m"
+        self.search_handler.size = 25000
+
+        lines = b"".join(self.search_handler.export_stream()).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 25000)
+        self.assertEqual(json.loads(lines[0]), HITS[0]["_source"])
+
+        content = gzip.decompress(b"".join(self.search_handler.export_stream(is_gzip=True)))
+        self.assertEqual(len(content.splitlines()), 25000)
+
+    @patch("apps.api.BkLogApi.search", lambda _, data_api_retry_cls: SEARCH_RESULT)
+    @patch("apps.api.BkLogApi.scroll", lambda _, data_api_retry_cls: SEARCH_RESULT)
+    def test_export_stream_clear_scroll(self):
+        self.search_handler.is_scroll = True
+        self.search_handler.scroll = "1m"
+        self.search_handler.size = 25000
+
+        with patch("apps.api.BkLogApi.clear_scroll") as clear_scroll:
+            b"".join(self.search_handler.export_stream())
+            self.assertEqual(clear_scroll.call_args[0][0]["scroll_id"], SEARCH_RESULT["_scroll_id"])
+
+            # 客户端中途断开时也需要释放scroll
+            clear_scroll.reset_mock()
+            stream = self.search_handler.export_stream()
+            next(stream)
+            clear_scroll.assert_not_called()
+            stream.close()
+            self.assertEqual(clear_scroll.call_count, 1)
+
+    def test_deal_query_result(self):
+        search_result = {
+            "took": 1,
+            "hits": {
+                "total": 1,
+                "hits": [
+                    {
+                        "_index": "test_index",
+                        "_source": {"log": "error log", "ext": {"container": "bk-log-api"}},
+                        "highlight": {"log": ["<mark>error</mark>", " log"]},
+                    }
+                ],
+            },
+        }
+        result = self.search_handler._deal_query_result(search_result, need_fields=True)
+
+        self.assertEqual(result["origin_log_list"], [{"log": "error log", "ext": {"container": "bk-log-api"}}])
+        self.assertEqual(
+            result["list"],
+            [{"log": "<mark>error</mark> log", "ext": {"container": "bk-log-api"}, "index": "test_index"}],
+        )
+        self.assertEqual(
+            self.search_handler.field,
+            {"log": {"max_length": 22}, "ext.container": {"max_length": 13}, "index": {"max_length": 10}},
+        )
+
+        result = self.search_handler._deal_query_result(search_result, need_list=False)
+        self.assertEqual(result["list"], [])
+        self.assertEqual(len(result["origin_log_list"]), 1)
+
+
+class SyncExecutor(object):
+    def submit(self, fn, *args):
+        return fn(*args)
+
+
+def context_dsl(params):
+    body = params["body"]
+    gse_index = 100 - body["from"] if body["sort"][0]["dtEventTimeStamp"]["order"] == "desc" else 100 + body["from"]
+    hits = [{"_index": "test_index", "_source": {"gseIndex": gse_index + i, "log": "log"}} for i in range(body["size"])]
+    return {"took": 1, "hits": {"total": len(hits), "hits": hits}}
+
+
+def context_msearch(dsl_func=context_dsl):
+    def msearch(params):
+        return [{"result": True, "data": dsl_func(search), "code": 0, "message": ""} for search in params["searches"]]
+
+    return MagicMock(side_effect=msearch)
+
+
+@patch(
+    "apps.log_search.handlers.search.mapping_handlers.MappingHandlers.is_nested_field",
+    lambda _, __: False,
+)
+@patch(
+    "apps.log_search.handlers.search.search_context.IndexSetSearchContext.get",
+    lambda index_set_id, with_mapping: LOG_SEARCH_CONTEXT,
+)
+@patch("apps.log_search.handlers.search.search_handlers_esquery.cache", caches["locmem"])
+@patch("apps.log_search.handlers.search.search_handlers_esquery.context_prefetch_executor", SyncExecutor())
+class TestSearchContext(TestCase):
+    def setUp(self) -> None:
+        caches["locmem"].clear()
+
+    @staticmethod
+    def search_context(**kwargs):
+        search_dict = dict(CONTEXT_SEARCH_DICT, search_type_tag="context", **kwargs)
+        return SearchHandler(INDEX_SET_ID, search_dict, pre_check_enable=False).search_context()
+
+    @staticmethod
+    def requested_pages(msearch):
+        return sorted(
+            (search["body"]["sort"][0]["dtEventTimeStamp"]["order"], search["body"]["from"])
+            for call in msearch.call_args_list
+            for search in call[0][0]["searches"]
+        )
+
+    def test_prefetch(self):
+        with patch("apps.api.BkLogApi.msearch", context_msearch()) as msearch:
+            result = self.search_context(zero=True)
+            self.assertEqual(len(result["list"]), 4)
+            # 上下两个方向的首页合并为一次msearch
+            self.assertEqual(len(msearch.call_args_list[0][0][0]["searches"]), 2)
+            # 上下两个方向的首页, 以及预取的下一页
+            self.assertEqual(self.requested_pages(msearch), [("asc", 0), ("asc", 2), ("desc", 0), ("desc", 2)])
+
+            # 加载更多直接命中预取结果, 同时继续预取下一页
+            msearch.reset_mock()
+            result = self.search_context(begin=-2)
+            self.assertEqual([log["gseIndex"] for log in result["list"]], [99, 98])
+            self.assertEqual(self.requested_pages(msearch), [("desc", 4)])
+
+    def test_msearch_error(self):
+        def msearch(params):
+            error = {"result": False, "data": None, "code": "3621002", "message": "search error"}
+            return [{"result": True, "data": context_dsl(params["searches"][0]), "code": 0, "message": ""}, error]
+
+        with patch("apps.api.BkLogApi.msearch", MagicMock(side_effect=msearch)):
+            with self.assertRaises(ApiResultError):
+                self.search_context(zero=True)
+
+    def test_no_prefetch_at_end(self):
+        def last_page_dsl(params):
+            result = context_dsl(params)
+            result["hits"]["hits"] = result["hits"]["hits"][:1]
+            return result
+
+        with patch("apps.api.BkLogApi.msearch", context_msearch(last_page_dsl)) as msearch:
+            self.search_context(begin=2)
+            self.assertEqual(self.requested_pages(msearch), [("asc", 2)])
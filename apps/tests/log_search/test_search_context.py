@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+from django.core.cache import caches
+from dataclasses import replace
+
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+
+from apps.log_search.handlers.search.mapping_handlers import MappingHandlers
+from apps.log_search.handlers.search.search_context import IndexSetSearchContext
+from apps.log_search.tasks.bkdata import sync_auth_status
+from apps.log_search.models import LogIndexSet, LogIndexSetData, Scenario
+
+RESULT_TABLE_ID = "2_bklog.search_context"
+TIME_FIELD = "log_time"
+
+
+@patch("apps.log_search.handlers.search.search_context.cache", caches["locmem"])
+class TestIndexSetSearchContext(TestCase):
+    def setUp(self) -> None:
+        caches["locmem"].clear()
+        IndexSetSearchContext._local = None
+        self.index_set = LogIndexSet.objects.create(
+            index_set_name="search_context",
+            project_id=1,
+            scenario_id=Scenario.ES,
+            storage_cluster_id=1,
+            time_field=TIME_FIELD,
+            time_field_type="date",
+            time_field_unit="millisecond",
+            source_app_code="bk_log_search",
+        )
+        LogIndexSetData.objects.create(
+            index_set_id=self.index_set.index_set_id,
+            bk_biz_id=2,
+            result_table_id=RESULT_TABLE_ID,
+            apply_status=LogIndexSetData.Status.NORMAL,
+        )
+
+    def test_build(self):
+        context = IndexSetSearchContext.get(self.index_set.index_set_id, with_mapping=False)
+        self.assertEqual(context.indices, RESULT_TABLE_ID)
+        self.assertEqual(context.scenario_id, Scenario.ES)
+        self.assertEqual(context.storage_cluster_id, 1)
+        self.assertEqual(context.time_field, TIME_FIELD)
+        self.assertEqual(context.time_field_unit, "millisecond")
+        self.assertFalse(context.has_mapping)
+
+    def test_cache_hit(self):
+        index_set_id = self.index_set.index_set_id
+        with patch.object(IndexSetSearchContext, "build", wraps=IndexSetSearchContext.build) as build:
+            first = IndexSetSearchContext.get(index_set_id, with_mapping=False)
+            second = IndexSetSearchContext.get(index_set_id, with_mapping=False)
+            self.assertIs(first, second)
+
+            # 进程内缓存失效后从共享缓存恢复, 不重新构建
+            IndexSetSearchContext._local = None
+            third = IndexSetSearchContext.get(index_set_id, with_mapping=False)
+            self.assertEqual(first, third)
+            self.assertEqual(build.call_count, 1)
+
+    def test_invalidate(self):
+        index_set_id = self.index_set.index_set_id
+        IndexSetSearchContext.get(index_set_id, with_mapping=False)
+
+        LogIndexSetData.objects.create(
+            index_set_id=index_set_id,
+            bk_biz_id=2,
+            result_table_id="2_bklog.search_context_other",
+            apply_status=LogIndexSetData.Status.NORMAL,
+        )
+        # 保存时立即清理当前进程缓存
+        self.assertNotIn(index_set_id, IndexSetSearchContext._get_local())
+
+        IndexSetSearchContext.invalidate(index_set_id)
+        context = IndexSetSearchContext.get(index_set_id, with_mapping=False)
+        self.assertEqual(set(context.indices.split(",")), {RESULT_TABLE_ID, "2_bklog.search_context_other"})
+
+    def test_fields_snapshot_not_invalidate(self):
+        index_set_id = self.index_set.index_set_id
+        IndexSetSearchContext.get(index_set_id, with_mapping=False)
+        self.index_set.save(update_fields=["fields_snapshot"])
+        self.assertIn(index_set_id, IndexSetSearchContext._get_local())
+
+    @override_settings(INDEX_SET_SEARCH_CONTEXT_CHECK_INTERVAL=0)
+    def test_reload_mapping_after_fingerprint_changed(self):
+        index_set_id = self.index_set.index_set_id
+
+        def load_mapping(context):
+            return replace(context, has_mapping=True, mapping_fingerprint=fingerprint, nested_fields=(fingerprint,))
+
+        with patch.object(IndexSetSearchContext, "load_mapping", autospec=True, side_effect=load_mapping), patch.object(
+            MappingHandlers, "get_mapping_fingerprint", side_effect=lambda: fingerprint
+        ):
+            fingerprint = "old"
+            self.assertEqual(IndexSetSearchContext.get(index_set_id).nested_fields, ("old",))
+            self.assertEqual(IndexSetSearchContext.get(index_set_id).nested_fields, ("old",))
+
+            # mapping变化后重新加载mapping相关信息
+            fingerprint = "new"
+            self.assertEqual(IndexSetSearchContext.get(index_set_id).nested_fields, ("new",))
+
+    @override_settings(RUN_VER="ieod")
+    def test_sync_auth_status_invalidate(self):
+        self.index_set.scenario_id = Scenario.BKDATA
+        self.index_set.save()
+        LogIndexSetData.objects.filter(index_set_id=self.index_set.index_set_id).update(
+            apply_status=LogIndexSetData.Status.PENDING
+        )
+        with patch(
+            "apps.log_search.tasks.bkdata.BkDataAuthHandler.list_authorized_rt_by_token", return_value=[RESULT_TABLE_ID]
+        ), patch.object(IndexSetSearchContext, "invalidate") as invalidate:
+            self.assertEqual(sync_auth_status(), 1)
+        invalidate.assert_called_once_with(self.index_set.index_set_id)
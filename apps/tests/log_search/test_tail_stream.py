@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import os
+import time
+from unittest import skipUnless
+
+import redis
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+
+from apps.log_search.handlers.search.tail_stream import TailStreamHandler
+from apps.log_search.models import Scenario
+
+INDEX_SET_ID = 1
+SEARCH_DICT = {"serverIp": "127.0.0.1", "path": "/tmp/health_check.log"}
+NOW = int(time.time() * 1000)
+# 配置后使用真实的redis执行Lua脚本, 例如 redis://127.0.0.1:6379/15
+TEST_REDIS_URL = os.environ.get("BKAPP_TEST_REDIS_URL")
+
+
+def make_log(timestamp, gse_index, iteration_index=0):
+    return {
+        "dtEventTimeStamp": NOW + timestamp,
+        "gseIndex": gse_index,
+        "iterationIndex": iteration_index,
+        "serverIp": "127.0.0.1",
+        "path": "/tmp/health_check.log",
+        "log": f"line {gse_index}-{iteration_index}",
+    }
+
+
+class FakeSearchHandler(object):
+    """
+    模拟ES中的日志流, 按gseIndex过滤
+    """
+
+    logs = []
+    calls = []
+
+    def __init__(self, index_set_id, search_dict):
+        self.scenario_id = Scenario.LOG
+        self.start = 0
+        self.zero = False
+        self.gseIndex = None
+
+    def search_tail_f(self):
+        FakeSearchHandler.calls.append({"zero": self.zero, "gseIndex": self.gseIndex})
+        if self.zero:
+            logs = list(self.logs)
+        else:
+            logs = [log for log in self.logs if log["gseIndex"] > self.gseIndex][:30]
+        return {"list": [dict(log) for log in logs], "origin_log_list": [dict(log) for log in logs]}
+
+
+@override_settings(TAIL_STREAM_MIN_INTERVAL=1, TAIL_STREAM_MAX_INTERVAL=4, TAIL_STREAM_BUFFER_SIZE=3)
+@patch("apps.log_search.handlers.search.tail_stream.cache", caches["locmem"])
+@patch("apps.log_search.handlers.search.tail_stream.SearchHandler", FakeSearchHandler)
+class TestTailStream(TestCase):
+    def setUp(self) -> None:
+        caches["locmem"].clear()
+        FakeSearchHandler.logs = [make_log(1000, 1), make_log(1000, 2), make_log(2000, 2, 1)]
+        FakeSearchHandler.calls = []
+
+    def new_handler(self):
+        return TailStreamHandler(INDEX_SET_ID, dict(SEARCH_DICT))
+
+    @staticmethod
+    def skip_interval(handler):
+        # 跳过当前轮询间隔
+        state = caches["locmem"].get(handler.state_key)
+        state["polled_at"] = 0
+        caches["locmem"].set(handler.state_key, state)
+
+    def test_share_upstream_poll(self):
+        result = self.new_handler().poll(wait=0)
+        self.assertEqual(result["total"], 3)
+        self.assertEqual(result["cursor"], f"{NOW + 2000}_2_1")
+
+        # 同一日志流的其他订阅者在轮询间隔内直接读取共享缓冲区
+        other = self.new_handler().poll(wait=0)
+        self.assertEqual(other["list"], result["list"])
+        self.assertEqual(len(FakeSearchHandler.calls), 1)
+
+        # 不同日志流单独轮询
+        TailStreamHandler(INDEX_SET_ID, {"serverIp": "127.0.0.2", "path": "/tmp/health_check.log"}).poll(wait=0)
+        self.assertEqual(len(FakeSearchHandler.calls), 2)
+
+    def test_resume_from_cursor(self):
+        handler = self.new_handler()
+        cursor = handler.poll(wait=0)["cursor"]
+        FakeSearchHandler.logs.append(make_log(3000, 3))
+
+        self.skip_interval(handler)
+        result = handler.poll(cursor, wait=0)
+        self.assertEqual([log["gseIndex"] for log in result["list"]], [3])
+        self.assertEqual(result["cursor"], f"{NOW + 3000}_3_0")
+        # 从上一个gse序号开始查询, 避免遗漏同一序号下的后续行
+        self.assertEqual(FakeSearchHandler.calls[-1], {"zero": False, "gseIndex": 1})
+
+    def test_adaptive_interval(self):
+        handler = self.new_handler()
+        cursor = handler.poll(wait=0)["cursor"]
+        intervals = []
+        for _ in range(4):
+            self.skip_interval(handler)
+            intervals.append(handler.poll(cursor, wait=0)["interval"])
+        # 没有新日志时间隔翻倍直至上限, 有新日志后恢复最小间隔
+        self.assertEqual(intervals, [2, 4, 4, 4])
+        FakeSearchHandler.logs.append(make_log(3000, 3))
+        self.skip_interval(handler)
+        self.assertEqual(handler.poll(cursor, wait=0)["interval"], 1)
+
+    def test_catch_up_before_buffer(self):
+        handler = self.new_handler()
+        handler.poll(wait=0)
+        FakeSearchHandler.logs.extend([make_log(3000, 3), make_log(3000, 4)])
+        self.skip_interval(handler)
+        handler.poll(f"{NOW + 2000}_2_1", wait=0)
+
+        # 缓冲区只保留最近3条, 更早的游标单独补查
+        result = self.new_handler().poll(f"{NOW + 1000}_1_0", wait=0)
+        self.assertEqual([log["gseIndex"] for log in result["list"]], [2, 2, 3, 4])
+        self.assertEqual(FakeSearchHandler.calls[-1], {"zero": False, "gseIndex": 0})
+
+    def test_sync_worker_poll_wait(self):
+        handler = self.new_handler()
+        cursor = handler.poll(wait=0)["cursor"]
+        # sync worker下不按请求的wait长时间占用worker
+        with override_settings(GUNICORN_WORKER_CLASS="sync", TAIL_STREAM_SYNC_LONG_POLL_TIMEOUT=0):
+            begin_time = time.time()
+            self.assertEqual(handler.poll(cursor, wait=10)["total"], 0)
+            self.assertLess(time.time() - begin_time, 1)
+
+    def test_release_own_lock(self):
+        handler = self.new_handler()
+        token = handler._acquire_lock()
+        self.assertIsNone(handler._acquire_lock())
+
+        # 锁超时后被其他进程获取, 不能删除其他进程的锁
+        caches["locmem"].set(handler.lock_key, "other")
+        handler._release_lock(token)
+        self.assertEqual(caches["locmem"].get(handler.lock_key), "other")
+
+        caches["locmem"].delete(handler.lock_key)
+        token = handler._acquire_lock()
+        handler._release_lock(token)
+        self.assertIsNone(caches["locmem"].get(handler.lock_key))
+
+    @skipUnless(TEST_REDIS_URL, "BKAPP_TEST_REDIS_URL is not set")
+    def test_release_own_lock_redis(self):
+        redis_client = redis.Redis.from_url(TEST_REDIS_URL, decode_responses=True)
+        handler = self.new_handler()
+        redis_client.delete(handler.redis_lock_key)
+        with override_settings(USE_REDIS=True), patch(
+            "apps.log_search.handlers.search.tail_stream.get_redis_connection", lambda _: redis_client
+        ):
+            token = handler._acquire_lock()
+            self.assertIsNone(handler._acquire_lock())
+
+            redis_client.set(handler.redis_lock_key, "other")
+            handler._release_lock(token)
+            self.assertEqual(redis_client.get(handler.redis_lock_key), "other")
+
+            redis_client.delete(handler.redis_lock_key)
+            token = handler._acquire_lock()
+            handler._release_lock(token)
+            self.assertIsNone(redis_client.get(handler.redis_lock_key))
+
+    def test_stream_sync_worker(self):
+        with override_settings(GUNICORN_WORKER_CLASS="sync"):
+            self.assertEqual(list(self.new_handler().stream()), ["retry: 30000\nevent: busy\ndata: {}\n\n"])
+        self.assertEqual(TailStreamHandler._stream_connections, 0)
+
+    @override_settings(GUNICORN_WORKER_CLASS="gevent")
+    def test_stream(self):
+        with override_settings(TAIL_STREAM_SSE_MAX_DURATION=1, TAIL_STREAM_LONG_POLL_TIMEOUT=0):
+            event = next(self.new_handler().stream())
+        self.assertTrue(event.startswith(f"id: {NOW + 2000}_2_1\nevent: log\ndata: "))
+
+    @override_settings(GUNICORN_WORKER_CLASS="gevent")
+    def test_stream_connection_limit(self):
+        with override_settings(
+            TAIL_STREAM_SSE_MAX_DURATION=1, TAIL_STREAM_LONG_POLL_TIMEOUT=0, TAIL_STREAM_SSE_MAX_CONNECTIONS=1
+        ):
+            stream = self.new_handler().stream()
+            next(stream)
+            # 连接数达到上限时推送busy事件后断开
+            self.assertEqual(list(self.new_handler().stream()), ["retry: 30000\nevent: busy\ndata: {}\n\n"])
+
+            # 连接断开后释放名额
+            stream.close()
+            self.assertEqual(TailStreamHandler._stream_connections, 0)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from apps.log_trace.handlers.proto.otlp import OtlpTrace
+
+INDEX_SET_ID = 1
+FIRST_SPANS = [
+    {"trace_id": "trace_1", "start_time": 1634000000123456},
+    {"trace_id": "trace_2", "start_time": 1634000100123456},
+]
+SPANS = [
+    {
+        "trace_id": trace_id,
+        "span_id": f"{trace_id}_{index}",
+        "parent_span_id": "",
+        "span_name": "test",
+        "elapsed_time": 10,
+        "start_time": 1634000000123456,
+        "kind": 2,
+        "trace_state": "",
+        "resource": {"service.name": "bk-log"},
+        "attributes": {},
+        "events": [],
+    }
+    for trace_id in ["trace_1", "trace_2"]
+    for index in range(3)
+]
+
+
+class FakeSearchHandler(object):
+    search_dicts = []
+    # 合并查询最多返回的span数
+    max_size = len(SPANS)
+    # 命中总数的统计上限, 模拟ES7未开启track_total_hits
+    total_cap = None
+
+    def __init__(self, index_set_id, search_dict):
+        self.search_dict = search_dict
+        self.search_dicts.append(search_dict)
+
+    def search(self, **kwargs):
+        trace_ids = self.search_dict["addition"][0]["value"].split(",")
+        spans = [span for span in SPANS if span["trace_id"] in trace_ids]
+        total = len(spans) if self.total_cap is None else min(len(spans), self.total_cap)
+        return {"total": total, "origin_log_list": spans[: self.max_size]}
+
+
+class TestOtlpTrace(TestCase):
+    @patch("apps.log_trace.handlers.proto.otlp.SearchHandlerEsquery", FakeSearchHandler)
+    def test_batch_search_trace(self):
+        FakeSearchHandler.search_dicts = []
+        spans = OtlpTrace().batch_search_trace(["trace_1", "trace_2"], INDEX_SET_ID, FIRST_SPANS)
+        traces = OtlpTrace()._transform_to_jaeger(spans)
+
+        # 所有trace只发起一次查询
+        self.assertEqual(len(FakeSearchHandler.search_dicts), 1)
+        search_dict = FakeSearchHandler.search_dicts[0]
+        self.assertEqual(search_dict["addition"][0]["value"], "trace_1,trace_2")
+        self.assertEqual(search_dict["start_time"], 1634000000 - OtlpTrace.BATCH_TRACE_TIME_PADDING)
+        self.assertEqual(search_dict["end_time"], 1634000100 + OtlpTrace.BATCH_TRACE_TIME_PADDING)
+        self.assertEqual({trace["traceID"]: len(trace["spans"]) for trace in traces}, {"trace_1": 3, "trace_2": 3})
+
+    @patch("apps.log_trace.handlers.proto.otlp.SearchHandlerEsquery", FakeSearchHandler)
+    @patch.object(FakeSearchHandler, "max_size", 4)
+    def test_batch_search_trace_truncated(self):
+        FakeSearchHandler.search_dicts = []
+        spans = OtlpTrace().batch_search_trace(["trace_1", "trace_2"], INDEX_SET_ID, FIRST_SPANS)
+        traces = OtlpTrace()._transform_to_jaeger(spans)
+
+        # 合并查询被截断时按trace逐个补查
+        self.assertEqual(len(FakeSearchHandler.search_dicts), 3)
+        trace_ids = {search_dict["addition"][0]["value"] for search_dict in FakeSearchHandler.search_dicts[1:]}
+        self.assertEqual(trace_ids, {"trace_1", "trace_2"})
+        self.assertEqual({trace["traceID"]: len(trace["spans"]) for trace in traces}, {"trace_1": 3, "trace_2": 3})
+
+    @patch("apps.log_trace.handlers.proto.otlp.SearchHandlerEsquery", FakeSearchHandler)
+    @patch("apps.log_trace.handlers.proto.otlp.MAX_RESULT_WINDOW", 4)
+    @patch.object(FakeSearchHandler, "max_size", 4)
+    @patch.object(FakeSearchHandler, "total_cap", 4)
+    def test_batch_search_trace_capped_total(self):
+        FakeSearchHandler.search_dicts = []
+        spans = OtlpTrace().batch_search_trace(["trace_1", "trace_2"], INDEX_SET_ID, FIRST_SPANS)
+        traces = OtlpTrace()._transform_to_jaeger(spans)
+
+        # 总数被统计上限截断与返回条数相同时, 取满一页也按trace逐个补查
+        self.assertEqual(len(FakeSearchHandler.search_dicts), 3)
+        self.assertEqual({trace["traceID"]: len(trace["spans"]) for trace in traces}, {"trace_1": 3, "trace_2": 3})
+
+    @patch("apps.log_trace.handlers.proto.otlp.logger")
+    def test_check_time_padding(self, logger):
+        spans = [
+            {"trace_id": "trace_1", "start_time": 1634000000123456},
+            {"trace_id": "trace_1", "start_time": 1634000000123456 + OtlpTrace.BATCH_TRACE_TIME_PADDING * 10 ** 6},
+            {"trace_id": "trace_2", "start_time": 1634000000123456},
+        ]
+        OtlpTrace()._check_time_padding(INDEX_SET_ID, spans)
+        logger.warning.assert_called_once()
+        self.assertIn("['trace_1']", logger.warning.call_args[0][0])
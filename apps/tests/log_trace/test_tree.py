@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+from django.test import TestCase
+
+from apps.log_trace.handlers.proto.log import LogTrace
+from apps.log_trace.handlers.proto.otlp import OtlpTrace
+from apps.utils.local import set_local_param
+
+
+def log_span(span_id, parent_span_id=""):
+    return {"spanID": span_id, "parentSpanID": parent_span_id, "startTime": 0, "duration": 1}
+
+
+def otlp_span(span_id, parent_span_id=""):
+    return {
+        "span_id": span_id,
+        "parent_span_id": parent_span_id,
+        "start_time": 1634000000123456,
+        "end_time": 1634000001123456,
+    }
+
+
+def child_ids(node, field):
+    return sorted(child[field] for child in node["children"])
+
+
+class TestBuildTree(TestCase):
+    def test_build_tree(self):
+        nodes = [log_span("b", "a"), log_span("c", "a"), log_span("a"), log_span("d", "b")]
+        root = LogTrace.build_tree(nodes)
+        self.assertEqual(root["spanID"], "a")
+        self.assertEqual(child_ids(root, "spanID"), ["b", "c"])
+        self.assertEqual(child_ids(nodes[0], "spanID"), ["d"])
+
+    def test_build_tree_orphan_and_roots(self):
+        # 父节点缺失的孤儿节点与额外的根节点都挂在根节点下
+        nodes = [log_span("a"), log_span("b", "a"), log_span("c", "missing"), log_span("d"), log_span("e", "d")]
+        root = LogTrace.build_tree(nodes)
+        self.assertEqual(root["spanID"], "a")
+        self.assertEqual(child_ids(root, "spanID"), ["b", "c", "d"])
+        self.assertEqual(child_ids(nodes[3], "spanID"), ["e"])
+
+    def test_build_tree_cycle(self):
+        nodes = [log_span("a", "c"), log_span("b", "a"), log_span("c", "b")]
+        root = LogTrace.build_tree(nodes)
+        # 每个节点只出现一次
+        seen = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            seen.append(node["spanID"])
+            stack.extend(node["children"])
+        self.assertEqual(sorted(seen), ["a", "b", "c"])
+
+    def test_build_tree_deep_chain(self):
+        size = 5000
+        nodes = [log_span(str(index), str(index - 1) if index else "") for index in range(size)]
+        nodes.reverse()
+        root = LogTrace.build_tree(nodes)
+        self.assertEqual(root["spanID"], "0")
+        depth = 0
+        node = root
+        while node["children"]:
+            node = node["children"][0]
+            depth += 1
+        self.assertEqual(depth, size - 1)
+
+    def test_build_tree_otlp(self):
+        set_local_param("time_zone", "Asia/Shanghai")
+        nodes = [otlp_span("b", "a"), otlp_span("a")]
+        root = OtlpTrace.build_tree(nodes)
+        self.assertEqual(root["span_id"], "a")
+        self.assertEqual(child_ids(root, "span_id"), ["b"])
+        self.assertEqual(root["start_time"], "2021-10-12 08:53:20")
+        self.assertEqual(root["to"], 1634000001123456)
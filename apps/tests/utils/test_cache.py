@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import threading
+import time
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from apps.utils.cache import LayeredCache, PickleSerializer, get_key_prefix, using_cache
+
+CACHE_KEY = "test_layered_cache"
+BACKEND_KEY = f"v2:{CACHE_KEY}"
+LOCK_KEY = f"{BACKEND_KEY}__lock"
+
+
+class Loader(object):
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestLayeredCache(TestCase):
+    def setUp(self):
+        self.backend = caches["locmem"]
+        self.backend.clear()
+        self.cache = LayeredCache(backend=self.backend)
+
+    def test_get_or_set(self):
+        loader = Loader({"data": [1, 2]})
+        result = self.cache.get_or_set(CACHE_KEY, loader, 60)
+        result["data"].append(3)
+        self.assertEqual(self.cache.get_or_set(CACHE_KEY, loader, 60), {"data": [1, 2]})
+
+        # 进程内缓存失效后从后端缓存读取
+        self.cache.local.clear()
+        self.assertEqual(self.cache.get_or_set(CACHE_KEY, loader, 60), {"data": [1, 2]})
+        self.assertEqual(self.cache.get(CACHE_KEY), {"data": [1, 2]})
+        self.assertEqual(loader.calls, 1)
+
+    def test_negative_cache(self):
+        loader = Loader([])
+        self.cache.get_or_set(CACHE_KEY, loader, 60)
+        self.assertEqual(self.cache.get_or_set(CACHE_KEY, loader, 60), [])
+        self.assertEqual(loader.calls, 1)
+
+        # None 不缓存
+        loader = Loader(None)
+        self.cache.get_or_set(f"{CACHE_KEY}_none", loader, 60)
+        self.cache.get_or_set(f"{CACHE_KEY}_none", loader, 60)
+        self.assertEqual(loader.calls, 2)
+
+    def test_stale_while_revalidate(self):
+        payload = PickleSerializer.dumps({"value": "stale", "fresh_until": time.time() - 1})
+        self.backend.set(BACKEND_KEY, payload, 60)
+        loader = Loader("fresh")
+
+        # 其他调用方正在刷新时返回旧值
+        self.backend.add(LOCK_KEY, 1, 60)
+        self.assertEqual(self.cache.get_or_set(CACHE_KEY, loader, 60), "stale")
+        self.assertEqual(loader.calls, 0)
+
+        self.backend.delete(LOCK_KEY)
+        self.assertEqual(self.cache.get_or_set(CACHE_KEY, loader, 60), "fresh")
+        self.assertEqual(loader.calls, 1)
+
+    def test_versioned_key(self):
+        # 旧版本进程写入的原始值不会被读取, 新版本的数据也不会写到旧key下
+        self.backend.set(CACHE_KEY, {"data": "old"}, 60)
+        loader = Loader({"data": "new"})
+        self.assertEqual(self.cache.get_or_set(CACHE_KEY, loader, 60), {"data": "new"})
+        self.assertEqual(self.backend.get(CACHE_KEY), {"data": "old"})
+        self.assertIsNotNone(self.backend.get(BACKEND_KEY))
+
+    def test_single_flight(self):
+        self.backend.add(LOCK_KEY, 1, 60)
+        owner = LayeredCache(backend=self.backend, local_maxsize=0)
+
+        def load():
+            time.sleep(0.1)
+            owner.set(CACHE_KEY, "owner", 60)
+            self.backend.delete(LOCK_KEY)
+
+        thread = threading.Thread(target=load)
+        thread.start()
+        loader = Loader("waiter")
+        self.assertEqual(self.cache.get_or_set(CACHE_KEY, loader, 60), "owner")
+        thread.join()
+        self.assertEqual(loader.calls, 0)
+
+    def test_using_cache(self):
+        loader = Loader({"fields": ["a"]})
+
+        @using_cache("test_using_cache_{index_set_id}", duration=60)
+        def get_fields(index_set_id):
+            return loader()
+
+        with patch("apps.utils.cache.layered_cache", self.cache):
+            self.assertEqual(get_fields(index_set_id=1), {"fields": ["a"]})
+            self.assertEqual(get_fields(index_set_id=1), {"fields": ["a"]})
+            get_fields(index_set_id=2)
+        self.assertEqual(loader.calls, 2)
+        self.assertEqual(get_key_prefix("{index}_schema"), "schema")
+        self.assertEqual(get_key_prefix("search_history_{username}_{index_set_id}"), "search_history")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making BK-LOG 蓝鲸日志平台 available.
+Copyright (C) 2021 THL A29 Limited, a Tencent company.  All rights reserved.
+BK-LOG 蓝鲸日志平台 is licensed under the MIT License.
+License for BK-LOG 蓝鲸日志平台:
+--------------------------------------------------------------------
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN
+NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+from unittest.mock import MagicMock
+
+from django.test import TestCase
+
+from apps.utils.local import activate_request, del_local_param, get_local_param
+from apps.utils.thread import BoundedExecutor, FuncThread, MultiExecuteFunc, executor_wrap
+
+
+class TestBoundedExecutor(TestCase):
+    def test_concurrency_cap(self):
+        executor = BoundedExecutor("test_cap", max_workers=2, max_queue=10)
+        lock = threading.Lock()
+        running = {"current": 0, "max": 0}
+
+        def task():
+            with lock:
+                running["current"] += 1
+                running["max"] = max(running["max"], running["current"])
+            time.sleep(0.02)
+            with lock:
+                running["current"] -= 1
+
+        futures = [executor.submit(task) for _ in range(8)]
+        for future in futures:
+            future.result()
+        self.assertLessEqual(running["max"], 2)
+
+    def test_caller_runs_when_saturated(self):
+        executor = BoundedExecutor("test_saturated", max_workers=1, max_queue=0)
+        event = threading.Event()
+        blocking = executor.submit(event.wait, 5)
+        # 线程池已满时在调用方线程执行
+        self.assertEqual(executor.submit(threading.get_ident).result(), threading.get_ident())
+        event.set()
+        self.assertTrue(blocking.result())
+
+    def test_nested_submit(self):
+        executor = BoundedExecutor("test_nested", max_workers=1, max_queue=1)
+
+        def outer():
+            # 工作线程内再次提交到同一线程池时直接执行, 不会死锁
+            return executor.submit(lambda: "inner").result(timeout=1)
+
+        self.assertEqual(executor.submit(outer).result(timeout=5), "inner")
+
+    def test_deadline(self):
+        executor = BoundedExecutor("test_deadline", max_workers=1, max_queue=1, deadline=0.01)
+        event = threading.Event()
+        blocking = executor.submit(event.wait, 5)
+        expired = executor.submit(lambda: "never")
+        time.sleep(0.05)
+        event.set()
+        blocking.result()
+        with self.assertRaises(TimeoutError):
+            expired.result()
+
+    def test_clear_request_after_task(self):
+        executor = BoundedExecutor("test_request", max_workers=1, max_queue=1)
+        request = MagicMock()
+        request.user.username = "user_a"
+        activate_request(request)
+        try:
+            task = FuncThread(lambda: get_local_param("request").user.username, None, "username", {})
+            self.assertEqual(executor.submit(executor_wrap, task).result(timeout=5), None)
+            self.assertEqual(task.results["username"], "user_a")
+        finally:
+            del_local_param("request")
+
+        # 同一工作线程中的后续任务不再沿用上一个任务的请求
+        self.assertIsNone(executor.submit(get_local_param, "request").result(timeout=5))
+
+
+class TestMultiExecuteFunc(TestCase):
+    def test_run(self):
+        multi_execute_func = MultiExecuteFunc()
+        multi_execute_func.append("square", lambda x: x * x, 3)
+        multi_execute_func.append("error", lambda: 1 / 0)
+        # 执行失败的任务不返回结果
+        self.assertEqual(multi_execute_func.run(), {"square": 9})
+
+    def test_timeout(self):
+        multi_execute_func = MultiExecuteFunc(timeout=0.05)
+        multi_execute_func.append("fast", lambda: "fast")
+        multi_execute_func.append("slow", lambda: time.sleep(1))
+        self.assertEqual(multi_execute_func.run(), {"fast": "fast"})
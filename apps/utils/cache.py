@@ -19,14 +19,237 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import functools
 import json
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
 
+from django.conf import settings
 from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
+from prometheus_client import Counter, Histogram
 
 from apps.utils.log import logger
 from apps.utils import md5_sum
 from apps.log_search.constants import TimeEnum
 
+cache_requests = Counter("bklog_cache_requests", "layered cache requests", ["prefix", "result"])
+cache_load_seconds = Histogram("bklog_cache_load_seconds", "layered cache load latency", ["prefix"])
+
+
+class JsonSerializer(object):
+    @staticmethod
+    def dumps(value) -> str:
+        return json.dumps(value, cls=DjangoJSONEncoder)
+
+    @staticmethod
+    def loads(payload):
+        return json.loads(payload)
+
+
+class PickleSerializer(object):
+    @staticmethod
+    def dumps(value) -> bytes:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(payload):
+        return pickle.loads(payload)
+
+
+class LocalLRUCache(object):
+    """
+    进程内有界LRU缓存, 保存序列化后的数据, 每次命中反序列化出新对象, 调用方修改结果不会影响缓存
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key -> (过期时间, 序列化数据)
+        self._data = OrderedDict()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, payload, timeout: float):
+        if timeout <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + timeout, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class LayeredCache(object):
+    """
+    两级缓存: 进程内LRU + Django缓存(Redis)
+    1. 进程内缓存时间较短, 命中时不访问Redis
+    2. 单飞锁: 同一个key未命中时只有一个调用方重新计算, 其他调用方等待其结果
+    3. 过期后在 stale 窗口内由拿到锁的调用方刷新, 其他调用方直接返回旧值
+    4. 空结果(非None)按较短的时间缓存, None 不缓存
+    5. Redis中的key带版本前缀, 与旧版本直接缓存原始值的key隔离, 滚动发布时新旧进程互不读取对方的数据
+    """
+
+    KEY_VERSION = "v2"
+    LOCK_TIMEOUT = 60
+    WAIT_INTERVAL = 0.05
+
+    def __init__(self, backend=None, local_maxsize: int = None):
+        self.backend = backend or cache
+        self.local = LocalLRUCache(settings.CACHE_LOCAL_MAXSIZE if local_maxsize is None else local_maxsize)
+
+    def get(self, key: str, prefix: str = "default", serializer=PickleSerializer):
+        """
+        只读取缓存, 不存在或已过期时返回None
+        """
+        envelope, result = self._get_envelope(key, serializer)
+        if envelope is None or envelope["fresh_until"] < time.time():
+            cache_requests.labels(prefix=prefix, result="miss").inc()
+            return None
+        cache_requests.labels(prefix=prefix, result=result).inc()
+        return envelope["value"]
+
+    def set(self, key: str, value: Any, timeout: int, prefix: str = "default", serializer=PickleSerializer):
+        if value is None:
+            return
+        if not value:
+            timeout = min(timeout, settings.CACHE_NEGATIVE_TTL)
+        now = time.time()
+        payload = serializer.dumps({"value": value, "fresh_until": now + timeout})
+        self.local.set(key, payload, min(timeout, settings.CACHE_LOCAL_TTL))
+        try:
+            self.backend.set(self._backend_key(key), payload, timeout + min(timeout, settings.CACHE_STALE_TTL))
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[layered cache] set cache({key}) failed: {e}")
+
+    def get_or_set(
+        self,
+        key: str,
+        func: Callable[[], Any],
+        timeout: int,
+        prefix: str = "default",
+        serializer=PickleSerializer,
+    ):
+        envelope, result = self._get_envelope(key, serializer)
+        if envelope is not None:
+            if envelope["fresh_until"] >= time.time():
+                cache_requests.labels(prefix=prefix, result=result).inc()
+                return envelope["value"]
+            # 已过期但仍在stale窗口内, 其他调用方正在刷新时直接返回旧值
+            if not self._acquire(key):
+                cache_requests.labels(prefix=prefix, result="stale").inc()
+                return envelope["value"]
+        elif not self._acquire(key):
+            # 其他调用方正在计算, 等待其结果
+            envelope = self._wait(key, serializer)
+            if envelope is not None:
+                cache_requests.labels(prefix=prefix, result="hit").inc()
+                return envelope["value"]
+            return self._load(key, func, timeout, prefix, serializer)
+
+        try:
+            return self._load(key, func, timeout, prefix, serializer)
+        finally:
+            self._release(key)
+
+    def _load(self, key, func, timeout, prefix, serializer):
+        cache_requests.labels(prefix=prefix, result="miss").inc()
+        begin_time = time.time()
+        value = func()
+        cache_load_seconds.labels(prefix=prefix).observe(time.time() - begin_time)
+        self.set(key, value, timeout, prefix, serializer)
+        return value
+
+    def _get_envelope(self, key, serializer):
+        result = "local_hit"
+        payload = self.local.get(key)
+        if payload is None:
+            result = "hit"
+            try:
+                payload = self.backend.get(self._backend_key(key))
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"[layered cache] get cache({key}) failed: {e}")
+                return None, result
+            if payload is None:
+                return None, result
+        try:
+            envelope = serializer.loads(payload)
+        except Exception:  # pylint: disable=broad-except
+            # 兼容旧格式的缓存数据, 按未命中处理
+            return None, result
+        if not isinstance(envelope, dict) or "fresh_until" not in envelope:
+            return None, result
+        if result == "hit":
+            self.local.set(key, payload, min(envelope["fresh_until"] - time.time(), settings.CACHE_LOCAL_TTL))
+        return envelope, result
+
+    @classmethod
+    def _backend_key(cls, key):
+        return f"{cls.KEY_VERSION}:{key}"
+
+    @classmethod
+    def _lock_key(cls, key):
+        return f"{cls._backend_key(key)}__lock"
+
+    def _acquire(self, key) -> bool:
+        try:
+            return bool(self.backend.add(self._lock_key(key), 1, self.LOCK_TIMEOUT))
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[layered cache] acquire lock({key}) failed: {e}")
+            return True
+
+    def _release(self, key):
+        try:
+            self.backend.delete(self._lock_key(key))
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[layered cache] release lock({key}) failed: {e}")
+
+    def _wait(self, key, serializer):
+        """
+        等待持有锁的调用方写入结果, 锁释放或超时后返回
+        """
+        wait_until = time.time() + settings.CACHE_SINGLE_FLIGHT_WAIT
+        while time.time() < wait_until:
+            time.sleep(self.WAIT_INTERVAL)
+            envelope, __ = self._get_envelope(key, serializer)
+            if envelope is not None:
+                return envelope
+            try:
+                if self.backend.get(self._lock_key(key)) is None:
+                    return None
+            except Exception:  # pylint: disable=broad-except
+                return None
+        return None
+
+
+layered_cache = LayeredCache()
+
+
+def get_key_prefix(key: str) -> str:
+    """
+    去掉key模板中的格式化参数, 作为统计维度
+    """
+    return re.sub(r"_+", "_", re.sub(r"\{[^}]*\}", "", key)).strip("_") or "default"
+
 
 def using_cache(key: str, duration, need_md5=False):
     """
@@ -35,6 +258,7 @@ def using_cache(key: str, duration, need_md5=False):
     :param need_md5: 缓冲是redis的时候 key不能带有空格等字符，需要用md5 hash一下
     :return:
     """
+    prefix = get_key_prefix(key)
 
     def decorator(func):
         @functools.wraps(func)
@@ -50,15 +274,9 @@ def using_cache(key: str, duration, need_md5=False):
             if need_md5:
                 actual_key = md5_sum(actual_key)
 
-            cache_result = cache.get(actual_key)
-
-            if cache_result:
-                return json.loads(cache_result)
-
-            result = func(*args, **kwargs)
-            if result:
-                cache.set(actual_key, json.dumps(result, cls=DjangoJSONEncoder), duration)
-            return result
+            return layered_cache.get_or_set(
+                actual_key, lambda: func(*args, **kwargs), int(duration), prefix=prefix, serializer=JsonSerializer
+            )
 
         return inner
 
@@ -72,5 +72,52 @@ class QcloudCos(object):
         )
         return response["ETag"]
 
+    def create_multipart_upload(self, file_name: str) -> str:
+        """
+        初始化分块上传
+        @param file_name 上传文件名
+        """
+        response = self._client.create_multipart_upload(Bucket=self._qcloud_cos_bucket.strip(), Key=file_name)
+        return response["UploadId"]
+
+    def upload_part(self, file_name: str, upload_id: str, part_number: int, body: bytes) -> str:
+        """
+        上传单个分块
+        @param file_name 上传文件名
+        @param upload_id 分块上传ID
+        @param part_number 分块编号, 从1开始
+        @param body 分块内容
+        """
+        response = self._client.upload_part(
+            Bucket=self._qcloud_cos_bucket.strip(),
+            Key=file_name,
+            Body=body,
+            PartNumber=part_number,
+            UploadId=upload_id,
+        )
+        return response["ETag"]
+
+    def complete_multipart_upload(self, file_name: str, upload_id: str, parts: list):
+        """
+        完成分块上传
+        @param file_name 上传文件名
+        @param upload_id 分块上传ID
+        @param parts 分块列表 [{"PartNumber": 1, "ETag": "xxx"}]
+        """
+        return self._client.complete_multipart_upload(
+            Bucket=self._qcloud_cos_bucket.strip(),
+            Key=file_name,
+            UploadId=upload_id,
+            MultipartUpload={"Part": parts},
+        )
+
+    def abort_multipart_upload(self, file_name: str, upload_id: str):
+        """
+        终止分块上传并清理已上传的分块
+        """
+        return self._client.abort_multipart_upload(
+            Bucket=self._qcloud_cos_bucket.strip(), Key=file_name, UploadId=upload_id
+        )
+
     def _has_accelerate(self):
         return settings.EXTRACT_COS_DOMAIN is not None
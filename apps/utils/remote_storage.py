@@ -19,8 +19,10 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import os
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from shutil import copyfile
 
+from django.conf import settings
 from django.utils.http import urlencode
 
 from apps.constants import RemoteStorageType
@@ -33,11 +35,116 @@ class Storage(ABC):
     def export_upload(self, *args, **kwargs):
         pass
 
+    @abstractmethod
+    def open_writer(self, *args, **kwargs) -> "UploadWriter":
+        pass
+
     @abstractmethod
     def generate_download_url(self, *args, **kwargs):
         pass
 
 
+class UploadWriter(ABC):
+    """
+    流式上传, 边写入边上传, 无需先在本地落盘完整文件
+    """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        self._write(data)
+
+    @abstractmethod
+    def _write(self, data: bytes):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def abort(self):
+        pass
+
+
+class CosUploadWriter(UploadWriter):
+    """
+    基于分块上传的cos写入, 每攒够一个分块即提交到后台线程上传
+    """
+
+    def __init__(self, qcloud_cos: QcloudCos, file_name: str, part_size: int, concurrency: int):
+        super().__init__()
+        self.qcloud_cos = qcloud_cos
+        self.file_name = file_name
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.upload_id = self.qcloud_cos.create_multipart_upload(file_name)
+        self._buffer = bytearray()
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+
+    def _upload_part(self, body: bytes):
+        # 限制在途分块数量, 上传慢于下载时阻塞写入方, 保证内存有界
+        pending = [future for future in self._futures if not future.done()]
+        if len(pending) >= self.concurrency:
+            wait(pending, return_when=FIRST_COMPLETED)
+        part_number = len(self._futures) + 1
+        self._futures.append(
+            self._executor.submit(self.qcloud_cos.upload_part, self.file_name, self.upload_id, part_number, body)
+        )
+
+    def close(self):
+        if self._buffer or not self._futures:
+            self._upload_part(bytes(self._buffer))
+            self._buffer = bytearray()
+        try:
+            parts = [
+                {"PartNumber": part_number, "ETag": future.result()}
+                for part_number, future in enumerate(self._futures, start=1)
+            ]
+        finally:
+            self._executor.shutdown(wait=True)
+        self.qcloud_cos.complete_multipart_upload(self.file_name, self.upload_id, parts)
+
+    def abort(self):
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self.qcloud_cos.abort_multipart_upload(self.file_name, self.upload_id)
+
+
+class NfsUploadWriter(UploadWriter):
+    """
+    直接写入nfs目标目录, 写入完成后再重命名为目标文件, 避免下载到不完整文件
+    """
+
+    def __init__(self, target_file_dir: str):
+        super().__init__()
+        self.target_file_dir = target_file_dir
+        self.tmp_file_dir = f"{target_file_dir}.tmp"
+        self._file = open(self.tmp_file_dir, "wb")
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.tmp_file_dir, self.target_file_dir)
+
+    def abort(self):
+        self._file.close()
+        if os.path.isfile(self.tmp_file_dir):
+            os.remove(self.tmp_file_dir)
+
+
 class CosStorage(Storage):
     def __init__(
         self,
@@ -59,6 +166,14 @@ class CosStorage(Storage):
     def export_upload(self, file_path, file_name, **kwargs):
         return self.qcloud_cos.upload_file(file_path, file_name)
 
+    def open_writer(self, file_name, **kwargs):
+        return CosUploadWriter(
+            self.qcloud_cos,
+            file_name,
+            part_size=settings.ASYNC_EXPORT_UPLOAD_PART_SIZE,
+            concurrency=settings.ASYNC_EXPORT_UPLOAD_CONCURRENCY,
+        )
+
     def generate_download_url(self, file_name, **kwargs):
         return self.qcloud_cos.get_download_url(file_name)
 
@@ -71,6 +186,9 @@ class NfsStorage(Storage):
         target_file_dir = os.path.join(self.nfs_path, file_name)
         copyfile(file_path, target_file_dir)
 
+    def open_writer(self, file_name, **kwargs):
+        return NfsUploadWriter(os.path.join(self.nfs_path, file_name))
+
     def generate_download_url(self, url_path: str, file_name: str, **kwargs):
         url_params = {"target_file": BaseCrypt().encrypt(file_name.encode())}
         url_params = urlencode(url_params)
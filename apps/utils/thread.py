@@ -17,12 +17,175 @@ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
 WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, wait
+from contextlib import contextmanager
 
-from opentelemetry.context import attach, get_current
+from django.conf import settings
+from django.db import close_old_connections
+from opentelemetry.context import attach, detach, get_current
+from prometheus_client import Counter, Gauge, Histogram
 
 from apps.utils.function import ignored
-from apps.utils.local import get_request, activate_request
+from apps.utils.local import activate_request, del_local_param, get_local_param, get_request, set_local_param
+from apps.utils.log import logger
+
+executor_task = Counter("bklog_executor_task", "Task result of shared executor pools", ["pool", "result"])
+executor_queue_depth = Gauge("bklog_executor_queue_depth", "Queued tasks of shared executor pools", ["pool"])
+executor_active = Gauge("bklog_executor_active", "Running tasks of shared executor pools", ["pool"])
+executor_wait = Histogram(
+    "bklog_executor_wait_seconds",
+    "Queue wait time of shared executor pools",
+    ["pool"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+executor_task_latency = Histogram(
+    "bklog_executor_task_seconds",
+    "Task latency of shared executor pools",
+    ["pool"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+
+
+class ExecutorPool(object):
+    """
+    按上游划分的线程池, 某个上游变慢时只占满自己的线程池
+    """
+
+    DEFAULT = "default"
+    ES = "es"
+    BKDATA = "bkdata"
+    CMDB = "cmdb"
+    JOB = "job"
+    NODEMAN = "nodeman"
+
+
+# 任务可能写入的线程变量
+TASK_LOCAL_PARAMS = ("request", "request.username")
+
+
+@contextmanager
+def task_context(close_connections=True):
+    """
+    线程池任务执行上下文
+    线程池中的线程常驻进程, 任务结束后恢复任务前的线程变量及trace上下文, 避免后续任务沿用上一个任务的请求
+    close_connections 为 True 时关闭失效的数据库连接, 仅在工作线程中使用, 调用方线程中可能处于事务内
+    """
+    previous_params = {key: get_local_param(key) for key in TASK_LOCAL_PARAMS}
+    token = attach(get_current())
+    try:
+        yield
+    finally:
+        with ignored(Exception):
+            detach(token)
+        for key, value in previous_params.items():
+            if value is None:
+                del_local_param(key)
+            else:
+                set_local_param(key, value)
+        if close_connections:
+            close_old_connections()
+
+
+def run_in_task_context(func, *args, **kwargs):
+    """
+    提交到线程池时包装任务, 用于未使用 BoundedExecutor 的线程池
+    """
+    with task_context():
+        return func(*args, **kwargs)
+
+
+# 当前线程所属的线程池链路, 在同一链路的线程池中再次提交时直接执行, 避免工作线程互相等待导致死锁
+_worker_local = threading.local()
+
+
+class BoundedExecutor(object):
+    """
+    进程内共享的有界线程池
+    1. 执行中的任务数不超过 max_workers, 排队中的任务数不超过 max_queue
+    2. 线程池已满或嵌套提交时在调用方线程直接执行, 由调用方承担背压, 不再额外创建线程
+    3. 排队超过 deadline 秒仍未开始执行的任务直接放弃, 避免执行调用方已不再等待的任务
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, deadline: int = None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"bklog_{name}")
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        chain = getattr(_worker_local, "chain", ())
+        if self.name in chain or not self._slots.acquire(blocking=False):
+            executor_task.labels(pool=self.name, result="caller_runs").inc()
+            return self._run_inline(func, args, kwargs)
+
+        executor_queue_depth.labels(pool=self.name).inc()
+        try:
+            return self._executor.submit(self._run, chain + (self.name,), time.time(), func, args, kwargs)
+        except RuntimeError:
+            executor_queue_depth.labels(pool=self.name).dec()
+            self._slots.release()
+            raise
+
+    def _run(self, chain, submitted_at, func, args, kwargs):
+        started_at = time.time()
+        executor_queue_depth.labels(pool=self.name).dec()
+        executor_active.labels(pool=self.name).inc()
+        executor_wait.labels(pool=self.name).observe(started_at - submitted_at)
+        _worker_local.chain = chain
+        try:
+            with task_context():
+                return self._run_task(started_at, submitted_at, func, args, kwargs)
+        finally:
+            executor_task_latency.labels(pool=self.name).observe(time.time() - started_at)
+            _worker_local.chain = ()
+            executor_active.labels(pool=self.name).dec()
+            self._slots.release()
+
+    def _run_task(self, started_at, submitted_at, func, args, kwargs):
+        if self.deadline and started_at - submitted_at > self.deadline:
+            executor_task.labels(pool=self.name, result="expired").inc()
+            raise TimeoutError(f"task waited more than {self.deadline}s in executor pool [{self.name}]")
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            executor_task.labels(pool=self.name, result="failed").inc()
+            raise
+        executor_task.labels(pool=self.name, result="success").inc()
+        return result
+
+    @staticmethod
+    def _run_inline(func, args, kwargs) -> Future:
+        future = Future()
+        try:
+            with task_context(close_connections=False):
+                future.set_result(func(*args, **kwargs))
+        except Exception as e:  # pylint: disable=broad-except
+            future.set_exception(e)
+        return future
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str = ExecutorPool.DEFAULT) -> BoundedExecutor:
+    """
+    获取进程内共享的线程池, 未单独配置的上游使用默认配置
+    """
+    executor = _executors.get(name)
+    if executor is not None:
+        return executor
+    with _executors_lock:
+        if name not in _executors:
+            config = settings.EXECUTOR_POOLS.get(name) or settings.EXECUTOR_POOLS[ExecutorPool.DEFAULT]
+            _executors[name] = BoundedExecutor(
+                name, config["max_workers"], config["max_queue"], deadline=config.get("deadline")
+            )
+        return _executors[name]
 
 
 class FuncThread:
@@ -32,6 +195,7 @@ class FuncThread:
         self.result_key = result_key
         self.results = results
         self.use_request = use_request
+        self.requests = None
         with ignored(AttributeError, BaseException):
             self.requests = get_request()
         self.trace_context = get_current()
@@ -42,7 +206,8 @@ class FuncThread:
 
     def run(self):
         self._init_context()
-        if self.use_request:
+        # 非请求上下文(如后台任务)中没有可传递的request
+        if self.use_request and self.requests is not None:
             activate_request(self.requests)
         if self.params:
             self.results[self.result_key] = self.func(self.params)
@@ -59,9 +224,15 @@ class MultiExecuteFunc(object):
     基于多线程的批量并发执行函数
     """
 
-    def __init__(self):
+    def __init__(self, pool: str = ExecutorPool.DEFAULT, timeout: int = None):
+        """
+        @param pool: 执行所用的共享线程池
+        @param timeout: 最长等待时间 单位秒, 为空时等待全部任务完成; 超时未完成的任务不返回结果
+        """
         self.results = {}
         self.task_list = []
+        self.pool = pool
+        self.timeout = timeout
 
     def append(self, result_key, func, params=None, use_request=True):
         if result_key in self.results:
@@ -72,6 +243,17 @@ class MultiExecuteFunc(object):
         self.task_list.append(task)
 
     def run(self):
-        with ThreadPoolExecutor() as executor:
-            executor.map(executor_wrap, self.task_list)
+        executor = get_executor(self.pool)
+        futures = [executor.submit(executor_wrap, task) for task in self.task_list]
+        _, not_done = wait(futures, timeout=self.timeout)
+        for future in futures:
+            if future in not_done:
+                continue
+            exception = future.exception()
+            if exception:
+                logger.warning(f"[MultiExecuteFunc] task in pool [{self.pool}] failed: {exception}")
+        if not_done:
+            logger.warning(f"[MultiExecuteFunc] {len(not_done)} tasks in pool [{self.pool}] not finished in time")
+            # 未完成的任务仍可能写入结果, 返回当前结果的副本
+            return dict(self.results)
         return self.results
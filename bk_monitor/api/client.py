@@ -40,7 +40,12 @@ class Client(object):
 
         _data = http_func(url, data, headers=headers, timeout=timeout)
 
-        logger.info("do http request: method=`%s`, url=`%s`, data=`%s`", http_func.__name__, url, json.dumps(data))
+        logger.info(
+            "do http request: method=`%s`, url=`%s`, data=`%s`",
+            http_func.__name__,
+            url,
+            data if isinstance(data, str) else json.dumps(data),
+        )
         logger.info("http request took %s ms", int((time.time() - begin) * 1000))
 
         if not _data.get("result"):
@@ -71,9 +76,12 @@ class Client(object):
         path = "metadata_create_time_series_group/"
         return self._call_esb_api(http_post, path, data)
 
-    def custom_report(self, data):
+    def custom_report(self, data, timeout=None):
+        """
+        data 可以为已序列化的json字符串
+        """
         path = "v2/push/"
-        return self._call_api(http_post, self._report_host, path, data, {}, timeout=None)
+        return self._call_api(http_post, self._report_host, path, data, {}, timeout=timeout)
 
     def save_alarm_strategy(self, data):
         path = "save_alarm_strategy/"
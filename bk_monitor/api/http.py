@@ -51,10 +51,12 @@ def _http_request(
                 cookies=cookies,
             )
         elif method == "POST":
+            # 已序列化的请求体直接发送, 避免重复序列化
+            body = {"data": data} if isinstance(data, (str, bytes)) else {"json": data}
             resp = requests.post(
                 url=url,
                 headers=headers,
-                json=data,
+                **body,
                 verify=verify,
                 cert=cert,
                 timeout=timeout,
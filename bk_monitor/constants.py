@@ -18,6 +18,18 @@ LOGGER_NAME = "bk_monitor"
 
 # custom_report 限制上报大小
 BATCH_SIZE = 100
+# custom_report 并发上报数
+REPORT_MAX_WORKERS = 8
+# custom_report 单次上报超时时间 单位秒
+REPORT_TIMEOUT = 10
+# custom_report 失败重试次数及首次重试间隔(指数退避) 单位秒
+REPORT_RETRY_TIMES = 2
+REPORT_RETRY_INTERVAL = 0.5
+
+# 上报配置进程内快照: 检查版本号间隔及最大存活时间 单位秒
+REPORT_CONFIG_VERSION_KEY = "bk_monitor_report_config_version"
+REPORT_CONFIG_SNAPSHOT_CHECK_INTERVAL = 10
+REPORT_CONFIG_SNAPSHOT_EXPIRED = 300
 
 
 class ErrorEnum:
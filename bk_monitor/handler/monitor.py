@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Optional
 
 from django.utils.translation import ugettext_lazy as _
@@ -13,6 +16,10 @@ from bk_monitor.constants import (
     SOURCE_LABEL,
     LOGGER_NAME,
     BATCH_SIZE,
+    REPORT_MAX_WORKERS,
+    REPORT_RETRY_INTERVAL,
+    REPORT_RETRY_TIMES,
+    REPORT_TIMEOUT,
     TIME_SERIES_TYPE,
     TIME_SERIES_ETL_CONFIG,
     EVENT_ETL_CONFIG,
@@ -24,6 +31,7 @@ from bk_monitor.utils.collector import MetricCollector
 from bk_monitor.utils.data_name_builder import DataNameBuilder
 from bk_monitor.utils.event import EventTrigger
 from bk_monitor.utils.query import CustomTable, SqlSplice
+from bk_monitor.utils.report_config import ReportConfigSnapshot
 
 logger = logging.getLogger(LOGGER_NAME)
 
@@ -176,36 +184,43 @@ class CustomReporter(object):
 
         data = MetricCollector(collector_import_paths=collector_import_paths).collect(namespaces=namespaces)
 
+        # 配置读取进程内快照, 每个分片只序列化一次, 重试时复用
+        report_configs = ReportConfigSnapshot.configs()
+        bodies = []
         for key, val in data.items():
             if not self._report_params_verity(key, val):
                 continue
-            try:
-                monitor_report_config = MonitorReportConfig.objects.get(data_name=key, is_enable=True)
-            except MonitorReportConfig.DoesNotExist:
-                logger.info(_("f{key} data_name初始化异常，请检查"))
+            monitor_report_config = report_configs.get(key)
+            if not monitor_report_config:
+                logger.info(_(f"{key} data_name初始化异常，请检查"))
                 continue
 
-            try:
-                chunks = [val[i : i + BATCH_SIZE] for i in range(0, len(val), BATCH_SIZE)]
-                for chunk in chunks:
-                    self._client.custom_report(
-                        {
-                            "data_id": monitor_report_config.data_id,
-                            "access_token": monitor_report_config.access_token,
-                            "data": chunk,
-                        }
-                    )
-            except Exception as e:  # pylint: disable=broad-except
-                logger.warning(f"custom_report error: {e}")
+            for i in range(0, len(val), BATCH_SIZE):
+                body = json.dumps(
+                    {
+                        "data_id": monitor_report_config.data_id,
+                        "access_token": monitor_report_config.access_token,
+                        "data": val[i : i + BATCH_SIZE],
+                    }
+                )
+                bodies.append((key, body))
+
+        if not bodies:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(REPORT_MAX_WORKERS, len(bodies))) as executor:
+            futures = {executor.submit(self._custom_report, body): key for key, body in bodies}
+            for future in as_completed(futures):
+                if future.exception():
+                    logger.warning(f"custom_report error: data_name -> {futures[future]}, {future.exception()}")
 
     def trigger_event(self, data_name: str, event: dict):
         if not data_name:
             logger.error("[bk_monitor] data_name is empty")
             return
 
-        try:
-            monitor_report_config = MonitorReportConfig.objects.get(data_name=data_name, is_enable=True)
-        except MonitorReportConfig.DoesNotExist:
+        monitor_report_config = ReportConfigSnapshot.get(data_name)
+        if not monitor_report_config:
             logger.error("[bk_monitor] data_name init failed please check")
             return
         try:
@@ -254,6 +269,18 @@ class CustomReporter(object):
 
         return True
 
+    def _custom_report(self, body: str):
+        """
+        上报单个分片, 失败时按指数退避重试
+        """
+        for retry in range(REPORT_RETRY_TIMES + 1):
+            try:
+                return self._client.custom_report(body, timeout=REPORT_TIMEOUT)
+            except (MonitorReportRequestException, MonitorReportResultException):
+                if retry >= REPORT_RETRY_TIMES:
+                    raise
+                time.sleep(REPORT_RETRY_INTERVAL * 2 ** retry)
+
     def _get_data_id(self, data_name_builder):
         try:
             result = self._client.get_data_id({"data_name": data_name_builder.name})
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from bk_monitor.constants import TIME_SERIES_TYPE
@@ -23,3 +25,16 @@ class MonitorReportConfig(models.Model):
     class Meta:
         verbose_name = _("运营数据上报配置")
         verbose_name_plural = _("运营数据上报配置")
+
+
+@receiver(post_save, sender=MonitorReportConfig)
+@receiver(post_delete, sender=MonitorReportConfig)
+def refresh_report_config_snapshot(sender, **kwargs):
+    """
+    上报配置变更后刷新进程内快照
+    """
+    from bk_monitor.utils.report_config import ReportConfigSnapshot
+
+    # 当前进程立即刷新，事务提交后再通知其他进程
+    ReportConfigSnapshot.invalidate(notify=False)
+    transaction.on_commit(ReportConfigSnapshot.invalidate)
@@ -258,7 +258,7 @@ def test_collect_metric():
     ]
 
 
-def custom_report(self, data):
+def custom_report(self, data, timeout=None):
     return
 
 
@@ -38,6 +38,9 @@ class Metric(object):
     指标定义
     """
 
+    # 单次采集可能生成大量指标对象
+    __slots__ = ("metric_name", "metric_value", "dimensions", "timestamp")
+
     def __init__(self, metric_name, metric_value, dimensions=None, timestamp=None):
         self.metric_name = metric_name
         self.metric_value = metric_value
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from django.core.cache import cache
+
+from bk_monitor.constants import (
+    LOGGER_NAME,
+    REPORT_CONFIG_SNAPSHOT_CHECK_INTERVAL,
+    REPORT_CONFIG_SNAPSHOT_EXPIRED,
+    REPORT_CONFIG_VERSION_KEY,
+)
+from bk_monitor.models import MonitorReportConfig
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class ReportConfigSnapshot(object):
+    """
+    已启用上报配置的进程内快照
+    配置保存后当前进程立即失效, 其他进程通过版本号感知变化, 缓存不可用时按最大存活时间重建
+    """
+
+    _configs: Optional[Dict[str, MonitorReportConfig]] = None
+    _version = None
+    _build_time = 0
+    _check_time = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, data_name: str) -> Optional[MonitorReportConfig]:
+        return cls.configs().get(data_name)
+
+    @classmethod
+    def configs(cls) -> Dict[str, MonitorReportConfig]:
+        configs = cls._configs
+        if configs is not None and time.time() - cls._check_time < REPORT_CONFIG_SNAPSHOT_CHECK_INTERVAL:
+            return configs
+
+        with cls._lock:
+            now = time.time()
+            if cls._configs is not None and now - cls._check_time < REPORT_CONFIG_SNAPSHOT_CHECK_INTERVAL:
+                return cls._configs
+
+            version = cls._get_version()
+            if (
+                cls._configs is not None
+                and version is not None
+                and version == cls._version
+                and now - cls._build_time < REPORT_CONFIG_SNAPSHOT_EXPIRED
+            ):
+                cls._check_time = now
+                return cls._configs
+
+            configs = {config.data_name: config for config in MonitorReportConfig.objects.filter(is_enable=True)}
+            cls._configs, cls._version, cls._build_time, cls._check_time = configs, version, now, now
+            return configs
+
+    @classmethod
+    def invalidate(cls, notify=True):
+        """
+        丢弃进程内快照, notify为True时更新版本号通知其他进程刷新
+        """
+        cls._configs = None
+        if not notify:
+            return
+        try:
+            cache.set(REPORT_CONFIG_VERSION_KEY, uuid.uuid4().hex, None)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[bk_monitor] update report config version error: {e}")
+
+    @classmethod
+    def _get_version(cls):
+        try:
+            version = cache.get(REPORT_CONFIG_VERSION_KEY)
+            if version is None:
+                cache.add(REPORT_CONFIG_VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(REPORT_CONFIG_VERSION_KEY)
+            return version
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"[bk_monitor] get report config version error: {e}")
+            return None
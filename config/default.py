@@ -164,6 +164,7 @@ CELERY_IMPORTS = (
     "apps.log_search.handlers.index_set",
     "apps.log_search.tasks.mapping",
     "apps.log_search.tasks.no_data",
+    "apps.log_search.tasks.index_catalog",
     "apps.log_databus.tasks.collector",
     "apps.log_databus.tasks.itsm",
     "apps.log_databus.tasks.bkdata",
@@ -285,6 +286,11 @@ BK_HOT_WARM_CONFIG_URL = (
 # bulk_request limit
 BULK_REQUEST_LIMIT = int(os.environ.get("BKAPP_BULK_REQUEST_LIMIT", 500))
 
+# DataAPI 长连接配置: 是否复用连接、单个host连接池大小、连接异常重试次数
+DATAAPI_SESSION_KEEP_ALIVE = os.environ.get("BKAPP_DATAAPI_SESSION_KEEP_ALIVE", "on") == "on"
+DATAAPI_SESSION_POOL_MAXSIZE = int(os.environ.get("BKAPP_DATAAPI_SESSION_POOL_MAXSIZE", 20))
+DATAAPI_SESSION_RETRY = int(os.environ.get("BKAPP_DATAAPI_SESSION_RETRY", 1))
+
 # redis_version
 REDIS_VERSION = int(os.environ.get("BKAPP_REDIS_VERSION", 2))
 
@@ -297,6 +303,15 @@ GRAFANA = {
     "PERMISSION_CLASSES": ["apps.grafana.permissions.BizPermission"],
 }
 
+# Grafana 时序查询增量缓存: 缓存时间(秒)、桶封闭延迟(秒, 覆盖日志入库延迟)、单个查询最多缓存的桶数
+GRAFANA_QUERY_CACHE_ENABLED = os.getenv("BKAPP_GRAFANA_QUERY_CACHE_ENABLED", "on") == "on"
+GRAFANA_QUERY_CACHE_TTL = int(os.getenv("BKAPP_GRAFANA_QUERY_CACHE_TTL", 24 * 60 * 60))
+GRAFANA_QUERY_CACHE_FINALIZE_DELAY = int(os.getenv("BKAPP_GRAFANA_QUERY_CACHE_FINALIZE_DELAY", 300))
+# 封闭不足该时长(秒)的桶仍可能有延迟到达的日志, 只缓存 GRAFANA_QUERY_CACHE_RECENT_TTL 秒后重新查询
+GRAFANA_QUERY_CACHE_SETTLE_DELAY = int(os.getenv("BKAPP_GRAFANA_QUERY_CACHE_SETTLE_DELAY", 60 * 60))
+GRAFANA_QUERY_CACHE_RECENT_TTL = int(os.getenv("BKAPP_GRAFANA_QUERY_CACHE_RECENT_TTL", 300))
+GRAFANA_QUERY_CACHE_MAX_BUCKETS = int(os.getenv("BKAPP_GRAFANA_QUERY_CACHE_MAX_BUCKETS", 7 * 24 * 60))
+
 # 是否可以跨业务创建索引集
 Index_Set_Cross_Biz = False
 
@@ -667,6 +682,14 @@ EXTRACT_PACK_MAX_FILE_SZIE_LIMIT = int(os.getenv("BKAPP_EXTRACT_PACK_MAX_FILE_SZ
 # 同时下载的文件数量限制
 CSTONE_DOWNLOAD_FILES_LIMIT = int(os.getenv("BKAPP_CSTONE_DOWNLOAD_FILES_LIMIT", 10))
 
+# 异步导出 sliced scroll 并发分片数, 仅用于未指定排序且导出全部命中结果的第三方ES场景, 小于等于1时按顺序拉取
+ASYNC_EXPORT_SCROLL_SLICES = int(os.getenv("BKAPP_ASYNC_EXPORT_SCROLL_SLICES", 4))
+# 异步导出 gzip 压缩等级
+ASYNC_EXPORT_COMPRESS_LEVEL = int(os.getenv("BKAPP_ASYNC_EXPORT_COMPRESS_LEVEL", 6))
+# 异步导出分块上传的分块大小(字节)及并发上传分块数
+ASYNC_EXPORT_UPLOAD_PART_SIZE = int(os.getenv("BKAPP_ASYNC_EXPORT_UPLOAD_PART_SIZE", 8 * 1024 * 1024))
+ASYNC_EXPORT_UPLOAD_CONCURRENCY = int(os.getenv("BKAPP_ASYNC_EXPORT_UPLOAD_CONCURRENCY", 2))
+
 # 过期pipeline任务超时时间设定
 PIPELINE_TASKS_EXPIRED_TIME = os.getenv("BKAPP_PIPELINE_TASKS_EXPIRED_TIME", 24)
 # Windows 机器JOB执行账户
@@ -702,6 +725,42 @@ ES_COMPATIBILITY = int(os.environ.get("BKAPP_ES_COMPATIBILITY", 0))
 # scroll滚动查询：默认关闭，通过环境变量控制
 FEATURE_EXPORT_SCROLL = os.environ.get("BKAPP_FEATURE_EXPORT_SCROLL", False)
 
+# 字段列表: 结果表mapping缓存时间、按mapping指纹缓存的字段列表时间 单位秒; 定时同步时每批拉取mapping的结果表数
+MAPPING_PROPERTY_TTL = int(os.environ.get("BKAPP_MAPPING_PROPERTY_TTL", 30 * 60))
+MAPPING_FIELDS_TTL = int(os.environ.get("BKAPP_MAPPING_FIELDS_TTL", 24 * 60 * 60))
+MAPPING_SYNC_BATCH_SIZE = int(os.environ.get("BKAPP_MAPPING_SYNC_BATCH_SIZE", 20))
+
+# 索引集检索上下文: Redis缓存时间、进程内缓存检查版本号的间隔 单位秒; 进程内最大缓存索引集数
+INDEX_SET_SEARCH_CONTEXT_TTL = int(os.environ.get("BKAPP_INDEX_SET_SEARCH_CONTEXT_TTL", 10 * 60))
+INDEX_SET_SEARCH_CONTEXT_CHECK_INTERVAL = int(os.environ.get("BKAPP_INDEX_SET_SEARCH_CONTEXT_CHECK_INTERVAL", 5))
+INDEX_SET_SEARCH_CONTEXT_LOCAL_MAXSIZE = int(os.environ.get("BKAPP_INDEX_SET_SEARCH_CONTEXT_LOCAL_MAXSIZE", 1024))
+
+# 实时日志推送: 上游轮询ES的最小、最大间隔, 长轮询最长等待时间, SSE单次连接最长时间, 等待时检查共享缓冲区的间隔 单位秒
+TAIL_STREAM_MIN_INTERVAL = float(os.environ.get("BKAPP_TAIL_STREAM_MIN_INTERVAL", 1))
+TAIL_STREAM_MAX_INTERVAL = float(os.environ.get("BKAPP_TAIL_STREAM_MAX_INTERVAL", 10))
+TAIL_STREAM_LONG_POLL_TIMEOUT = int(os.environ.get("BKAPP_TAIL_STREAM_LONG_POLL_TIMEOUT", 25))
+# SSE连接期间一直占用worker, 单次连接时长需小于gunicorn的worker超时时间(65秒), 到期后客户端自动重连续传
+TAIL_STREAM_SSE_MAX_DURATION = int(os.environ.get("BKAPP_TAIL_STREAM_SSE_MAX_DURATION", 45))
+TAIL_STREAM_WAIT_STEP = float(os.environ.get("BKAPP_TAIL_STREAM_WAIT_STEP", 0.5))
+# 实时日志推送: 每个日志流共享缓冲区保留的最大日志条数、无人订阅后缓冲区过期时间 单位秒
+TAIL_STREAM_BUFFER_SIZE = int(os.environ.get("BKAPP_TAIL_STREAM_BUFFER_SIZE", 500))
+TAIL_STREAM_TTL = int(os.environ.get("BKAPP_TAIL_STREAM_TTL", 60))
+# 实时日志推送: 每个进程同时保持的SSE连接数上限, 超出时客户端按retry(毫秒)后重连或改用长轮询
+TAIL_STREAM_SSE_MAX_CONNECTIONS = int(os.environ.get("BKAPP_TAIL_STREAM_SSE_MAX_CONNECTIONS", 50))
+TAIL_STREAM_SSE_RETRY = int(os.environ.get("BKAPP_TAIL_STREAM_SSE_RETRY", 30 * 1000))
+# gunicorn worker类型, 与 gunicorn_config.py 一致; sync worker每个进程同时只能处理一个请求,
+# 此时不开启SSE推送, 长轮询最长等待 TAIL_STREAM_SYNC_LONG_POLL_TIMEOUT 秒, 避免长连接占满worker
+GUNICORN_WORKER_CLASS = os.environ.get("BKAPP_GUNICORN_WORKER_CLASS", "sync")
+ASYNC_WORKER_CLASSES = ["gevent", "eventlet"]
+TAIL_STREAM_SYNC_LONG_POLL_TIMEOUT = int(os.environ.get("BKAPP_TAIL_STREAM_SYNC_LONG_POLL_TIMEOUT", 2))
+
+# 日志上下文: 上下文窗口缓存时间 单位秒; 后台预取下一页的线程数
+SEARCH_CONTEXT_WINDOW_TTL = int(os.environ.get("BKAPP_SEARCH_CONTEXT_WINDOW_TTL", 60))
+SEARCH_CONTEXT_PREFETCH_WORKERS = int(os.environ.get("BKAPP_SEARCH_CONTEXT_PREFETCH_WORKERS", 4))
+
+# 查询语句执行计划: 普通关键字按全文检索字段改写为match_phrase, 关闭后恢复为 *keyword* 通配查询
+ESQUERY_QUERY_PLANNER_ENABLED = os.environ.get("BKAPP_ESQUERY_QUERY_PLANNER_ENABLED", "on") == "on"
+
 # BCS
 PAASCC_APIGATEWAY = ""
 
@@ -718,6 +777,31 @@ COLLECTOR_SCENARIOS = os.environ.get("BKAPP_COLLECTOR_SCENARIOS", "row,section")
 COLLECTOR_GUIDE_URL = os.environ.get("BKAPP_COLLECTOR_GUIDE_URL", "")
 # ITSM接入服务ID
 COLLECTOR_ITSM_SERVICE_ID = int(os.environ.get("BKAPP_COLLECTOR_ITSM_SERVICE_ID", 0))
+
+# 进程内共享线程池, 按上游划分: {名称: {max_workers: 最大并发数, max_queue: 最大排队数, deadline: 排队截止时间(秒)}}
+EXECUTOR_POOLS = {
+    name: {
+        "max_workers": int(os.environ.get(f"BKAPP_EXECUTOR_{name.upper()}_MAX_WORKERS", max_workers)),
+        "max_queue": int(os.environ.get(f"BKAPP_EXECUTOR_{name.upper()}_MAX_QUEUE", max_queue)),
+        "deadline": int(os.environ.get(f"BKAPP_EXECUTOR_{name.upper()}_DEADLINE", 60)),
+    }
+    for name, max_workers, max_queue in [
+        ("default", 32, 256),
+        ("es", 32, 256),
+        ("bkdata", 16, 128),
+        ("cmdb", 16, 256),
+        ("job", 8, 128),
+        ("nodeman", 8, 128),
+    ]
+}
+
+# ES集群指标采集时间预算 单位秒, 超时的集群本轮跳过, 已采集的指标正常上报
+ES_MONITOR_CLUSTER_TIMEOUT = int(os.environ.get("BKAPP_ES_MONITOR_CLUSTER_TIMEOUT", 30))
+
+# 采集项订阅状态缓存时间 单位秒, 部署中的订阅不使用缓存
+COLLECTOR_SUBSCRIPTION_STATUS_CACHE_TTL = int(os.environ.get("BKAPP_COLLECTOR_SUBSCRIPTION_STATUS_CACHE_TTL", 30))
+# 单次向节点管理查询订阅状态的订阅数
+COLLECTOR_SUBSCRIPTION_STATUS_BATCH_SIZE = int(os.environ.get("BKAPP_COLLECTOR_SUBSCRIPTION_STATUS_BATCH_SIZE", 200))
 ITSM_LOG_DISPLAY_ROLE = "LOG_SEARCH"
 BLUEKING_BK_BIZ_ID = int(os.environ.get("BKAPP_BLUEKING_BK_BIZ_ID", 2))
 BKMONITOR_CUSTOM_PROXY_IP = os.environ.get(
@@ -730,6 +814,23 @@ BKMONITOR_CUSTOM_PROXY_IP = os.environ.get(
 ES_QUERY_ACCESS_LIST: list = ["bkdata", "es", "log"]
 ES_QUERY_TIMEOUT = int(os.environ.get("BKAPP_ES_QUERY_TIMEOUT", 55))
 
+# ES客户端连接池: 连接信息缓存时间、探活间隔、空闲淘汰时间 单位秒
+ES_CLIENT_CONNECT_INFO_TTL = int(os.environ.get("BKAPP_ES_CLIENT_CONNECT_INFO_TTL", 60))
+ES_CLIENT_HEALTH_CHECK_INTERVAL = int(os.environ.get("BKAPP_ES_CLIENT_HEALTH_CHECK_INTERVAL", 30))
+ES_CLIENT_IDLE_TIMEOUT = int(os.environ.get("BKAPP_ES_CLIENT_IDLE_TIMEOUT", 600))
+# 被淘汰的ES客户端延迟关闭的时间 单位秒, 需大于查询超时时间, 保证使用该客户端的查询已结束
+ES_CLIENT_CLOSE_DELAY = int(os.environ.get("BKAPP_ES_CLIENT_CLOSE_DELAY", ES_QUERY_TIMEOUT + 10))
+# 单个ES客户端的最大连接数
+ES_CLIENT_POOL_MAXSIZE = int(os.environ.get("BKAPP_ES_CLIENT_POOL_MAXSIZE", 10))
+
+# SaaS 与 API 同代码同配置部署时，esquery 查询在进程内执行，不经过网关
+ESQUERY_LOCAL_DISPATCH = os.environ.get("BKAPP_ESQUERY_LOCAL_DISPATCH", "off") == "on"
+
+# 索引目录: 按时间范围解析到具体索引, 目录缓存时间 单位秒; 索引串超过最大长度时按月折叠为通配
+INDEX_CATALOG_ENABLED = os.environ.get("BKAPP_INDEX_CATALOG_ENABLED", "on") == "on"
+INDEX_CATALOG_TTL = int(os.environ.get("BKAPP_INDEX_CATALOG_TTL", 30 * 60))
+INDEX_CATALOG_MAX_INDEX_LENGTH = int(os.environ.get("BKAPP_INDEX_CATALOG_MAX_INDEX_LENGTH", 3000))
+
 # ESQUERY 查询白名单，直接透传
 ESQUERY_WHITE_LIST = [
     "bk_log_search",
@@ -818,6 +919,27 @@ BKLOG_QOS_LIMIT = int(os.getenv("BK_BKLOG_QOS_LIMIT", 3))
 # 达到窗口内限制次数屏蔽时间 单位分钟
 BKLOG_QOS_LIMIT_TIME = int(os.getenv("BK_BKLOG_QOS_LIMIT_TIME", 5))
 
+# ESQUERY 准入控制: 按 (app_code, 索引集/索引) 的令牌桶限速, 交互检索再按用户区分, 按集群限制并发查询数并按优先级排队
+ESQUERY_ADMISSION_ENABLED = os.getenv("BKAPP_ESQUERY_ADMISSION_ENABLED", "on") == "on"
+# 每秒生成令牌数
+ESQUERY_ADMISSION_RATE = int(os.getenv("BKAPP_ESQUERY_ADMISSION_RATE", 20))
+# 令牌桶容量(允许的突发查询数)
+ESQUERY_ADMISSION_BURST = int(os.getenv("BKAPP_ESQUERY_ADMISSION_BURST", 60))
+# 单个集群同时执行的查询数上限
+ESQUERY_ADMISSION_CLUSTER_CONCURRENCY = int(os.getenv("BKAPP_ESQUERY_ADMISSION_CLUSTER_CONCURRENCY", 32))
+# 执行中查询的租约时长 单位秒, 进程异常退出未释放时到期自动清理
+ESQUERY_ADMISSION_LEASE = int(os.getenv("BKAPP_ESQUERY_ADMISSION_LEASE", 120))
+# 各优先级最长排队时间 单位秒
+ESQUERY_ADMISSION_MAX_WAIT = {
+    "interactive": int(os.getenv("BKAPP_ESQUERY_ADMISSION_INTERACTIVE_WAIT", 10)),
+    "export": int(os.getenv("BKAPP_ESQUERY_ADMISSION_EXPORT_WAIT", 60)),
+    "background": int(os.getenv("BKAPP_ESQUERY_ADMISSION_BACKGROUND_WAIT", 30)),
+}
+# web进程中最长排队时间 单位秒, 排队期间一直占用gunicorn worker, 长时间排队只在celery任务中进行
+ESQUERY_ADMISSION_WEB_MAX_WAIT = int(os.getenv("BKAPP_ESQUERY_ADMISSION_WEB_MAX_WAIT", 3))
+# 排队时检查间隔 单位秒
+ESQUERY_ADMISSION_WAIT_STEP = float(os.getenv("BKAPP_ESQUERY_ADMISSION_WAIT_STEP", 0.2))
+
 # ajax请求401返回plain信息
 IS_AJAX_PLAIN_MODE = True
 
@@ -897,6 +1019,17 @@ if BKAPP_IS_BKLOG_API and REDIS_MODE == "sentinel" and USE_REDIS:
     CACHES["default"] = CACHES["redis_sentinel"]
     CACHES["login_db"] = CACHES["redis_sentinel"]
 
+# 两级缓存: 进程内LRU最大条目数及缓存时间、过期后返回旧值的时间窗口、空结果缓存时间、单飞锁等待时间 单位秒
+CACHE_LOCAL_MAXSIZE = int(os.getenv("BKAPP_CACHE_LOCAL_MAXSIZE", 1024))
+CACHE_LOCAL_TTL = int(os.getenv("BKAPP_CACHE_LOCAL_TTL", 10))
+CACHE_STALE_TTL = int(os.getenv("BKAPP_CACHE_STALE_TTL", 60))
+CACHE_NEGATIVE_TTL = int(os.getenv("BKAPP_CACHE_NEGATIVE_TTL", 30))
+CACHE_SINGLE_FLIGHT_WAIT = int(os.getenv("BKAPP_CACHE_SINGLE_FLIGHT_WAIT", 5))
+
+# 权限中心策略进程内缓存: 按(用户, 动作)缓存编译后的策略
+IAM_POLICY_CACHE_MAXSIZE = int(os.getenv("BKAPP_IAM_POLICY_CACHE_MAXSIZE", 4096))
+IAM_POLICY_CACHE_TTL = int(os.getenv("BKAPP_IAM_POLICY_CACHE_TTL", 60))
+
 """
 以下为框架代码 请勿修改
 """
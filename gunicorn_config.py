@@ -38,7 +38,9 @@ except ImportError:
 
 bind = f"{os.getenv('LAN_IP', '')}:{os.getenv('BKLOG_API_PORT', '8000')}"
 workers = 8
-# worker_class = 'gevent'
+# 实时日志SSE推送(tail_f/stream)在连接期间一直占用worker, sync worker下不开启SSE且长轮询只短暂等待,
+# 开启SSE的环境需通过 BKAPP_GUNICORN_WORKER_CLASS=gevent 使用gevent worker, 并保证 TAIL_STREAM_SSE_MAX_DURATION 小于 timeout
+worker_class = os.getenv("BKAPP_GUNICORN_WORKER_CLASS", "sync")
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"